@@ -0,0 +1,145 @@
+#!/usr/bin/env python3.9
+"""
+Memory and latency benchmark of the in-memory columnar engine against SQLite reads.
+
+For every catalog size given, imports a synthetic catalog, then compares Products,
+reading from SQLite with its read cache cleared before every call, against
+ColumnarProducts, reading from its columns: the memory taken by a full copy of the
+products (the result of get_all() against the loaded columns), and the latency of
+get_all(), get_specific(), count(), low_stock() and total_quantity(). SQLite reads
+low-stock lists from its quantity index, and the columns filter the quantity column.
+
+Usage:
+    python3.9 -m benchmarks.bench_columnar --sizes 10k,100k,1m --ops 200
+"""
+
+import argparse
+import gc
+import random
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable
+
+from benchmarks.bench_suite import _catalog, _parse_size
+from modules.columnar import ColumnarProducts
+from modules.products import Products
+
+
+def _latency(operation: Callable[[], Any], count: int) -> float:
+    """
+    Return the mean latency of `operation` over `count` calls, in milliseconds.
+    """
+    operation()
+    started = time.perf_counter()
+    for _ in range(count):
+        operation()
+    return round(1000 * (time.perf_counter() - started) / count, 3)
+
+
+def _allocated(operation: Callable[[], Any]) -> tuple[Any, int]:
+    """
+    Call `operation`, and return its result along with the bytes it allocated that are
+    still held.
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = operation()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def _run_size(size: int, db_path: str, args: argparse.Namespace) -> dict:
+    """
+    Measure both engines on a catalog of `size` products stored at `db_path`.
+    """
+    rng = random.Random(args.seed)
+    inventory = Products(db_path=db_path)
+    inventory.create_table()
+    inventory.import_data(_catalog(size, args.seed))
+    inventory.close()
+
+    sqlite_inventory = Products(db_path=db_path)
+    columnar = ColumnarProducts(db_path=db_path, refresh_interval=60.0)
+    skus: Callable[[], list] = lambda: [
+        f'{rng.randrange(size):08d}' for _ in range(args.skus_per_read)
+    ]
+    repeats: int = max(3, min(args.ops, 5_000_000 // size))
+
+    rows, rows_bytes = _allocated(sqlite_inventory.get_all)
+    del rows
+    _, columns_bytes = _allocated(lambda: columnar.create_table())
+
+    def uncached(method: Callable[..., Any]) -> Callable[..., Any]:
+        def call(*call_args: Any) -> Any:
+            sqlite_inventory.cache.clear()
+            return method(*call_args)
+        return call
+
+    results: dict = {
+        'memory_bytes': {'sqlite_rows': rows_bytes, 'columns': columns_bytes},
+        'latency_ms': {
+            'get_all': {
+                'sqlite': _latency(uncached(sqlite_inventory.get_all), repeats),
+                'columnar': _latency(columnar.get_all, repeats)
+            },
+            'get_specific': {
+                'sqlite': _latency(
+                    lambda: uncached(sqlite_inventory.get_specific)(skus()), args.ops
+                ),
+                'columnar': _latency(lambda: columnar.get_specific(skus()), args.ops)
+            },
+            'count': {
+                'sqlite': _latency(uncached(sqlite_inventory.count), args.ops),
+                'columnar': _latency(columnar.count, args.ops)
+            },
+            'low_stock': {
+                'sqlite': _latency(
+                    lambda: uncached(sqlite_inventory.low_stock)(args.threshold), repeats
+                ),
+                'columnar': _latency(lambda: columnar.low_stock(args.threshold), repeats)
+            },
+            'total_quantity': {
+                'sqlite': _latency(uncached(sqlite_inventory.total_quantity), args.ops),
+                'columnar': _latency(columnar.total_quantity, args.ops)
+            }
+        }
+    }
+    sqlite_inventory.close()
+    columnar.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10k,100k,1m', help='comma-separated catalog sizes')
+    parser.add_argument('--ops', type=int, default=200, help='calls per case')
+    parser.add_argument('--skus-per-read', type=int, default=20)
+    parser.add_argument('--threshold', type=int, default=10, help='low-stock threshold')
+    parser.add_argument('--seed', type=int, default=2022)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in args.sizes.split(','):
+            size: int = _parse_size(label)
+            results = _run_size(size, str(Path(tmp, f'products-{size}.db')), args)
+            memory: dict = results['memory_bytes']
+            print(f'--- {label.strip()} products')
+            print(
+                f'{"memory":>16}: sqlite rows {memory["sqlite_rows"] / 1e6:.1f} MB, '
+                f'columns {memory["columns"] / 1e6:.1f} MB'
+            )
+            for case, latency in results['latency_ms'].items():
+                speedup: float = (
+                    latency['sqlite'] / latency['columnar'] if latency['columnar'] else 0.0
+                )
+                print(
+                    f'{case:>16}: sqlite {latency["sqlite"]} ms, '
+                    f'columnar {latency["columnar"]} ms ({speedup:.1f}x)'
+                )
+
+
+if __name__ == '__main__':
+    main()
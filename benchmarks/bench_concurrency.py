@@ -0,0 +1,153 @@
+#!/usr/bin/env python3.9
+"""
+Mixed read/write throughput benchmark for the products database.
+
+Compares the original access pattern (a new connection per call, rollback journal,
+every thread committing its own writes) against Products (pooled readers, WAL, and the
+single-writer queue) under the same concurrent workload.
+
+Usage:
+    python3.9 -m benchmarks.bench_concurrency --threads 8 --seconds 5 --read-ratio 0.8
+"""
+
+import argparse
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+from modules.products import Products
+
+
+def _seed(path: str, rows: int) -> None:
+    """
+    Create a products table at `path` holding `rows` synthetic products.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE products (
+            sku         TEXT PRIMARY KEY NOT NULL,
+            name        TEXT NOT NULL,
+            quantity    INTEGER NOT NULL DEFAULT 0 CHECK (quantity >= 0)
+        );
+    ''')
+    conn.executemany(
+        'INSERT INTO products(sku, name, quantity) VALUES (?, ?, ?);',
+        ((f'{i:08d}', f'Product {i}', 100) for i in range(rows))
+    )
+    conn.commit()
+    conn.close()
+
+
+class _Legacy:
+    """
+    The pre-pool access pattern: connect, execute, commit and close on every call.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def get_specific(self, skus: list) -> list:
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute(
+            f"SELECT * FROM products WHERE sku IN ({','.join('?' * len(skus))});", skus
+        ).fetchall()
+        conn.close()
+        return rows
+
+    def update_quantity(self, sku: str, operation: str, count: int) -> None:
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute(
+                'UPDATE products SET quantity = quantity + ? WHERE sku = ?;', (count, sku)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def _run(
+    read: Callable[[list], object],
+    write: Callable[[str], None],
+    threads: int,
+    seconds: float,
+    read_ratio: float,
+    rows: int
+) -> dict:
+    """
+    Hammer `read` and `write` from `threads` threads for `seconds` and count operations.
+    """
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(seed: int) -> None:
+        rng = random.Random(seed)
+        local = {'reads': 0, 'writes': 0, 'errors': 0}
+        while time.perf_counter() < deadline:
+            sku = f'{rng.randrange(rows):08d}'
+            try:
+                if rng.random() < read_ratio:
+                    read([sku])
+                    local['reads'] += 1
+                else:
+                    write(sku)
+                    local['writes'] += 1
+            except sqlite3.Error:
+                # e.g. "database is locked"
+                local['errors'] += 1
+        with lock:
+            for key, value in local.items():
+                counts[key] += value
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+    ops = counts['reads'] + counts['writes']
+    return {**counts, 'ops_per_sec': round(ops / seconds, 1)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--read-ratio', type=float, default=0.8)
+    parser.add_argument('--rows', type=int, default=10_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = str(Path(tmp, 'legacy.db'))
+        _seed(legacy_path, args.rows)
+        legacy = _Legacy(legacy_path)
+        legacy_result = _run(
+            legacy.get_specific,
+            lambda sku: legacy.update_quantity(sku, 'add', 1),
+            args.threads, args.seconds, args.read_ratio, args.rows
+        )
+
+        pooled_path = str(Path(tmp, 'pooled.db'))
+        _seed(pooled_path, args.rows)
+        inventory = Products(db_path=pooled_path, pool_size=args.threads)
+        pooled_result = _run(
+            inventory.get_specific,
+            lambda sku: inventory.update_quantity(sku, 'add', 1),
+            args.threads, args.seconds, args.read_ratio, args.rows
+        )
+        pooled_result['writer'] = inventory.writer_stats()
+        inventory.close()
+
+    print(f'connect-per-call, rollback journal: {legacy_result}')
+    print(f'pooled readers, WAL, single writer: {pooled_result}')
+    if legacy_result['ops_per_sec']:
+        speedup = pooled_result['ops_per_sec'] / legacy_result['ops_per_sec']
+        print(f'speedup: {speedup:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3.9
+"""
+Speed and size benchmark of the columnar Arrow IPC and Parquet formats against CSV.
+
+For every catalog size given, imports a synthetic catalog, then exports all products in
+every format, as /export-csv and /export-columnar stream them, reporting the time and
+the bytes of each file, along with the legacy sqlite_rows_to_csv() file export. Every
+file is then read back, parsed and validated only, and imported into an empty database,
+as the background jobs of /import-csv and /import-columnar do, reporting the time of
+each. Requires the optional pyarrow package.
+
+Usage:
+    python3.9 -m benchmarks.bench_formats --sizes 100k,1m
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterable
+
+from benchmarks.bench_suite import _catalog, _parse_size
+from modules import arrow_utils
+from modules.csv_utils import csv_to_list, gzip_chunks, iter_csv_text, sqlite_rows_to_csv
+from modules.parallel_csv import iter_csv_chunks
+from modules.products import Products
+import modules.services as services
+
+
+def _timed(operation: Callable[[], Any]) -> tuple[Any, float]:
+    """
+    Call `operation`, and return its result along with its duration, in seconds.
+    """
+    started = time.perf_counter()
+    result = operation()
+    return result, round(time.perf_counter() - started, 3)
+
+
+def _drain(chunks: Iterable, path: str) -> int:
+    """
+    Write the text or bytes `chunks` of a streamed export to the file at `path`, and
+    return its size.
+    """
+    with open(path, 'wb') as file:
+        for chunk in chunks:
+            file.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+    return Path(path).stat().st_size
+
+
+def _run_size(size: int, tmp: str) -> dict:
+    """
+    Measure every format on a catalog of `size` products, with files under `tmp`.
+    """
+    inventory = Products(db_path=str(Path(tmp, f'products-{size}.db')))
+    inventory.create_table()
+    inventory.import_data(_catalog(size, 2022))
+
+    exports: dict[str, Callable[[str], int]] = {
+        'csv': lambda path: _drain(iter_csv_text(inventory.iter_products()), path),
+        'csv.gz': lambda path: _drain(
+            gzip_chunks(iter_csv_text(inventory.iter_products())), path
+        ),
+        'arrow': lambda path: _drain(
+            arrow_utils.iter_columnar_bytes(inventory.iter_products(), 'arrow'), path
+        ),
+        'parquet': lambda path: _drain(
+            arrow_utils.iter_columnar_bytes(inventory.iter_products(), 'parquet'), path
+        )
+    }
+    results: dict = {'export': {}, 'parse': {}, 'import': {}}
+    paths: dict[str, str] = {}
+    for fmt, export in exports.items():
+        paths[fmt] = str(Path(tmp, f'export-{size}.{fmt}'))
+        nbytes, seconds = _timed(lambda: export(paths[fmt]))
+        results['export'][fmt] = {'seconds': seconds, 'bytes': nbytes}
+
+    # the export /export-csv used to do: every row in memory, then a file on disk
+    legacy_path: str = str(Path(tmp, f'legacy-{size}.csv'))
+    _, seconds = _timed(lambda: sqlite_rows_to_csv(inventory.get_all(), legacy_path))
+    results['export']['csv (sqlite_rows_to_csv)'] = {
+        'seconds': seconds, 'bytes': Path(legacy_path).stat().st_size
+    }
+    inventory.close()
+
+    # reading and validating the rows, without writing them
+    parsers: dict[str, Callable[[], Any]] = {
+        'csv (csv_to_list)': lambda: len(csv_to_list(paths['csv'])),
+        'csv': lambda: sum(len(chunk['rows']) for chunk in iter_csv_chunks(paths['csv'])),
+        'arrow': lambda: sum(
+            len(chunk['rows'])
+            for chunk in arrow_utils.iter_columnar_chunks(paths['arrow'], 'arrow')
+        ),
+        'parquet': lambda: sum(
+            len(chunk['rows'])
+            for chunk in arrow_utils.iter_columnar_chunks(paths['parquet'], 'parquet')
+        )
+    }
+    for fmt, parse in parsers.items():
+        rows, seconds = _timed(parse)
+        results['parse'][fmt] = {'seconds': seconds, 'rows': rows}
+
+    # full imports into an empty database
+    for fmt in ('csv', 'arrow', 'parquet'):
+        target = Products(db_path=str(Path(tmp, f'import-{size}-{fmt}.db')))
+        target.create_table()
+        report, seconds = _timed(
+            lambda: services.import_csv_file(target, paths['csv']) if fmt == 'csv'
+            else services.import_columnar_file(target, paths[fmt], fmt)
+        )
+        target.close()
+        results['import'][fmt] = {'seconds': seconds, 'inserted': report['inserted']}
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='100k,1m', help='comma-separated catalog sizes')
+    args = parser.parse_args()
+
+    if not arrow_utils.available():
+        parser.exit(1, 'pyarrow is not installed; run `pip install pyarrow`.\n')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in args.sizes.split(','):
+            results = _run_size(_parse_size(label), tmp)
+            print(f'--- {label.strip()} products')
+            csv_export: dict = results['export']['csv']
+            for fmt, export in results['export'].items():
+                print(
+                    f'{"export " + fmt:>32}: {export["seconds"]} s, '
+                    f'{export["bytes"] / 1e6:.1f} MB '
+                    f'({csv_export["bytes"] / max(export["bytes"], 1):.1f}x smaller, '
+                    f'{csv_export["seconds"] / max(export["seconds"], 1e-3):.1f}x faster '
+                    f'than CSV)'
+                )
+            for stage in ('parse', 'import'):
+                baseline: float = results[stage]['csv']['seconds']
+                for fmt, result in results[stage].items():
+                    print(
+                        f'{stage + " " + fmt:>32}: {result["seconds"]} s '
+                        f'({baseline / max(result["seconds"], 1e-3):.1f}x faster than CSV)'
+                    )
+
+
+if __name__ == '__main__':
+    main()
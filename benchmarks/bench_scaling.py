@@ -0,0 +1,158 @@
+#!/usr/bin/env python3.9
+"""
+HTTP throughput benchmark for the production server at increasing worker counts.
+
+Starts `main.py --workers N` on a synthetic catalog for every N given, drives it with
+client processes issuing a mix of inventory page loads, searches and quantity updates
+for a fixed time, and reports requests per second and latency percentiles. Server and
+clients share the machine, so throughput only grows while cores are left over.
+
+Usage:
+    python3.9 -m benchmarks.bench_scaling --workers 1,2,4,8 --clients 16 --seconds 10
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from modules.products import Products
+
+
+def _seed(path: str, rows: int) -> None:
+    """
+    Create the products database at `path` holding `rows` synthetic products.
+    """
+    inventory = Products(db_path=path)
+    inventory.create_table()
+    for _ in inventory.import_batches(
+        [(f'{i:08d}', f'Product {i}', 100) for i in range(start, min(start + 5000, rows))]
+        for start in range(0, rows, 5000)
+    ):
+        pass
+    inventory.close()
+
+
+def _wait_until_listening(port: int, timeout: float = 30.0) -> None:
+    """
+    Wait until a server accepts connections on `port`.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1.0).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server did not start listening on port {port}')
+
+
+def _client(port: int, seconds: float, read_ratio: float, rows: int, seed: int) -> dict:
+    """
+    Issue requests one after another for `seconds`, and return the number of successful
+    and failed requests and the latency of every successful one.
+    """
+    rng = random.Random(seed)
+    ok, errors = 0, 0
+    latencies: list[float] = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sku = f'{rng.randrange(rows):08d}'
+        roll = rng.random()
+        if roll < read_ratio / 2:
+            method, url, body = 'GET', f'/get-inventory?after={sku}', None
+        elif roll < read_ratio:
+            method, url, body = 'GET', f'/search?q={sku[:5]}', None
+        else:
+            method, url = 'POST', '/update-quantity'
+            body = json.dumps({'sku': sku, 'operation': 'add', 'count': 1})
+
+        started = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30.0)
+            conn.request(method, url, body, {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+        except OSError:
+            errors += 1
+            continue
+        if response.status == 200:
+            ok += 1
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors += 1
+    return {'ok': ok, 'errors': errors, 'latencies': latencies}
+
+
+def _run(db_path: str, workers: int, port: int, args: argparse.Namespace) -> dict:
+    """
+    Serve `db_path` with `workers` worker processes, load it, and summarize the results.
+    """
+    server = subprocess.Popen(
+        [sys.executable, 'main.py', '--workers', str(workers), '--port', str(port),
+         '--db', db_path],
+        stdout=subprocess.DEVNULL
+    )
+    try:
+        _wait_until_listening(port)
+        with multiprocessing.Pool(args.clients) as pool:
+            results = pool.starmap(_client, [
+                (port, args.seconds, args.read_ratio, args.rows, seed)
+                for seed in range(args.clients)
+            ])
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+    latencies = sorted(latency for result in results for latency in result['latencies'])
+    ok = sum(result['ok'] for result in results)
+
+    def percentile(fraction: float) -> float:
+        if not latencies:
+            return 0.0
+        index = min(int(fraction * len(latencies)), len(latencies) - 1)
+        return round(1000 * latencies[index], 1)
+
+    return {
+        'workers': workers,
+        'requests_per_sec': round(ok / args.seconds, 1),
+        'errors': sum(result['errors'] for result in results),
+        'p50_ms': percentile(0.5),
+        'p99_ms': percentile(0.99)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated worker counts')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--read-ratio', type=float, default=0.9)
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--port', type=int, default=5099)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp, 'products.db'))
+        _seed(db_path, args.rows)
+
+        baseline = 0.0
+        for workers in (int(count) for count in args.workers.split(',')):
+            result = _run(db_path, workers, args.port, args)
+            baseline = baseline or result['requests_per_sec']
+            if baseline:
+                result['speedup'] = round(result['requests_per_sec'] / baseline, 2)
+            print(result)
+
+
+if __name__ == '__main__':
+    main()
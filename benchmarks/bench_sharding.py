@@ -0,0 +1,88 @@
+#!/usr/bin/env python3.9
+"""
+Write throughput benchmark for sharded products storage.
+
+Imports the same synthetic catalog into 1, 2, 4... shards, then updates quantities of
+random products from several threads at once, and reports the updates committed per
+second for every shard count, along with the speedup over a single shard. Every shard
+has its own writer, so writes to different shards are committed in parallel; the
+speedup is bounded by the cores and disk the machine has.
+
+Usage:
+    python3.9 -m benchmarks.bench_sharding --shards 1,2,4 --threads 16 --seconds 5
+"""
+
+import argparse
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from modules.products import Products
+from modules.sharding import ShardedProducts
+
+
+def _run(inventory: Products, threads: int, seconds: float, rows: int) -> dict:
+    """
+    Update quantities of random products from `threads` threads for `seconds`, and count
+    the updates.
+    """
+    counts: list[int] = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    def worker(index: int) -> None:
+        rng = random.Random(index)
+        while time.perf_counter() < deadline:
+            inventory.update_quantity(f'{rng.randrange(rows):08d}', 'add', 1)
+            counts[index] += 1
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'updates': sum(counts),
+        'updates_per_sec': round(sum(counts) / elapsed, 1),
+        'writer': inventory.writer_stats()
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shards', default='1,2,4', help='comma-separated shard counts')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--rows', type=int, default=100_000)
+    args = parser.parse_args()
+
+    catalog = [
+        {'sku': f'{i:08d}', 'name': f'Product {i}', 'quantity': 100}
+        for i in range(args.rows)
+    ]
+    results: dict[int, dict] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in (int(shards) for shards in args.shards.split(',')):
+            path = str(Path(tmp, f'products-{count}.db'))
+            inventory: Products = (
+                ShardedProducts(db_path=path, shards=count) if count > 1
+                else Products(db_path=path)
+            )
+            inventory.create_table()
+            inventory.import_data(catalog)
+            results[count] = _run(inventory, args.threads, args.seconds, args.rows)
+            inventory.close()
+            print(f'{count} shard(s): {results[count]}')
+
+    if 1 in results and results[1]['updates_per_sec']:
+        for count, result in results.items():
+            speedup = result['updates_per_sec'] / results[1]['updates_per_sec']
+            print(f'{count} shard(s): {speedup:.2f}x the updates of one')
+
+
+if __name__ == '__main__':
+    main()
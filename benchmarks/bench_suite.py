@@ -0,0 +1,314 @@
+#!/usr/bin/env python3.9
+"""
+Reproducible benchmark suite for the inventory service.
+
+For every catalog size given, generates the same synthetic catalog from a fixed seed,
+imports it into a fresh database, then measures the main operations one call at a time:
+import_data, get_all, get_specific, single and batched quantity updates, CSV export
+and /get-inventory rendering through the Flask test client, followed by a mixed
+workload run from several threads at once.
+Results are written as JSON, so runs can be compared across commits; given the results
+of an earlier run, cases whose throughput dropped by more than the threshold are
+reported as regressions, and the exit status is 1.
+
+Usage:
+    python3.9 -m benchmarks.bench_suite --sizes 10k,100k,1m --output results.json
+    python3.9 -m benchmarks.bench_suite --sizes 10k --baseline results.json --threshold 0.2
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import main as application
+from modules.products import Products
+
+# words that synthetic product names are made of
+NAME_WORDS: tuple = (
+    'steel', 'cotton', 'red', 'blue', 'large', 'small', 'organic', 'wireless', 'classic',
+    'bolt', 'shirt', 'lamp', 'cable', 'bottle', 'chair', 'drill', 'notebook', 'tape'
+)
+
+
+def _parse_size(text: str) -> int:
+    """
+    Convert a catalog size such as '10k' or '1m' into a number of products.
+    """
+    text = text.strip().lower()
+    multiplier: int = {'k': 1000, 'm': 1000 * 1000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * multiplier)
+
+
+def _catalog(size: int, seed: int) -> list[dict]:
+    """
+    Generate `size` synthetic products; the same seed always produces the same catalog.
+    """
+    rng = random.Random(seed)
+    return [
+        {
+            'sku': f'{i:08d}',
+            'name': ' '.join(rng.choices(NAME_WORDS, k=3)),
+            'quantity': rng.randrange(1000)
+        }
+        for i in range(size)
+    ]
+
+
+def _summarize(latencies: list[float], elapsed: float) -> dict:
+    """
+    Summarize the latencies of the operations completed in `elapsed` seconds.
+    """
+    latencies = sorted(latencies)
+
+    def percentile(fraction: float) -> float:
+        if not latencies:
+            return 0.0
+        index = min(int(fraction * len(latencies)), len(latencies) - 1)
+        return round(1000 * latencies[index], 3)
+
+    return {
+        'ops': len(latencies),
+        'seconds': round(elapsed, 4),
+        'ops_per_sec': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': percentile(0.5),
+        'p99_ms': percentile(0.99),
+        'max_ms': percentile(1.0)
+    }
+
+
+def _measure(operation: Callable[[int], Any], count: int, warmup: int = 0) -> dict:
+    """
+    Call `operation` with the numbers 0 to `count` - 1, one call at a time, and
+    summarize the latency of the calls. The first `warmup` calls, which fill caches and
+    open connections, are made beforehand and not measured.
+    """
+    for i in range(warmup):
+        operation(i)
+    latencies: list[float] = []
+    started = time.perf_counter()
+    for i in range(count):
+        call_started = time.perf_counter()
+        operation(i)
+        latencies.append(time.perf_counter() - call_started)
+    return _summarize(latencies, time.perf_counter() - started)
+
+
+def _measure_concurrent(
+    operation: Callable[[random.Random], Any],
+    threads: int,
+    seconds: float,
+    seed: int
+) -> dict:
+    """
+    Call `operation` in a loop from `threads` threads for `seconds`, each thread with
+    its own seeded random generator, and summarize the latency of the calls.
+    """
+    latencies: list[list[float]] = [[] for _ in range(threads)]
+    deadline = time.perf_counter() + seconds
+
+    def work(index: int) -> None:
+        rng = random.Random(seed + index)
+        while time.perf_counter() < deadline:
+            call_started = time.perf_counter()
+            operation(rng)
+            latencies[index].append(time.perf_counter() - call_started)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    result = _summarize(
+        [latency for thread in latencies for latency in thread],
+        time.perf_counter() - started
+    )
+    result['threads'] = threads
+    return result
+
+
+def _run_size(size: int, db_path: str, args: argparse.Namespace) -> dict:
+    """
+    Run every case on a catalog of `size` products stored at `db_path`.
+    """
+    catalog = _catalog(size, args.seed)
+    rng = random.Random(args.seed)
+    results: dict = {}
+
+    def sku(number: int) -> str:
+        return f'{number % size:08d}'
+
+    # import into a fresh database, then serve it through the application
+    inventory = Products(db_path=db_path)
+    inventory.create_table()
+    results['import_data'] = _measure(lambda i: inventory.import_data(catalog), 1)
+    results['import_data']['rows'] = size
+    inventory.close()
+    del catalog
+
+    app = application.create_app(db_path=db_path, seed_csv='')
+    inventory = application.INVENTORY
+    client = app.test_client()
+
+    def get_all(i: int) -> None:
+        # repeated identical reads would otherwise come from the read cache
+        inventory.cache.clear()
+        inventory.get_all()
+
+    # fewer repetitions of the cases that read the whole catalog
+    repeats: int = max(3, min(args.ops // 10, 10_000_000 // size))
+    results['get_all'] = _measure(get_all, repeats)
+    results['get_specific'] = _measure(
+        lambda i: inventory.get_specific(
+            [sku(rng.randrange(size)) for _ in range(args.skus_per_read)]
+        ),
+        args.ops, warmup=args.ops // 10
+    )
+    results['update_quantity'] = _measure(
+        lambda i: inventory.update_quantity(sku(rng.randrange(size)), 'add', 1),
+        args.ops, warmup=args.ops // 10
+    )
+    results['update_quantity_batched'] = _measure(
+        lambda i: inventory.apply_batch([
+            {'op': 'add', 'sku': sku(rng.randrange(size)), 'count': 1}
+            for _ in range(args.batch_size)
+        ]),
+        max(1, args.ops // 10)
+    )
+    results['update_quantity_batched']['ops_per_batch'] = args.batch_size
+    results['export_csv'] = _measure(
+        lambda i: client.get('/export-csv?items=[]').get_data(), repeats
+    )
+    results['get_inventory_page'] = _measure(
+        lambda i: client.get(f'/get-inventory?after={sku(rng.randrange(size))}').get_data(),
+        args.ops, warmup=args.ops // 10
+    )
+
+    # a mixed workload: mostly reads, some quantity updates; every thread gets its own
+    # test client
+    local = threading.local()
+
+    def mixed(thread_rng: random.Random) -> None:
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        roll: float = thread_rng.random()
+        if roll < args.read_ratio / 2:
+            local.client.get(f'/get-inventory?after={sku(thread_rng.randrange(size))}')
+        elif roll < args.read_ratio:
+            inventory.get_specific(
+                [sku(thread_rng.randrange(size)) for _ in range(args.skus_per_read)]
+            )
+        else:
+            inventory.update_quantity(sku(thread_rng.randrange(size)), 'add', 1)
+
+    results['concurrent_mixed'] = _measure_concurrent(
+        mixed, args.threads, args.seconds, args.seed
+    )
+    results['concurrent_mixed']['read_ratio'] = args.read_ratio
+    return results
+
+
+def _metadata(args: argparse.Namespace) -> dict:
+    """
+    Describe the code and machine the benchmarks ran on.
+    """
+    try:
+        commit: Optional[str] = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'args': vars(args)
+    }
+
+
+def _regressions(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Return a description of every case whose throughput dropped by more than the
+    fraction `threshold` compared to the `baseline` run. Cases missing from either run
+    are skipped.
+    """
+    found: list[str] = []
+    for size, cases in results['results'].items():
+        for case, result in cases.items():
+            before: Optional[dict] = baseline.get('results', {}).get(size, {}).get(case)
+            if not before or not before.get('ops_per_sec'):
+                continue
+            change: float = result['ops_per_sec'] / before['ops_per_sec'] - 1
+            if change < -threshold:
+                found.append(
+                    f'{size} {case}: {before["ops_per_sec"]} -> {result["ops_per_sec"]} '
+                    f'ops/s ({change:+.0%})'
+                )
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10k,100k,1m', help='comma-separated catalog sizes')
+    parser.add_argument('--ops', type=int, default=500, help='calls per single-call case')
+    parser.add_argument('--skus-per-read', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--read-ratio', type=float, default=0.9)
+    parser.add_argument('--seed', type=int, default=2022)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare to')
+    parser.add_argument(
+        '--threshold', type=float, default=0.2,
+        help='largest tolerated drop in throughput, as a fraction'
+    )
+    args = parser.parse_args()
+
+    # load the baseline first, so a bad path fails before the benchmarks run
+    baseline: Optional[dict] = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+
+    results: dict = {'meta': _metadata(args), 'results': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in args.sizes.split(','):
+            size: int = _parse_size(label)
+            print(f'--- {label.strip()} products', file=sys.stderr)
+            cases = _run_size(size, str(Path(tmp, f'products-{size}.db')), args)
+            results['results'][label.strip()] = cases
+            for case, result in cases.items():
+                print(
+                    f'{case:>24}: {result["ops_per_sec"]:>10} ops/s  '
+                    f'p50 {result["p50_ms"]} ms  p99 {result["p99_ms"]} ms',
+                    file=sys.stderr
+                )
+
+    output: str = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        print(output)
+
+    if baseline is not None:
+        regressions = _regressions(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions beyond {args.threshold:.0%}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,53 +4,449 @@ Inventory Management System
 Shopify 2022 Summer Internship Technical Challenge
 
 Main application entry point.
+Run `python3.9 main.py` for the development server, or `python3.9 main.py --workers N`
+to serve with N worker processes; create_app() builds the application for any other
+WSGI server. With `--asgi`, the workers serve the data endpoints of modules/asgi.py
+with uvicorn instead; create_asgi_app() builds that application for any ASGI server.
 Serves the following endpoints:
     - GET       /                           > Renders and returns the web UI HTML templates
-    - GET       /get-inventory              > Renders and returns the inventory table HTML
-    - GET       /export-csv?items=          > Return a CSV file of the specified products;
-                                            empty list [] for all products
-    - POST      /import_csv                 > Accept a CSV file and import its contents to
-                                            the product inventory
+    - GET       /get-inventory?after=&sort= > Renders and returns a page of the inventory
+                                            table HTML
+    - GET       /search?q=                  > Renders and returns the inventory table HTML
+                                            of the products best matching a query
+    - GET       /changes?since=             > Return the products changed since a change
+                                            log entry, with their table row HTML
+    - GET       /low-stock?threshold=       > Return the products below a quantity, lowest
+                                            first, as JSON
+    - GET       /totals                     > Return the number of products and units
+    - GET       /quantity-histogram         > Return the number of products per quantity
+                                            range
+    - GET       /events?since=              > Stream product changes as they happen, as
+                                            Server-Sent Events
+    - GET       /export-csv?items=          > Stream a CSV file of the specified products;
+                                            empty list [] for all products; Arrow or
+                                            Parquet if the Accept header prefers them
+    - GET       /export-columnar?items=&format=
+                                            > Stream an Arrow IPC or Parquet file of the
+                                            specified products
+    - POST      /import-csv?mode=           > Accept a CSV file (raw `text/csv` body or
+                                            multipart form) and start a background job
+                                            importing or merging it into the product
+                                            inventory
+    - POST      /import-columnar?mode=&format=
+                                            > Accept an Arrow IPC or Parquet file and
+                                            start a background import job, as above
+    - GET       /jobs/<id>                  > Return the status and progress of a
+                                            background job
+    - DELETE    /jobs/<id>                  > Cancel a background job
     - POST      /add-product                > Add a new product to the inventory
     - DELETE    /delete-products?items=     > Delete a non-empty list of items from the
                                             inventory
     - POST      /change-name                > Chage the name of a specified product
     - POST      /update-quantity            > Update the quantity of a specified product
+    - POST      /batch                      > Apply many quantity updates, renames and
+                                            deletions in a single transaction
+    - GET       /history?sku=&before=       > Return the ledger entries of a product, newest
+                                            first
+    - GET       /products-at?at=&sku=       > Return all products, or one, as they were at
+                                            a point in time
+    - GET       /metrics                    > Return this process's request, service and
+                                            SQL metrics in the Prometheus text format
+Every POST and DELETE endpoint that changes products accepts an `Idempotency-Key` header;
+a request sent again with the same key and body is answered with the original result,
+without being applied twice.
 """
 # external libraries
-from flask import Flask, render_template, request, Response, make_response, send_file
+from flask import Flask, g, render_template, request, Response, make_response
 from pathlib import Path
+from typing import Callable, Iterator, Optional
+import argparse
+import atexit
+import json
+import time
 
 # internal modules
-from modules.csv_utils import csv_to_list
+from modules import arrow_utils
+from modules.asgi import InventoryASGI
+from modules.async_products import AsyncProducts
+from modules.cache import LRUCache
+from modules.columnar import ColumnarProducts
+from modules.events import ChangeBroadcaster
+from modules.jobs import JobManager
+from modules.metrics import METRICS, Sample
 from modules.products import Products
+import modules.metrics as metrics
+from modules.server import file_lock, serve
 import modules.services as services
+from modules.sharding import ShardedProducts, shard_paths
 
 # global constants
 SQLITE_DB_PATH: str = 'products.db'
 INITIAL_DATA_CSV: str = 'products_init.csv'
-EXPORTED_CSV_PATH: str = 'export.csv'
+DB_POOL_SIZE: int = 8
+DB_SHARDS: int = 1           # database files the products are partitioned across
+COLUMNAR_READS: bool = False  # serve reads from an in-memory copy of the products table
+QUANTITY_WRITE_BEHIND: float = 0.0  # seconds quantity updates may be buffered; 0 disables
+MAX_UPLOAD_BYTES: int = 1024 * 1024 * 1024
+PAGE_SIZE: int = 100         # products per page of the inventory table
+MAX_PAGE_SIZE: int = 2000    # largest page a client may ask for
+FRAGMENT_CACHE_SIZE: int = 64  # rendered table fragments kept in memory
+MAX_CHANGES: int = 500       # changed products sent before a client must reload instead
+EVENT_BUFFER_SIZE: int = 256  # change events buffered per /events client
+EVENT_KEEPALIVE: float = 15.0  # seconds between keep-alive comments on idle /events streams
+MAX_IMPORT_JOBS: int = 2     # CSV imports running at the same time
+MAX_QUEUED_IMPORTS: int = 8  # CSV imports waiting for a free slot
+SLOW_QUERY_SECONDS: Optional[float] = None  # log SQL statements slower than this
+IDEMPOTENCY_KEYS: int = 10000        # most recent idempotency keys kept
+IDEMPOTENCY_TTL: float = 24 * 3600.0  # seconds an idempotency key is kept for
+IDEMPOTENCY_KEY_MAX_LENGTH: int = 255  # longest Idempotency-Key header accepted
+# media types of the columnar formats, and the format each one names
+COLUMNAR_MIMETYPES: dict = {
+    spec['mimetype']: name for name, spec in arrow_utils.FORMATS.items()
+}
 INVENTORY: Products
+BROADCASTER: ChangeBroadcaster
+JOBS: JobManager
+
+# rendered HTML fragments, keyed on the data version and the request URL
+FRAGMENT_CACHE: LRUCache = LRUCache(maxsize=FRAGMENT_CACHE_SIZE, ttl=60.0)
+# duration of every request, until its response is returned by the view
+REQUEST_SECONDS = METRICS.histogram(
+    'inventory_http_request_seconds', 'Time spent handling each request.',
+    ['route', 'method', 'status']
+)
 
 app = Flask(__name__)
 
 
+@app.before_request
+def _start_timer() -> None:
+    """
+    Note when the request started, for the request metrics.
+    """
+    g.request_started = time.perf_counter()
+
+
+@app.before_request
+def _check_idempotency_key() -> Optional[Response]:
+    """
+    Reject a request whose `Idempotency-Key` header is empty or too long.
+    """
+    key: Optional[str] = request.headers.get('Idempotency-Key')
+    if key is not None and not 0 < len(key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        return make_response(
+            f"Idempotency-Key must have 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters.", 400
+        )
+    return None
+
+
+@app.after_request
+def _record_request(resp: Response) -> Response:
+    """
+    Record the duration and status of the request under its route pattern, so that
+    requests for different products share a series.
+    """
+    started: Optional[float] = g.get('request_started')
+    if started is not None:
+        route: str = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.observe(
+            (route, request.method, str(resp.status_code)), time.perf_counter() - started
+        )
+    return resp
+
+
+def _inventory_page(
+    after_sku: Optional[str] = None,
+    after_name: Optional[str] = None,
+    limit: int = PAGE_SIZE,
+    sort: str = 'sku',
+    seq: Optional[int] = None
+) -> dict:
+    """
+    Fetch one page of the inventory for the Jinja2 HTML templates.
+    `limit` is clamped between 1 and MAX_PAGE_SIZE. `seq` is the change log position
+    read before the page, if already known.
+    """
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    # note the change log position first, so the page is at least as new as it claims
+    if seq is None:
+        seq = INVENTORY.change_seq(fresh=True)
+    # fetch one extra product to find out whether there is another page after this one
+    rows: list = INVENTORY.get_page(
+        after_sku=after_sku, limit=limit + 1, sort=sort, after_name=after_name
+    )
+    return {'rows': rows[:limit], 'has_more': len(rows) > limit, 'sort': sort, 'seq': seq}
+
+
+def _cached_fragment(render: Callable[[int], str]) -> Response:
+    """
+    Return an HTML fragment that only depends on the inventory data and the request URL,
+    rendered by `render` given the change log position it must be at least as new as.
+    The ETag is derived from the identifier of the database and the head of its change
+    log, which every change to the data advances, whichever process made it, so every
+    worker and every restart of the server tags the same data alike. The head is read
+    from the database on every request, so changes made by other workers are seen
+    right away: a client that already holds the current version gets `304 Not
+    Modified`, and otherwise the fragment is rendered at most once per version and URL.
+    """
+    # read the version before the data, so the fragment is never older than its ETag;
+    # reading it fresh drops the cached results older than it
+    seq: int = INVENTORY.change_seq(fresh=True)
+    etag: str = f'{INVENTORY.instance_id()}-{seq}'
+    if request.if_none_match.contains(etag):
+        resp: Response = make_response('', 304)
+    else:
+        key: tuple = (etag, request.full_path)
+        hit, html = FRAGMENT_CACHE.get(key)
+        if not hit:
+            html = render(seq)
+            FRAGMENT_CACHE.put(key, html)
+        resp = make_response(html)
+
+    # let browsers keep the fragment, but revalidate it on every request
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+
 @app.route('/', methods=['GET'])
 def index():
     """
     Render and return the main web UI to the frontend.
-    Pass the INVENTORY object to the Jinja2 HTML templates.
+    Pass the INVENTORY object and the first page of products to the Jinja2 HTML
+    templates.
     """
-    return render_template('index.html', inventory=INVENTORY)
+    return render_template('index.html', inventory=INVENTORY, page=_inventory_page())
 
 
 @app.route('/get-inventory', methods=['GET'])
 def get_inventory():
     """
-    Return the latest inventory table HTML.
+    Return the latest inventory table HTML, one page of products at a time.
+    Optional parameters:
+        `sort`: 'sku' (default) or 'name'
+        `limit`: number of products per page
+        `after`, `after_name`: the SKU and name of the last product already shown; if
+            given, only the table rows of the next page are returned
+    Responses carry an ETag, so unchanged pages are answered with `304 Not Modified`.
+    """
+    sort: str = request.args.get('sort', 'sku')
+    if sort not in {'sku', 'name'}:
+        return make_response("`sort` must only be 'sku' or 'name'", 400)
+
+    def render(seq: int) -> str:
+        page: dict = _inventory_page(
+            after_sku=request.args.get('after'),
+            after_name=request.args.get('after_name'),
+            limit=request.args.get('limit', PAGE_SIZE, type=int),
+            sort=sort,
+            seq=seq
+        )
+
+        # render the HTML for the next rows, or for the whole table starting at the top
+        if request.args.get('after') is not None:
+            return render_template('inventory_rows.html', inventory=INVENTORY, page=page)
+        return render_template('inventory.html', inventory=INVENTORY, page=page)
+
+    return _cached_fragment(render)
+
+
+@app.route('/search', methods=['GET'])
+def search():
+    """
+    Return the inventory table HTML holding the products that best match the search
+    query given by the `q` parameter, up to `limit` products.
+    """
+    query: str = request.args.get('q', '')
+    limit: int = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+
+    def render(seq: int) -> str:
+        page: dict = {
+            'rows': INVENTORY.search(query=query, limit=limit),
+            'has_more': False,
+            'sort': 'relevance',
+            'seq': seq
+        }
+        return render_template('inventory.html', inventory=INVENTORY, page=page)
+
+    return _cached_fragment(render)
+
+
+@app.route('/changes', methods=['GET'])
+def changes():
+    """
+    Return the products changed after the change log entry given by the `since`
+    parameter as JSON, so the frontend can patch the rows it shows:
+    {
+        'seq': int,         # the latest change included, for the next request
+        'reset': bool,      # if true, the changes are too many or too old to list
+        'count': int,       # the number of products in the inventory
+        'changes': [{'sku': str, 'deleted': bool, 'name': str, 'quantity': int,
+                     'html': str}, ...]
+    }
+    """
+    since: Optional[int] = request.args.get('since', type=int)
+    if since is None or since < 0:
+        return make_response("`since` must be a change log sequence number.", 400)
+
+    feed: dict = INVENTORY.get_changes(since=since, limit=MAX_CHANGES)
+
+    # render the table row of every product that still exists
+    changed: list[dict] = []
+    for row in feed['changes']:
+        change: dict = {'sku': row['sku'], 'deleted': row['name'] is None}
+        if not change['deleted']:
+            page: dict = {'rows': [row], 'has_more': False}
+            change.update({
+                'name': row['name'],
+                'quantity': row['quantity'],
+                'html': render_template('inventory_rows.html', inventory=INVENTORY, page=page)
+            })
+        changed.append(change)
+
+    return {
+        'seq': feed['seq'],
+        'reset': feed['reset'],
+        'count': INVENTORY.count(),
+        'changes': changed
+    }
+
+
+@app.route('/history', methods=['GET'])
+def history():
+    """
+    Return the ledger entries of the product given by the `sku` parameter as JSON,
+    newest first, up to `limit` of them and only those before the entry `before` if
+    given:
+    {
+        'sku': str,
+        'entries': [{'seq': int, 'ts': float, 'op': str, 'name': str,
+                     'quantity': int | None, 'delta': int}, ...],
+        'before': int | None    # the `before` of the next page, if there may be one
+    }
+    """
+    sku: Optional[str] = request.args.get('sku')
+    if not sku:
+        return make_response("`sku` must be a product SKU.", 400)
+    limit: int = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+
+    entries: list = INVENTORY.history(
+        sku=sku, limit=limit, before=request.args.get('before', type=int)
+    )
+    return {
+        'sku': sku,
+        'entries': [dict(entry) for entry in entries],
+        'before': entries[-1]['seq'] if len(entries) == limit else None
+    }
+
+
+@app.route('/products-at', methods=['GET'])
+def products_at():
+    """
+    Return the products as they were at the Unix time given by the `at` parameter, or
+    right after the ledger entry given by `seq`, as JSON; only the product given by
+    `sku` if set:
+    {
+        'products': [{'sku': str, 'name': str, 'quantity': int}, ...]
+    }
+    """
+    at: Optional[float] = request.args.get('at', type=float)
+    seq: Optional[int] = request.args.get('seq', type=int)
+    if (at is None) == (seq is None) or (seq is not None and seq < 0):
+        return make_response(
+            "Exactly one of `at` (a Unix time) or `seq` (a ledger entry) is required.", 400
+        )
+
+    sku: Optional[str] = request.args.get('sku')
+    if sku:
+        product = INVENTORY.product_at(sku=sku, at=at, seq=seq)
+        rows: list = [product] if product is not None else []
+    else:
+        rows = INVENTORY.products_at(at=at, seq=seq)
+    return {'products': [dict(row) for row in rows]}
+
+
+@app.route('/low-stock', methods=['GET'])
+def low_stock():
+    """
+    Return the products whose quantity is below the `threshold` parameter as JSON, lowest
+    quantity first, up to `limit` of them:
+    {
+        'threshold': int,
+        'products': [{'sku': str, 'name': str, 'quantity': int}, ...]
+    }
+    """
+    threshold: Optional[int] = request.args.get('threshold', type=int)
+    if threshold is None:
+        return make_response("`threshold` must be a whole number of units.", 400)
+    limit: int = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+
+    rows: list = INVENTORY.low_stock(threshold, limit=limit)
+    return {'threshold': threshold, 'products': [dict(row) for row in rows]}
+
+
+@app.route('/totals', methods=['GET'])
+def totals():
+    """
+    Return the number of products and the total number of units held as JSON:
+    {
+        'products': int,
+        'units': int
+    }
+    """
+    return {'products': INVENTORY.count(), 'units': INVENTORY.total_quantity()}
+
+
+@app.route('/quantity-histogram', methods=['GET'])
+def quantity_histogram():
+    """
+    Return the number of products in each quantity range as JSON; `max` is None for the
+    last, open-ended range:
+    {
+        'buckets': [{'min': int, 'max': int | None, 'products': int}, ...]
+    }
+    """
+    return {'buckets': INVENTORY.quantity_histogram()}
+
+
+@app.route('/events', methods=['GET'])
+def events():
+    """
+    Stream the changes to products as Server-Sent Events, as soon as they are committed.
+    Each `change` event carries the changed product as JSON:
+        {'sku': str, 'op': str, 'name': str, 'quantity': int}
+    where `op` is 'insert', 'update' or 'delete', and the event ID is the change log
+    sequence number. A `reset` event means changes were missed, because the client fell
+    too far behind, and the client should reload everything it shows.
+    A reconnecting client resumes after its `Last-Event-ID`; a new client may pass the
+    change log position of the page it shows as the `since` parameter.
     """
-    # return the HTML for the latest inventory list
-    return render_template('inventory.html', inventory=INVENTORY)
+    last_seq: Optional[int] = request.headers.get('Last-Event-ID', type=int)
+    if last_seq is None:
+        last_seq = request.args.get('since', type=int)
+    subscription = BROADCASTER.subscribe(last_seq=last_seq)
+
+    def stream() -> Iterator[str]:
+        try:
+            # ask browsers to reconnect quickly when the connection drops
+            yield 'retry: 3000\n\n'
+            while (batch := subscription.get(timeout=EVENT_KEEPALIVE)) is not None:
+                if not batch:
+                    # keep idle connections from being closed by proxies
+                    yield ': keep-alive\n\n'
+                for event in batch:
+                    yield (
+                        f"id: {event['id']}\nevent: {event['event']}\n"
+                        f"data: {json.dumps(event['data'])}\n\n"
+                    )
+        finally:
+            # the client disconnected, or the server is shutting down
+            BROADCASTER.unsubscribe(subscription)
+
+    resp: Response = Response(stream(), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
 
 
 @app.route('/export-csv', methods=['GET'])
@@ -58,47 +454,154 @@ def export_csv():
     """
     Return a CSV file of the specified products given by the `items` parameter.
     `items` must be a JSON list of strings, where each string is a unique product SKU.
-    If successful, returns `inventory_export.csv`.
+    If successful, streams `inventory_export.csv`, gzip-compressed if the client accepts
+    gzip encoding. A client whose Accept header prefers the Arrow IPC stream or Parquet
+    media type gets the same products in that format instead, as from /export-columnar.
     """
-    # call the export CSV service to perform the export operation
+    # serve a columnar format if the client asks for one over CSV
+    best: Optional[str] = request.accept_mimetypes.best_match(
+        ['text/csv', *COLUMNAR_MIMETYPES], default='text/csv'
+    )
+    if best in COLUMNAR_MIMETYPES:
+        return services.export_columnar(
+            inventory=INVENTORY,
+            items_param=request.args.get('items'),
+            fmt=COLUMNAR_MIMETYPES[best]
+        )
+
+    # call the export CSV service to stream the exported items to the user
     resp: Response = services.export_csv(
         inventory=INVENTORY,
         items_param=request.args.get('items'),
-        path=EXPORTED_CSV_PATH
+        use_gzip=('gzip' in request.accept_encodings)
     )
+    resp.headers['Vary'] = 'Accept, Accept-Encoding'
+    return resp
 
-    # if export unsuccessful, return the error response and write to terminal
-    if resp.status_code != 200:
-        return resp
 
-    # return the exported items in EXPORTED_CSV_PATH as 'inventory_export.csv' to the user
-    return send_file(
-        path_or_file=EXPORTED_CSV_PATH,
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name='inventory_export.csv'
+@app.route('/export-columnar', methods=['GET'])
+def export_columnar():
+    """
+    Return an Arrow IPC stream or a Parquet file of the specified products given by the
+    `items` parameter, like /export-csv. The `format` parameter, 'arrow' or 'parquet',
+    picks the format; without it, the Accept header does, and Arrow is the default.
+    Responds 501 if the server lacks the optional pyarrow package.
+    """
+    fmt: Optional[str] = request.args.get('format')
+    if fmt is None:
+        best: Optional[str] = request.accept_mimetypes.best_match(list(COLUMNAR_MIMETYPES))
+        fmt = COLUMNAR_MIMETYPES.get(best or '', 'arrow')
+
+    # call the export columnar service to stream the exported items to the user
+    resp: Response = services.export_columnar(
+        inventory=INVENTORY,
+        items_param=request.args.get('items'),
+        fmt=fmt
     )
+    return resp
 
 
 @app.route('/import-csv', methods=['POST'])
 def import_csv():
     """
-    When given a multipart form POST request, accept a CSV file and import its contents to
-    the product inventory.
-    When given a GET request,
+    Accept a CSV file and start a background job importing its contents to the product
+    inventory.
+    The CSV file is either the raw request body, sent with a `text/csv` content type and
+    an optional `filename` parameter, or the `file` part of a multipart form request.
+    The `mode` parameter tells what to do with products that already exist: 'ignore'
+    them (the default), 'replace' their name and quantity, 'add-quantity' to their
+    quantity, or 'set-quantity'. Products that would be left as they are are not written.
+    If successful, responds 202 with the status of the job, whose progress can be
+    followed at /jobs/<id>, or 429 if too many imports are already waiting. The same file
+    sent again with the same `Idempotency-Key` header is answered with the status of the
+    job started the first time.
     """
-    # ensure the request is a multipart form data with a file part
+    # save a raw CSV request body straight from the request stream
+    if request.mimetype == 'text/csv':
+        return services.import_csv_stream(
+            inventory=INVENTORY,
+            jobs=JOBS,
+            stream=request.stream,
+            filename=request.args.get('filename', 'upload.csv'),
+            mode=request.args.get('mode', 'ignore'),
+            idempotency_key=request.headers.get('Idempotency-Key')
+        )
+
+    # otherwise, ensure the request is a multipart form data with a file part
     if 'file' not in request.files:
         return make_response("Must provide file as a multipart form request.", 400)
 
     # call the import CSV service to perform the import operation
     resp: Response = services.import_csv(
         inventory=INVENTORY,
-        post_file=request.files['file']
+        jobs=JOBS,
+        post_file=request.files['file'],
+        mode=request.args.get('mode', 'ignore'),
+        idempotency_key=request.headers.get('Idempotency-Key')
+    )
+    return resp
+
+
+@app.route('/import-columnar', methods=['POST'])
+def import_columnar():
+    """
+    Accept an Arrow IPC (stream or file) or Parquet file, with `sku`, `name` and
+    `quantity` columns, and start a background job importing its contents to the product
+    inventory, like /import-csv.
+    The file is either the raw request body, whose format is given by the `format`
+    parameter or else by its content type, or the `file` part of a multipart form
+    request, whose format is given by its extension.
+    Responds 501 if the server lacks the optional pyarrow package.
+    """
+    # save a raw request body straight from the request stream
+    if request.mimetype != 'multipart/form-data':
+        fmt: str = request.args.get('format') or COLUMNAR_MIMETYPES.get(request.mimetype, '')
+        return services.import_columnar_stream(
+            inventory=INVENTORY,
+            jobs=JOBS,
+            stream=request.stream,
+            filename=request.args.get('filename', f'upload.{fmt}'),
+            fmt=fmt,
+            mode=request.args.get('mode', 'ignore'),
+            idempotency_key=request.headers.get('Idempotency-Key')
+        )
+
+    # otherwise, ensure the request has a file part
+    if 'file' not in request.files:
+        return make_response("Must provide file as a multipart form request.", 400)
+
+    # call the import columnar service to perform the import operation
+    resp: Response = services.import_columnar(
+        inventory=INVENTORY,
+        jobs=JOBS,
+        post_file=request.files['file'],
+        mode=request.args.get('mode', 'ignore'),
+        idempotency_key=request.headers.get('Idempotency-Key')
     )
     return resp
 
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id: str):
+    """
+    Return the status of a background job as JSON: its progress in units of work (bytes
+    of the file for CSV imports), throughput per second, estimated seconds left, error,
+    and the report of its task.
+    """
+    resp: Response = services.job_status(jobs=JOBS, job_id=job_id)
+    return resp
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id: str):
+    """
+    Cancel a background job. A running CSV import stops after its current batch; the
+    batches already imported are kept.
+    """
+    resp: Response = services.cancel_job(jobs=JOBS, job_id=job_id)
+    return resp
+
+
 @app.route('/add-product', methods=['POST'])
 def add_product():
     """
@@ -110,6 +613,7 @@ def add_product():
         'quantity': int
     }
     'quantity' >= 0
+    A request sent again with the same `Idempotency-Key` header is not applied twice.
     """
     request_data: dict = request.get_json()
 
@@ -118,7 +622,8 @@ def add_product():
         inventory=INVENTORY,
         sku=request_data['sku'],
         name=request_data['name'],
-        quantity=request_data['quantity']
+        quantity=request_data['quantity'],
+        idempotency_key=request.headers.get('Idempotency-Key')
     )
 
     return resp
@@ -129,11 +634,13 @@ def delete_products():
     """
     Delete the specified products given by the `items` parameter.
     `items` must be a JSON list of strings, where each string is a unique product SKU.
+    A request sent again with the same `Idempotency-Key` header is not applied twice.
     """
     # call the delete products service to remove the specified product
     resp: Response = services.delete_products(
         inventory=INVENTORY,
-        items_param=request.args.get('items')
+        items_param=request.args.get('items'),
+        idempotency_key=request.headers.get('Idempotency-Key')
     )
 
     return resp
@@ -148,6 +655,7 @@ def change_name():
         'sku': str,
         'new_name': str
     }
+    A request sent again with the same `Idempotency-Key` header is not applied twice.
     """
     request_data: dict = request.get_json()
 
@@ -155,7 +663,8 @@ def change_name():
     resp: Response = services.change_name(
         inventory=INVENTORY,
         sku=request_data['sku'],
-        new_name=request_data['new_name']
+        new_name=request_data['new_name'],
+        idempotency_key=request.headers.get('Idempotency-Key')
     )
 
     return resp
@@ -173,6 +682,8 @@ def update_quantity():
     }
     'operation' in {'add', 'subtract', 'set'}
     'count' >= 0
+    A request sent again with the same `Idempotency-Key` header is not applied twice, so
+    a retried addition is only counted once.
     """
     request_data: dict = request.get_json()
 
@@ -181,27 +692,223 @@ def update_quantity():
         inventory=INVENTORY,
         sku=request_data['sku'],
         operation=request_data['operation'],
-        count=request_data['count']
+        count=request_data['count'],
+        idempotency_key=request.headers.get('Idempotency-Key')
     )
 
     return resp
 
 
-if __name__ == '__main__':
-    # create the inventory object
-    INVENTORY = Products(db_path=SQLITE_DB_PATH, table_name='products')
+@app.route('/batch', methods=['POST'])
+def batch():
+    """
+    Applies a list of operations to products in a single transaction.
+    JSON body format:
+    {
+        'ops': [
+            {'op': 'add' | 'subtract' | 'set', 'sku': str, 'count': int},
+            {'op': 'rename', 'sku': str, 'name': str},
+            {'op': 'delete', 'sku': str},
+            ...
+        ],
+        'atomic': bool
+    }
+    'count' >= 0
+    If 'atomic' is true, either every operation is applied, or none.
+    A committed batch sent again with the same `Idempotency-Key` header is answered with
+    the outcome of the first request, and not applied twice.
+    """
+    request_data: dict = request.get_json()
+
+    # call the batch service to apply the operations
+    resp: Response = services.apply_batch(
+        inventory=INVENTORY,
+        ops=request_data.get('ops'),
+        atomic=request_data.get('atomic', False),
+        idempotency_key=request.headers.get('Idempotency-Key')
+    )
 
-    # create a new products table if the database file did not exist before
-    if not Path(SQLITE_DB_PATH).is_file():
+    return resp
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Return the metrics of this process in the Prometheus text format: request, service,
+    Products method and SQL statement latency histograms, row and error counters, and the
+    current counters of the connection pool, caches, writer and background services.
+    Every worker process keeps its own metrics.
+    """
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _component_stats() -> Iterator[Sample]:
+    """
+    Yield the statistics counters of the inventory's components and background services.
+    """
+    components: dict = {
+        'pool': INVENTORY.pool_stats(),
+        'cache': INVENTORY.cache_stats(),
+        'writer': INVENTORY.writer_stats(),
+        'write_behind': INVENTORY.write_behind_stats(),
+        'fragment_cache': FRAGMENT_CACHE.stats(),
+        'events': BROADCASTER.stats(),
+        'jobs': JOBS.stats()
+    }
+    if isinstance(INVENTORY, ColumnarProducts):
+        components['columns'] = INVENTORY.column_stats()
+    for component, stats in components.items():
+        for stat, value in stats.items():
+            yield 'inventory_component_stat', {'component': component, 'stat': stat}, value
+
+
+def create_app(db_path: str = SQLITE_DB_PATH, seed_csv: str = INITIAL_DATA_CSV) -> Flask:
+    """
+    Application factory: open the inventory database at `db_path` and start the
+    background services the endpoints rely on, then return the Flask application.
+    Call it once in every process that serves requests, after any fork, such as in each
+    worker of a production server:
+        python3.9 main.py --workers 4
+        gunicorn --workers 4 'main:create_app()'
+    Processes starting together take turns creating the database and the products
+    table, so only the first one seeds a new database from `seed_csv`.
+    """
+    global INVENTORY, BROADCASTER, JOBS
+
+    # log the SQL statements slower than the threshold, if one is set
+    metrics.SLOW_QUERY_SECONDS = SLOW_QUERY_SECONDS
+
+    # hold the setup lock, so other processes wait until the database is ready
+    with file_lock(f'{db_path}.lock'):
+        # opening the database creates the file, so check whether it is new beforehand
+        new_database: bool = not Path(shard_paths(db_path, DB_SHARDS)[0]).is_file()
+
+        # create the inventory object, partitioned across several database files, or
+        # reading from in-memory columns, if set
+        options: dict = {
+            'table_name': 'products',
+            'pool_size': DB_POOL_SIZE,
+            'write_behind': QUANTITY_WRITE_BEHIND,
+            'idempotency_size': IDEMPOTENCY_KEYS,
+            'idempotency_ttl': IDEMPOTENCY_TTL
+        }
+        if DB_SHARDS > 1:
+            INVENTORY = ShardedProducts(db_path=db_path, shards=DB_SHARDS, **options)
+        elif COLUMNAR_READS:
+            INVENTORY = ColumnarProducts(db_path=db_path, **options)
+        else:
+            INVENTORY = Products(db_path=db_path, **options)
+        # write buffered updates and close the database connections when the process
+        # shuts down
+        atexit.register(INVENTORY.close)
+
+        # create the products table, or add missing indices and counters to an
+        # existing one
         INVENTORY.create_table()
-        # ingest initial product data if the INITIAL_DATA_CSV file exists
-        if Path(INITIAL_DATA_CSV).is_file():
-            initial_data: list = csv_to_list(INITIAL_DATA_CSV)
-            INVENTORY.import_data(data=initial_data)
-
-    # reload the dev server upon HTML changes
-    app.config['TEMPLATES_AUTO_RELOAD'] = True
-    # specify max file upload to be 5MiB
-    app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024
-    # run the Flask development server
-    app.run(threaded=True, port=5000, use_reloader=True)
+
+        # ingest initial product data if the database file did not exist before and the
+        # seed CSV file exists
+        if new_database and Path(seed_csv).is_file():
+            services.import_csv_file(INVENTORY, seed_csv)
+
+    # run CSV imports in the background; stopped before the database connections close.
+    # Jobs are published next to the database, so any worker can report on them
+    JOBS = JobManager(
+        max_running=MAX_IMPORT_JOBS,
+        max_queued=MAX_QUEUED_IMPORTS,
+        state_dir=f'{db_path}-jobs'
+    )
+    atexit.register(JOBS.close)
+
+    # push committed changes to the clients connected to /events
+    BROADCASTER = ChangeBroadcaster(INVENTORY, buffer_size=EVENT_BUFFER_SIZE)
+    atexit.register(BROADCASTER.close)
+
+    # report the components' counters along with the metrics
+    METRICS.add_collector(
+        'inventory_component_stat', 'gauge',
+        'Current statistics of the connection pool, caches, writer and background services.',
+        _component_stats
+    )
+
+    # CSV imports are streamed in batches, so uploads can be large
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+    return app
+
+
+def create_asgi_app(
+    db_path: str = SQLITE_DB_PATH,
+    seed_csv: str = INITIAL_DATA_CSV
+) -> InventoryASGI:
+    """
+    Application factory for ASGI servers: set up the inventory and the background
+    services like create_app(), and return an ASGI application serving the data
+    endpoints through non-blocking calls. Call it once in every worker process:
+        python3.9 main.py --workers 4 --asgi
+        uvicorn --factory main:create_asgi_app
+    """
+    create_app(db_path=db_path, seed_csv=seed_csv)
+    return InventoryASGI(
+        AsyncProducts(INVENTORY),
+        JOBS,
+        max_body_bytes=MAX_UPLOAD_BYTES,
+        max_key_length=IDEMPOTENCY_KEY_MAX_LENGTH
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inventory Management System server')
+    parser.add_argument(
+        '--workers', type=int, default=0,
+        help='serve with this many worker processes instead of the development server'
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--db', default=SQLITE_DB_PATH, help='SQLite database file')
+    parser.add_argument(
+        '--shards', type=int, default=DB_SHARDS,
+        help='partition the products across this many database files next to --db'
+    )
+    parser.add_argument(
+        '--columnar', action='store_true', default=COLUMNAR_READS,
+        help='serve reads from an in-memory columnar copy of the products'
+    )
+    parser.add_argument(
+        '--slow-query-ms', type=float, default=None,
+        help='log SQL statements that take longer than this many milliseconds'
+    )
+    parser.add_argument(
+        '--asgi', action='store_true',
+        help='serve the data endpoints with the ASGI application and uvicorn'
+    )
+    args = parser.parse_args()
+    DB_SHARDS = args.shards
+    COLUMNAR_READS = args.columnar
+    if DB_SHARDS > 1 and COLUMNAR_READS:
+        parser.error('--columnar cannot be combined with --shards')
+    if args.slow_query_ms is not None:
+        SLOW_QUERY_SECONDS = args.slow_query_ms / 1000
+
+    if args.asgi:
+        # run uvicorn in every worker, which builds its own application
+        serve(
+            lambda: create_asgi_app(db_path=args.db),
+            host=args.host,
+            port=args.port,
+            workers=max(args.workers, 1),
+            asgi=True
+        )
+    elif args.workers > 0:
+        # run the production server; every worker builds its own application
+        serve(
+            lambda: create_app(db_path=args.db),
+            host=args.host,
+            port=args.port,
+            workers=args.workers
+        )
+    else:
+        create_app(db_path=args.db)
+        # reload the dev server upon HTML changes
+        app.config['TEMPLATES_AUTO_RELOAD'] = True
+        # run the Flask development server
+        app.run(host=args.host, port=args.port, threaded=True, use_reloader=True)
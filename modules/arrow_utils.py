@@ -0,0 +1,245 @@
+#!/usr/bin/env python3.9
+"""
+Utility functions that allow for reading and writing products in the columnar Apache
+Arrow IPC and Parquet formats, alongside the CSV ones in csv_utils.
+Requires the optional pyarrow package (`pip install pyarrow`); available() tells whether
+it is installed.
+"""
+
+import os
+from sqlite3 import Row
+from typing import Any, Iterable, Iterator
+
+from modules.csv_utils import batched, clean_product_fields
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # the formats are optional
+    pyarrow = None
+
+# the supported formats, with their media types and accepted file extensions
+FORMATS: dict = {
+    'arrow': {
+        'mimetype': 'application/vnd.apache.arrow.stream',
+        'extensions': {'arrow', 'arrows', 'feather'}
+    },
+    'parquet': {
+        'mimetype': 'application/vnd.apache.parquet',
+        'extensions': {'parquet'}
+    }
+}
+# rows per record batch written, and per Parquet row group
+BATCH_ROWS: int = 64 * 1024
+# compression codec of Arrow IPC record batches and Parquet pages
+COMPRESSION: str = 'zstd'
+# the columns of a products file
+COLUMNS: tuple = ('sku', 'name', 'quantity')
+# the first bytes of an Arrow IPC file, as opposed to an Arrow IPC stream
+ARROW_FILE_MAGIC: bytes = b'ARROW1'
+
+
+def available() -> bool:
+    """
+    Return True if pyarrow is installed, so that the columnar formats can be used.
+    """
+    return pyarrow is not None
+
+
+def format_of(filename: str) -> str:
+    """
+    Return the name of the format that the extension of `filename` belongs to, or an
+    empty string if none.
+    """
+    extension: str = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    for name, spec in FORMATS.items():
+        if extension in spec['extensions']:
+            return name
+    return ''
+
+
+def _schema() -> Any:
+    """
+    Return the Arrow schema of products: a string `sku` and `name`, and an integer
+    `quantity`.
+    """
+    return pyarrow.schema([
+        ('sku', pyarrow.string()), ('name', pyarrow.string()), ('quantity', pyarrow.int64())
+    ])
+
+
+class _ChunkSink:
+    """
+    A write-only file object that keeps what is written to it until taken, so that a
+    file can be streamed while it is being written.
+    """
+
+    closed: bool = False
+
+    def __init__(self) -> None:
+        self._chunks: list[bytes] = []
+        self._position: int = 0
+
+    def write(self, data: Any) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def take(self) -> bytes:
+        """
+        Return the bytes written since the last call, and forget them.
+        """
+        data: bytes = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_columnar_bytes(
+    rows: Iterable[Row],
+    fmt: str,
+    batch_rows: int = BATCH_ROWS
+) -> Iterator[bytes]:
+    """
+    Given an iterable of SQLite Row objects with the columns sku, name and quantity,
+    lazily yield the bytes of an Arrow IPC stream or a Parquet file, depending on `fmt`,
+    one record batch or row group of `batch_rows` rows at a time.
+    """
+    assert fmt in FORMATS and available()
+
+    schema = _schema()
+    sink = _ChunkSink()
+    writer: Any = (
+        pyarrow.ipc.new_stream(
+            sink, schema, options=pyarrow.ipc.IpcWriteOptions(compression=COMPRESSION)
+        )
+        if fmt == 'arrow'
+        else pyarrow.parquet.ParquetWriter(sink, schema, compression=COMPRESSION)
+    )
+
+    # each chunk of rows becomes one record batch, built column by column
+    for chunk in batched(rows, batch_rows):
+        skus, names, quantities = zip(*chunk)
+        writer.write_batch(pyarrow.record_batch([
+            pyarrow.array(skus, pyarrow.string()),
+            pyarrow.array(names, pyarrow.string()),
+            pyarrow.array(quantities, pyarrow.int64())
+        ], schema=schema))
+        data: bytes = sink.take()
+        if data:
+            yield data
+
+    # write the end of the stream, or the Parquet footer
+    writer.close()
+    yield sink.take()
+
+
+def _clean_batch(
+    batch: Any,
+    first_row: int
+) -> tuple[list[tuple[str, str, int]], list[dict]]:
+    """
+    Validate the rows of a record batch, numbered from `first_row`, and return the valid
+    ones as (sku, name, quantity) tuples, along with the rejected ones as dictionaries:
+    {'row': int, 'reason': str}.
+    """
+    missing: list[str] = [column for column in COLUMNS if column not in batch.schema.names]
+    if missing:
+        raise ValueError(f'missing columns: {", ".join(missing)}')
+
+    # common case: text SKUs and names, integer quantities, and every row valid, which is
+    # checked column by column without building a Python object per field
+    if all(pyarrow.types.is_string(batch.column(column).type) for column in COLUMNS[:2]) \
+            and pyarrow.types.is_integer(batch.column('quantity').type):
+        skus, names = (batch.column(column) for column in COLUMNS[:2])
+        # as in CSV files, SKUs and names are stored as they are, but must not be blank
+        trimmed_skus, trimmed_names = (
+            pyarrow.compute.utf8_trim_whitespace(column) for column in (skus, names)
+        )
+        quantities = batch.column('quantity').fill_null(0)
+        valid = pyarrow.compute.all(pyarrow.compute.and_(
+            pyarrow.compute.and_(
+                pyarrow.compute.greater(pyarrow.compute.utf8_length(trimmed_skus), 0),
+                pyarrow.compute.greater(pyarrow.compute.utf8_length(trimmed_names), 0)
+            ),
+            pyarrow.compute.greater_equal(quantities, 0)
+        ).fill_null(False)).as_py()
+        if valid or not batch.num_rows:
+            return list(zip(skus.to_pylist(), names.to_pylist(), quantities.to_pylist())), []
+
+    # otherwise, validate the rows one by one to describe the rejected ones
+    columns: dict = batch.select(COLUMNS).to_pydict()
+    rows: list[tuple[str, str, int]] = []
+    rejections: list[dict] = []
+    for number, (sku, name, quantity) in enumerate(
+        zip(*(columns[column] for column in COLUMNS)), start=first_row
+    ):
+        try:
+            rows.append(clean_product_fields(
+                '' if sku is None else str(sku),
+                '' if name is None else str(name),
+                '' if quantity is None else str(quantity)
+            ))
+        except ValueError as err:
+            rejections.append({'row': number, 'reason': str(err)})
+    return rows, rejections
+
+
+def iter_columnar_chunks(path: str, fmt: str, batch_rows: int = BATCH_ROWS) -> Iterator[dict]:
+    """
+    Read the Arrow IPC (stream or file) or Parquet file at `path`, depending on `fmt`,
+    one record batch at a time, and yield the valid and rejected rows of every batch as
+    a dictionary shaped like the chunks of parallel_csv.iter_csv_chunks():
+        {'start': int, 'end': int, 'rows': list[tuple[str, str, int]], 'records': int,
+         'rejections': list[dict]}
+    `start` and `end` estimate the bytes of the file read before and after the batch.
+    Raise ValueError if the file lacks one of the sku, name and quantity columns.
+    """
+    assert fmt in FORMATS and available()
+
+    size: int = os.path.getsize(path)
+    batches: Iterator = iter(())
+    total_rows: int = 0     # rows in the file, if known in advance
+    if fmt == 'parquet':
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        total_rows = parquet_file.metadata.num_rows
+        batches = parquet_file.iter_batches(batch_size=batch_rows)
+    else:
+        source = pyarrow.memory_map(path)
+        if source.read(len(ARROW_FILE_MAGIC)) == ARROW_FILE_MAGIC:
+            reader = pyarrow.ipc.open_file(source)
+            total_rows = sum(
+                reader.get_batch(i).num_rows for i in range(reader.num_record_batches)
+            )
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        else:
+            source.seek(0)
+            batches = iter(pyarrow.ipc.open_stream(source))
+
+    start: int = 0
+    records: int = 0
+    for batch in batches:
+        rows, rejections = _clean_batch(batch, first_row=records + 1)
+        records += batch.num_rows
+        end: int = size * records // total_rows if total_rows else source.tell()
+        yield {
+            'start': start, 'end': end, 'rows': rows, 'records': batch.num_rows,
+            'rejections': rejections
+        }
+        start = end
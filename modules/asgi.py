@@ -0,0 +1,274 @@
+#!/usr/bin/env python3.9
+"""
+An ASGI application serving the data endpoints of main.py with the coroutines in
+async_services.py, so that an ASGI server holds many slow uploads, long exports and
+waiting writes on one event loop, without a thread for each.
+Exposes the InventoryASGI class; main.create_asgi_app() builds one, and
+server.serve(asgi=True) runs it with uvicorn in every worker process.
+"""
+
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+from urllib.parse import parse_qsl
+
+from modules.async_products import AsyncProducts
+from modules.async_services import Reply, _reply
+from modules.jobs import JobManager
+import modules.async_services as async_services
+
+# the ASGI receive and send callables
+Receive = Callable[[], Awaitable[dict]]
+Send = Callable[[dict], Awaitable[None]]
+
+
+class _BodyTooLarge(Exception):
+    """
+    Raised while receiving a request body larger than the configured limit.
+    """
+
+
+class InventoryASGI:
+    """
+    An ASGI (version 3) application serving these endpoints of main.py, with the same
+    parameters and responses:
+        - GET       /export-csv?items=      > Stream a CSV file of the specified products,
+                                            gzip-compressed if the client accepts it
+        - POST      /import-csv?mode=&filename=
+                                            > Accept a raw CSV request body and start a
+                                            background job importing it
+        - GET       /jobs/<id>              > Return the status of a background job
+        - DELETE    /jobs/<id>              > Cancel a background job
+        - POST      /add-product            > Add a new product to the inventory
+        - DELETE    /delete-products?items= > Delete a non-empty list of products
+        - POST      /change-name            > Change the name of a product
+        - POST      /update-quantity        > Update the quantity of a product
+        - POST      /batch                  > Apply a batch of operations
+    Like those of main.py, the endpoints that change products honour an
+    `Idempotency-Key` header.
+    Other paths are answered 404; the web UI and the other endpoints are served by the
+    Flask application.
+
+    Public methods:
+        - InventoryASGI(inventory: AsyncProducts, jobs: JobManager,
+                        max_body_bytes: Optional[int] = None,
+                        max_key_length: int = 255) -> None
+        - await InventoryASGI(scope: dict, receive: Receive, send: Send) -> None
+    """
+
+    inventory: AsyncProducts        # the products served
+    jobs: JobManager                # runs the background imports
+    max_body_bytes: Optional[int]   # largest request body accepted, if limited
+    max_key_length: int             # longest Idempotency-Key header accepted
+
+    def __init__(
+        self,
+        inventory: AsyncProducts,
+        jobs: JobManager,
+        max_body_bytes: Optional[int] = None,
+        max_key_length: int = 255
+    ) -> None:
+        self.inventory = inventory
+        self.jobs = jobs
+        self.max_body_bytes = max_body_bytes
+        self.max_key_length = max_key_length
+        # (method, path) -> handler; paths under /jobs/ are routed by their prefix
+        self._routes: dict[tuple[str, str], Callable[..., Awaitable[Reply]]] = {
+            ('GET', '/export-csv'): self._export_csv,
+            ('POST', '/import-csv'): self._import_csv,
+            ('GET', '/jobs/'): self._job_status,
+            ('DELETE', '/jobs/'): self._cancel_job,
+            ('POST', '/add-product'): self._add_product,
+            ('DELETE', '/delete-products'): self._delete_products,
+            ('POST', '/change-name'): self._change_name,
+            ('POST', '/update-quantity'): self._update_quantity,
+            ('POST', '/batch'): self._batch
+        }
+
+    async def __call__(self, scope: dict, receive: Receive, send: Send) -> None:
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        reply: Reply = await self._dispatch(scope, receive)
+        await send({
+            'type': 'http.response.start',
+            'status': reply.status,
+            'headers': [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in reply.headers
+            ]
+        })
+        if isinstance(reply.body, bytes):
+            await send({'type': 'http.response.body', 'body': reply.body})
+            return
+
+        # stream the body, and stop producing it if the client goes away
+        body: Any = reply.body
+        try:
+            async for chunk in body:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(body, 'aclose'):
+                await body.aclose()
+
+    @staticmethod
+    async def _lifespan(receive: Receive, send: Send) -> None:
+        """
+        Acknowledge the startup and shutdown of the server. The inventory is opened
+        before the application is built, and closed at exit by main.create_app().
+        """
+        while True:
+            message: dict = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _dispatch(self, scope: dict, receive: Receive) -> Reply:
+        """
+        Call the handler of the request's method and path with the request, and return
+        its reply, or an error reply if there is no such handler or the request is
+        malformed.
+        """
+        path: str = scope['path']
+        method: str = scope['method']
+        route: str = '/jobs/' if path.startswith('/jobs/') else path
+        handler: Optional[Callable[..., Awaitable[Reply]]] = self._routes.get((method, route))
+        if handler is None:
+            if any(route == known for _, known in self._routes):
+                return _reply("Method not allowed.", 405)
+            return _reply("Not found.", 404)
+
+        request: dict = {
+            'path': path,
+            'args': dict(parse_qsl(scope['query_string'].decode('latin-1'))),
+            'headers': {
+                name.decode('latin-1').lower(): value.decode('latin-1')
+                for name, value in scope['headers']
+            },
+            'receive': receive
+        }
+        # reject a request whose `Idempotency-Key` header is empty or too long
+        key: Optional[str] = request['headers'].get('idempotency-key')
+        if key is not None and not 0 < len(key) <= self.max_key_length:
+            return _reply(
+                f"Idempotency-Key must have 1 to {self.max_key_length} characters.", 400
+            )
+        length: str = request['headers'].get('content-length', '')
+        if self.max_body_bytes is not None and length.isdigit() \
+                and int(length) > self.max_body_bytes:
+            return _reply("Request body too large.", 413)
+
+        try:
+            return await handler(request)
+        except _BodyTooLarge:
+            return _reply("Request body too large.", 413)
+        except (KeyError, TypeError, ValueError) as err:
+            # a missing field or an unreadable JSON body
+            print(f"---\nEndpoint: {path}\n{err!r}\n---")
+            return _reply("Must provide a JSON body with the required fields.", 400)
+
+    async def _iter_body(self, receive: Receive) -> AsyncIterator[bytes]:
+        """
+        Yield the chunks of the request body as they are received. Raise ConnectionError
+        if the client disconnects first, and _BodyTooLarge past the size limit.
+        """
+        received: int = 0
+        while True:
+            message: dict = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ConnectionError('client disconnected during the upload')
+            chunk: bytes = message.get('body', b'')
+            received += len(chunk)
+            if self.max_body_bytes is not None and received > self.max_body_bytes:
+                raise _BodyTooLarge()
+            if chunk:
+                yield chunk
+            if not message.get('more_body', False):
+                return
+
+    async def _json(self, request: dict) -> Any:
+        """
+        Receive the request body and return it decoded from JSON.
+        """
+        chunks: list[bytes] = [chunk async for chunk in self._iter_body(request['receive'])]
+        return json.loads(b''.join(chunks))
+
+    async def _export_csv(self, request: dict) -> Reply:
+        return await async_services.export_csv(
+            inventory=self.inventory,
+            items_param=request['args'].get('items'),
+            use_gzip=('gzip' in request['headers'].get('accept-encoding', ''))
+        )
+
+    async def _import_csv(self, request: dict) -> Reply:
+        content_type: str = request['headers'].get('content-type', '')
+        if content_type.split(';')[0].strip() != 'text/csv':
+            return _reply("Must provide the CSV file as a raw `text/csv` body.", 400)
+        return await async_services.import_csv_stream(
+            inventory=self.inventory,
+            jobs=self.jobs,
+            chunks=self._iter_body(request['receive']),
+            filename=request['args'].get('filename', 'upload.csv'),
+            mode=request['args'].get('mode', 'ignore'),
+            idempotency_key=request['headers'].get('idempotency-key')
+        )
+
+    async def _job_status(self, request: dict) -> Reply:
+        return await async_services.job_status(
+            inventory=self.inventory, jobs=self.jobs, job_id=request['path'][len('/jobs/'):]
+        )
+
+    async def _cancel_job(self, request: dict) -> Reply:
+        return await async_services.cancel_job(
+            inventory=self.inventory, jobs=self.jobs, job_id=request['path'][len('/jobs/'):]
+        )
+
+    async def _add_product(self, request: dict) -> Reply:
+        request_data: dict = await self._json(request)
+        return await async_services.add_product(
+            inventory=self.inventory,
+            sku=request_data['sku'],
+            name=request_data['name'],
+            quantity=request_data['quantity'],
+            idempotency_key=request['headers'].get('idempotency-key')
+        )
+
+    async def _delete_products(self, request: dict) -> Reply:
+        return await async_services.delete_products(
+            inventory=self.inventory,
+            items_param=request['args'].get('items'),
+            idempotency_key=request['headers'].get('idempotency-key')
+        )
+
+    async def _change_name(self, request: dict) -> Reply:
+        request_data: dict = await self._json(request)
+        return await async_services.change_name(
+            inventory=self.inventory,
+            sku=request_data['sku'],
+            new_name=request_data['new_name'],
+            idempotency_key=request['headers'].get('idempotency-key')
+        )
+
+    async def _update_quantity(self, request: dict) -> Reply:
+        request_data: dict = await self._json(request)
+        return await async_services.update_quantity(
+            inventory=self.inventory,
+            sku=request_data['sku'],
+            operation=request_data['operation'],
+            count=request_data['count'],
+            idempotency_key=request['headers'].get('idempotency-key')
+        )
+
+    async def _batch(self, request: dict) -> Reply:
+        request_data: dict = await self._json(request)
+        return await async_services.apply_batch(
+            inventory=self.inventory,
+            ops=request_data.get('ops'),
+            atomic=request_data.get('atomic', False),
+            idempotency_key=request['headers'].get('idempotency-key')
+        )
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3.9
+"""
+Non-blocking access to products in the inventory, for asyncio applications.
+Exposes the AsyncProducts class, which offers the Products API as coroutines that run the
+blocking SQLite calls on a dedicated executor, so an event loop can serve many concurrent
+requests without a thread for each of them.
+"""
+
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import (
+    Any, AsyncIterator, Callable, Generator, Iterable, Optional, Sequence, cast
+)
+
+from modules.products import Products
+from modules.sharding import ShardedProducts
+
+
+class AsyncProducts:
+    """
+    An asyncio front end for a Products object. Every call is queued on a dedicated
+    database executor, whose threads are the only ones blocked on SQLite; any number of
+    coroutines can wait on it, and the event loop keeps serving others meanwhile.
+
+    The executor has one thread per pooled read connection, plus enough threads to let
+    the writer commit a full group of queued writes at once; for ShardedProducts, that
+    many per shard. The wrapped Products object can still be used directly by
+    synchronous code at the same time.
+
+    Public methods:
+        - AsyncProducts(products: Products, max_workers: Optional[int] = None) -> None
+        - AsyncProducts.run(func: Callable[..., Any], *args, **kwargs) -> Any
+        - AsyncProducts.create_table() -> None
+        - AsyncProducts.import_data(data: list[dict]) -> None
+        - AsyncProducts.import_batches(batches: Iterable[Sequence[tuple]],
+                                       mode: str = 'ignore') -> AsyncIterator[dict]
+        - AsyncProducts.get_all() -> list[sqlite3.Row]
+        - AsyncProducts.get_specific(skus: list) -> list[sqlite3.Row]
+        - AsyncProducts.get_page(after_sku: Optional[str] = None, limit: int = 100,
+                                 sort: str = 'sku', after_name: Optional[str] = None)
+              -> list[sqlite3.Row]
+        - AsyncProducts.count() -> int
+        - AsyncProducts.low_stock(threshold: int, limit: int = 100) -> list[sqlite3.Row]
+        - AsyncProducts.total_quantity() -> int
+        - AsyncProducts.quantity_histogram() -> list[dict]
+        - AsyncProducts.search(query: str, limit: int = 50) -> list[sqlite3.Row]
+        - AsyncProducts.change_seq(fresh: bool = False) -> int
+        - AsyncProducts.get_changes(since: int, limit: int = 500) -> dict
+        - AsyncProducts.history(sku: str, limit: int = 100, before: Optional[int] = None)
+              -> list[sqlite3.Row]
+        - AsyncProducts.product_at(sku: str, at: Optional[float] = None,
+                                   seq: Optional[int] = None) -> Optional[sqlite3.Row]
+        - AsyncProducts.products_at(at: Optional[float] = None, seq: Optional[int] = None)
+              -> list[sqlite3.Row]
+        - AsyncProducts.take_snapshot() -> Optional[int]
+        - AsyncProducts.rebuild(seq: Optional[int] = None) -> dict
+        - AsyncProducts.iter_products(skus: Optional[list] = None, chunk_size: int = 1000)
+              -> AsyncIterator[list[sqlite3.Row]]
+        - AsyncProducts.add_product(sku: str, name: str, quantity: int = 0,
+                                    idempotency_key: Optional[str] = None) -> None
+        - AsyncProducts.delete_products(skus: list[str],
+                                        idempotency_key: Optional[str] = None) -> None
+        - AsyncProducts.change_name(sku: str, new_name: str,
+                                    idempotency_key: Optional[str] = None) -> None
+        - AsyncProducts.update_quantity(sku: str, operation: str, count: int,
+                                        idempotency_key: Optional[str] = None) -> None
+        - AsyncProducts.apply_batch(ops: list[dict], atomic: bool = False,
+                                    idempotency_key: Optional[str] = None) -> dict
+        - AsyncProducts.recall(key: str, request: Any) -> Any
+        - AsyncProducts.remember(key: str, request: Any, result: Any,
+                                 replace: bool = False) -> Any
+        - AsyncProducts.forget(key: str, request: Any) -> None
+        - AsyncProducts.flush() -> None
+        - AsyncProducts.close() -> None
+    All of them are coroutines, except iter_products() and import_batches(), which are
+    asynchronous generators.
+    """
+
+    products: Products  # the wrapped products object
+
+    def __init__(self, products: Products, max_workers: Optional[int] = None) -> None:
+        """
+        Wrap `products`, and create the executor its calls run on, with `max_workers`
+        threads if given.
+        """
+        self.products = products
+        shards: list[Products] = (
+            products.shards if isinstance(products, ShardedProducts) else [products]
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or sum(
+                shard.pool.size + shard.writer.max_batch for shard in shards
+            ),
+            thread_name_prefix='db'
+        )
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Call `func` with the given arguments on the database executor, and return its
+        result without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def create_table(self) -> None:
+        await self.run(self.products.create_table)
+
+    async def import_data(self, data: list[dict]) -> None:
+        await self.run(self.products.import_data, data)
+
+    async def import_batches(
+        self,
+        batches: Iterable[Sequence[tuple]],
+        mode: str = 'ignore'
+    ) -> AsyncIterator[dict]:
+        """
+        Like Products.import_batches(), but yield each progress dictionary without
+        blocking the event loop while the batch is being written.
+        """
+        progress = cast(
+            Generator[dict, None, None], self.products.import_batches(batches, mode=mode)
+        )
+        try:
+            while (report := await self.run(next, progress, None)) is not None:
+                yield report
+        finally:
+            await self.run(progress.close)
+
+    async def get_all(self) -> list[sqlite3.Row]:
+        return await self.run(self.products.get_all)
+
+    async def get_specific(self, skus: list) -> list[sqlite3.Row]:
+        return await self.run(self.products.get_specific, skus)
+
+    async def get_page(
+        self,
+        after_sku: Optional[str] = None,
+        limit: int = 100,
+        sort: str = 'sku',
+        after_name: Optional[str] = None
+    ) -> list[sqlite3.Row]:
+        return await self.run(
+            self.products.get_page,
+            after_sku=after_sku, limit=limit, sort=sort, after_name=after_name
+        )
+
+    async def count(self) -> int:
+        return await self.run(self.products.count)
+
+    async def low_stock(self, threshold: int, limit: int = 100) -> list[sqlite3.Row]:
+        return await self.run(self.products.low_stock, threshold, limit=limit)
+
+    async def total_quantity(self) -> int:
+        return await self.run(self.products.total_quantity)
+
+    async def quantity_histogram(self) -> list[dict]:
+        return await self.run(self.products.quantity_histogram)
+
+    async def search(self, query: str, limit: int = 50) -> list[sqlite3.Row]:
+        return await self.run(self.products.search, query, limit=limit)
+
+    async def change_seq(self, fresh: bool = False) -> int:
+        return await self.run(self.products.change_seq, fresh=fresh)
+
+    async def get_changes(self, since: int, limit: int = 500) -> dict:
+        return await self.run(self.products.get_changes, since, limit=limit)
+
+    async def history(
+        self,
+        sku: str,
+        limit: int = 100,
+        before: Optional[int] = None
+    ) -> list[sqlite3.Row]:
+        return await self.run(self.products.history, sku, limit=limit, before=before)
+
+    async def product_at(
+        self,
+        sku: str,
+        at: Optional[float] = None,
+        seq: Optional[int] = None
+    ) -> Optional[sqlite3.Row]:
+        return await self.run(self.products.product_at, sku, at=at, seq=seq)
+
+    async def products_at(
+        self,
+        at: Optional[float] = None,
+        seq: Optional[int] = None
+    ) -> list[sqlite3.Row]:
+        return await self.run(self.products.products_at, at=at, seq=seq)
+
+    async def take_snapshot(self) -> Optional[int]:
+        return await self.run(self.products.take_snapshot)
+
+    async def rebuild(self, seq: Optional[int] = None) -> dict:
+        return await self.run(self.products.rebuild, seq=seq)
+
+    async def iter_products(
+        self,
+        skus: Optional[list] = None,
+        chunk_size: int = 1000
+    ) -> AsyncIterator[list[sqlite3.Row]]:
+        """
+        Like Products.iter_products(), but yield the products in lists of up to
+        `chunk_size` rows, each fetched on the database executor. The pooled connection
+        is held until the generator is exhausted or closed, not a thread.
+        """
+        rows = cast(
+            Generator[sqlite3.Row, None, None],
+            self.products.iter_products(skus=skus, chunk_size=chunk_size)
+        )
+        try:
+            while chunk := await self.run(lambda: list(islice(rows, chunk_size))):
+                yield chunk
+        finally:
+            # return the connection to the pool
+            await self.run(rows.close)
+
+    async def add_product(
+        self,
+        sku: str,
+        name: str,
+        quantity: int = 0,
+        idempotency_key: Optional[str] = None
+    ) -> None:
+        await self.run(
+            self.products.add_product, sku, name, quantity, idempotency_key=idempotency_key
+        )
+
+    async def delete_products(
+        self,
+        skus: list[str],
+        idempotency_key: Optional[str] = None
+    ) -> None:
+        await self.run(self.products.delete_products, skus, idempotency_key=idempotency_key)
+
+    async def change_name(
+        self,
+        sku: str,
+        new_name: str,
+        idempotency_key: Optional[str] = None
+    ) -> None:
+        await self.run(
+            self.products.change_name, sku, new_name, idempotency_key=idempotency_key
+        )
+
+    async def update_quantity(
+        self,
+        sku: str,
+        operation: str,
+        count: int,
+        idempotency_key: Optional[str] = None
+    ) -> None:
+        await self.run(
+            self.products.update_quantity, sku, operation, count,
+            idempotency_key=idempotency_key
+        )
+
+    async def apply_batch(
+        self,
+        ops: list[dict],
+        atomic: bool = False,
+        idempotency_key: Optional[str] = None
+    ) -> dict:
+        return await self.run(
+            self.products.apply_batch, ops, atomic=atomic, idempotency_key=idempotency_key
+        )
+
+    async def recall(self, key: str, request: Any) -> Any:
+        return await self.run(self.products.recall, key, request)
+
+    async def remember(
+        self,
+        key: str,
+        request: Any,
+        result: Any,
+        replace: bool = False
+    ) -> Any:
+        return await self.run(
+            self.products.remember, key, request, result, replace=replace
+        )
+
+    async def forget(self, key: str, request: Any) -> None:
+        await self.run(self.products.forget, key, request)
+
+    async def flush(self) -> None:
+        await self.run(self.products.flush)
+
+    async def close(self) -> None:
+        """
+        Close the wrapped products object, then stop the executor once the calls already
+        queued have finished.
+        """
+        await self.run(self.products.close)
+        self._executor.shutdown(wait=False)
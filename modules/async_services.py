@@ -0,0 +1,376 @@
+#!/usr/bin/env python3.9
+"""
+Asynchronous versions of the functionality in services.py, for async request handlers,
+such as those of the ASGI application in asgi.py.
+Database calls go through an AsyncProducts object, and other blocking work runs on its
+executor, so awaiting them never blocks the event loop. Request and response bodies are
+streamed as asynchronous iterables, so slow uploads and long exports hold no thread
+while they wait on the client.
+Responses are Reply tuples that do not depend on any web framework, with the same
+status codes and bodies as those of the synchronous services.
+"""
+
+from typing import AsyncIterable, AsyncIterator, NamedTuple, Optional, Union
+import traceback
+import tempfile
+import json
+import zlib
+import os
+
+from modules.async_products import AsyncProducts
+from modules.jobs import JobManager
+from modules.products import MERGE_MODES, IdempotencyKeyReused
+from modules.csv_utils import iter_csv_text
+from modules.metrics import instrument
+import modules.services as services
+
+# records the duration and exceptions of a service coroutine, under the same metrics as
+# the synchronous services
+_timed = instrument(services.SERVICE_SECONDS, services.SERVICE_ERRORS)
+
+
+class Reply(NamedTuple):
+    """
+    The response of a service coroutine: its status code, its headers as (name, value)
+    pairs, and its body, either bytes or an asynchronous iterable of bytes to stream.
+    """
+    status: int
+    headers: list[tuple[str, str]]
+    body: Union[bytes, AsyncIterable[bytes]]
+
+
+def _reply(content: Union[str, dict, list], status: int = 200) -> Reply:
+    """
+    Make a Reply holding `content`, as Flask's make_response() would: a string as HTML
+    text, and a dictionary or a list as JSON.
+    """
+    if isinstance(content, str):
+        return Reply(status, [('Content-Type', 'text/html; charset=utf-8')], content.encode())
+    body: bytes = f'{json.dumps(content, separators=(",", ":"))}\n'.encode()
+    return Reply(status, [('Content-Type', 'application/json')], body)
+
+
+def _key_reused(endpoint: str, err: IdempotencyKeyReused) -> Reply:
+    """
+    Respond to a request whose idempotency key was already sent along with a different
+    request, like services._key_reused().
+    """
+    print(f"---\nEndpoint: {endpoint}\n{err}\n---")
+    return _reply(services.KEY_REUSED_MESSAGE, 422)
+
+
+async def _iter_export(
+    inventory: AsyncProducts,
+    skus: Optional[list],
+    use_gzip: bool
+) -> AsyncIterator[bytes]:
+    """
+    Lazily yield the CSV file of the products identified by `skus`, or of all products,
+    one chunk of rows at a time, gzip-compressed if `use_gzip` is set.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None
+    header: bool = True
+    async for rows in inventory.iter_products(skus=skus):
+        data: bytes = ''.join(iter_csv_text(rows, header=header)).encode('utf-8')
+        header = False
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            yield data
+
+    if header:
+        # no products; the file still has its header
+        data = ''.join(iter_csv_text([])).encode('utf-8')
+        yield compressor.compress(data) if compressor is not None else data
+    if compressor is not None:
+        yield compressor.flush()
+
+
+@_timed
+async def export_csv(
+    inventory: AsyncProducts,
+    items_param: str,
+    use_gzip: bool = False
+) -> Reply:
+    """
+    Export the products in `inventory` specified by `items` as a streamed CSV download,
+    like services.export_csv(). The body of the reply is an asynchronous iterable of
+    bytes, produced as the client reads it.
+    """
+    # try to read the list of items to export from the GET parameter `items`
+    try:
+        items: list = services._items_param_to_list(items_param)
+    except Exception as err:
+        print(f"---\nEndpoint: /export-csv\n{err}\n---")
+        return _reply(
+            "Parameter error! Must provide a JSON list of SKU strings for `items`.",
+            400
+        )
+
+    # stream the products specified by items; empty list results in all products
+    # being dumped
+    headers: list[tuple[str, str]] = [
+        ('Content-Type', 'text/csv; charset=utf-8'),
+        ('Content-Disposition', 'attachment; filename=inventory_export.csv'),
+        ('Vary', 'Accept-Encoding')
+    ]
+    if use_gzip:
+        headers.append(('Content-Encoding', 'gzip'))
+    return Reply(200, headers, _iter_export(inventory, items or None, use_gzip))
+
+
+@_timed
+async def import_csv_stream(
+    inventory: AsyncProducts,
+    jobs: JobManager,
+    chunks: AsyncIterable[bytes],
+    filename: str,
+    mode: str = 'ignore',
+    idempotency_key: Optional[str] = None
+) -> Reply:
+    """
+    Import the products from an asynchronous iterable of CSV data chunks named
+    `filename`, such as a request body being received, into the `inventory`, like
+    services.import_csv_stream(). The chunks are written to a temporary file on the
+    database executor as they arrive, then the file is imported in a background job.
+    A retry sent with the same `idempotency_key` and file is answered with the job
+    started by the first attempt (see services.start_import_job()).
+    """
+    # check that the file has a valid extension
+    if not services._allowed_filetype(filename=filename, allowed_exts={'csv'}):
+        return _reply("Incorrect file extension (must be CSV).", 400)
+
+    # check that the merge mode is known
+    if mode not in MERGE_MODES:
+        return _reply(f"Invalid mode (must be one of: {', '.join(MERGE_MODES)}).", 400)
+
+    # save the upload; the file is deleted once the job has ended
+    upload = await inventory.run(tempfile.NamedTemporaryFile, suffix='.csv', delete=False)
+    try:
+        with upload:
+            async for chunk in chunks:
+                await inventory.run(upload.write, chunk)
+    except Exception as err:
+        print(f"---\nEndpoint: /import-csv\n{err}")
+        traceback.print_exc()
+        print("\n---")
+        await inventory.run(os.remove, upload.name)
+        return _reply("Server could not receive the CSV file. Please try again.", 500)
+
+    # queuing the job reads the job files, so it runs on the executor as well
+    body, status = await inventory.run(
+        services._submit_import_job,
+        inventory=inventory.products, jobs=jobs, path=upload.name, mode=mode,
+        idempotency_key=idempotency_key
+    )
+    reply: Reply = _reply(body, status)
+    if isinstance(body, dict):
+        reply.headers.append(('Location', f'/jobs/{body["id"]}'))
+    return reply
+
+
+@_timed
+async def job_status(inventory: AsyncProducts, jobs: JobManager, job_id: str) -> Reply:
+    """
+    Respond with the status, progress and report of the background job `job_id`. Job
+    statuses are read from files, on the executor of the `inventory`.
+    """
+    snapshot: Optional[dict] = await inventory.run(jobs.status, job_id)
+    if snapshot is None:
+        return _reply("No such job.", 404)
+    return _reply(snapshot, 200)
+
+
+@_timed
+async def cancel_job(inventory: AsyncProducts, jobs: JobManager, job_id: str) -> Reply:
+    """
+    Ask the background job `job_id` to stop, and respond with its status. Job statuses
+    are written to files, on the executor of the `inventory`.
+    """
+    snapshot: Optional[dict] = await inventory.run(jobs.cancel, job_id)
+    if snapshot is None:
+        return _reply("No such job.", 404)
+    return _reply(snapshot, 202)
+
+
+@_timed
+async def add_product(
+    inventory: AsyncProducts,
+    sku: str,
+    name: str,
+    quantity: int,
+    idempotency_key: Optional[str] = None
+) -> Reply:
+    """
+    Add a new product to the `inventory`, like services.add_product().
+    A retry sent with the same `idempotency_key` is not applied again.
+    """
+    # reject less than 0 quantities
+    if not (int(quantity) >= 0):
+        return _reply("Quantity must >= 0", 400)
+
+    # try to add the specified product to the inventory
+    try:
+        await inventory.add_product(
+            sku=sku, name=name, quantity=int(quantity), idempotency_key=idempotency_key
+        )
+    except IdempotencyKeyReused as err:
+        return _key_reused('/add-product', err)
+    except Exception as err:
+        print(f"---\nEndpoint: /add-product\n{err}")
+        traceback.print_exc()
+        print("\n---")
+        return _reply(
+            f"Server could not add the specified product.\n{err}",
+            500
+        )
+
+    return _reply("Successfully added the product!", 200)
+
+
+@_timed
+async def delete_products(
+    inventory: AsyncProducts,
+    items_param: str,
+    idempotency_key: Optional[str] = None
+) -> Reply:
+    """
+    Delete products in `inventory` specified by `items`, like services.delete_products().
+    A retry sent with the same `idempotency_key` is not applied again.
+    """
+    # try to read the list of items to delete from the GET parameter `items`
+    try:
+        items: list = services._items_param_to_list(items_param)
+        assert items != []
+    except Exception as err:
+        print(f"---\nEndpoint: /delete-products\n{err}")
+        traceback.print_exc()
+        print("\n---")
+        return _reply(
+            "Parameter error! Must provide a non-empty JSON list of SKU strings for `items`.",
+            400
+        )
+
+    # try to delete the specified items from the inventory
+    try:
+        await inventory.delete_products(items, idempotency_key=idempotency_key)
+    except IdempotencyKeyReused as err:
+        return _key_reused('/delete-products', err)
+    except Exception as err:
+        print(f"---\nEndpoint: /delete-products\n{err}")
+        traceback.print_exc()
+        print("\n---")
+        return _reply(
+            f"Server could not delete the specified products.\n{err}",
+            500
+        )
+
+    return _reply("Successfully deleted products!", 200)
+
+
+@_timed
+async def change_name(
+    inventory: AsyncProducts,
+    sku: str,
+    new_name: str,
+    idempotency_key: Optional[str] = None
+) -> Reply:
+    """
+    Rename the product in the `inventory` identified by the `sku` into `new_name`.
+    A retry sent with the same `idempotency_key` is not applied again.
+    """
+    # try to change the name of the specified product in the inventory
+    try:
+        await inventory.change_name(
+            sku=sku, new_name=new_name, idempotency_key=idempotency_key
+        )
+    except IdempotencyKeyReused as err:
+        return _key_reused('/change-name', err)
+    except Exception as err:
+        print(f"---\nEndpoint: /change-name\n{err}")
+        traceback.print_exc()
+        print("\n---")
+        return _reply(
+            f"Server could not rename the specified product.\n{err}",
+            500
+        )
+
+    return _reply("Successfully renamed the product!", 200)
+
+
+@_timed
+async def update_quantity(
+    inventory: AsyncProducts,
+    sku: str,
+    operation: str,
+    count: int,
+    idempotency_key: Optional[str] = None
+) -> Reply:
+    """
+    Updates the quantity of the product in `inventory` by either adding, subtracting, or
+    setting the quantity to `count`.
+    A retry sent with the same `idempotency_key` is not applied again, so an addition is
+    not counted twice.
+    """
+    if operation not in {'add', 'subtract', 'set'}:
+        return _reply("`operation` must only be 'add', 'subtract', or 'set'", 400)
+
+    if not (int(count) >= 0):
+        return _reply("`count` must >= 0", 400)
+
+    # try to change the quantity of the specified product in the inventory
+    try:
+        await inventory.update_quantity(
+            sku=sku, operation=operation, count=int(count), idempotency_key=idempotency_key
+        )
+    except IdempotencyKeyReused as err:
+        return _key_reused('/update-quantity', err)
+    except Exception as err:
+        print(f"---\nEndpoint: /update-quantity\n{err}")
+        traceback.print_exc()
+        print("\n---")
+        return _reply(
+            f"Server could not update the quantity of the specified product.\n{err}",
+            500
+        )
+
+    return _reply("Successfully updated product quantity!", 200)
+
+
+@_timed
+async def apply_batch(
+    inventory: AsyncProducts,
+    ops: list,
+    atomic: bool = False,
+    idempotency_key: Optional[str] = None
+) -> Reply:
+    """
+    Apply a list of operations to products in the `inventory` in a single transaction,
+    like services.apply_batch().
+    A retry of a committed batch sent with the same `idempotency_key` is answered with
+    the outcome of the first attempt, without applying the batch again.
+    """
+    if not isinstance(ops, list) or ops == []:
+        return _reply("`ops` must be a non-empty list of operations.", 400)
+
+    if len(ops) > services.MAX_BATCH_OPS:
+        return _reply(f"At most {services.MAX_BATCH_OPS} operations per batch.", 400)
+
+    # try to apply the operations to the inventory
+    try:
+        report: dict = await inventory.apply_batch(
+            ops, atomic=bool(atomic), idempotency_key=idempotency_key
+        )
+    except IdempotencyKeyReused as err:
+        return _key_reused('/batch', err)
+    except Exception as err:
+        print(f"---\nEndpoint: /batch\n{err}")
+        traceback.print_exc()
+        print("\n---")
+        return _reply(
+            f"Server could not apply the batch of operations.\n{err}",
+            500
+        )
+
+    # an atomic batch that was rolled back conflicts with the current inventory
+    return _reply(report, 200 if report['committed'] else 409)
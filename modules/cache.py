@@ -0,0 +1,90 @@
+#!/usr/bin/env python3.9
+"""
+A small in-process cache for query results.
+Exposes the LRUCache class, a thread-safe least-recently-used cache whose entries also
+expire after a time-to-live.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """
+    A thread-safe mapping that holds at most `maxsize` entries, evicting the least
+    recently used entry when full, and treating entries older than `ttl` seconds as
+    missing.
+
+    Public methods:
+        - LRUCache(maxsize: int = 256, ttl: float = 5.0) -> None
+        - LRUCache.get(key: Hashable) -> tuple[bool, Any]
+        - LRUCache.put(key: Hashable, value: Any) -> None
+        - LRUCache.clear() -> None
+        - LRUCache.stats() -> dict
+    """
+
+    maxsize: int    # maximum number of entries
+    ttl: float      # seconds an entry stays valid
+
+    def __init__(self, maxsize: int = 256, ttl: float = 5.0) -> None:
+        """
+        Configure the size bound and the time-to-live of entries.
+        """
+        assert maxsize >= 1
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()   # key -> (expiry time, value)
+        self._lock = threading.Lock()
+        self._counters: dict[str, int] = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,     # entries dropped to make room for new ones
+            'expirations': 0    # entries dropped because they outlived the ttl
+        }
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        """
+        Return (True, value) if a live entry exists for `key`, otherwise (False, None).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self._counters['expirations'] += 1
+                entry = None
+
+            if entry is None:
+                self._counters['misses'] += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return True, entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Store `value` under `key`, evicting the least recently used entry if full.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def clear(self) -> None:
+        """
+        Drop every entry.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Return the hit, miss, eviction and expiration counters and the current size.
+        """
+        with self._lock:
+            return {**self._counters, 'size': len(self._entries), 'maxsize': self.maxsize}
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3.9
+"""
+Write-behind buffering for quantity updates.
+Exposes the QuantityCoalescer class, which merges many small quantity updates to the
+same products in memory and hands them over to be written in a single transaction.
+"""
+
+import threading
+import time
+from typing import Callable, Optional
+
+# a pending quantity change, as (value, floor, delta): the quantity becomes `value` if it
+# is not None, and max(floor, quantity + delta) otherwise
+QuantityChange = tuple[Optional[int], int, int]
+
+# the change that leaves a quantity as it is; quantities are never negative
+NO_CHANGE: QuantityChange = (None, 0, 0)
+
+
+def compose(change: QuantityChange, operation: str, count: int) -> QuantityChange:
+    """
+    Return the change that applies `change`, then adds, subtracts or sets `count`.
+    Subtraction never takes a quantity below 0, exactly as if every update had been
+    applied one by one.
+    """
+    assert operation in {'add', 'subtract', 'set'}
+    assert count >= 0
+
+    value, floor, delta = change
+    if operation == 'set':
+        return count, 0, 0
+    if value is not None:
+        return (value + count if operation == 'add' else max(0, value - count)), 0, 0
+    if operation == 'add':
+        return None, floor + count, delta + count
+    return None, max(0, floor - count), delta - count
+
+
+class QuantityCoalescer:
+    """
+    Buffers quantity updates per SKU, merging consecutive updates of the same product
+    into one pending change, and passes all pending changes to `flush` at once.
+
+    Pending changes are flushed once `max_pending` products have one, `max_delay`
+    seconds after the oldest pending update at the latest, whenever flush() is called,
+    and on close(). Updates that were accepted but not flushed yet are lost if the
+    process dies, so `max_delay` is the durability window.
+
+    Public methods:
+        - QuantityCoalescer(flush: Callable[[dict[str, QuantityChange]], None],
+                            max_pending: int = 1000, max_delay: float = 0.5) -> None
+        - QuantityCoalescer.update(sku: str, operation: str, count: int) -> None
+        - QuantityCoalescer.flush() -> None
+        - QuantityCoalescer.stats() -> dict
+        - QuantityCoalescer.close() -> None
+    """
+
+    max_pending: int    # number of products with pending changes that forces a flush
+    max_delay: float    # seconds an update may stay pending
+
+    def __init__(
+        self,
+        flush: Callable[[dict[str, QuantityChange]], None],
+        max_pending: int = 1000,
+        max_delay: float = 0.5
+    ) -> None:
+        """
+        Start the thread that flushes pending changes once they are `max_delay` old.
+        `flush` receives a dictionary mapping SKUs to their pending changes, and must
+        write them all before returning.
+        """
+        assert max_pending >= 1
+        assert max_delay > 0
+
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+        self._flush = flush
+        self._pending: dict[str, QuantityChange] = {}
+        self._pending_updates: int = 0      # updates merged into the pending changes
+        self._oldest: float = 0.0           # time of the oldest pending update
+        self._cond = threading.Condition(threading.Lock())  # guards the pending changes
+        self._flush_lock = threading.Lock()  # flushes are written one after another
+        self._closed: bool = False
+        self._counters: dict[str, int] = {
+            'updates': 0,           # updates accepted
+            'flushes': 0,           # flushes that wrote at least one change
+            'flushed_updates': 0,   # updates written by those flushes
+            'flushed_rows': 0,      # product rows written by those flushes
+            'failed_flushes': 0,    # flushes whose write raised
+            'lost_updates': 0       # updates in the failed flushes
+        }
+
+        self._thread = threading.Thread(
+            target=self._work, name='quantity-coalescer', daemon=True
+        )
+        self._thread.start()
+
+    def update(self, sku: str, operation: str, count: int) -> None:
+        """
+        Add, subtract or set the quantity of the product `sku` by `count`, as soon as the
+        pending changes are flushed. Flushes right away if too many products have pending
+        changes.
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Quantity coalescer has been closed.')
+            if not self._pending:
+                self._oldest = time.monotonic()
+                self._cond.notify()
+            self._pending[sku] = compose(self._pending.get(sku, NO_CHANGE), operation, count)
+            self._pending_updates += 1
+            self._counters['updates'] += 1
+            full: bool = len(self._pending) >= self.max_pending
+
+        # the caller that fills the buffer pays for the flush, which holds back writers
+        # that outpace the database
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write all pending changes now. Re-raises any exception raised by the write; the
+        changes of a failed flush are dropped.
+        """
+        with self._flush_lock:
+            with self._cond:
+                pending: dict[str, QuantityChange] = self._pending
+                updates: int = self._pending_updates
+                self._pending = {}
+                self._pending_updates = 0
+            if not pending:
+                return
+
+            try:
+                self._flush(pending)
+            except BaseException:
+                with self._cond:
+                    self._counters['failed_flushes'] += 1
+                    self._counters['lost_updates'] += updates
+                raise
+
+            with self._cond:
+                self._counters['flushes'] += 1
+                self._counters['flushed_updates'] += updates
+                self._counters['flushed_rows'] += len(pending)
+
+    def _work(self) -> None:
+        """
+        Background thread main loop: flush pending changes once they are old enough.
+        """
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or bool(self._pending))
+                if self._closed:
+                    return
+                deadline: float = self._oldest + self.max_delay
+                self._cond.wait_for(
+                    lambda: self._closed or not self._pending,
+                    timeout=max(0.0, deadline - time.monotonic())
+                )
+                if self._closed:
+                    return
+
+            try:
+                self.flush()
+            except Exception as error:
+                # already counted; the thread must keep flushing later updates
+                print(f'\n---\nFlushing buffered quantity updates failed.\n{error}\n---')
+
+    def stats(self) -> dict:
+        """
+        Return the update and flush counters, the number of pending changes, and the
+        coalescing ratio: the average number of updates merged into each written row.
+        """
+        with self._cond:
+            ratio: float = (
+                self._counters['flushed_updates'] / self._counters['flushed_rows']
+                if self._counters['flushed_rows'] else 0.0
+            )
+            return {
+                **self._counters,
+                'pending_rows': len(self._pending),
+                'pending_updates': self._pending_updates,
+                'coalescing_ratio': ratio
+            }
+
+    def close(self) -> None:
+        """
+        Stop accepting updates, stop the background thread, and flush pending changes.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush()
@@ -0,0 +1,554 @@
+#!/usr/bin/env python3.9
+"""
+A compact in-memory copy of the products table, for read-heavy deployments.
+Exposes the ColumnStore class, which holds products in array-backed columns, the
+ColumnRow class, the products it reads, and the ColumnarProducts class, a Products
+object that serves reads from a ColumnStore loaded from the database and kept in sync
+with it through the change log.
+"""
+
+import sqlite3
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from heapq import nsmallest
+from itertools import compress, repeat
+from typing import Any, Iterable, Iterator, Optional
+
+from modules.metrics import instrument
+from modules.products import METHOD_ERRORS, METHOD_ROWS, METHOD_SECONDS, Products
+
+try:
+    import pyarrow
+    import pyarrow.compute
+except ImportError:  # filters loop over Python integers without it
+    pyarrow = None
+
+# rows fetched from the database at a time while loading the columns
+LOAD_CHUNK_SIZE: int = 10000
+# changes applied one by one when syncing; after more than this, the columns are reloaded
+MAX_SYNCED_CHANGES: int = 5000
+
+_timed = instrument(METHOD_SECONDS, METHOD_ERRORS, rows=METHOD_ROWS)
+
+
+class _TextColumn:
+    """
+    Strings stored back to back as UTF-8 in one buffer of up to 4 GiB, and located by
+    their start and end offsets. Replaced and removed strings leave their bytes behind
+    until compact().
+    """
+
+    def __init__(self) -> None:
+        self.data = bytearray()
+        self.starts = array('I')
+        self.ends = array('I')
+        self.garbage: int = 0  # bytes no longer referenced by any string
+
+    def append(self, text: str) -> None:
+        self.starts.append(len(self.data))
+        self.data += text.encode('utf-8')
+        self.ends.append(len(self.data))
+
+    def get(self, index: int) -> str:
+        return self.data[self.starts[index]:self.ends[index]].decode('utf-8')
+
+    def set(self, index: int, text: str) -> None:
+        self.garbage += self.ends[index] - self.starts[index]
+        self.starts[index] = len(self.data)
+        self.data += text.encode('utf-8')
+        self.ends[index] = len(self.data)
+
+    def remove(self, index: int) -> None:
+        """
+        Remove the string at `index` by moving the last string into its place.
+        """
+        self.garbage += self.ends[index] - self.starts[index]
+        self.starts[index] = self.starts[-1]
+        self.ends[index] = self.ends[-1]
+        self.starts.pop()
+        self.ends.pop()
+
+    def select(self, indices: Optional[Iterable[int]] = None) -> Iterator[str]:
+        """
+        Iterate over the strings at `indices`, or over all of them; the loop runs in C.
+        """
+        starts: Iterable[int] = self.starts
+        ends: Iterable[int] = self.ends
+        if indices is not None:
+            indices = list(indices)
+            starts = map(self.starts.__getitem__, indices)
+            ends = map(self.ends.__getitem__, indices)
+        return map(
+            bytearray.decode,
+            map(self.data.__getitem__, map(slice, starts, ends)),
+            repeat('utf-8')
+        )
+
+    def compact(self) -> None:
+        """
+        Drop unreferenced bytes once they take up more than half of the buffer.
+        """
+        if self.garbage * 2 <= len(self.data):
+            return
+        data = bytearray()
+        starts = array('I')
+        ends = array('I')
+        for chunk in map(self.data.__getitem__, map(slice, self.starts, self.ends)):
+            starts.append(len(data))
+            data += chunk
+            ends.append(len(data))
+        self.data, self.starts, self.ends, self.garbage = data, starts, ends, 0
+
+    def copy(self) -> '_TextColumn':
+        """
+        Return a copy of the column that later changes to it do not affect.
+        """
+        column = _TextColumn()
+        column.data = bytearray(self.data)
+        column.starts = array('I', self.starts)
+        column.ends = array('I', self.ends)
+        column.garbage = self.garbage
+        return column
+
+    def nbytes(self) -> int:
+        return (
+            len(self.data) + self.starts.itemsize * len(self.starts)
+            + self.ends.itemsize * len(self.ends)
+        )
+
+
+class ColumnRow(tuple):
+    """
+    A product read from the columns: a (sku, name, quantity) tuple that can also be
+    indexed by column name, and turned into a dictionary, like the sqlite3.Row objects
+    read from the database.
+    """
+
+    __slots__ = ()
+
+    _COLUMNS: dict[str, int] = {'sku': 0, 'name': 1, 'quantity': 2}
+
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(key, str):
+            key = self._COLUMNS[key]
+        return tuple.__getitem__(self, key)
+
+    def keys(self) -> list[str]:
+        return list(self._COLUMNS)
+
+
+class ColumnStore:
+    """
+    Products held in three columns: SKUs and names as UTF-8 text in shared buffers, and
+    quantities in an array of 64-bit integers. SKUs are found through an open-addressing
+    hash table of positions, with linear probing, kept in arrays along with the hash of
+    every SKU. Rows have no Python objects of their own, and filters over quantities
+    loop in C. The total quantity is kept up to date as products change. Positions
+    change when products are removed. Not thread-safe.
+
+    Public methods:
+        - ColumnStore() -> None
+        - ColumnStore.put(sku: str, name: str, quantity: int) -> None
+        - ColumnStore.remove(sku: str) -> None
+        - ColumnStore.find(skus: Iterable[str]) -> list[int]
+        - ColumnStore.rows(indices: Optional[Iterable[int]] = None)
+              -> Iterator[tuple[str, str, int]]
+        - ColumnStore.snapshot(indices: Optional[Iterable[int]] = None)
+              -> Iterator[tuple[str, str, int]]
+        - ColumnStore.total_quantity() -> int
+        - ColumnStore.below(threshold: int) -> list[int]
+        - ColumnStore.lowest(indices: list[int], limit: int) -> list[int]
+        - ColumnStore.nbytes() -> int
+    """
+
+    def __init__(self) -> None:
+        self._skus = _TextColumn()
+        self._names = _TextColumn()
+        self._quantities = array('q')
+        self._hashes = array('q')  # hash of the SKU at every position
+        self._total: int = 0       # sum of the quantities
+        # hash table slots holding a position, or -1 if empty; at most half are used
+        self._slots = array('i', [-1]) * 8
+
+    def __len__(self) -> int:
+        return len(self._quantities)
+
+    def _slot(self, sku: str, sku_hash: int) -> int:
+        """
+        Return the slot holding the position of the product identified by `sku`, or the
+        empty slot where it belongs.
+        """
+        mask: int = len(self._slots) - 1
+        slot: int = sku_hash & mask
+        while True:
+            index: int = self._slots[slot]
+            if index < 0:
+                return slot
+            if self._hashes[index] == sku_hash and self._skus.get(index) == sku:
+                return slot
+            slot = (slot + 1) & mask
+
+    def _clear_slot(self, slot: int) -> None:
+        """
+        Empty `slot`, moving back the positions after it in its cluster that could no
+        longer be found otherwise.
+        """
+        mask: int = len(self._slots) - 1
+        following: int = slot
+        while True:
+            following = (following + 1) & mask
+            index: int = self._slots[following]
+            if index < 0:
+                break
+            home: int = self._hashes[index] & mask
+            # move the position unless its home slot lies cyclically in (slot, following]
+            if (slot < following and (home <= slot or home > following)) or (
+                slot > following and following < home <= slot
+            ):
+                self._slots[slot] = index
+                slot = following
+        self._slots[slot] = -1
+
+    def _grow(self) -> None:
+        """
+        Double the hash table and place every position again.
+        """
+        self._slots = array('i', [-1]) * (2 * len(self._slots))
+        mask: int = len(self._slots) - 1
+        for index, sku_hash in enumerate(self._hashes):
+            slot: int = sku_hash & mask
+            while self._slots[slot] >= 0:
+                slot = (slot + 1) & mask
+            self._slots[slot] = index
+
+    def put(self, sku: str, name: str, quantity: int) -> None:
+        """
+        Add the product identified by `sku`, or replace its name and quantity.
+        """
+        sku_hash: int = hash(sku)
+        slot: int = self._slot(sku, sku_hash)
+        index: int = self._slots[slot]
+        if index < 0:
+            self._slots[slot] = len(self._quantities)
+            self._hashes.append(sku_hash)
+            self._skus.append(sku)
+            self._names.append(name)
+            self._quantities.append(quantity)
+            self._total += quantity
+            if 2 * len(self._quantities) > len(self._slots):
+                self._grow()
+            return
+        if self._names.get(index) != name:
+            self._names.set(index, name)
+            self._names.compact()
+        self._total += quantity - self._quantities[index]
+        self._quantities[index] = quantity
+
+    def remove(self, sku: str) -> None:
+        """
+        Remove the product identified by `sku`, if present; the last product takes its
+        position.
+        """
+        slot: int = self._slot(sku, hash(sku))
+        index: int = self._slots[slot]
+        if index < 0:
+            return
+        self._clear_slot(slot)
+        self._total -= self._quantities[index]
+        last: int = len(self._quantities) - 1
+        if index != last:
+            self._slots[self._slot(self._skus.get(last), self._hashes[last])] = index
+        self._hashes[index] = self._hashes[last]
+        self._hashes.pop()
+        self._skus.remove(index)
+        self._names.remove(index)
+        self._quantities[index] = self._quantities[last]
+        self._quantities.pop()
+        self._skus.compact()
+        self._names.compact()
+
+    def find(self, skus: Iterable[str]) -> list[int]:
+        """
+        Return the positions of the products identified by `skus` that are present, each
+        once, in the order of `skus`.
+        """
+        indices: list[int] = []
+        for sku in dict.fromkeys(skus):
+            index: int = self._slots[self._slot(sku, hash(sku))]
+            if index >= 0:
+                indices.append(index)
+        return indices
+
+    def rows(self, indices: Optional[Iterable[int]] = None) -> Iterator[tuple[str, str, int]]:
+        """
+        Iterate over the products at `indices`, or over all of them, as (sku, name,
+        quantity) tuples.
+        """
+        if indices is None:
+            return zip(self._skus.select(), self._names.select(), self._quantities)
+        indices = list(indices)
+        return zip(
+            self._skus.select(indices),
+            self._names.select(indices),
+            map(self._quantities.__getitem__, indices)
+        )
+
+    def snapshot(
+        self,
+        indices: Optional[Iterable[int]] = None
+    ) -> Iterator[tuple[str, str, int]]:
+        """
+        Like rows(), but the products are read from a copy of the columns taken now, so
+        that the iterator may be consumed after the store changes, without holding its
+        lock. Copying all products copies the buffers as they are; selected products
+        are read right away.
+        """
+        if indices is not None:
+            return iter(list(self.rows(indices)))
+        skus: _TextColumn = self._skus.copy()
+        names: _TextColumn = self._names.copy()
+        return zip(skus.select(), names.select(), array('q', self._quantities))
+
+    def total_quantity(self) -> int:
+        """
+        Return the sum of the quantities of all products.
+        """
+        return self._total
+
+    def below(self, threshold: int) -> list[int]:
+        """
+        Return the positions of the products whose quantity is below `threshold`. With
+        pyarrow, the quantities are compared in place, without a Python object each.
+        """
+        if pyarrow is not None:
+            quantities = pyarrow.Array.from_buffers(
+                pyarrow.int64(), len(self._quantities),
+                [None, pyarrow.py_buffer(self._quantities)]
+            )
+            return pyarrow.compute.indices_nonzero(
+                pyarrow.compute.less(quantities, threshold)
+            ).to_pylist()
+        return list(compress(
+            range(len(self._quantities)), map(threshold.__gt__, self._quantities)
+        ))
+
+    def lowest(self, indices: list[int], limit: int) -> list[int]:
+        """
+        Return the positions among `indices` of the `limit` products with the lowest
+        quantities, ordered by quantity, then SKU. Only the products with a quantity up
+        to the `limit`-th lowest one have their SKU read.
+        """
+        if len(indices) > limit:
+            quantities: list[int] = list(map(self._quantities.__getitem__, indices))
+            cutoff: int = nsmallest(limit, quantities)[-1]
+            indices = list(compress(indices, map(cutoff.__ge__, quantities)))
+        return nsmallest(
+            limit, indices, key=lambda index: (self._quantities[index], self._skus.get(index))
+        )
+
+    def nbytes(self) -> int:
+        """
+        Return the memory taken by the columns and the hash table.
+        """
+        return self._skus.nbytes() + self._names.nbytes() + sum(
+            column.itemsize * len(column)
+            for column in (self._quantities, self._hashes, self._slots)
+        )
+
+
+class ColumnarProducts(Products):
+    """
+    A Products object that keeps a copy of the products table in a ColumnStore, and
+    serves get_all(), get_specific(), count(), low_stock() and total_quantity() from it
+    instead of SQLite, as ColumnRow tuples rather than Row objects. All other calls,
+    including every write, go to the database.
+
+    The columns are loaded on first use, and brought up to date before a read whenever
+    a write was made through this object, or `refresh_interval` seconds passed since
+    the last check, which bounds how long writes made by other processes go unnoticed.
+    Changes are read from the change log; when there are too many, or the log no longer
+    reaches back far enough, the columns are reloaded. If the columns cannot be loaded,
+    reads go to the database. The columns are locked while they are brought up to date
+    and the products a read returns are copied, not while the rows are built.
+
+    Public methods:
+        - ColumnarProducts(db_path: str = ":memory:", refresh_interval: float = 1.0,
+                           **options) -> None
+        - ColumnarProducts.column_stats() -> dict
+    and those of Products.
+    """
+
+    refresh_interval: float  # seconds between checks for writes made by other processes
+
+    def __init__(
+        self,
+        db_path: str = ":memory:",
+        refresh_interval: float = 1.0,
+        **options: Any
+    ) -> None:
+        """
+        Configure how often the columns are checked against the database, in seconds.
+        The other options are those of Products.
+        """
+        super().__init__(db_path=db_path, **options)
+        assert refresh_interval >= 0
+        self.refresh_interval = refresh_interval
+        self._store: Optional[ColumnStore] = None
+        self._store_lock = threading.Lock()
+        self._store_seq: int = 0          # change log entry the columns are current with
+        self._store_version: int = -1     # table version the columns are current with
+        self._store_checked: float = 0.0  # monotonic time of the last check
+        self._column_counters: dict[str, int] = {'loads': 0, 'syncs': 0, 'synced_changes': 0}
+
+    def _load(self) -> None:
+        """
+        Read all products and the latest change log entry from one database snapshot
+        into new columns, which replace the current ones. On failure, the columns are
+        dropped, so reads go to the database.
+        """
+        # SQL statements to fetch the latest change log entry, and all products
+        seq_stmt = f'SELECT coalesce(max(seq), 0) FROM {self.table_name}_changes;'
+        products_stmt = f'SELECT sku, name, quantity FROM {self.table_name};'
+
+        # borrow a connection to the database and fill new columns one chunk at a time
+        self._store = None
+        store = ColumnStore()
+        with self._get_conn_cur() as (conn, cur):
+            try:
+                cur.execute('BEGIN;')
+                self._store_seq = cur.execute(seq_stmt).fetchone()[0]
+                cur.execute(products_stmt)
+                while chunk := cur.fetchmany(LOAD_CHUNK_SIZE):
+                    for sku, name, quantity in chunk:
+                        store.put(sku, name, quantity)
+                cur.execute('COMMIT;')
+                self._store = store
+                self._column_counters['loads'] += 1
+            except sqlite3.Error as error:
+                print(self._sqlite_error_msg(
+                    context='loading products into columns',
+                    error=error,
+                    table_name=self.table_name
+                ))
+
+    def _sync(self) -> None:
+        """
+        Apply the changes logged since the columns were last brought up to date, or
+        (re)load the columns if they cannot all be listed or were never loaded.
+        """
+        if self._store is None:
+            self._load()
+            return
+        feed: dict = self.get_changes(self._store_seq, limit=MAX_SYNCED_CHANGES)
+        if feed['reset']:
+            self._load()
+            return
+        for change in feed['changes']:
+            if change['name'] is None:
+                self._store.remove(change['sku'])
+            else:
+                self._store.put(change['sku'], change['name'], change['quantity'])
+        self._store_seq = feed['seq']
+        self._column_counters['syncs'] += 1
+        self._column_counters['synced_changes'] += len(feed['changes'])
+
+    @contextmanager
+    def _columns(self) -> Iterator[Optional[ColumnStore]]:
+        """
+        Bring the columns up to date if needed, and hold them for the duration of a
+        `with` block, or None if they could not be loaded; loading is retried at the
+        next check. The block should only take what it reads from the columns, with
+        ColumnStore.snapshot(), and build its results afterwards.
+        """
+        with self._store_lock:
+            # read the version first, so that writes committing meanwhile are synced later
+            version: int = self.version
+            now: float = time.monotonic()
+            if (
+                version != self._store_version
+                or now - self._store_checked >= self.refresh_interval
+            ):
+                self._sync()
+                self._store_version = version
+                self._store_checked = now
+            yield self._store
+
+    @staticmethod
+    def _to_rows(rows: Iterable[tuple]) -> list:
+        """
+        Convert (sku, name, quantity) tuples into ColumnRow tuples, which are read like
+        the Row objects returned by the database.
+        """
+        return list(map(ColumnRow, rows))
+
+    def create_table(self) -> None:
+        """
+        Like Products.create_table(), then load the columns.
+        """
+        super().create_table()
+        with self._store_lock:
+            self._load()
+            self._store_version = self.version
+            self._store_checked = time.monotonic()
+
+    @_timed
+    def get_all(self) -> list[sqlite3.Row]:
+        with self._columns() as store:
+            rows: Optional[Iterator[tuple]] = store.snapshot() if store is not None else None
+        if rows is None:
+            return super().get_all()
+        return self._to_rows(rows)
+
+    @_timed
+    def get_specific(self, skus: list) -> list[sqlite3.Row]:
+        with self._columns() as store:
+            rows: Optional[Iterator[tuple]] = (
+                store.snapshot(store.find(skus)) if store is not None else None
+            )
+        if rows is None:
+            return super().get_specific(skus)
+        return self._to_rows(rows)
+
+    @_timed
+    def count(self) -> int:
+        with self._columns() as store:
+            if store is not None:
+                return len(store)
+        return super().count()
+
+    @_timed
+    def low_stock(self, threshold: int, limit: int = 100) -> list[sqlite3.Row]:
+        """
+        Like Products.low_stock(); the quantity column is filtered in C, and only the
+        products below the threshold are ranked.
+        """
+        assert limit >= 1
+        with self._columns() as store:
+            rows: Optional[Iterator[tuple]] = (
+                store.snapshot(store.lowest(store.below(threshold), limit))
+                if store is not None else None
+            )
+        if rows is None:
+            return super().low_stock(threshold, limit=limit)
+        return self._to_rows(rows)
+
+    @_timed
+    def total_quantity(self) -> int:
+        with self._columns() as store:
+            if store is not None:
+                return store.total_quantity()
+        return super().total_quantity()
+
+    def column_stats(self) -> dict:
+        """
+        Return the number of products held in the columns, their approximate size in
+        bytes, and how many times they were loaded and synced, with how many changes.
+        """
+        with self._store_lock:
+            return {
+                'rows': len(self._store) if self._store is not None else 0,
+                'bytes': self._store.nbytes() if self._store is not None else 0,
+                **self._column_counters
+            }
@@ -4,7 +4,11 @@ Utility functions that allow for the project-relevant interactions with CSV file
 """
 
 import csv
+import io
+import zlib
+from itertools import islice
 from sqlite3 import Row
+from typing import Iterable, Iterator
 
 
 def csv_to_list(path: str) -> list[dict]:
@@ -18,6 +22,43 @@ def csv_to_list(path: str) -> list[dict]:
         return list(reader)
 
 
+def clean_product_fields(
+    sku: str,
+    name: str,
+    quantity_text: str
+) -> tuple[str, str, int]:
+    """
+    Given the raw `sku`, `name` and `quantity` fields of a product CSV row, return them as
+    a (sku, name, quantity) tuple with a sku and name that are not blank, and an integer
+    quantity >= 0 (0 when left blank). The sku and name are returned as they are, with
+    any surrounding whitespace, as imports have always stored them.
+    Raise a ValueError describing the problem if the row cannot be imported.
+    """
+    quantity_text = quantity_text.strip()
+
+    if not sku.strip():
+        raise ValueError('missing sku')
+    if not name.strip():
+        raise ValueError('missing name')
+    try:
+        quantity: int = int(quantity_text) if quantity_text else 0
+    except ValueError:
+        raise ValueError(f'quantity is not an integer: {quantity_text!r}') from None
+    if quantity < 0:
+        raise ValueError(f'quantity must be >= 0: {quantity}')
+
+    return sku, name, quantity
+
+
+def batched(rows: Iterable, size: int) -> Iterator[list]:
+    """
+    Group the items of `rows` into lists of at most `size` items, lazily.
+    """
+    iterator: Iterator = iter(rows)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
 def sqlite_rows_to_csv(results: list[Row], path: str) -> None:
     """
     Given a list of SQLite Row objects and a file path, write the list of Rows into a CSV
@@ -30,3 +71,44 @@ def sqlite_rows_to_csv(results: list[Row], path: str) -> None:
         writer: csv.DictWriter = csv.DictWriter(file, fieldnames=headers)
         writer.writeheader()
         writer.writerows(dict(i) for i in results)
+
+
+def iter_csv_text(
+    rows: Iterable[Row],
+    chunk_bytes: int = 64 * 1024,
+    header: bool = True
+) -> Iterator[str]:
+    """
+    Given an iterable of SQLite Row objects, lazily yield the text of a CSV file in
+    chunks of roughly `chunk_bytes` characters. Each Row is a row in the CSV file.
+    CSV headers, unless `header` is False, such as for a later part of the same file:
+        sku,name,quantity
+    """
+    headers: list = ['sku', 'name', 'quantity']
+    buffer: io.StringIO = io.StringIO()
+    writer: csv.DictWriter = csv.DictWriter(buffer, fieldnames=headers)
+    if header:
+        writer.writeheader()
+
+    for row in rows:
+        writer.writerow(dict(row))
+        if buffer.tell() >= chunk_bytes:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    # flush the last partial chunk
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks: Iterable[str], level: int = 6) -> Iterator[bytes]:
+    """
+    Lazily gzip-compress an iterable of text chunks, encoded as UTF-8.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        compressed: bytes = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3.9
+"""
+Live notifications of inventory changes.
+Exposes the ChangeBroadcaster class, which follows the change log of a Products object
+and fans every change out to any number of subscribers, such as the Server-Sent Events
+streams of connected clients, and the Subscription class it hands out.
+"""
+
+import threading
+from collections import deque
+from typing import Optional
+
+from modules.products import Products
+
+
+class Subscription:
+    """
+    A bounded buffer of events for one subscriber of a ChangeBroadcaster.
+
+    Events are dictionaries: {'event': 'change' or 'reset', 'id': int, 'data': dict}.
+    When the subscriber falls `maxsize` events behind, its buffered events are replaced
+    by a single 'reset' event, telling it to reload everything it holds; the broadcaster
+    never waits for a slow subscriber.
+
+    Public methods:
+        - Subscription(seq: int, maxsize: int = 256) -> None
+        - Subscription.get(timeout: Optional[float] = None) -> Optional[list[dict]]
+        - Subscription.close() -> None
+    """
+
+    seq: int        # id of the latest event buffered for the subscriber
+    maxsize: int    # maximum number of buffered events
+
+    def __init__(self, seq: int, maxsize: int = 256) -> None:
+        """
+        Start buffering events that come after the change log entry `seq`.
+        """
+        assert maxsize >= 1
+
+        self.seq = seq
+        self.maxsize = maxsize
+        self.overflows: int = 0     # times the buffer was replaced by a reset event
+        self._events: deque = deque()
+        self._cond = threading.Condition(threading.Lock())
+        self._closed: bool = False
+
+    def _put(self, events: list[dict]) -> None:
+        """
+        Buffer the events that are newer than the ones already buffered.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            events = [event for event in events if event['id'] > self.seq]
+            if not events:
+                return
+
+            if len(self._events) + len(events) > self.maxsize:
+                # the subscriber cannot keep up; drop its backlog and make it reload
+                self._events.clear()
+                self._events.append({
+                    'event': 'reset', 'id': events[-1]['id'], 'data': {'reason': 'overflow'}
+                })
+                self.overflows += 1
+            else:
+                self._events.extend(events)
+            self.seq = events[-1]['id']
+            self._cond.notify()
+
+    def _reset(self, seq: int, reason: str) -> None:
+        """
+        Replace the buffered events by a single reset event.
+        """
+        with self._cond:
+            self._events.clear()
+            self._events.append({'event': 'reset', 'id': seq, 'data': {'reason': reason}})
+            self.seq = max(self.seq, seq)
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[list[dict]]:
+        """
+        Wait up to `timeout` seconds for events, and return and remove all buffered
+        events; the list is empty if none arrived in time. Return None once the
+        subscription is closed.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._closed or bool(self._events), timeout)
+            if self._closed:
+                return None
+            events: list[dict] = list(self._events)
+            self._events.clear()
+            return events
+
+    def close(self) -> None:
+        """
+        Stop buffering events and wake up a waiting get().
+        """
+        with self._cond:
+            self._closed = True
+            self._events.clear()
+            self._cond.notify_all()
+
+
+class ChangeBroadcaster:
+    """
+    Follows the change log of a Products object on a background thread, and delivers
+    every change to all open subscriptions.
+
+    The change log is read as soon as a write through the Products object finishes, and
+    otherwise every `poll_interval` seconds, which picks up writes made by other
+    processes. The log is read once per round no matter how many subscribers there are.
+
+    Public methods:
+        - ChangeBroadcaster(inventory: Products, buffer_size: int = 256,
+                            poll_interval: float = 1.0) -> None
+        - ChangeBroadcaster.subscribe(last_seq: Optional[int] = None) -> Subscription
+        - ChangeBroadcaster.unsubscribe(subscription: Subscription) -> None
+        - ChangeBroadcaster.stats() -> dict
+        - ChangeBroadcaster.close() -> None
+    """
+
+    inventory: Products     # the products whose changes are broadcast
+    buffer_size: int        # maximum number of events buffered per subscriber
+    poll_interval: float    # seconds between reads of the change log when idle
+
+    def __init__(
+        self,
+        inventory: Products,
+        buffer_size: int = 256,
+        poll_interval: float = 1.0
+    ) -> None:
+        """
+        Start following the change log from its current end.
+        """
+        self.inventory = inventory
+        self.buffer_size = buffer_size
+        self.poll_interval = poll_interval
+
+        self._seq: int = inventory.change_seq()
+        self._subscriptions: set[Subscription] = set()
+        self._lock = threading.Lock()       # guards _seq and _subscriptions
+        self._wake = threading.Event()
+        self._closed: bool = False
+        self._counters: dict[str, int] = {
+            'rounds': 0,            # times the change log was read
+            'events': 0,            # change events read from the log
+            'resets': 0,            # times the log could not be followed change by change
+            'subscribed': 0         # subscriptions handed out in total
+        }
+
+        inventory.add_write_listener(self._wake.set)
+        self._thread = threading.Thread(
+            target=self._work, name='change-broadcaster', daemon=True
+        )
+        self._thread.start()
+
+    @staticmethod
+    def _to_events(changes: list) -> list[dict]:
+        """
+        Turn change rows from Products.get_changes() into 'change' events.
+        """
+        return [
+            {
+                'event': 'change',
+                'id': row['seq'],
+                'data': {
+                    'sku': row['sku'],
+                    'op': 'delete' if row['name'] is None else row['op'],
+                    'name': row['name'],
+                    'quantity': row['quantity']
+                }
+            }
+            for row in changes
+        ]
+
+    def _work(self) -> None:
+        """
+        Background thread main loop: read new changes and fan them out.
+        """
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if self._closed:
+                return
+
+            with self._lock:
+                feed: dict = self.inventory.get_changes(
+                    since=self._seq, limit=self.buffer_size
+                )
+                self._counters['rounds'] += 1
+                if feed['reset']:
+                    self._counters['resets'] += 1
+                    for subscription in self._subscriptions:
+                        subscription._reset(feed['seq'], reason='log')
+                elif feed['changes']:
+                    events: list[dict] = self._to_events(feed['changes'])
+                    self._counters['events'] += len(events)
+                    for subscription in self._subscriptions:
+                        subscription._put(events)
+                self._seq = feed['seq']
+
+    def subscribe(self, last_seq: Optional[int] = None) -> Subscription:
+        """
+        Open a subscription to the changes made after the change log entry `last_seq`,
+        or from now on if it is None. Changes the subscriber missed are buffered first,
+        or replaced by a reset event if there are too many of them or the log no longer
+        goes back that far.
+        """
+        with self._lock:
+            subscription = Subscription(self._seq, maxsize=self.buffer_size)
+            if last_seq is not None and last_seq != self._seq:
+                # catch up with the changes since `last_seq`; the broadcast skips
+                # whatever this already covers
+                subscription.seq = last_seq
+                feed: dict = self.inventory.get_changes(
+                    since=last_seq, limit=self.buffer_size
+                )
+                if feed['reset']:
+                    subscription._reset(max(feed['seq'], self._seq), reason='resume')
+                else:
+                    subscription._put(self._to_events(feed['changes']))
+                    subscription.seq = max(subscription.seq, self._seq)
+
+            self._subscriptions.add(subscription)
+            self._counters['subscribed'] += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """
+        Close a subscription and stop delivering events to it.
+        """
+        subscription.close()
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def stats(self) -> dict:
+        """
+        Return counters describing the broadcast, and the number of open subscriptions
+        and of their buffer overflows.
+        """
+        with self._lock:
+            return {
+                **self._counters,
+                'subscribers': len(self._subscriptions),
+                'overflows': sum(sub.overflows for sub in self._subscriptions)
+            }
+
+    def close(self) -> None:
+        """
+        Stop the background thread and close every subscription.
+        """
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        with self._lock:
+            for subscription in self._subscriptions:
+                subscription.close()
+            self._subscriptions.clear()
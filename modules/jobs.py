@@ -0,0 +1,389 @@
+#!/usr/bin/env python3.9
+"""
+Background jobs with progress reporting.
+Exposes the Job class, which holds the state and progress of one long-running task, and
+the JobManager class, which runs jobs on a bounded pool of threads, and new_job_id(),
+which picks the ID of a job.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+def new_job_id() -> str:
+    """
+    Return a new random job ID.
+    """
+    return uuid.uuid4().hex
+
+
+class JobCancelled(Exception):
+    """
+    Raised by Job.check_cancelled() to stop a job that was asked to cancel.
+    """
+
+
+class Job:
+    """
+    The state of one background job. The job's task reports its progress through
+    update(), in units of work such as bytes, along with a report of any details.
+
+    A job is 'queued', then 'running', and ends up 'done', 'failed' or 'cancelled'.
+    If the job has a `state_dir`, its snapshot is also published there as a JSON file
+    on every change, and a cancel request may be made through the same directory, so
+    that other processes can follow and cancel the job.
+
+    Public methods:
+        - Job(total: int = 0, state_dir: Optional[str] = None,
+              job_id: Optional[str] = None) -> None
+        - Job.update(processed: int, report: Optional[dict] = None) -> None
+        - Job.cancel() -> None
+        - Job.check_cancelled() -> None
+        - Job.snapshot() -> dict
+    """
+
+    id: str         # unique identifier of the job
+    status: str     # 'queued', 'running', 'done', 'failed' or 'cancelled'
+    total: int      # units of work in the whole job, or 0 if unknown
+    report: dict    # details last published by the job's task
+
+    def __init__(
+        self,
+        total: int = 0,
+        state_dir: Optional[str] = None,
+        job_id: Optional[str] = None
+    ) -> None:
+        """
+        Create a queued job that will process `total` units of work, identified by
+        `job_id`, a new random ID by default (see new_job_id()).
+        """
+        self.id = job_id or new_job_id()
+        self.status = 'queued'
+        self.total = total
+        self.report = {}
+        self.error: Optional[str] = None
+        self._processed: int = 0
+        self._created: float = time.time()
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._state_dir = state_dir
+
+    def _publish(self) -> None:
+        """
+        Write the job's snapshot to its state directory, if it has one. Must be called
+        with the lock held. The file is replaced atomically, so readers never see a
+        partly written snapshot.
+        """
+        if self._state_dir is None:
+            return
+        path: str = os.path.join(self._state_dir, f'{self.id}.json')
+        with open(f'{path}.{os.getpid()}.tmp', 'w') as file:
+            json.dump(self._snapshot(), file)
+        os.replace(f'{path}.{os.getpid()}.tmp', path)
+
+    def _cancel_requested(self) -> bool:
+        """
+        Return whether the job was asked to stop, by this process or through its state
+        directory.
+        """
+        if not self._cancel.is_set() and self._state_dir is not None and os.path.exists(
+            os.path.join(self._state_dir, f'{self.id}.cancel')
+        ):
+            self._cancel.set()
+        return self._cancel.is_set()
+
+    def update(self, processed: int, report: Optional[dict] = None) -> None:
+        """
+        Record that `processed` units of work are done so far, and publish a copy of
+        `report` if it is given, so the task can keep changing its own dictionary.
+        """
+        with self._lock:
+            self._processed = processed
+            if report is not None:
+                self.report = {
+                    key: list(value) if isinstance(value, list) else value
+                    for key, value in report.items()
+                }
+            self._publish()
+
+    def cancel(self) -> None:
+        """
+        Ask the job to stop. A queued job will not start; a running job stops the next
+        time its task calls check_cancelled().
+        """
+        self._cancel.set()
+
+    def check_cancelled(self) -> None:
+        """
+        Raise JobCancelled if the job was asked to stop.
+        """
+        if self._cancel_requested():
+            raise JobCancelled()
+
+    def snapshot(self) -> dict:
+        """
+        Return the job's status and progress: the units of work processed, the
+        throughput in units per second, and the estimated seconds left, once known.
+        """
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self) -> dict:
+        """
+        Build the snapshot returned by snapshot(). Must be called with the lock held.
+        """
+        now: float = self._finished or time.time()
+        elapsed: float = now - self._started if self._started is not None else 0.0
+        rate: float = self._processed / elapsed if elapsed > 0 else 0.0
+        eta: Optional[float] = None
+        if self.status == 'running' and rate > 0 and self.total:
+            eta = max(self.total - self._processed, 0) / rate
+
+        return {
+            'id': self.id,
+            'status': self.status,
+            'processed': self._processed,
+            'total': self.total,
+            'progress': (self._processed / self.total) if self.total else None,
+            'elapsed': elapsed,
+            'throughput': rate,
+            'eta': eta,
+            'error': self.error,
+            'cancel_requested': self._cancel.is_set(),
+            'created': self._created,
+            'report': self.report
+        }
+
+
+class JobManager:
+    """
+    Runs jobs in the background, at most `max_running` at a time; further jobs wait in a
+    queue of at most `max_queued` jobs. The latest `keep_finished` finished jobs are
+    remembered so that their results can still be looked up.
+
+    If several processes serve the same clients, give their managers the same
+    `state_dir`: each job is then published there, so status() and cancel() reach jobs
+    run by any of the processes. The limits apply to each process separately.
+
+    Public methods:
+        - JobManager(max_running: int = 2, max_queued: int = 8,
+                     keep_finished: int = 100, state_dir: Optional[str] = None) -> None
+        - JobManager.submit(task: Callable[[Job], Any], total: int = 0,
+                            cleanup: Optional[Callable[[], Any]] = None,
+                            job_id: Optional[str] = None) -> Optional[Job]
+        - JobManager.get(job_id: str) -> Optional[Job]
+        - JobManager.status(job_id: str) -> Optional[dict]
+        - JobManager.cancel(job_id: str) -> Optional[dict]
+        - JobManager.stats() -> dict
+        - JobManager.close() -> None
+    """
+
+    max_running: int    # jobs that may run at the same time
+    max_queued: int     # jobs that may wait for a free slot
+    keep_finished: int  # finished jobs kept for lookups
+    state_dir: Optional[str]  # directory shared with other processes, if any
+
+    def __init__(
+        self,
+        max_running: int = 2,
+        max_queued: int = 8,
+        keep_finished: int = 100,
+        state_dir: Optional[str] = None
+    ) -> None:
+        """
+        Configure the limits; threads are started as jobs are submitted.
+        """
+        assert max_running >= 1 and max_queued >= 0 and keep_finished >= 0
+
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.keep_finished = keep_finished
+        self.state_dir = state_dir
+        if state_dir is not None:
+            os.makedirs(state_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_running, thread_name_prefix='job')
+        self._jobs: OrderedDict[str, Job] = OrderedDict()   # in order of submission
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        task: Callable[[Job], Any],
+        total: int = 0,
+        cleanup: Optional[Callable[[], Any]] = None,
+        job_id: Optional[str] = None
+    ) -> Optional[Job]:
+        """
+        Queue `task` to run in the background with its Job, and return the job, or None
+        if too many jobs are already waiting. `cleanup` is called once the job ended,
+        whether it ran or not. The job is identified by `job_id`, if given, which must
+        come from new_job_id() and not be used by any other job, so that it can be
+        recorded before the job starts.
+        """
+        with self._lock:
+            waiting: int = sum(1 for job in self._jobs.values() if job.status == 'queued')
+            if waiting >= self.max_queued + self.max_running - self._running():
+                return None
+            job = Job(total=total, state_dir=self.state_dir, job_id=job_id)
+            with job._lock:
+                job._publish()
+            self._jobs[job.id] = job
+            self._forget_finished()
+
+        self._executor.submit(self._run, job, task, cleanup)
+        return job
+
+    def _running(self) -> int:
+        """
+        Return the number of running jobs. Must be called with the lock held.
+        """
+        return sum(1 for job in self._jobs.values() if job.status == 'running')
+
+    def _forget_finished(self) -> None:
+        """
+        Drop the oldest finished jobs beyond `keep_finished`, along with their state
+        files. Must be called with the lock held.
+        """
+        finished: list[str] = [
+            job_id for job_id, job in self._jobs.items()
+            if job.status in {'done', 'failed', 'cancelled'}
+        ]
+        for job_id in finished[:max(len(finished) - self.keep_finished, 0)]:
+            del self._jobs[job_id]
+            for path in self._state_files(job_id):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _state_files(self, job_id: str) -> list[str]:
+        """
+        Return the paths of the snapshot and cancel request files of the job `job_id`
+        in the state directory, or an empty list without a state directory or for IDs
+        that no job could have.
+        """
+        if self.state_dir is None or not re.fullmatch(r'[0-9a-f]{32}', job_id):
+            return []
+        return [
+            os.path.join(self.state_dir, f'{job_id}.json'),
+            os.path.join(self.state_dir, f'{job_id}.cancel')
+        ]
+
+    def _run(
+        self,
+        job: Job,
+        task: Callable[[Job], Any],
+        cleanup: Optional[Callable[[], Any]]
+    ) -> None:
+        """
+        Run one job on a pool thread and record how it ended.
+        """
+        try:
+            cancelled: bool = job._cancel_requested()
+            with job._lock:
+                if cancelled:
+                    job.status = 'cancelled'
+                    job._publish()
+                    return
+                job.status = 'running'
+                job._started = time.time()
+                job._publish()
+
+            status: str = 'done'
+            try:
+                task(job)
+            except JobCancelled:
+                status = 'cancelled'
+            except Exception as err:
+                print(f"---\nBackground job {job.id} failed\n{err}")
+                traceback.print_exc()
+                print("\n---")
+                status = 'failed'
+                job.error = str(err)
+
+            with job._lock:
+                job.status = status
+                job._finished = time.time()
+                job._publish()
+        finally:
+            if cleanup is not None:
+                cleanup()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        Return the job with the ID `job_id` run by this manager, or None if there is no
+        such job.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """
+        Return the snapshot of the job with the ID `job_id`, whether this manager runs
+        it or another one sharing the state directory, or None if there is no such job.
+        """
+        job: Optional[Job] = self.get(job_id)
+        if job is not None:
+            return job.snapshot()
+
+        paths: list[str] = self._state_files(job_id)
+        if not paths:
+            return None
+        try:
+            with open(paths[0]) as file:
+                snapshot: dict = json.load(file)
+        except FileNotFoundError:
+            return None
+        snapshot['cancel_requested'] = (
+            snapshot['cancel_requested'] or os.path.exists(paths[1])
+        )
+        return snapshot
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        """
+        Ask the job with the ID `job_id` to stop, and return its snapshot, or None if
+        there is no such job. A job run by another manager sharing the state directory
+        stops the next time it checks for cancellation.
+        """
+        job: Optional[Job] = self.get(job_id)
+        if job is not None:
+            job.cancel()
+            return job.snapshot()
+
+        if self.status(job_id) is None:
+            return None
+        # the job's state files exist, so its ID is valid
+        with open(self._state_files(job_id)[1], 'w'):
+            pass
+        return self.status(job_id)
+
+    def stats(self) -> dict:
+        """
+        Return the number of jobs in each status, among the jobs run by this manager.
+        """
+        with self._lock:
+            counts: dict[str, int] = {
+                status: 0 for status in ('queued', 'running', 'done', 'failed', 'cancelled')
+            }
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+    def close(self) -> None:
+        """
+        Cancel every job and wait for the running ones to stop.
+        """
+        with self._lock:
+            jobs: list[Job] = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3.9
+"""
+Lightweight instrumentation with Prometheus-format output.
+Exposes the Counter and Histogram metric types, the Registry that renders them, the
+shared METRICS registry, the instrument() decorator that times function calls, and the
+TimedConnection class, an SQLite connection that times every statement it executes and
+optionally logs slow ones.
+"""
+
+import asyncio
+import functools
+import inspect
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Iterable, Optional, Sequence, Union
+
+# upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS: tuple = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0
+)
+# statements that take longer than this many seconds are logged; None disables logging
+SLOW_QUERY_SECONDS: Optional[float] = None
+# longest statement label; longer statements are cut short
+MAX_STATEMENT_LABEL: int = 120
+
+# a sample collected on demand: (metric name, labels, value)
+Sample = tuple[str, dict, float]
+
+
+def _format_labels(labels: dict) -> str:
+    """
+    Render a label set in the Prometheus text format, e.g. {method="get_page"}.
+    """
+    if not labels:
+        return ''
+    escaped: list[str] = [
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        )
+        for name, value in labels.items()
+    ]
+    return '{' + ','.join(escaped) + '}'
+
+
+class Counter:
+    """
+    A monotonically increasing count per label set, such as a number of errors.
+
+    Public methods:
+        - Counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> None
+        - Counter.inc(labels: tuple = (), amount: float = 1) -> None
+        - Counter.render() -> list[str]
+    """
+
+    name: str                   # metric name
+    documentation: str          # HELP text
+    labelnames: tuple           # names of the labels, in the order of label values
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        """
+        Add `amount` to the count of the label values `labels`.
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        """
+        Return the lines of the metric in the Prometheus text format.
+        """
+        with self._lock:
+            values: list = list(self._values.items())
+        lines: list[str] = [
+            f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter'
+        ]
+        for labels, value in values:
+            lines.append(
+                f'{self.name}{_format_labels(dict(zip(self.labelnames, labels)))} {value}'
+            )
+        return lines
+
+
+class Histogram:
+    """
+    A distribution of observed values per label set, such as latencies, counted in
+    buckets with fixed upper bounds along with their sum.
+
+    Public methods:
+        - Histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+                    buckets: Sequence[float] = DEFAULT_BUCKETS) -> None
+        - Histogram.observe(labels: tuple, value: float) -> None
+        - Histogram.render() -> list[str]
+    """
+
+    name: str                   # metric name
+    documentation: str          # HELP text
+    labelnames: tuple           # names of the labels, in the order of label values
+    buckets: tuple              # ascending upper bounds of the buckets
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count in each bucket, count above the last bucket, sum]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float) -> None:
+        """
+        Record one observation of `value` for the label values `labels`.
+        """
+        index: int = bisect_left(self.buckets, value)
+        with self._lock:
+            series: Optional[list] = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1)
+                series.append(0.0)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        """
+        Return the lines of the metric in the Prometheus text format, with cumulative
+        bucket counts.
+        """
+        with self._lock:
+            snapshot: list = [(labels, list(series)) for labels, series in self._series.items()]
+        lines: list[str] = [
+            f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram'
+        ]
+        for labels, series in snapshot:
+            label_dict: dict = dict(zip(self.labelnames, labels))
+            cumulative: int = 0
+            for bound, count in zip((*self.buckets, float('inf')), series):
+                cumulative += count
+                le: str = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(
+                    f'{self.name}_bucket{_format_labels({**label_dict, "le": le})} {cumulative}'
+                )
+            lines.append(f'{self.name}_sum{_format_labels(label_dict)} {series[-1]}')
+            lines.append(f'{self.name}_count{_format_labels(label_dict)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """
+    A set of metrics rendered together, plus collectors: functions that report current
+    values, such as pool and cache statistics, only when the metrics are rendered.
+
+    Public methods:
+        - Registry() -> None
+        - Registry.counter(name: str, documentation: str,
+                           labelnames: Sequence[str] = ()) -> Counter
+        - Registry.histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+                             buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram
+        - Registry.add_collector(name: str, kind: str, documentation: str,
+                                 collect: Callable[[], Iterable[Sample]]) -> None
+        - Registry.render() -> str
+    """
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Union[Counter, Histogram]] = {}
+        self._collectors: dict[str, tuple[str, str, Callable[[], Iterable[Sample]]]] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """
+        Return the counter called `name`, creating it on first use.
+        """
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, documentation, labelnames)
+            metric = self._metrics[name]
+        assert isinstance(metric, Counter)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """
+        Return the histogram called `name`, creating it on first use.
+        """
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, documentation, labelnames, buckets)
+            metric = self._metrics[name]
+        assert isinstance(metric, Histogram)
+        return metric
+
+    def add_collector(
+        self,
+        name: str,
+        kind: str,
+        documentation: str,
+        collect: Callable[[], Iterable[Sample]]
+    ) -> None:
+        """
+        Register `collect`, called on every render to produce the samples of the metric
+        family `name`, of type `kind` ('gauge' or 'counter'). Samples may carry their
+        own metric names, which should start with `name`. Replaces any collector
+        registered under the same name.
+        """
+        assert kind in {'gauge', 'counter'}
+        with self._lock:
+            self._collectors[name] = (kind, documentation, collect)
+
+    def render(self) -> str:
+        """
+        Return every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics: list = list(self._metrics.values())
+            collectors: list = list(self._collectors.items())
+
+        lines: list[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for name, (kind, documentation, collect) in collectors:
+            lines.extend((f'# HELP {name} {documentation}', f'# TYPE {name} {kind}'))
+            for sample_name, labels, value in collect():
+                lines.append(f'{sample_name}{_format_labels(labels)} {float(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# the metrics of this process
+METRICS = Registry()
+
+
+def instrument(
+    seconds: Histogram,
+    errors: Counter,
+    rows: Optional[Counter] = None,
+    label: Optional[str] = None,
+    when: Optional[Callable[[tuple], bool]] = None
+) -> Callable[[Callable], Callable]:
+    """
+    Return a decorator that records the duration of every call of the decorated
+    function in `seconds`, and every exception it raises in `errors`, labeled with
+    `label`, or the function's name by default (followed by the exception type for
+    errors). If `rows` is given, the length of every list the function returns is added
+    to it. If `when` is given, calls for whose positional arguments it returns False
+    are not recorded, for example calls of methods on instances that opted out.
+    Generator functions are timed until the generator is exhausted or closed, and
+    coroutine functions until the coroutine finishes.
+    """
+    def decorator(func: Callable) -> Callable:
+        name: str = label or func.__name__
+        labels: tuple = (name,)
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args: Any, **kwargs: Any) -> Any:
+                if when is not None and not when(args):
+                    return (yield from func(*args, **kwargs))
+                started: float = time.perf_counter()
+                try:
+                    return (yield from func(*args, **kwargs))
+                except Exception as error:
+                    errors.inc((name, type(error).__name__))
+                    raise
+                finally:
+                    seconds.observe(labels, time.perf_counter() - started)
+            return generator_wrapper
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def coroutine_wrapper(*args: Any, **kwargs: Any) -> Any:
+                if when is not None and not when(args):
+                    return await func(*args, **kwargs)
+                started: float = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as error:
+                    errors.inc((name, type(error).__name__))
+                    raise
+                finally:
+                    seconds.observe(labels, time.perf_counter() - started)
+            return coroutine_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if when is not None and not when(args):
+                return func(*args, **kwargs)
+            started: float = time.perf_counter()
+            try:
+                result: Any = func(*args, **kwargs)
+            except Exception as error:
+                errors.inc((name, type(error).__name__))
+                raise
+            finally:
+                seconds.observe(labels, time.perf_counter() - started)
+            if rows is not None and isinstance(result, list):
+                rows.inc(labels, len(result))
+            return result
+        return wrapper
+
+    return decorator
+
+
+SQL_SECONDS: Histogram = METRICS.histogram(
+    'inventory_sql_seconds', 'Time spent executing each SQL statement.', ['statement']
+)
+SQL_ROWS: Counter = METRICS.counter(
+    'inventory_sql_rows_changed_total',
+    'Rows inserted, updated or deleted by each SQL statement.',
+    ['statement']
+)
+SQL_ERRORS: Counter = METRICS.counter(
+    'inventory_sql_errors_total', 'SQL statements that raised, by error.',
+    ['statement', 'error']
+)
+SQL_SLOW: Counter = METRICS.counter(
+    'inventory_sql_slow_total', 'SQL statements slower than the slow query threshold.',
+    ['statement']
+)
+
+# statement text -> its label: whitespace collapsed, placeholder lists shortened
+_statement_labels: dict[str, str] = {}
+
+
+def _statement_label(sql: str) -> str:
+    """
+    Return the label of the SQL statement `sql`. Statements that only differ in
+    whitespace or in the length of a list of placeholders share a label.
+    """
+    label: Optional[str] = _statement_labels.get(sql)
+    if label is None:
+        label = re.sub(r'\s+', ' ', sql).strip()
+        label = re.sub(r'\?(\s*,\s*\?)+', '?, ...', label)
+        label = label[:MAX_STATEMENT_LABEL]
+        if len(_statement_labels) < 10000:
+            _statement_labels[sql] = label
+    return label
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    An SQLite cursor that records the duration, changed rows and errors of every
+    statement it executes, and logs statements slower than SLOW_QUERY_SECONDS.
+    """
+
+    def _timed(self, method: Callable, sql: str, params: Any) -> sqlite3.Cursor:
+        """
+        Call the cursor method `method` on `sql` and `params`, and record the statement.
+        """
+        label: str = _statement_label(sql)
+        started: float = time.perf_counter()
+        try:
+            method(self, sql, params)
+        except Exception as error:
+            SQL_ERRORS.inc((label, type(error).__name__))
+            raise
+        finally:
+            elapsed: float = time.perf_counter() - started
+            SQL_SECONDS.observe((label,), elapsed)
+            if SLOW_QUERY_SECONDS is not None and elapsed >= SLOW_QUERY_SECONDS:
+                SQL_SLOW.inc((label,))
+                print(f'\n---\nSlow SQL statement: {elapsed * 1000:.1f} ms\n{label}\n---')
+        if self.rowcount > 0:
+            SQL_ROWS.inc((label,), self.rowcount)
+        return self
+
+    def execute(self, sql: str, params: Any = ()) -> sqlite3.Cursor:  # type: ignore
+        return self._timed(sqlite3.Cursor.execute, sql, params)
+
+    def executemany(self, sql: str, params: Any) -> sqlite3.Cursor:  # type: ignore
+        return self._timed(sqlite3.Cursor.executemany, sql, params)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    An SQLite connection whose cursors are TimedCursors, including the ones created by
+    the execute() shortcuts. Pass it as the `factory` of sqlite3.connect().
+    """
+
+    def cursor(self, factory: Any = TimedCursor) -> Any:
+        return super().cursor(factory)
+
+    def execute(self, sql: str, params: Any = ()) -> sqlite3.Cursor:  # type: ignore
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql: str, params: Any) -> sqlite3.Cursor:  # type: ignore
+        return self.cursor().executemany(sql, params)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3.9
+"""
+Parallel parsing and validation of product CSV files.
+Cuts a CSV file into byte ranges that each hold whole rows, and parses and validates the
+ranges in a pool of worker processes, so large files are read on every core while a
+single writer inserts the resulting rows.
+"""
+
+import atexit
+import csv
+import io
+import multiprocessing.context
+import os
+import sys
+import threading
+import types
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterable, Iterator, Optional
+
+from modules.csv_utils import clean_product_fields
+
+# approximate size of the byte range parsed by one task
+CHUNK_BYTES: int = 1024 * 1024
+# size of the blocks read while looking for range boundaries
+SCAN_BYTES: int = 1024 * 1024
+# a record appended to every range parsed, which only comes out as a record of its own
+# if the range does not end inside a quoted field
+_END_FIELD: str = '\uffff'
+
+# worker processes shared by all imports, started on first use
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+# held while a worker process starts
+_start_lock = threading.Lock()
+
+
+class _WorkerProcess(multiprocessing.context.SpawnProcess):
+    """
+    A spawned worker process that does not import the main module of its parent. By
+    default, a spawned process runs the main module of its parent again, which for the
+    server is main.py, its Flask application and everything it imports; the workers
+    only need this module, which they import to unpickle their tasks.
+    """
+
+    def start(self) -> None:
+        # the main module is looked up while the process starts, to tell the new process
+        # which one to run; an empty one is left alone
+        with _start_lock:
+            main_module: types.ModuleType = sys.modules['__main__']
+            sys.modules['__main__'] = types.ModuleType('__main__')
+            try:
+                super().start()
+            finally:
+                sys.modules['__main__'] = main_module
+
+
+class _WorkerContext(multiprocessing.context.SpawnContext):
+    """
+    The spawn start method, with _WorkerProcess processes.
+    """
+
+    Process = _WorkerProcess
+
+
+def split_csv_ranges(
+    path: str,
+    chunk_bytes: int = CHUNK_BYTES
+) -> tuple[list[str], list[tuple[int, int]]]:
+    """
+    Read the header of the CSV file at `path`, and cut the rest of the file into
+    (start, end) byte ranges of roughly `chunk_bytes` bytes each. Every range ends right
+    after a line break that is not inside a quoted field, as told by the parity of the
+    quotes before it, so each range holds whole rows. A stray quote in an unquoted field
+    throws the parity off; parse_csv_range() detects the ranges cut inside a field.
+    Return the header fields and the list of ranges.
+    """
+    assert chunk_bytes >= 1
+
+    ranges: list[tuple[int, int]] = []
+    with open(path, 'rb') as file:
+        header: str = file.readline().decode('utf-8-sig')
+        fields: list[str] = next(csv.reader([header]), [])
+        range_start: int = file.tell()
+        offset: int = range_start       # file offset of the current block
+        in_quotes: bool = False         # whether the scan is inside a quoted field
+
+        # quotes only appear in pairs outside of quoted fields (escaped quotes are
+        # doubled), so the parity of the quotes seen tells whether a line break ends a row
+        while block := file.read(SCAN_BYTES):
+            index: int = 0
+            while True:
+                # skip to where the current range is long enough, then find the next line
+                # break outside a quoted field
+                wanted: int = max(index, range_start + chunk_bytes - offset)
+                if wanted >= len(block):
+                    break
+                in_quotes ^= block.count(b'"', index, wanted) % 2 == 1
+                index = wanted
+
+                newline: int = block.find(b'\n', index)
+                while newline != -1:
+                    in_quotes ^= block.count(b'"', index, newline) % 2 == 1
+                    index = newline + 1
+                    if not in_quotes:
+                        break
+                    newline = block.find(b'\n', index)
+                if newline == -1:
+                    break
+
+                ranges.append((range_start, offset + index))
+                range_start = offset + index
+
+            in_quotes ^= block.count(b'"', index) % 2 == 1
+            offset += len(block)
+
+        if offset > range_start:
+            ranges.append((range_start, offset))
+
+    return fields, ranges
+
+
+def _clean_records(
+    records: Iterable[list[str]],
+    fields: list[str]
+) -> tuple[list[tuple[str, str, int]], int, list[tuple[int, str]]]:
+    """
+    Validate the CSV `records` of a file whose header holds `fields`, and return the
+    valid rows as (sku, name, quantity) tuples, the number of records, and the number of
+    every invalid record, counting from 1, with the reason it was rejected.
+    """
+    # like csv.DictReader, the last column of a repeated header name wins
+    positions: dict[str, int] = {field: index for index, field in enumerate(fields)}
+    columns: list[int] = [positions.get(name, -1) for name in ('sku', 'name', 'quantity')]
+
+    rows: list[tuple[str, str, int]] = []
+    rejections: list[tuple[int, str]] = []
+    count: int = 0
+    for record in records:
+        # csv.DictReader skips blank lines as well
+        if not record:
+            continue
+        count += 1
+        try:
+            rows.append(clean_product_fields(*(
+                record[column] if 0 <= column < len(record) else ''
+                for column in columns
+            )))
+        except ValueError as err:
+            rejections.append((count, str(err)))
+    return rows, count, rejections
+
+
+def parse_csv_range(path: str, start: int, end: int, fields: list[str]) -> Optional[dict]:
+    """
+    Parse and validate the rows in bytes `start` to `end` of the CSV file at `path`,
+    whose header holds `fields`. Return a dictionary:
+        {'start': int, 'end': int, 'rows': list[tuple[str, str, int]], 'records': int,
+         'rejections': list[tuple[int, str]]}
+    where `rows` are the valid rows as (sku, name, quantity) tuples, `records` is the
+    number of rows in the range, and `rejections` lists the number of each invalid row
+    within the range, counting from 1, with the reason it was rejected.
+    Return None if the range ends inside a quoted field, so that it does not hold whole
+    rows.
+    """
+    with open(path, 'rb') as file:
+        file.seek(start)
+        text: str = file.read(end - start).decode('utf-8')
+
+    # a range cut inside a quoted field swallows the record appended to it
+    complete: bool = False
+
+    def records() -> Iterator[list[str]]:
+        nonlocal complete
+        for record in csv.reader(io.StringIO(f'{text}\r\n{_END_FIELD}', newline='')):
+            complete = record == [_END_FIELD]
+            if not complete:
+                yield record
+
+    rows, count, rejections = _clean_records(records(), fields)
+    if not complete:
+        return None
+    return {
+        'start': start, 'end': end,
+        'rows': rows, 'records': count, 'rejections': rejections
+    }
+
+
+def _parse_csv_sequentially(
+    path: str,
+    start: int,
+    fields: list[str],
+    chunk_bytes: int = CHUNK_BYTES
+) -> Iterator[dict]:
+    """
+    Parse and validate the CSV file at `path`, whose header holds `fields`, from byte
+    `start` to its end, reading it record by record in this process, and yield the
+    results like parse_csv_range() does for every `chunk_bytes` bytes or so.
+    """
+    with open(path, 'rb') as file:
+        file.seek(start)
+        position: int = start   # file offset of the end of the lines read
+
+        def lines() -> Iterator[str]:
+            nonlocal position
+            for line in io.TextIOWrapper(file, encoding='utf-8', newline=''):
+                position += len(line.encode('utf-8'))
+                yield line
+
+        reader: Iterator[list[str]] = csv.reader(lines())
+        while True:
+            # the reader only reads the lines of the records it returns
+            chunk_start: int = position
+            chunk: list[list[str]] = []
+            for record in reader:
+                chunk.append(record)
+                if position - chunk_start >= chunk_bytes:
+                    break
+            if not chunk:
+                return
+            rows, count, rejections = _clean_records(chunk, fields)
+            yield {
+                'start': chunk_start, 'end': position,
+                'rows': rows, 'records': count, 'rejections': rejections
+            }
+
+
+def _get_executor(workers: int) -> ProcessPoolExecutor:
+    """
+    Return the shared pool of worker processes, starting it with `workers` processes if
+    it is not running yet.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn fresh interpreters: forking would copy the server's threads and
+            # open database connections into the workers
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=_WorkerContext())
+            atexit.register(_executor.shutdown)
+        return _executor
+
+
+def iter_csv_chunks(
+    path: str,
+    workers: Optional[int] = None,
+    chunk_bytes: int = CHUNK_BYTES
+) -> Iterator[dict]:
+    """
+    Parse and validate the CSV file at `path` one byte range at a time, on up to
+    `workers` processes (one per core by default), and yield the results of
+    parse_csv_range() in file order. Rejected rows are numbered from the start of the
+    file, as dictionaries: {'row': int, 'reason': str}.
+    Only a few ranges are parsed ahead of the one being consumed, so memory use does not
+    grow with the size of the file.
+    """
+    fields, ranges = split_csv_ranges(path, chunk_bytes)
+    processes: int = workers or os.cpu_count() or 1
+
+    def parse_all() -> Iterator[dict]:
+        # a single process parses in place, without the cost of sending rows around
+        if processes <= 1 or len(ranges) <= 1:
+            for start, end in ranges:
+                chunk: Optional[dict] = parse_csv_range(path, start, end, fields)
+                if chunk is None:
+                    # the ranges are cut inside fields from here on; read the rest of
+                    # the file record by record instead
+                    yield from _parse_csv_sequentially(path, start, fields, chunk_bytes)
+                    return
+                yield chunk
+            return
+
+        executor: ProcessPoolExecutor = _get_executor(processes)
+        pending: deque[tuple[int, Future]] = deque()  # start of each range, and its parse
+        todo: Iterator[tuple[int, int]] = iter(ranges)
+        try:
+            while True:
+                # keep every worker busy, plus one range in reserve for each
+                while len(pending) < 2 * processes:
+                    next_range: Optional[tuple[int, int]] = next(todo, None)
+                    if next_range is None:
+                        break
+                    pending.append((
+                        next_range[0],
+                        executor.submit(parse_csv_range, path, *next_range, fields)
+                    ))
+                if not pending:
+                    return
+                start, future = pending.popleft()
+                chunk = future.result()
+                if chunk is None:
+                    yield from _parse_csv_sequentially(path, start, fields, chunk_bytes)
+                    return
+                yield chunk
+        finally:
+            # the consumer stopped early, or the rest is read in this process; drop the
+            # ranges nobody will read
+            for _, future in pending:
+                future.cancel()
+
+    rows_before: int = 0    # rows in the ranges already yielded
+    for chunk in parse_all():
+        chunk['rejections'] = [
+            {'row': rows_before + number, 'reason': reason}
+            for number, reason in chunk['rejections']
+        ]
+        rows_before += chunk['records']
+        yield chunk
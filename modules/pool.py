@@ -0,0 +1,256 @@
+#!/usr/bin/env python3.9
+"""
+A small thread-aware pool of SQLite connections.
+Exposes the ConnectionPool class, which keeps database connections (and their
+prepared-statement caches) alive between calls instead of reconnecting every time.
+"""
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """
+    Raised when no pooled connection became available within the configured timeout.
+    Subclasses sqlite3.OperationalError so existing `except sqlite3.Error` handlers
+    treat an exhausted pool like any other database error.
+    """
+
+
+class ConnectionPool:
+    """
+    A bounded pool of SQLite connections that can be shared by many threads.
+
+    Each thread prefers the connection it used last (thread affinity), which keeps that
+    connection's page cache and statement cache warm for the thread's workload. When the
+    preferred connection is busy, any idle connection is handed out instead; new
+    connections are opened until `size` is reached, after which callers wait up to
+    `timeout` seconds for a connection to be released.
+
+    Public methods:
+        - ConnectionPool(db_path: str, size: int = 5, ...) -> None
+        - ConnectionPool.acquire() -> sqlite3.Connection
+        - ConnectionPool.release(conn: sqlite3.Connection) -> None
+        - ConnectionPool.connection() -> ContextManager[sqlite3.Connection]
+        - ConnectionPool.stats() -> dict
+        - ConnectionPool.close() -> None
+    """
+
+    db_path: str                # path or URI of the SQLite database
+    size: int                   # maximum number of open connections
+    timeout: float              # seconds to wait for a free connection
+    health_check_interval: float  # idle seconds after which a connection is re-checked
+
+    def __init__(
+        self,
+        db_path: str,
+        size: int = 5,
+        timeout: float = 5.0,
+        health_check_interval: float = 30.0,
+        cached_statements: int = 128,
+        uri: bool = False,
+        on_connect: Optional[Callable[[sqlite3.Connection], Any]] = None,
+        factory: type = sqlite3.Connection
+    ) -> None:
+        """
+        Configure the pool; connections are opened lazily on first use.
+        `on_connect` is called once with every newly opened connection, and can be used
+        to apply per-connection settings such as pragmas.
+        `factory` is the class of the connections, a subclass of sqlite3.Connection.
+        """
+        assert size >= 1
+
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._cached_statements = cached_statements
+        self._uri = uri
+        self._on_connect = on_connect
+        self._factory = factory
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle: dict[int, sqlite3.Connection] = {}   # id(conn) -> idle connection
+        self._last_used: dict[int, float] = {}           # id(conn) -> release time
+        self._open: int = 0
+        self._closed: bool = False
+        self._affinity = threading.local()
+
+        self._counters: dict[str, float] = {
+            'hits': 0,                  # served by an already open connection
+            'affinity_hits': 0,         # ... which was the thread's own last connection
+            'misses': 0,                # a new connection had to be opened
+            'waits': 0,                 # the caller had to wait for a release
+            'wait_time': 0.0,           # total seconds spent waiting
+            'max_wait_time': 0.0,       # longest single wait in seconds
+            'timeouts': 0,              # waits that gave up after `timeout`
+            'health_check_failures': 0  # connections discarded by the health check
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a new connection that may be handed between threads.
+        """
+        conn: sqlite3.Connection = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=self._cached_statements,
+            uri=self._uri,
+            factory=self._factory
+        )
+        if self._on_connect is not None:
+            self._on_connect(conn)
+        return conn
+
+    def _healthy(self, conn: sqlite3.Connection) -> bool:
+        """
+        Return whether a connection that sat idle for a while can still run a query.
+        """
+        try:
+            conn.execute('SELECT 1;').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _take_idle(self) -> Optional[sqlite3.Connection]:
+        """
+        Remove and return an idle connection, preferring the calling thread's last one.
+        Must be called with the pool lock held.
+        """
+        preferred: Optional[sqlite3.Connection] = getattr(self._affinity, 'conn', None)
+        if preferred is not None and id(preferred) in self._idle:
+            self._counters['affinity_hits'] += 1
+            return self._idle.pop(id(preferred))
+        if self._idle:
+            return self._idle.pop(next(iter(self._idle)))
+        return None
+
+    def acquire(self) -> sqlite3.Connection:
+        """
+        Borrow a connection from the pool. It must be handed back with release().
+        Raise PoolTimeout if none becomes available within `timeout` seconds.
+        """
+        conn: Optional[sqlite3.Connection] = None
+        with self._cond:
+            if self._closed:
+                raise sqlite3.ProgrammingError('Connection pool has been closed.')
+
+            conn = self._take_idle()
+            if conn is None and self._open >= self.size:
+                # every connection is checked out; wait for one to be released
+                self._counters['waits'] += 1
+                started: float = time.perf_counter()
+                self._cond.wait_for(
+                    lambda: self._closed or bool(self._idle) or self._open < self.size,
+                    timeout=self.timeout
+                )
+                waited: float = time.perf_counter() - started
+                self._counters['wait_time'] += waited
+                self._counters['max_wait_time'] = max(
+                    self._counters['max_wait_time'], waited
+                )
+                if self._closed:
+                    raise sqlite3.ProgrammingError('Connection pool has been closed.')
+                conn = self._take_idle()
+                if conn is None and self._open >= self.size:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout(
+                        f'No database connection available after {self.timeout}s '
+                        f'(pool size: {self.size}).'
+                    )
+
+            if conn is None:
+                # reserve a slot for the connection opened below
+                self._open += 1
+                self._counters['misses'] += 1
+            else:
+                self._counters['hits'] += 1
+                last_used: float = self._last_used.pop(id(conn), 0.0)
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except BaseException:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+        elif time.monotonic() - last_used > self.health_check_interval:
+            # replace connections that went bad while sitting idle
+            if not self._healthy(conn):
+                with self._cond:
+                    self._counters['health_check_failures'] += 1
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+                try:
+                    conn = self._connect()
+                except BaseException:
+                    # give up the slot of the closed connection
+                    with self._cond:
+                        self._open -= 1
+                        self._cond.notify()
+                    raise
+
+        self._affinity.conn = conn
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """
+        Hand a borrowed connection back to the pool, rolling back any transaction the
+        borrower left open.
+        """
+        if conn.in_transaction:
+            conn.rollback()
+
+        with self._cond:
+            if self._closed:
+                self._open -= 1
+                conn.close()
+                return
+            self._idle[id(conn)] = conn
+            self._last_used[id(conn)] = time.monotonic()
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection for the duration of a `with` block.
+        """
+        conn: sqlite3.Connection = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self) -> dict:
+        """
+        Return a snapshot of the pool's usage counters, useful for sizing the pool.
+        """
+        with self._cond:
+            snapshot: dict = dict(self._counters)
+            snapshot.update({
+                'size': self.size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._open - len(self._idle)
+            })
+        return snapshot
+
+    def close(self) -> None:
+        """
+        Close all idle connections and refuse further acquisitions. Connections that are
+        still checked out are closed as soon as they are released.
+        """
+        with self._cond:
+            self._closed = True
+            for conn in self._idle.values():
+                conn.close()
+                self._open -= 1
+            self._idle.clear()
+            self._last_used.clear()
+            self._cond.notify_all()
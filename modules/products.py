@@ -4,7 +4,123 @@ Enables access to products in the inventory.
 Allows for project-relevant SQLite database access by exposing the Products class.
 """
 
+import hashlib
+import json
+import os
+import re
 import sqlite3
+import tempfile
+from contextlib import contextmanager
+from itertools import groupby
+from typing import Any, Callable, Iterable, Iterator, Optional, Sequence, Union
+import threading
+
+from modules.cache import LRUCache
+from modules.coalescer import QuantityChange, QuantityCoalescer
+from modules.metrics import METRICS, TimedConnection, instrument
+from modules.pool import ConnectionPool
+from modules.writer import WriteJob, WriteQueue
+
+# pragmas applied to every connection unless overridden through Products(pragmas=...)
+DEFAULT_PRAGMAS: dict = {
+    'journal_mode': 'wal',          # readers are not blocked by the writer
+    'synchronous': 'normal',        # in WAL mode, only checkpoints fsync
+    'cache_size': -16000,           # page cache per connection, in KiB when negative
+    'mmap_size': 256 * 1024 * 1024,  # read through memory-mapped I/O, in bytes
+    'temp_store': 'default',        # in-memory statement journals slow big savepoints
+    'busy_timeout': 5000            # milliseconds to wait on locks held by others
+}
+# number of writes between trimming the change log down to its configured size, and
+# checking whether a ledger snapshot is due
+CHANGE_LOG_PRUNE_INTERVAL: int = 100
+# lower bounds of the quantity ranges counted by Products.quantity_histogram(); the
+# counters of an existing database keep the ranges they were created with
+QUANTITY_BUCKETS: tuple = (0, 1, 10, 100, 1000, 10000)
+# the current time as a Unix timestamp with millisecond precision, in SQL
+SQL_NOW: str = "((julianday('now') - 2440587.5) * 86400.0)"
+# operations accepted by Products.apply_batch(), and the field each one needs
+BATCH_OPS: dict = {
+    'add': 'count',
+    'subtract': 'count',
+    'set': 'count',
+    'rename': 'name',
+    'delete': None
+}
+# how imports treat a row whose SKU already exists, as the conflict clause of the INSERT;
+# rows that would be left as they are are not written at all
+MERGE_MODES: dict = {
+    'ignore': 'DO NOTHING',
+    'replace': '''
+        DO UPDATE SET name = excluded.name, quantity = excluded.quantity
+        WHERE name IS NOT excluded.name OR quantity IS NOT excluded.quantity
+    ''',
+    'add-quantity': '''
+        DO UPDATE SET quantity = quantity + excluded.quantity
+        WHERE excluded.quantity != 0
+    ''',
+    'set-quantity': '''
+        DO UPDATE SET quantity = excluded.quantity
+        WHERE quantity IS NOT excluded.quantity
+    '''
+}
+
+# metrics of the public methods
+METHOD_SECONDS = METRICS.histogram(
+    'inventory_products_seconds', 'Time spent in each Products method.', ['method']
+)
+METHOD_ROWS = METRICS.counter(
+    'inventory_products_rows_total', 'Rows returned by each Products method.', ['method']
+)
+METHOD_ERRORS = METRICS.counter(
+    'inventory_products_errors_total', 'Exceptions raised by each Products method.',
+    ['method', 'error']
+)
+SQLITE_ERRORS = METRICS.counter(
+    'inventory_sqlite_errors_total', 'SQLite errors reported by Products, by operation.',
+    ['context', 'error']
+)
+# records the duration, returned rows and exceptions of a method, unless the instance
+# it is called on opted out
+_timed = instrument(
+    METHOD_SECONDS, METHOD_ERRORS, rows=METHOD_ROWS,
+    when=lambda args: args[0].method_metrics
+)
+
+
+def _quantity_bucket(quantity: str) -> str:
+    """
+    Return a SQL expression for the lower bound of the QUANTITY_BUCKETS range that the
+    SQL expression `quantity` falls in.
+    """
+    cases: str = ' '.join(
+        f'WHEN {quantity} < {upper} THEN {lower}'
+        for lower, upper in zip(QUANTITY_BUCKETS, QUANTITY_BUCKETS[1:])
+    )
+    return f'(CASE {cases} ELSE {QUANTITY_BUCKETS[-1]} END)'
+
+
+class _BatchRejected(Exception):
+    """
+    Raised inside an atomic batch to roll it back when one of its operations failed.
+    """
+
+
+class IdempotencyKeyReused(ValueError):
+    """
+    Raised when an idempotency key is sent again along with a different request than the
+    one whose result it holds.
+    """
+
+
+class _Replayed(Exception):
+    """
+    Raised inside a write to skip it when its idempotency key was taken in the meantime,
+    carrying the result stored under the key.
+    """
+
+    def __init__(self, result: Any) -> None:
+        super().__init__()
+        self.result = result
 
 
 class Products:
@@ -13,45 +129,594 @@ class Products:
     operating on products in the inventory system.
 
     Public methods:
-        - Products(db_path: str = ":memory:", table_name: str = 'products') -> None
+        - Products(db_path: str = ":memory:", table_name: str = 'products',
+                   pool_size: int = 5, pool_timeout: float = 5.0,
+                   pragmas: Optional[dict] = None, cache_size: int = 256,
+                   cache_ttl: float = 5.0, change_log_size: int = 10000,
+                   write_behind: float = 0.0, write_behind_size: int = 1000,
+                   snapshot_interval: int = 100000, snapshots_kept: int = 4,
+                   sql_metrics: bool = True, idempotency_size: int = 10000,
+                   idempotency_ttl: float = 86400.0, method_metrics: bool = True)
+              -> None
         - Products.create_table() -> None
         - Products.import_data(data: list[dict]) -> None
+        - Products.import_batches(batches: Iterable[Sequence[tuple]],
+                                  mode: str = 'ignore') -> Iterator[dict]
         - Products.get_all() -> list[sqlite3.Row]
         - Products.get_specific(skus: list) -> list[sqlite3.Row]
-        - Products.add_product(sku: str, name: str, quantity: int = 0) -> None
-        - Products.delete_products(skus: list[str]) -> None
-        - Products.change_name(sku: str, new_name: str) -> None
-        - Products.update_quantity(sku: str, operation: str, count: int) -> None
+        - Products.get_page(after_sku: Optional[str] = None, limit: int = 100,
+                            sort: str = 'sku', after_name: Optional[str] = None)
+              -> list[sqlite3.Row]
+        - Products.count() -> int
+        - Products.low_stock(threshold: int, limit: int = 100) -> list[sqlite3.Row]
+        - Products.total_quantity() -> int
+        - Products.quantity_histogram() -> list[dict]
+        - Products.search(query: str, limit: int = 50) -> list[sqlite3.Row]
+        - Products.change_seq(fresh: bool = False) -> int
+        - Products.get_changes(since: int, limit: int = 500) -> dict
+        - Products.history(sku: str, limit: int = 100, before: Optional[int] = None)
+              -> list[sqlite3.Row]
+        - Products.product_at(sku: str, at: Optional[float] = None,
+                              seq: Optional[int] = None) -> Optional[sqlite3.Row]
+        - Products.products_at(at: Optional[float] = None, seq: Optional[int] = None)
+              -> list[sqlite3.Row]
+        - Products.take_snapshot() -> Optional[int]
+        - Products.rebuild(seq: Optional[int] = None) -> dict
+        - Products.add_write_listener(listener: Callable[[], Any]) -> None
+        - Products.iter_products(skus: Optional[list] = None, chunk_size: int = 1000)
+              -> Iterator[sqlite3.Row]
+        - Products.add_product(sku: str, name: str, quantity: int = 0,
+                               idempotency_key: Optional[str] = None) -> None
+        - Products.delete_products(skus: list[str],
+                                   idempotency_key: Optional[str] = None) -> None
+        - Products.change_name(sku: str, new_name: str,
+                               idempotency_key: Optional[str] = None) -> None
+        - Products.update_quantity(sku: str, operation: str, count: int,
+                                   idempotency_key: Optional[str] = None) -> None
+        - Products.apply_batch(ops: list[dict], atomic: bool = False,
+                               idempotency_key: Optional[str] = None) -> dict
+        - Products.recall(key: str, request: Any) -> Any
+        - Products.remember(key: str, request: Any, result: Any, replace: bool = False)
+              -> Any
+        - Products.forget(key: str, request: Any) -> None
+        - Products.version -> int
+        - Products.instance_id() -> str
+        - Products.pool_stats() -> dict
+        - Products.cache_stats() -> dict
+        - Products.writer_stats() -> dict
+        - Products.write_behind_stats() -> dict
+        - Products.flush() -> None
+        - Products.close() -> None
     """
 
     db_path: str       # path to a SQLite database file
     table_name: str    # name of the products table
+    pragmas: dict      # SQLite pragmas applied to every connection
+    pool: ConnectionPool  # reusable read connections to the database
+    writer: WriteQueue    # the single connection that performs all mutations
+    cache: LRUCache       # recent read results, valid until the next write
+    change_log_size: int  # number of most recent changes kept in the change log
+    snapshot_interval: int  # ledger entries between automatic snapshots; 0 disables them
+    snapshots_kept: int     # number of most recent snapshots kept, besides the first one
+    quantity_buffer: Optional[QuantityCoalescer]  # pending quantity updates, if enabled
+    idempotency_size: int     # number of most recent idempotency keys kept
+    idempotency_ttl: float    # seconds an idempotency key is kept for
+    method_metrics: bool      # whether calls of the public methods are recorded
 
-    def __init__(self, db_path: str = ":memory:", table_name: str = 'products') -> None:
+    def __init__(
+        self,
+        db_path: str = ":memory:",
+        table_name: str = 'products',
+        pool_size: int = 5,
+        pool_timeout: float = 5.0,
+        pragmas: Optional[dict] = None,
+        cache_size: int = 256,
+        cache_ttl: float = 5.0,
+        change_log_size: int = 10000,
+        write_behind: float = 0.0,
+        write_behind_size: int = 1000,
+        snapshot_interval: int = 100000,
+        snapshots_kept: int = 4,
+        sql_metrics: bool = True,
+        idempotency_size: int = 10000,
+        idempotency_ttl: float = 86400.0,
+        method_metrics: bool = True
+    ) -> None:
         """
-        Configure the path to the SQLite database file, defaults to in-memory storage.
+        Configure the path to the SQLite database file, defaults to a temporary database
+        that close() removes.
         Configure the name of the products table, defaults to 'products'.
+        Configure how many read connections are kept open for reuse, and how many
+        seconds a call may wait for one when all of them are busy.
+        Configure SQLite pragmas; given values override those in DEFAULT_PRAGMAS.
+        Configure how many read results are cached, and for how many seconds at most;
+        the time limit bounds how long writes made by other processes can go unnoticed.
+        Configure how many of the most recent product changes are kept for
+        get_changes().
+        Configure write-behind for update_quantity(): if `write_behind` is positive,
+        quantity updates are merged in memory and written together, at most
+        `write_behind` seconds later, or as soon as `write_behind_size` products have
+        pending updates. Reads do not see buffered updates, and updates that were not
+        written yet are lost if the process dies; other writes and close() write them
+        first.
+        Configure ledger snapshots: a copy of all products is stored once
+        `snapshot_interval` entries were added to the ledger since the previous one, or
+        never if it is 0, and the `snapshots_kept` most recent ones are kept, along with
+        the first one. Point-in-time queries read the latest snapshot before the point
+        and the ledger entries after it.
+        Configure whether the duration, changed rows and errors of every SQL statement are
+        recorded in the metrics registry (see modules.metrics).
+        Configure how many idempotency keys of writes are kept, at most
+        `idempotency_size` of the most recent ones, and for how many seconds; a write sent
+        again with a kept key is not repeated (see _write_once()).
+        Configure whether the duration, returned rows and errors of every call of a public
+        method are recorded in the metrics registry; objects that are only used through
+        another one, which records its calls, turn it off.
         WARNING: table_name is not sanitized!
         """
         self.db_path = db_path
         self.table_name = table_name
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        assert set(self.pragmas) <= set(DEFAULT_PRAGMAS), 'unsupported pragma'
+        assert change_log_size >= 1
+        self.change_log_size = change_log_size
+        assert snapshot_interval >= 0 and snapshots_kept >= 1
+        self.snapshot_interval = snapshot_interval
+        self.snapshots_kept = snapshots_kept
+        assert idempotency_size >= 1 and idempotency_ttl > 0
+        self.idempotency_size = idempotency_size
+        self.idempotency_ttl = idempotency_ttl
+        self.method_metrics = method_metrics
+
+        conn_path: str = db_path
+        self._temp_dir: Optional[tempfile.TemporaryDirectory] = None
+        if db_path == ':memory:':
+            # every plain ':memory:' connection is a separate database, and a shared
+            # in-memory one has no WAL, so its readers would block the writer; keep the
+            # database in a temporary file instead, removed by close()
+            self._temp_dir = tempfile.TemporaryDirectory(prefix='products-')
+            conn_path = os.path.join(self._temp_dir.name, 'products.db')
+
+        # all mutations go through one writer connection
+        factory: type = TimedConnection if sql_metrics else sqlite3.Connection
+        self.writer = WriteQueue(lambda: self._configure(
+            sqlite3.connect(conn_path, factory=factory), writer=True
+        ))
+        self.pool = ConnectionPool(
+            conn_path,
+            size=pool_size,
+            timeout=pool_timeout,
+            on_connect=self._configure,
+            factory=factory
+        )
+
+        # read results are cached until the next write through this object
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self._version: int = 0
+        self._writes_in_flight: int = 0
+        # latest change log entry read by change_seq(fresh=True)
+        self._change_head: int = 0
+        self._instance_id: Optional[str] = None   # read once by instance_id()
+        self._version_lock = threading.Lock()
+        self._write_listeners: list[Callable[[], Any]] = []
+
+        self.quantity_buffer = None
+        if write_behind > 0:
+            self.quantity_buffer = QuantityCoalescer(
+                self._flush_quantities,
+                max_pending=write_behind_size,
+                max_delay=write_behind
+            )
 
+    def _configure(
+        self,
+        conn: sqlite3.Connection,
+        writer: bool = False
+    ) -> sqlite3.Connection:
+        """
+        Apply the configured pragmas to a freshly opened connection and return it.
+        The journal mode is a property of the database file, so only the writer sets it;
+        read connections are made read-only.
+        """
+        for pragma, value in self.pragmas.items():
+            if pragma != 'journal_mode' or writer:
+                conn.execute(f'PRAGMA {pragma} = {value};')
+
+        if not writer:
+            conn.execute('PRAGMA query_only = 1;')
+        return conn
+
+    @contextmanager
     def _get_conn_cur(
         self,
         use_row_factory: bool = False
-    ) -> tuple[sqlite3.Connection, sqlite3.Cursor]:
+    ) -> Iterator[tuple[sqlite3.Connection, sqlite3.Cursor]]:
         """
-        Return SQLite database connaction and cursor objects based on the database path.
-        If use_row_factory is set to True, then use sqlite3.Row as the connection's row
-        factory.
+        Borrow a pooled SQLite database connection and create a cursor on it, for the
+        duration of a `with` block. The connection is returned to the pool afterwards.
+        If use_row_factory is set to True, then the cursor produces sqlite3.Row objects.
         """
-        conn: sqlite3.Connection = sqlite3.connect(self.db_path)
+        with self.pool.connection() as conn:
+            cur: sqlite3.Cursor = conn.cursor()
+
+            if use_row_factory:
+                cur.row_factory = sqlite3.Row
+
+            try:
+                yield conn, cur
+            finally:
+                cur.close()
 
-        if use_row_factory:
-            conn.row_factory = sqlite3.Row
+    def _write(self, job: WriteJob, flush_pending: bool = True) -> Any:
+        """
+        Run `job` on the writer, wait for it to commit, and return its result.
+        Buffered quantity updates are written first, so writes keep their order, unless
+        `flush_pending` is False.
+        Afterwards, bump the table version, so that cached reads from before the write
+        are never served again, and every so often trim the change log.
+        """
+        if flush_pending and self.quantity_buffer is not None:
+            self.quantity_buffer.flush()
+
+        with self._version_lock:
+            self._writes_in_flight += 1
+        try:
+            return self.writer.run(job)
+        finally:
+            with self._version_lock:
+                self._version += 1
+                self._writes_in_flight -= 1
+                self.cache.clear()
+                prune: bool = self._version % CHANGE_LOG_PRUNE_INTERVAL == 0
+            if prune:
+                self._prune_changes()
+                self._prune_idempotency_keys()
+                if self.snapshot_interval:
+                    self._snapshot(only_if_due=True)
+            for listener in self._write_listeners:
+                listener()
+
+    def _prune_changes(self) -> None:
+        """
+        Delete all but the newest `change_log_size` entries of the change log.
+        """
+        # SQL statement to delete the oldest entries of the change log
+        stmt = f'''
+            DELETE FROM {self.table_name}_changes
+            WHERE seq <= (SELECT max(seq) FROM {self.table_name}_changes) - :keep;
+        '''
+
+        # queue the SQL statement on the writer and wait for it to commit
+        try:
+            self.writer.run(lambda cur: cur.execute(stmt, {'keep': self.change_log_size}))
+        except sqlite3.Error as error:
+            print(self._sqlite_error_msg(
+                context='pruning the change log',
+                error=error,
+                table_name=self.table_name
+            ))
+
+    def _prune_idempotency_keys(self) -> None:
+        """
+        Delete the idempotency keys that expired, and all but the newest
+        `idempotency_size` of the others.
+        """
+        # SQL statement to delete expired keys and the oldest keys beyond the limit
+        stmt = f'''
+            DELETE FROM {self.table_name}_idempotency
+            WHERE ts < {SQL_NOW} - :ttl OR ts <= (
+                SELECT ts FROM {self.table_name}_idempotency
+                ORDER BY ts DESC LIMIT 1 OFFSET :keep
+            );
+        '''
 
-        cur: sqlite3.Cursor = conn.cursor()
-        return conn, cur
+        # queue the SQL statement on the writer and wait for it to commit
+        try:
+            self.writer.run(lambda cur: cur.execute(
+                stmt, {'ttl': self.idempotency_ttl, 'keep': self.idempotency_size}
+            ))
+        except sqlite3.Error as error:
+            print(self._sqlite_error_msg(
+                context='pruning idempotency keys',
+                error=error,
+                table_name=self.table_name
+            ))
+
+    @staticmethod
+    def _fingerprint(request: Any) -> str:
+        """
+        Return a digest of `request`, any JSON-serializable description of a write, that
+        tells whether a write sent with an idempotency key is the same as the first one.
+        """
+        return hashlib.sha256(
+            json.dumps(request, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+
+    def _recall(self, cur: sqlite3.Cursor, key: str, fingerprint: str) -> Optional[str]:
+        """
+        Return the result stored under the idempotency `key`, as JSON text, or None if
+        the key is free or expired. Raise IdempotencyKeyReused if the key was taken by a
+        request whose fingerprint is not `fingerprint`.
+        """
+        # SQL statement to read the request and result stored under a key that has not
+        # expired yet
+        stmt = f'''
+            SELECT request, result FROM {self.table_name}_idempotency
+            WHERE key = :key AND ts >= {SQL_NOW} - :ttl;
+        '''
+        row: Optional[tuple] = cur.execute(
+            stmt, {'key': key, 'ttl': self.idempotency_ttl}
+        ).fetchone()
+
+        if row is None:
+            return None
+        if row[0] != fingerprint:
+            raise IdempotencyKeyReused(
+                f'idempotency key {key!r} was already used for a different request'
+            )
+        return row[1]
+
+    def _store_result(
+        self,
+        cur: sqlite3.Cursor,
+        key: str,
+        fingerprint: str,
+        result: Any
+    ) -> str:
+        """
+        Store `result` under the free or expired idempotency `key`, along with the
+        `fingerprint` of its request, and return it as JSON text. Must be called on the
+        writer.
+        """
+        # SQL statement to take a key, replacing an expired entry
+        stmt = f'''
+            INSERT OR REPLACE INTO {self.table_name}_idempotency(key, request, result)
+            VALUES (:key, :request, :result);
+        '''
+        text: str = json.dumps(result)
+        cur.execute(stmt, {'key': key, 'request': fingerprint, 'result': text})
+        return text
+
+    def _write_once(
+        self,
+        job: WriteJob,
+        key: Optional[str],
+        request: Any,
+        result: Callable[[], Any] = lambda: None
+    ) -> tuple[bool, Any]:
+        """
+        Run `job` on the writer like _write(), and in the same transaction, store the
+        return value of `result` under the idempotency `key`, along with a fingerprint of
+        `request`, a JSON-serializable description of the write. If the key already holds
+        the result of the same request, the job is not run again.
+        Return (False, the job's return value) if the job ran, or (True, the stored
+        result) if it did not. Without a `key`, always run the job.
+        Raise IdempotencyKeyReused if the key holds the result of a different request.
+        """
+        if key is None:
+            return False, self._write(job)
+        taken: str = key
+        fingerprint: str = self._fingerprint(request)
+
+        # attempt to answer a retry from the stored result, without waiting on the writer
+        with self._get_conn_cur() as (conn, cur):
+            stored: Optional[str] = self._recall(cur, key, fingerprint)
+        if stored is not None:
+            return True, json.loads(stored)
+
+        def once(cur: sqlite3.Cursor) -> Any:
+            # another attempt may have taken the key since it was checked
+            stored: Optional[str] = self._recall(cur, taken, fingerprint)
+            if stored is not None:
+                raise _Replayed(json.loads(stored))
+            outcome: Any = job(cur)
+            self._store_result(cur, taken, fingerprint, result())
+            return outcome
+
+        try:
+            return False, self._write(once)
+        except _Replayed as replayed:
+            return True, replayed.result
+
+    def _store_snapshot(
+        self,
+        cur: sqlite3.Cursor,
+        only_if_due: bool = False
+    ) -> Optional[int]:
+        """
+        Store a snapshot of all products as of the latest ledger entry, delete the
+        snapshots that are no longer kept, and return the sequence number of that entry.
+        If `only_if_due` is set, do nothing and return None unless `snapshot_interval`
+        entries were added to the ledger since the latest snapshot. Must be called on the
+        writer.
+        """
+        head: int = cur.execute(
+            f'SELECT coalesce(max(seq), 0) FROM {self.table_name}_ledger;'
+        ).fetchone()[0]
+        if only_if_due:
+            latest: int = cur.execute(
+                f'SELECT coalesce(max(seq), 0) FROM {self.table_name}_snapshots;'
+            ).fetchone()[0]
+            if head - latest < self.snapshot_interval:
+                return None
+
+        # SQL statements to store the snapshot, and to find the snapshots to delete: all
+        # but the first and the most recent ones
+        snapshot_stmt = f'''
+            INSERT INTO {self.table_name}_snapshots(seq, ts, products)
+            SELECT :seq, {SQL_NOW}, value FROM {self.table_name}_stats
+            WHERE key = 'count';
+        '''
+        rows_stmt = f'''
+            INSERT INTO {self.table_name}_snapshot_rows(snapshot, sku, name, quantity)
+            SELECT :snapshot, sku, name, quantity FROM {self.table_name};
+        '''
+        expired = f'''
+            SELECT id FROM {self.table_name}_snapshots
+            WHERE id > (SELECT min(id) FROM {self.table_name}_snapshots)
+                AND id NOT IN (
+                    SELECT id FROM {self.table_name}_snapshots
+                    ORDER BY id DESC LIMIT :keep
+                )
+        '''
+
+        snapshot: Optional[int] = cur.execute(snapshot_stmt, {'seq': head}).lastrowid
+        cur.execute(rows_stmt, {'snapshot': snapshot})
+        keep: dict = {'keep': self.snapshots_kept}
+        cur.execute(
+            f'DELETE FROM {self.table_name}_snapshot_rows WHERE snapshot IN ({expired});',
+            keep
+        )
+        cur.execute(
+            f'DELETE FROM {self.table_name}_snapshots WHERE id IN ({expired});', keep
+        )
+        return head
+
+    def _snapshot(self, only_if_due: bool = False) -> Optional[int]:
+        """
+        Store a snapshot of all products through the writer, like _store_snapshot(), and
+        return the sequence number of the ledger entry it is as of, or None if none was
+        stored.
+        """
+        try:
+            return self.writer.run(lambda cur: self._store_snapshot(cur, only_if_due))
+        except sqlite3.Error as error:
+            print(self._sqlite_error_msg(
+                context='taking a ledger snapshot',
+                error=error,
+                table_name=self.table_name
+            ))
+        return None
+
+    def _ledger_position(
+        self,
+        cur: sqlite3.Cursor,
+        at: Optional[float] = None,
+        seq: Optional[int] = None
+    ) -> int:
+        """
+        Return the sequence number of the ledger entry `seq` if given, otherwise of the
+        latest entry made at or before the Unix time `at`, or of the latest entry if
+        neither is given; 0 stands for the start of the ledger.
+        """
+        if seq is not None:
+            return seq
+        if at is None:
+            stmt = f'SELECT coalesce(max(seq), 0) FROM {self.table_name}_ledger;'
+            return cur.execute(stmt).fetchone()[0]
+
+        # SQL statement to find the latest entry up to the given time through the index
+        stmt = f'''
+            SELECT seq FROM {self.table_name}_ledger WHERE ts <= :at
+            ORDER BY ts DESC, seq DESC LIMIT 1;
+        '''
+        row: Optional[tuple] = cur.execute(stmt, {'at': at}).fetchone()
+        return row[0] if row is not None else 0
+
+    def _state_stmt(self, cur: sqlite3.Cursor, seq: int) -> tuple[str, dict]:
+        """
+        Return a SELECT statement and its parameters listing the `sku`, `name` and
+        `quantity` of every product as it was right after the ledger entry `seq`: the
+        latest snapshot up to that entry, updated with the ledger entries after it.
+        """
+        # SQL statement to find the latest snapshot up to the entry
+        snapshot_stmt = f'''
+            SELECT id, seq FROM {self.table_name}_snapshots WHERE seq <= :seq
+            ORDER BY seq DESC, id DESC LIMIT 1;
+        '''
+        snapshot: Optional[tuple] = cur.execute(snapshot_stmt, {'seq': seq}).fetchone()
+
+        # SQL statement to combine the products of the snapshot that did not change
+        # afterwards with the latest state of those that did
+        stmt = f'''
+            WITH tail AS (
+                SELECT sku, max(seq) AS seq FROM {self.table_name}_ledger
+                WHERE seq > :since AND seq <= :seq GROUP BY sku
+            )
+            SELECT sku, name, quantity FROM {self.table_name}_snapshot_rows
+            WHERE snapshot = :snapshot AND sku NOT IN (SELECT sku FROM tail)
+            UNION ALL
+            SELECT ledger.sku, ledger.name, ledger.quantity
+            FROM tail JOIN {self.table_name}_ledger AS ledger ON ledger.seq = tail.seq
+            WHERE ledger.op != 'delete'
+        '''
+        params: dict = {
+            'snapshot': snapshot[0] if snapshot is not None else None,
+            'since': snapshot[1] if snapshot is not None else 0,
+            'seq': seq
+        }
+        return stmt, params
+
+    def _read_through(
+        self,
+        stmt: str,
+        params: Union[Sequence, dict] = ()
+    ) -> list[sqlite3.Row]:
+        """
+        Return the rows of a SELECT statement as a list of SQLite Row objects, from the
+        cache if the table has not been written to since they were cached, otherwise by
+        executing the statement on a pooled connection. Raise sqlite3.Error if the
+        statement fails; failures are not cached.
+        The returned list may be shared with other callers and must not be modified.
+        """
+        key: tuple = (
+            stmt,
+            tuple(sorted(params.items())) if isinstance(params, dict) else tuple(params)
+        )
+        with self._version_lock:
+            version: int = self._version
+            writing: bool = self._writes_in_flight > 0
+
+        # results read while a write is committing could be outdated by the time they
+        # are cached, so only use the cache while no write is in progress
+        if not writing:
+            hit, cached = self.cache.get(key)
+            if hit:
+                return cached
+
+        with self._get_conn_cur(use_row_factory=True) as (conn, cur):
+            cur.execute(stmt, params)
+            results: list[sqlite3.Row] = cur.fetchall()
+
+        # cache the results only if no write started or committed in the meantime
+        with self._version_lock:
+            if not writing and version == self._version and not self._writes_in_flight:
+                self.cache.put(key, results)
+        return results
+
+    @property
+    def version(self) -> int:
+        """
+        The table version: a counter bumped after every write made through this object,
+        and whenever change_seq(fresh=True) finds changes made through others.
+        """
+        with self._version_lock:
+            return self._version
+
+    def instance_id(self) -> str:
+        """
+        Return the identifier of the database, chosen at random when its products table
+        was created. It is the same in every process using the database, and differs
+        from that of a database created in its place, whose change log starts over.
+        """
+        if self._instance_id is None:
+            # SQL statement to fetch the identifier; it never changes
+            stmt = f"SELECT value FROM {self.table_name}_stats WHERE key = 'instance';"
+            with self._get_conn_cur() as (conn, cur):
+                row: Optional[tuple] = cur.execute(stmt).fetchone()
+            if row is None:
+                # the table is not created yet
+                return '0'
+            self._instance_id = f'{row[0] & 0xffffffffffffffff:016x}'
+        return self._instance_id
+
+    def add_write_listener(self, listener: Callable[[], Any]) -> None:
+        """
+        Call `listener` without arguments after every write made through this object has
+        finished, whether or not it succeeded. Listeners run on the writing thread and
+        must return quickly.
+        """
+        self._write_listeners.append(listener)
 
     @staticmethod
     def _sqlite_error_msg(
@@ -62,7 +727,10 @@ class Products:
     ) -> str:
         """
         Create a helpful SQLite error message and return the message as a string.
+        The error is counted in the metrics under the part of `context` before any
+        comma or colon, which leaves out product SKUs.
         """
+        SQLITE_ERRORS.inc((re.split('[,:]', context)[0], type(error).__name__))
         additional_info: str = f'\t{extra}\n' if extra else ''
         message: str = ''.join((
             f'\n---\nSQLite\nError occurred while {context}.\n',
@@ -70,26 +738,403 @@ class Products:
         ))
         return message
 
+    def pool_stats(self) -> dict:
+        """
+        Return the connection pool's hit/miss and wait-time counters.
+        """
+        return self.pool.stats()
+
+    def cache_stats(self) -> dict:
+        """
+        Return the read cache's hit, miss, eviction and expiration counters.
+        """
+        return self.cache.stats()
+
+    def writer_stats(self) -> dict:
+        """
+        Return the write queue's job and transaction counters.
+        """
+        return self.writer.stats()
+
+    def write_behind_stats(self) -> dict:
+        """
+        Return the counters of buffered quantity updates, including how many updates were
+        merged into each written row on average, or an empty dictionary if write-behind is
+        disabled.
+        """
+        return self.quantity_buffer.stats() if self.quantity_buffer is not None else {}
+
+    @_timed
+    def flush(self) -> None:
+        """
+        Write buffered quantity updates now, if write-behind is enabled.
+        """
+        if self.quantity_buffer is None:
+            return
+
+        try:
+            self.quantity_buffer.flush()
+        except sqlite3.Error as error:
+            print(self._sqlite_error_msg(
+                context='writing buffered quantity updates',
+                error=error,
+                table_name=self.table_name
+            ))
+
+    def close(self) -> None:
+        """
+        Write buffered quantity updates, finish queued writes, and close every database
+        connection. The object must not be used afterwards.
+        """
+        if self.quantity_buffer is not None:
+            try:
+                self.quantity_buffer.close()
+            except sqlite3.Error as error:
+                print(self._sqlite_error_msg(
+                    context='writing buffered quantity updates',
+                    error=error,
+                    table_name=self.table_name
+                ))
+        self.writer.close()
+        self.pool.close()
+        if self._temp_dir is not None:
+            self._temp_dir.cleanup()
+
+    def _bulk_insert(
+        self,
+        cur: sqlite3.Cursor,
+        stmt: str,
+        data: Iterable
+    ) -> tuple[int, int]:
+        """
+        Execute an INSERT statement once for every set of parameters in `data`, add the
+        new rows to the search index, and return the numbers of rows inserted and of
+        existing rows updated by an upsert clause. Must be called on the writer.
+        New rows are indexed with a single statement afterwards rather than by a trigger:
+        FTS5 flushes its pending index data after every trigger statement, which makes
+        bulk inserts several times slower. For the same reason, an upsert must not update
+        a row inserted by the same call, which has no index entry to replace yet.
+        """
+        # new rows receive rowids larger than any existing one
+        last_rowid: int = cur.execute(
+            f'SELECT coalesce(max(rowid), 0) FROM {self.table_name};'
+        ).fetchone()[0]
+
+        # rows inserted or updated, since rows left as they are do not count
+        written: int = cur.executemany(stmt, data).rowcount
+
+        inserted: int = cur.execute(f'''
+            INSERT INTO {self.table_name}_fts(rowid, name, sku)
+            SELECT rowid, name, sku FROM {self.table_name} WHERE rowid > ?;
+        ''', (last_rowid,)).rowcount
+        return inserted, written - inserted
+
+    def _idempotency_stmts(self) -> list[str]:
+        """
+        Return the SQL statements that create the table of the keys that clients sent
+        along with writes, each with a digest of the request and the result to answer
+        retries with, and its index on the time keys were stored.
+        """
+        return [
+            f'''
+                CREATE TABLE IF NOT EXISTS {self.table_name}_idempotency (
+                    key         TEXT PRIMARY KEY NOT NULL,
+                    request     TEXT NOT NULL,
+                    result      TEXT NOT NULL,
+                    ts          REAL NOT NULL DEFAULT {SQL_NOW}
+                );
+            ''',
+            f'''
+                CREATE INDEX IF NOT EXISTS {self.table_name}_idempotency_ts
+                ON {self.table_name}_idempotency(ts);
+            '''
+        ]
+
+    @_timed
     def create_table(self) -> None:
         """
-        Create a products table that can store sku, name, and quantity for each product.
+        Create a products table that can store sku, name, and quantity for each product,
+        along with its supporting indices, counters and triggers. Safe to call on an
+        existing database, where it adds whatever is missing.
         """
-        # create a connection to the database and obtain a cursor
-        conn, cur = self._get_conn_cur()
+        # SQL statements to create the products table, an index for paging through
+        # products ordered by name, a product count kept up to date by triggers, next
+        # to a random identifier of the database, an index on quantities along with the
+        # total quantity and the number of products per quantity range, also kept up
+        # to date by triggers, a full-text search index over product names and SKUs, a
+        # change log that triggers append the SKU of every inserted, updated or deleted
+        # product to, a permanent ledger of every change along with snapshots of all
+        # products, and the idempotency keys of recent writes along with their results
+        # (see _idempotency_stmts())
+        stmts: list[str] = [
+            f'''
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    sku         TEXT PRIMARY KEY NOT NULL,
+                    name        TEXT NOT NULL,
+                    quantity    INTEGER NOT NULL DEFAULT 0 CHECK (quantity >= 0)
+                );
+            ''',
+            f'''
+                CREATE INDEX IF NOT EXISTS {self.table_name}_name_sku
+                ON {self.table_name}(name, sku);
+            ''',
+            f'''
+                CREATE TABLE IF NOT EXISTS {self.table_name}_stats (
+                    key         TEXT PRIMARY KEY NOT NULL,
+                    value       INTEGER NOT NULL DEFAULT 0
+                );
+            ''',
+            f'''
+                INSERT OR IGNORE INTO {self.table_name}_stats(key, value)
+                SELECT 'count', count(*) FROM {self.table_name};
+            ''',
+            f'''
+                INSERT OR IGNORE INTO {self.table_name}_stats(key, value)
+                VALUES ('instance', random());
+            ''',
+            f'''
+                CREATE TRIGGER IF NOT EXISTS {self.table_name}_count_insert
+                AFTER INSERT ON {self.table_name}
+                BEGIN
+                    UPDATE {self.table_name}_stats SET value = value + 1
+                    WHERE key = 'count';
+                END;
+            ''',
+            f'''
+                CREATE TRIGGER IF NOT EXISTS {self.table_name}_count_delete
+                AFTER DELETE ON {self.table_name}
+                BEGIN
+                    UPDATE {self.table_name}_stats SET value = value - 1
+                    WHERE key = 'count';
+                END;
+            ''',
+            # an index for listing products by quantity, and the total quantity and the
+            # number of products per quantity range, kept up to date by triggers
+            f'''
+                CREATE INDEX IF NOT EXISTS {self.table_name}_quantity_sku
+                ON {self.table_name}(quantity, sku);
+            ''',
+            f'''
+                INSERT OR IGNORE INTO {self.table_name}_stats(key, value)
+                SELECT 'quantity', coalesce(sum(quantity), 0) FROM {self.table_name};
+            ''',
+            f'''
+                CREATE TABLE IF NOT EXISTS {self.table_name}_histogram (
+                    bucket      INTEGER PRIMARY KEY NOT NULL,
+                    products    INTEGER NOT NULL DEFAULT 0
+                );
+            ''',
+            f'''
+                INSERT INTO {self.table_name}_histogram(bucket, products)
+                SELECT {_quantity_bucket('quantity')}, count(*) FROM {self.table_name}
+                WHERE NOT EXISTS (SELECT 1 FROM {self.table_name}_histogram)
+                GROUP BY 1;
+            ''',
+            f'''
+                CREATE TRIGGER IF NOT EXISTS {self.table_name}_aggregates_insert
+                AFTER INSERT ON {self.table_name}
+                BEGIN
+                    UPDATE {self.table_name}_stats SET value = value + new.quantity
+                    WHERE key = 'quantity';
+                    INSERT INTO {self.table_name}_histogram(bucket, products)
+                    VALUES ({_quantity_bucket('new.quantity')}, 1)
+                    ON CONFLICT(bucket) DO UPDATE SET products = products + 1;
+                END;
+            ''',
+            f'''
+                CREATE TRIGGER IF NOT EXISTS {self.table_name}_aggregates_delete
+                AFTER DELETE ON {self.table_name}
+                BEGIN
+                    UPDATE {self.table_name}_stats SET value = value - old.quantity
+                    WHERE key = 'quantity';
+                    UPDATE {self.table_name}_histogram SET products = products - 1
+                    WHERE bucket = {_quantity_bucket('old.quantity')};
+                END;
+            ''',
+            f'''
+                CREATE TRIGGER IF NOT EXISTS {self.table_name}_aggregates_update
+                AFTER UPDATE OF quantity ON {self.table_name}
+                WHEN old.quantity IS NOT new.quantity
+                BEGIN
+                    UPDATE {self.table_name}_stats
+                    SET value = value + new.quantity - old.quantity
+                    WHERE key = 'quantity';
+                    UPDATE {self.table_name}_histogram SET products = products - 1
+                    WHERE bucket = {_quantity_bucket('old.quantity')}
+                        AND bucket != {_quantity_bucket('new.quantity')};
+                    INSERT INTO {self.table_name}_histogram(bucket, products)
+                    SELECT {_quantity_bucket('new.quantity')}, 1
+                    WHERE {_quantity_bucket('old.quantity')}
+                        != {_quantity_bucket('new.quantity')}
+                    ON CONFLICT(bucket) DO UPDATE SET products = products + 1;
+                END;
+            ''',
+            f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS {self.table_name}_fts USING fts5(
+                    name, sku,
+                    content='{self.table_name}', content_rowid='rowid', prefix='2 3'
+                );
+            ''',
+            # new rows are indexed by _bulk_insert() rather than by a trigger
+            f'''
+                CREATE TRIGGER IF NOT EXISTS {self.table_name}_search_delete
+                AFTER DELETE ON {self.table_name}
+                BEGIN
+                    INSERT INTO {self.table_name}_fts(
+                        {self.table_name}_fts, rowid, name, sku
+                    )
+                    VALUES ('delete', old.rowid, old.name, old.sku);
+                END;
+            ''',
+            f'''
+                CREATE TRIGGER IF NOT EXISTS {self.table_name}_search_update
+                AFTER UPDATE OF sku, name ON {self.table_name}
+                BEGIN
+                    INSERT INTO {self.table_name}_fts(
+                        {self.table_name}_fts, rowid, name, sku
+                    )
+                    VALUES ('delete', old.rowid, old.name, old.sku);
+                    INSERT INTO {self.table_name}_fts(rowid, name, sku)
+                    VALUES (new.rowid, new.name, new.sku);
+                END;
+            ''',
+            f'''
+                CREATE TABLE IF NOT EXISTS {self.table_name}_changes (
+                    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sku         TEXT NOT NULL,
+                    op          TEXT NOT NULL CHECK (op IN ('insert', 'update', 'delete'))
+                );
+            ''',
+            f'''
+                CREATE TRIGGER IF NOT EXISTS {self.table_name}_log_insert
+                AFTER INSERT ON {self.table_name}
+                BEGIN
+                    INSERT INTO {self.table_name}_changes(sku, op)
+                    VALUES (new.sku, 'insert');
+                END;
+            ''',
+            f'''
+                CREATE TRIGGER IF NOT EXISTS {self.table_name}_log_delete
+                AFTER DELETE ON {self.table_name}
+                BEGIN
+                    INSERT INTO {self.table_name}_changes(sku, op)
+                    VALUES (old.sku, 'delete');
+                END;
+            ''',
+            # updates that leave a product as it was are not logged
+            f'''
+                CREATE TRIGGER IF NOT EXISTS {self.table_name}_log_update
+                AFTER UPDATE ON {self.table_name}
+                WHEN old.sku IS NOT new.sku OR old.name IS NOT new.name
+                    OR old.quantity IS NOT new.quantity
+                BEGIN
+                    INSERT INTO {self.table_name}_changes(sku, op)
+                    SELECT old.sku, 'delete' WHERE old.sku IS NOT new.sku;
+                    INSERT INTO {self.table_name}_changes(sku, op)
+                    VALUES (new.sku, 'update');
+                END;
+            ''',
+            # every change, with the product as it is afterwards and the change of its
+            # quantity; a deleted product has no quantity
+            f'''
+                CREATE TABLE IF NOT EXISTS {self.table_name}_ledger (
+                    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ts          REAL NOT NULL DEFAULT {SQL_NOW},
+                    sku         TEXT NOT NULL,
+                    op          TEXT NOT NULL
+                                CHECK (op IN ('insert', 'update', 'delete')),
+                    name        TEXT NOT NULL,
+                    quantity    INTEGER,
+                    delta       INTEGER NOT NULL
+                );
+            ''',
+            f'''
+                CREATE INDEX IF NOT EXISTS {self.table_name}_ledger_sku
+                ON {self.table_name}_ledger(sku, seq);
+            ''',
+            f'''
+                CREATE INDEX IF NOT EXISTS {self.table_name}_ledger_ts
+                ON {self.table_name}_ledger(ts);
+            ''',
+            f'''
+                CREATE TRIGGER IF NOT EXISTS {self.table_name}_ledger_insert
+                AFTER INSERT ON {self.table_name}
+                BEGIN
+                    INSERT INTO {self.table_name}_ledger(sku, op, name, quantity, delta)
+                    VALUES (new.sku, 'insert', new.name, new.quantity, new.quantity);
+                END;
+            ''',
+            f'''
+                CREATE TRIGGER IF NOT EXISTS {self.table_name}_ledger_delete
+                AFTER DELETE ON {self.table_name}
+                BEGIN
+                    INSERT INTO {self.table_name}_ledger(sku, op, name, quantity, delta)
+                    VALUES (old.sku, 'delete', old.name, NULL, -old.quantity);
+                END;
+            ''',
+            f'''
+                CREATE TRIGGER IF NOT EXISTS {self.table_name}_ledger_update
+                AFTER UPDATE ON {self.table_name}
+                WHEN old.sku IS NOT new.sku OR old.name IS NOT new.name
+                    OR old.quantity IS NOT new.quantity
+                BEGIN
+                    INSERT INTO {self.table_name}_ledger(sku, op, name, quantity, delta)
+                    SELECT old.sku, 'delete', old.name, NULL, -old.quantity
+                    WHERE old.sku IS NOT new.sku;
+                    INSERT INTO {self.table_name}_ledger(sku, op, name, quantity, delta)
+                    SELECT new.sku, iif(old.sku IS NOT new.sku, 'insert', 'update'),
+                        new.name, new.quantity,
+                        new.quantity - iif(old.sku IS NOT new.sku, 0, old.quantity);
+                END;
+            ''',
+            # snapshots of all products, each as of the ledger entry `seq`
+            f'''
+                CREATE TABLE IF NOT EXISTS {self.table_name}_snapshots (
+                    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                    seq         INTEGER NOT NULL,
+                    ts          REAL NOT NULL,
+                    products    INTEGER NOT NULL
+                );
+            ''',
+            f'''
+                CREATE TABLE IF NOT EXISTS {self.table_name}_snapshot_rows (
+                    snapshot    INTEGER NOT NULL,
+                    sku         TEXT NOT NULL,
+                    name        TEXT NOT NULL,
+                    quantity    INTEGER NOT NULL,
+                    PRIMARY KEY (snapshot, sku)
+                ) WITHOUT ROWID;
+            ''',
+            *self._idempotency_stmts()
+        ]
 
-        # SQL statement to create the products table
-        stmt = f'''
-            CREATE TABLE IF NOT EXISTS {self.table_name} (
-                sku         TEXT PRIMARY KEY NOT NULL,
-                name        TEXT NOT NULL,
-                quantity    INTEGER NOT NULL DEFAULT 0 CHECK (quantity >= 0)
-            );
-        '''
+        def create(cur: sqlite3.Cursor) -> None:
+            # an existing products table needs its search index built from scratch
+            search_index_exists: bool = cur.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = ?;",
+                (f'{self.table_name}_fts',)
+            ).fetchone() is not None
+            # the ledger starts from a snapshot of the products that already exist
+            ledger_exists: bool = cur.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = ?;",
+                (f'{self.table_name}_ledger',)
+            ).fetchone() is not None
+
+            for stmt in stmts:
+                cur.execute(stmt)
+
+            if not ledger_exists:
+                self._store_snapshot(cur)
+
+            if not search_index_exists:
+                cur.execute(
+                    f"INSERT INTO {self.table_name}_fts({self.table_name}_fts) "
+                    "VALUES ('rebuild');"
+                )
 
-        # attempt to execute the SQL statement
+        # queue the SQL statements on the writer and wait for them to commit
         try:
-            cur.execute(stmt)
-            conn.commit()
+            self._write(create)
         except sqlite3.Error as error:
             print(self._sqlite_error_msg(
                 context='creating table',
@@ -97,9 +1142,7 @@ class Products:
                 table_name=self.table_name
             ))
 
-        # close the database connection
-        conn.close()
-
+    @_timed
     def import_data(self, data: list[dict]) -> None:
         """
         Given a list of dictionaries, insert each dictionary as a row in the products
@@ -107,19 +1150,15 @@ class Products:
         products table.
         When a conflict occurrs, ignore the conflict and skip that row.
         """
-        # create a connection to the database and obtain a cursor
-        conn, cur = self._get_conn_cur()
-
         # SQL statement to ingest the given data into the `products` table
-        stmt = '''
-            INSERT OR IGNORE INTO products(sku, name, quantity)
+        stmt = f'''
+            INSERT OR IGNORE INTO {self.table_name}(sku, name, quantity)
             VALUES (:sku, :name, :quantity);
         '''
 
-        # attempt to execute the SQL statement
+        # queue the SQL statement on the writer and wait for it to commit
         try:
-            cur.executemany(stmt, data)
-            conn.commit()
+            self._write(lambda cur: self._bulk_insert(cur, stmt, data))
         except sqlite3.Error as error:
             print(self._sqlite_error_msg(
                 context='importing data',
@@ -127,25 +1166,94 @@ class Products:
                 table_name=self.table_name
             ))
 
-        # close the database connection
-        conn.close()
+    @_timed
+    def import_batches(
+        self,
+        batches: Iterable[Sequence[tuple]],
+        mode: str = 'ignore'
+    ) -> Iterator[dict]:
+        """
+        Insert already validated rows, given as batches of (sku, name, quantity) tuples,
+        one transaction per batch. A row whose SKU already exists is merged into the
+        existing product according to `mode`:
+            - 'ignore': the row is skipped, like import_data() does
+            - 'replace': the name and quantity are overwritten
+            - 'add-quantity': the quantity is added to the existing one
+            - 'set-quantity': the quantity is overwritten, and the name is kept
+        Products the row would leave as they are are not written to at all. After each
+        batch is committed, yield a progress dictionary:
+            {'batch': int, 'rows': int, 'inserted': int, 'updated': int,
+             'unchanged': int, 'failed': int}
+        where `failed` counts the rows of a batch that could not be imported at all.
+        """
+        assert mode in MERGE_MODES
+
+        # SQL statement to ingest the given data into the `products` table
+        stmt = f'''
+            INSERT INTO {self.table_name}(sku, name, quantity)
+            VALUES (?, ?, ?)
+            ON CONFLICT(sku) {MERGE_MODES[mode]};
+        '''
+
+        for number, batch in enumerate(batches, start=1):
+            progress: dict = {
+                'batch': number, 'rows': len(batch), 'inserted': 0, 'updated': 0,
+                'unchanged': 0, 'failed': 0
+            }
+
+            # queue the batch on the writer and wait for it to commit
+            rows: Sequence[tuple] = (
+                batch if mode == 'ignore' else self._merge_duplicates(batch, mode)
+            )
+            try:
+                inserted, updated = self._write(
+                    lambda cur: self._bulk_insert(cur, stmt, rows)
+                )
+                progress['inserted'] = inserted
+                progress['updated'] = updated
+                progress['unchanged'] = len(batch) - inserted - updated
+            except sqlite3.Error as error:
+                progress['failed'] = len(batch)
+                print(self._sqlite_error_msg(
+                    context=f'importing data, batch {number}',
+                    error=error,
+                    table_name=self.table_name
+                ))
+
+            yield progress
 
+    @staticmethod
+    def _merge_duplicates(rows: Sequence[tuple], mode: str) -> list[tuple]:
+        """
+        Combine the (sku, name, quantity) rows of a batch that share a SKU into the one
+        row that leaves the product as importing them one after another in `mode` would.
+        Rows that are merged away are counted as unchanged.
+        """
+        merged: dict[str, tuple] = {}
+        for sku, name, quantity in rows:
+            first: Optional[tuple] = merged.get(sku)
+            if first is None or mode == 'replace':
+                merged[sku] = (sku, name, quantity)
+            elif mode == 'add-quantity':
+                merged[sku] = (sku, first[1], first[2] + quantity)
+            else:
+                merged[sku] = (sku, first[1], quantity)
+        return list(merged.values())
+
+    @_timed
     def get_all(self) -> list[sqlite3.Row]:
         """
         Return all products in the products table as a list, where each product is
         represented by a SQLite Row object, and can be used as and converted to a Python
         dictionary.
         """
-        # create a connection to the database and obtain a cursor
-        conn, cur = self._get_conn_cur(use_row_factory=True)
-
         # SQL statement to fetch all products
         stmt = f'SELECT * FROM {self.table_name};'
 
-        # attempt to execute the SQL statement and fetch results
+        # attempt to fetch the results, from the cache if they are still current
+        results: list[sqlite3.Row] = []
         try:
-            cur.execute(stmt)
-            results = cur.fetchall()
+            results = self._read_through(stmt)
         except sqlite3.Error as error:
             print(self._sqlite_error_msg(
                 context='getting all products',
@@ -153,11 +1261,9 @@ class Products:
                 table_name=self.table_name
             ))
 
-        # close the database connection
-        conn.close()
-
         return results
 
+    @_timed
     def get_specific(self, skus: list) -> list[sqlite3.Row]:
         """
         Return specific products in the products table as a list, identified by their sku,
@@ -165,17 +1271,14 @@ class Products:
         Each product is represented by a SQLite Row object, and can be used as and
         converted to a Python dictionary.
         """
-        # create a connection to the database and obtain a cursor
-        conn, cur = self._get_conn_cur(use_row_factory=True)
-
         # SQL statement to fetch specific products identified by the given skus
         placeholders = ','.join('?' * len(skus))  # pre-set correct number of placeholders
         stmt = f'SELECT * FROM {self.table_name} WHERE sku IN ({placeholders});'
 
-        # attempt to execute the SQL statement and fetch results
+        # attempt to fetch the results, from the cache if they are still current
+        results: list[sqlite3.Row] = []
         try:
-            cur.execute(stmt, skus)
-            results = cur.fetchall()
+            results = self._read_through(stmt, params=skus)
         except sqlite3.Error as error:
             print(self._sqlite_error_msg(
                 context='getting specific products',
@@ -184,29 +1287,587 @@ class Products:
                 extra=f'Requested products: {skus}'
             ))
 
-        # close the database connection
-        conn.close()
+        return results
+
+    @_timed
+    def get_page(
+        self,
+        after_sku: Optional[str] = None,
+        limit: int = 100,
+        sort: str = 'sku',
+        after_name: Optional[str] = None
+    ) -> list[sqlite3.Row]:
+        """
+        Return up to `limit` products that come after the product `after_sku`, ordered by
+        `sort`, which is either 'sku' or 'name' (ties between names are broken by sku).
+        If `after_sku` is None, return the first page.
+        Uses keyset pagination on an index, so every page costs the same no matter how
+        deep into the table it is. When sorting by name, `after_name` should be the name
+        of the `after_sku` product as the client last saw it; if it is not given, the
+        product's current name is looked up.
+        Each product is represented by a SQLite Row object.
+        """
+        assert sort in {'sku', 'name'}
+        assert limit >= 1
+
+        # SQL statement to fetch the page of products following the given cursor
+        params: dict = {'after_sku': after_sku, 'after_name': after_name, 'limit': limit}
+        where: str = ''
+        if after_sku is not None and sort == 'sku':
+            where = 'WHERE sku > :after_sku'
+        elif after_sku is not None and after_name is not None:
+            where = 'WHERE (name, sku) > (:after_name, :after_sku)'
+        elif after_sku is not None:
+            where = f'''
+                WHERE (name, sku) > (
+                    SELECT name, sku FROM {self.table_name} WHERE sku = :after_sku
+                )
+            '''
+        order: str = 'sku' if sort == 'sku' else 'name, sku'
+        stmt = f'SELECT * FROM {self.table_name} {where} ORDER BY {order} LIMIT :limit;'
+
+        # attempt to fetch the results, from the cache if they are still current
+        results: list[sqlite3.Row] = []
+        try:
+            results = self._read_through(stmt, params=params)
+        except sqlite3.Error as error:
+            print(self._sqlite_error_msg(
+                context='getting a page of products',
+                error=error,
+                table_name=self.table_name,
+                extra=f'After product: {after_sku}, sorted by: {sort}'
+            ))
+
+        return results
+
+    @_timed
+    def count(self) -> int:
+        """
+        Return the number of products in the products table. The count is maintained by
+        triggers on every insert and delete, so no table scan is needed.
+        """
+        # SQL statement to fetch the maintained product count
+        stmt = f"SELECT value FROM {self.table_name}_stats WHERE key = 'count';"
+
+        # attempt to fetch the result, from the cache if it is still current
+        result: int = 0
+        try:
+            rows: list[sqlite3.Row] = self._read_through(stmt)
+            result = rows[0]['value'] if rows else 0
+        except sqlite3.Error as error:
+            print(self._sqlite_error_msg(
+                context='counting products',
+                error=error,
+                table_name=self.table_name
+            ))
+
+        return result
+
+    @_timed
+    def low_stock(self, threshold: int, limit: int = 100) -> list[sqlite3.Row]:
+        """
+        Return up to `limit` products whose quantity is below `threshold`, lowest
+        quantity first, then by SKU, as SQLite Row objects. The products are read in
+        order from the quantity index, so the cost grows with `limit`, not with the
+        number of products.
+        """
+        assert limit >= 1
+
+        # SQL statement to fetch the products below the threshold, lowest first
+        stmt = f'''
+            SELECT * FROM {self.table_name} WHERE quantity < ?
+            ORDER BY quantity, sku LIMIT ?;
+        '''
+
+        # attempt to fetch the results, from the cache if they are still current
+        results: list[sqlite3.Row] = []
+        try:
+            results = self._read_through(stmt, params=(threshold, limit))
+        except sqlite3.Error as error:
+            print(self._sqlite_error_msg(
+                context='getting low-stock products',
+                error=error,
+                table_name=self.table_name,
+                extra=f'Threshold: {threshold}'
+            ))
+
+        return results
+
+    @_timed
+    def total_quantity(self) -> int:
+        """
+        Return the total number of units of all products. The total is maintained by
+        triggers on every insert, update and delete, so no table scan is needed.
+        """
+        # SQL statement to fetch the maintained total quantity
+        stmt = f"SELECT value FROM {self.table_name}_stats WHERE key = 'quantity';"
+
+        # attempt to fetch the result, from the cache if it is still current
+        result: int = 0
+        try:
+            rows: list[sqlite3.Row] = self._read_through(stmt)
+            result = rows[0]['value'] if rows else 0
+        except sqlite3.Error as error:
+            print(self._sqlite_error_msg(
+                context='adding up quantities',
+                error=error,
+                table_name=self.table_name
+            ))
+
+        return result
+
+    @_timed
+    def quantity_histogram(self) -> list[dict]:
+        """
+        Return the number of products in each quantity range of QUANTITY_BUCKETS, as a
+        list of dictionaries, in increasing order:
+            {'min': int, 'max': int | None, 'products': int}
+        `max` is the largest quantity in the range, or None for the last one. The counts
+        are maintained by triggers, so no table scan is needed.
+        """
+        # SQL statement to fetch the maintained number of products per range
+        stmt = f'SELECT bucket, products FROM {self.table_name}_histogram;'
+
+        # attempt to fetch the results, from the cache if they are still current
+        counts: dict[int, int] = {}
+        try:
+            counts = {row['bucket']: row['products'] for row in self._read_through(stmt)}
+        except sqlite3.Error as error:
+            print(self._sqlite_error_msg(
+                context='getting the quantity histogram',
+                error=error,
+                table_name=self.table_name
+            ))
+
+        uppers: tuple = QUANTITY_BUCKETS[1:] + (None,)
+        return [
+            {
+                'min': lower,
+                'max': upper - 1 if upper is not None else None,
+                'products': counts.get(lower, 0)
+            }
+            for lower, upper in zip(QUANTITY_BUCKETS, uppers)
+        ]
+
+    @_timed
+    def search(self, query: str, limit: int = 50) -> list[sqlite3.Row]:
+        """
+        Return up to `limit` products whose name or SKU contain words starting with every
+        word in `query`, best matches first. Matches on SKUs rank above matches on names.
+        Each product is represented by a SQLite Row object.
+        """
+        # turn the words of the query into quoted prefix terms, so that user input is
+        # never interpreted as FTS5 query syntax
+        terms: list[str] = re.findall(r'\w+', query)
+        if not terms:
+            return []
+        match: str = ' '.join(f'"{term}"*' for term in terms)
+
+        # SQL statement to fetch the best matching products using the search index
+        stmt = f'''
+            SELECT {self.table_name}.* FROM {self.table_name}_fts
+            JOIN {self.table_name}
+                ON {self.table_name}.rowid = {self.table_name}_fts.rowid
+            WHERE {self.table_name}_fts MATCH :match
+            ORDER BY bm25({self.table_name}_fts, 1.0, 2.0)
+            LIMIT :limit;
+        '''
+
+        # borrow a connection to the database and attempt to execute the SQL statement
+        # and fetch results
+        results: list[sqlite3.Row] = []
+        with self._get_conn_cur(use_row_factory=True) as (conn, cur):
+            try:
+                cur.execute(stmt, {'match': match, 'limit': limit})
+                results = cur.fetchall()
+            except sqlite3.Error as error:
+                print(self._sqlite_error_msg(
+                    context='searching products',
+                    error=error,
+                    table_name=self.table_name,
+                    extra=f'Search query: {query}'
+                ))
 
         return results
 
-    def add_product(self, sku: str, name: str, quantity: int = 0) -> None:
+    @_timed
+    def change_seq(self, fresh: bool = False) -> int:
+        """
+        Return the sequence number of the latest entry in the change log, or 0 if no
+        product has been changed yet.
+        If `fresh`, read it from the database rather than from the cache, so that changes
+        made by other processes are seen right away; finding any also drops the cached
+        results and bumps the table version, so reads that follow are at least as new.
+        """
+        # SQL statement to fetch the latest change log sequence number
+        stmt = f'SELECT coalesce(max(seq), 0) AS seq FROM {self.table_name}_changes;'
+
+        # attempt to fetch the result, from the cache if it is still current
+        result: int = 0
+        try:
+            if not fresh:
+                result = self._read_through(stmt)[0]['seq']
+            else:
+                with self._get_conn_cur() as (conn, cur):
+                    result = cur.execute(stmt).fetchone()[0]
+                with self._version_lock:
+                    if result != self._change_head:
+                        self._change_head = result
+                        self._version += 1
+                        self.cache.clear()
+        except sqlite3.Error as error:
+            print(self._sqlite_error_msg(
+                context='getting the latest change',
+                error=error,
+                table_name=self.table_name
+            ))
+
+        return result
+
+    @_timed
+    def get_changes(self, since: int, limit: int = 500) -> dict:
+        """
+        Return the products that changed after the change log entry `since`, as a
+        dictionary:
+            {'seq': int, 'reset': bool, 'changes': list[sqlite3.Row]}
+        `seq` is the latest entry included. Each change is a Row with the columns `seq`,
+        `sku`, `op`, `name` and `quantity`: `op` is the kind of the product's latest
+        change ('insert', 'update' or 'delete'), and the other columns hold the product
+        as it is now; `name` and `quantity` are None if the product was deleted. Every
+        product appears at most once, in the order of its latest change.
+        `reset` is True, and `changes` empty, when the changes cannot be listed
+        completely: there are more than `limit` of them, or the log no longer reaches
+        back to `since`. The caller should then reload everything it holds.
+        """
+        assert limit >= 1
+
+        # SQL statements to fetch the bounds of the change log, and the latest state of
+        # every product changed since the given entry
+        bounds_stmt = f'''
+            SELECT coalesce(min(seq), 1) AS first, coalesce(max(seq), 0) AS last
+            FROM {self.table_name}_changes;
+        '''
+        changes_stmt = f'''
+            WITH latest AS (
+                SELECT sku, max(seq) AS seq, op FROM {self.table_name}_changes
+                WHERE seq > :since GROUP BY sku
+            )
+            SELECT latest.seq, latest.sku, latest.op, {self.table_name}.name,
+                {self.table_name}.quantity
+            FROM latest LEFT JOIN {self.table_name} ON {self.table_name}.sku = latest.sku
+            ORDER BY latest.seq
+            LIMIT :limit;
+        '''
+
+        # borrow a connection to the database and read both from one snapshot
+        feed: dict = {'seq': since, 'reset': True, 'changes': []}
+        with self._get_conn_cur(use_row_factory=True) as (conn, cur):
+            try:
+                cur.execute('BEGIN;')
+                bounds: sqlite3.Row = cur.execute(bounds_stmt).fetchone()
+                changes: list[sqlite3.Row] = cur.execute(
+                    changes_stmt, {'since': since, 'limit': limit + 1}
+                ).fetchall()
+                cur.execute('COMMIT;')
+
+                feed['seq'] = bounds['last']
+                # entries after `since` were pruned, or `since` comes from another log
+                if bounds['first'] <= since + 1 and since <= bounds['last']:
+                    if len(changes) <= limit:
+                        feed['reset'] = False
+                        feed['changes'] = changes
+            except sqlite3.Error as error:
+                print(self._sqlite_error_msg(
+                    context='getting changed products',
+                    error=error,
+                    table_name=self.table_name,
+                    extra=f'Changes since: {since}'
+                ))
+
+        return feed
+
+    @_timed
+    def history(
+        self,
+        sku: str,
+        limit: int = 100,
+        before: Optional[int] = None
+    ) -> list[sqlite3.Row]:
+        """
+        Return the ledger entries of the product identified by `sku`, newest first, up to
+        `limit` of them, and only those before the entry `before` if given, to page
+        through a long history. Each entry is a Row with the columns `seq`, `ts` (Unix
+        time), `op` ('insert', 'update' or 'delete'), `name` and `quantity` (the product
+        right after the change; `quantity` is None once deleted) and `delta` (the change
+        of its quantity).
+        """
+        assert limit >= 1
+
+        # SQL statement to fetch the product's latest entries through the ledger index
+        stmt = f'''
+            SELECT seq, ts, op, name, quantity, delta FROM {self.table_name}_ledger
+            WHERE sku = :sku AND seq < :before
+            ORDER BY seq DESC
+            LIMIT :limit;
+        '''
+        params: dict = {
+            'sku': sku,
+            'before': before if before is not None else 2 ** 63 - 1,
+            'limit': limit
+        }
+
+        # attempt to fetch the results, from the cache if they are still current
+        results: list[sqlite3.Row] = []
+        try:
+            results = self._read_through(stmt, params)
+        except sqlite3.Error as error:
+            print(self._sqlite_error_msg(
+                context='getting product history',
+                error=error,
+                table_name=self.table_name,
+                extra=f'Requested product: {sku}'
+            ))
+
+        return results
+
+    @_timed
+    def product_at(
+        self,
+        sku: str,
+        at: Optional[float] = None,
+        seq: Optional[int] = None
+    ) -> Optional[sqlite3.Row]:
+        """
+        Return the product identified by `sku` as it was at the Unix time `at`, or right
+        after the ledger entry `seq`, as a Row with the columns `sku`, `name` and
+        `quantity`; None if it did not exist then. Without `at` and `seq`, return the
+        product as it is now according to the ledger.
+        Only the product's latest entry up to that point is read, or the snapshot the
+        ledger started from if the product has no such entry.
+        """
+        # SQL statements to fetch the product's latest entry up to the point, or the
+        # product in the latest snapshot up to the point; deletions have no quantity
+        entry_stmt = f'''
+            SELECT sku, name, quantity FROM {self.table_name}_ledger
+            WHERE sku = :sku AND seq <= :seq
+            ORDER BY seq DESC
+            LIMIT 1;
+        '''
+        snapshot_stmt = f'''
+            SELECT sku, name, quantity FROM {self.table_name}_snapshot_rows
+            WHERE sku = :sku AND snapshot = (
+                SELECT id FROM {self.table_name}_snapshots WHERE seq <= :seq
+                ORDER BY seq DESC, id DESC LIMIT 1
+            );
+        '''
+
+        # borrow a connection to the database and read everything from one snapshot
+        result: Optional[sqlite3.Row] = None
+        with self._get_conn_cur(use_row_factory=True) as (conn, cur):
+            try:
+                cur.execute('BEGIN;')
+                params: dict = {'sku': sku, 'seq': self._ledger_position(cur, at, seq)}
+                entry: Optional[sqlite3.Row] = cur.execute(entry_stmt, params).fetchone()
+                if entry is None:
+                    result = cur.execute(snapshot_stmt, params).fetchone()
+                elif entry['quantity'] is not None:
+                    result = entry
+                cur.execute('COMMIT;')
+            except sqlite3.Error as error:
+                if conn.in_transaction:
+                    conn.rollback()
+                print(self._sqlite_error_msg(
+                    context='getting a product at a point in time',
+                    error=error,
+                    table_name=self.table_name,
+                    extra=f'Requested product: {sku}, at: {at}, seq: {seq}'
+                ))
+
+        return result
+
+    @_timed
+    def products_at(
+        self,
+        at: Optional[float] = None,
+        seq: Optional[int] = None
+    ) -> list[sqlite3.Row]:
+        """
+        Return all products as they were at the Unix time `at`, or right after the
+        ledger entry `seq`, as Row objects with the columns `sku`, `name` and
+        `quantity`, ordered by SKU. Without `at` and `seq`, return the products as they
+        are now according to the ledger.
+        The products are read from the latest snapshot up to that point and the ledger
+        entries after it, so the work is bounded by the size of the inventory and the
+        snapshot interval, not by the length of the ledger.
+        """
+        # borrow a connection to the database and read everything from one snapshot
+        results: list[sqlite3.Row] = []
+        with self._get_conn_cur(use_row_factory=True) as (conn, cur):
+            try:
+                cur.execute('BEGIN;')
+                stmt, params = self._state_stmt(cur, self._ledger_position(cur, at, seq))
+                results = cur.execute(stmt + ' ORDER BY sku;', params).fetchall()
+                cur.execute('COMMIT;')
+            except sqlite3.Error as error:
+                if conn.in_transaction:
+                    conn.rollback()
+                print(self._sqlite_error_msg(
+                    context='getting products at a point in time',
+                    error=error,
+                    table_name=self.table_name,
+                    extra=f'At: {at}, seq: {seq}'
+                ))
+
+        return results
+
+    @_timed
+    def take_snapshot(self) -> Optional[int]:
+        """
+        Store a snapshot of all products now, rather than waiting for the next automatic
+        one, and return the sequence number of the latest ledger entry it includes; None
+        if it failed.
+        """
+        return self._snapshot()
+
+    @_timed
+    def rebuild(self, seq: Optional[int] = None) -> dict:
+        """
+        Bring the products table back to its state right after the ledger entry `seq`,
+        or by default to the latest state recorded in the ledger, which recovers it from
+        the latest snapshot and the entries after it. Only the products that differ are
+        written, and those changes are themselves recorded in the ledger.
+        Return a dictionary:
+            {'committed': bool, 'seq': int, 'inserted': int, 'updated': int,
+             'deleted': int}
+        where `seq` is the ledger entry the table was brought back to.
+        """
+        assert seq is None or seq >= 0
+        report: dict = {
+            'committed': False, 'seq': seq, 'inserted': 0, 'updated': 0, 'deleted': 0
+        }
+
+        # SQL statements to collect the target state in a temporary table, to delete the
+        # products missing from it, to list the products that differ from it, and to
+        # insert or overwrite them
+        create_stmt = f'''
+            CREATE TEMP TABLE {self.table_name}_rebuild (
+                sku         TEXT PRIMARY KEY NOT NULL,
+                name        TEXT NOT NULL,
+                quantity    INTEGER NOT NULL
+            );
+        '''
+        delete_stmt = f'''
+            DELETE FROM {self.table_name}
+            WHERE sku NOT IN (SELECT sku FROM temp.{self.table_name}_rebuild);
+        '''
+        differ_stmt = f'''
+            SELECT target.sku, target.name, target.quantity
+            FROM temp.{self.table_name}_rebuild AS target
+            LEFT JOIN {self.table_name} AS current ON current.sku = target.sku
+            WHERE current.sku IS NULL OR current.name IS NOT target.name
+                OR current.quantity IS NOT target.quantity;
+        '''
+        upsert_stmt = f'''
+            INSERT INTO {self.table_name}(sku, name, quantity) VALUES (?, ?, ?)
+            ON CONFLICT(sku) {MERGE_MODES['replace']};
+        '''
+
+        def restore(cur: sqlite3.Cursor) -> None:
+            report['seq'] = self._ledger_position(cur, seq=seq)
+            stmt, params = self._state_stmt(cur, report['seq'])
+            cur.execute(f'DROP TABLE IF EXISTS temp.{self.table_name}_rebuild;')
+            cur.execute(create_stmt)
+            try:
+                cur.execute(
+                    f'INSERT INTO temp.{self.table_name}_rebuild(sku, name, quantity) '
+                    f'{stmt};',
+                    params
+                )
+                report['deleted'] = cur.execute(delete_stmt).rowcount
+                rows: list = cur.execute(differ_stmt).fetchall()
+                report['inserted'], report['updated'] = self._bulk_insert(
+                    cur, upsert_stmt, rows
+                )
+            finally:
+                cur.execute(f'DROP TABLE temp.{self.table_name}_rebuild;')
+
+        # queue the rebuild on the writer and wait for it to commit
+        try:
+            self._write(restore)
+            report['committed'] = True
+        except sqlite3.Error as error:
+            print(self._sqlite_error_msg(
+                context='rebuilding products from the ledger',
+                error=error,
+                table_name=self.table_name,
+                extra=f'Ledger entry: {seq}'
+            ))
+
+        return report
+
+    @_timed
+    def iter_products(
+        self,
+        skus: Optional[list] = None,
+        chunk_size: int = 1000
+    ) -> Iterator[sqlite3.Row]:
+        """
+        Lazily yield the products identified by `skus`, or all products if `skus` is None,
+        as SQLite Row objects. Rows are fetched from the database cursor `chunk_size` at a
+        time, so memory use does not grow with the size of the table.
+        The pooled connection is held until the generator is exhausted or closed.
+        """
+        # SQL statement to fetch all products, or specific products identified by the skus
+        stmt = f'SELECT * FROM {self.table_name}'
+        params: list = []
+        if skus is not None:
+            placeholders = ','.join('?' * len(skus))  # pre-set number of placeholders
+            stmt += f' WHERE sku IN ({placeholders})'
+            params = skus
+
+        # borrow a connection to the database and attempt to execute the SQL statement,
+        # then fetch and yield results one chunk at a time
+        with self._get_conn_cur(use_row_factory=True) as (conn, cur):
+            try:
+                cur.execute(stmt + ';', params)
+                while chunk := cur.fetchmany(chunk_size):
+                    yield from chunk
+            except sqlite3.Error as error:
+                print(self._sqlite_error_msg(
+                    context='iterating over products',
+                    error=error,
+                    table_name=self.table_name,
+                    extra=f'Requested products: {skus}'
+                ))
+
+    @_timed
+    def add_product(
+        self,
+        sku: str,
+        name: str,
+        quantity: int = 0,
+        idempotency_key: Optional[str] = None
+    ) -> None:
         """
         Add a new product with a unique SKU, name, and a given quantity.
         If quantity is not specified, default to 0.
+        If `idempotency_key` was already sent with the same product, do nothing.
         """
-        # create a connection to the database and obtain a cursor
-        conn, cur = self._get_conn_cur()
-
         # SQL statement to add a new product into the `products` table
-        stmt = '''
-            INSERT INTO products(sku, name, quantity)
+        stmt = f'''
+            INSERT INTO {self.table_name}(sku, name, quantity)
             VALUES (:sku, :name, :quantity);
         '''
 
-        # attempt to execute the SQL statement
+        # queue the SQL statement on the writer and wait for it to commit
         try:
-            cur.execute(stmt, {'sku': sku, 'name': name, 'quantity': quantity})
-            conn.commit()
+            self._write_once(
+                lambda cur: self._bulk_insert(
+                    cur, stmt, [{'sku': sku, 'name': name, 'quantity': quantity}]
+                ),
+                key=idempotency_key,
+                request=['add_product', sku, name, quantity]
+            )
         except sqlite3.Error as error:
             print(self._sqlite_error_msg(
                 context=f'adding new product, sku: {sku}',
@@ -214,26 +1875,29 @@ class Products:
                 table_name=self.table_name
             ))
 
-        # close the database connection
-        conn.close()
-
-    def delete_products(self, skus: list[str]) -> None:
+    @_timed
+    def delete_products(
+        self,
+        skus: list[str],
+        idempotency_key: Optional[str] = None
+    ) -> None:
         """
         Delete products given by the skus parameter in the products table.
+        If `idempotency_key` was already sent with the same SKUs, do nothing.
         """
         assert skus != []
 
-        # create a connection to the database and obtain a cursor
-        conn, cur = self._get_conn_cur()
-
         # SQL statement to delete specific products identified by the given skus
         placeholders = ','.join('?' * len(skus))  # pre-set correct number of placeholders
         stmt = f'DELETE FROM {self.table_name} WHERE sku IN ({placeholders});'
 
-        # attempt to execute the SQL statement and fetch results
+        # queue the SQL statement on the writer and wait for it to commit
         try:
-            cur.execute(stmt, skus)
-            conn.commit()
+            self._write_once(
+                lambda cur: cur.execute(stmt, skus),
+                key=idempotency_key,
+                request=['delete_products', skus]
+            )
         except sqlite3.Error as error:
             print(self._sqlite_error_msg(
                 context='deleting specific products',
@@ -242,23 +1906,27 @@ class Products:
                 extra=f'Attempted to delete products: {skus}'
             ))
 
-        # close the database connection
-        conn.close()
-
-    def change_name(self, sku: str, new_name: str) -> None:
+    @_timed
+    def change_name(
+        self,
+        sku: str,
+        new_name: str,
+        idempotency_key: Optional[str] = None
+    ) -> None:
         """
         Change the name of the product identified by `sku` to the `new_name`.
+        If `idempotency_key` was already sent with the same change, do nothing.
         """
-        # create a connection to the database and obtain a cursor
-        conn, cur = self._get_conn_cur()
-
         # SQL statement to update the specified product with a new name
         stmt = f'UPDATE {self.table_name} SET name = :new_name WHERE sku = :sku;'
 
-        # attempt to execute the SQL statement and fetch results
+        # queue the SQL statement on the writer and wait for it to commit
         try:
-            cur.execute(stmt, {'new_name': new_name, 'sku': sku})
-            conn.commit()
+            self._write_once(
+                lambda cur: cur.execute(stmt, {'new_name': new_name, 'sku': sku}),
+                key=idempotency_key,
+                request=['change_name', sku, new_name]
+            )
         except sqlite3.Error as error:
             print(self._sqlite_error_msg(
                 context=f'changing product name for sku: {sku}',
@@ -267,25 +1935,30 @@ class Products:
                 extra=f'Given new name: {new_name}'
             ))
 
-        # close the database connection
-        conn.close()
-
-    def update_quantity(self, sku: str, operation: str, count: int) -> None:
+    @_timed
+    def update_quantity(
+        self,
+        sku: str,
+        operation: str,
+        count: int,
+        idempotency_key: Optional[str] = None
+    ) -> None:
         """
         Update the quantity of the product identified by `sku` by either adding,
         subtracting, or setting the quantity to the given `count`.
+        If `idempotency_key` was already sent with the same update, do nothing. Updates
+        with a key are written right away, even with write-behind enabled, since the key
+        is stored in the same transaction.
         """
         assert operation in {'add', 'subtract', 'set'}
         assert count >= 0
 
-        # create a connection to the database and obtain a cursor
-        conn, cur = self._get_conn_cur()
-
         if operation == 'set':
             # SQL statement to set the specified product's quantity to the given count
             stmt = f'UPDATE {self.table_name} SET quantity = :qty WHERE sku = :sku;'
         elif operation == 'add':
-            # SQL statement to increase the specified product's quantity by the given count
+            # SQL statement to increase the specified product's quantity by the given
+            # count
             stmt = f'UPDATE {self.table_name} ' +\
                 'SET quantity = quantity + :qty WHERE sku = :sku;'
         else:
@@ -295,10 +1968,17 @@ class Products:
             stmt = f'UPDATE {self.table_name} ' +\
                 'SET quantity = max(0, quantity - :qty) WHERE sku = :sku;'
 
-        # attempt to execute the SQL statement and fetch results
+        # queue the SQL statement on the writer and wait for it to commit, or leave the
+        # update to the write-behind buffer
         try:
-            cur.execute(stmt, {'qty': count, 'sku': sku})
-            conn.commit()
+            if self.quantity_buffer is not None and idempotency_key is None:
+                self.quantity_buffer.update(sku, operation, count)
+            else:
+                self._write_once(
+                    lambda cur: cur.execute(stmt, {'qty': count, 'sku': sku}),
+                    key=idempotency_key,
+                    request=['update_quantity', sku, operation, count]
+                )
         except sqlite3.Error as error:
             print(self._sqlite_error_msg(
                 context=f'updating product quantity ({operation}) for sku: {sku}',
@@ -307,5 +1987,245 @@ class Products:
                 extra=f'SQL statement: {stmt}'
             ))
 
-        # close the database connection
-        conn.close()
+    def _flush_quantities(self, pending: dict[str, QuantityChange]) -> None:
+        """
+        Write the quantity changes buffered by the write-behind buffer in one transaction.
+        Raise sqlite3.Error if the write fails.
+        """
+        # SQL statement to apply a buffered change: set a new quantity, or add a delta
+        # without going below the floor left by subtractions
+        stmt = f'''
+            UPDATE {self.table_name}
+            SET quantity = coalesce(:value, max(:floor, quantity + :delta))
+            WHERE sku = :sku;
+        '''
+        params: list[dict] = [
+            {'sku': sku, 'value': value, 'floor': floor, 'delta': delta}
+            for sku, (value, floor, delta) in pending.items()
+        ]
+
+        # queue the SQL statement on the writer and wait for it to commit
+        self._write(lambda cur: cur.executemany(stmt, params), flush_pending=False)
+
+    @staticmethod
+    def _check_batch_op(op: Any) -> tuple[Optional[dict], str]:
+        """
+        Validate one operation given to apply_batch(). Return the operation's parameters
+        for its SQL statement and an empty string if it is valid, otherwise None and the
+        reason it is not.
+        """
+        if not isinstance(op, dict) or op.get('op') not in BATCH_OPS:
+            return None, f"`op` must be one of {', '.join(BATCH_OPS)}"
+        if not isinstance(op.get('sku'), str):
+            return None, '`sku` must be a string'
+
+        params: dict = {'sku': op['sku']}
+        field: Optional[str] = BATCH_OPS[op['op']]
+        if field == 'count':
+            try:
+                params['count'] = int(op['count'])
+            except (KeyError, TypeError, ValueError):
+                return None, '`count` must be an integer'
+            if params['count'] < 0:
+                return None, '`count` must be >= 0'
+        elif field == 'name':
+            if not isinstance(op.get('name'), str):
+                return None, '`name` must be a string'
+            params['name'] = op['name']
+        return params, ''
+
+    @_timed
+    def apply_batch(
+        self,
+        ops: list[dict],
+        atomic: bool = False,
+        idempotency_key: Optional[str] = None
+    ) -> dict:
+        """
+        Apply a list of operations to products in a single transaction, and return a
+        report of the outcome of each one. Every operation is a dictionary with an `op`
+        and the `sku` of the product it applies to:
+            {'op': 'add' | 'subtract' | 'set', 'sku': str, 'count': int}
+            {'op': 'rename', 'sku': str, 'name': str}
+            {'op': 'delete', 'sku': str}
+        Operations run in the given order; consecutive operations of the same kind are
+        executed together with executemany(). Subtracting never takes a quantity below 0.
+        By default, operations that are invalid or fail are reported and the rest are
+        still applied. If `atomic` is set, the whole batch is rolled back instead when any
+        operation is invalid or fails.
+        Return a dictionary:
+            {'committed': bool, 'applied': int, 'not_found': int, 'failed': int,
+             'results': [{'index': int, 'status': str, 'error': str}, ...]}
+        where the status of an operation is 'ok', 'not_found' (no product has its SKU),
+        'invalid', 'failed', or 'rolled_back' (it was valid, but its atomic batch was not
+        committed). `error` is only given for invalid and failed operations.
+        If `idempotency_key` was already sent with the same batch, and that batch was
+        committed, return its report again instead of applying the batch twice.
+        """
+        # SQL statements for each kind of operation
+        stmts: dict[str, str] = {
+            'add': f'UPDATE {self.table_name} '
+                   'SET quantity = quantity + :count WHERE sku = :sku;',
+            'subtract': f'UPDATE {self.table_name} '
+                        'SET quantity = max(0, quantity - :count) WHERE sku = :sku;',
+            'set': f'UPDATE {self.table_name} SET quantity = :count WHERE sku = :sku;',
+            'rename': f'UPDATE {self.table_name} SET name = :name WHERE sku = :sku;',
+            'delete': f'DELETE FROM {self.table_name} WHERE sku = :sku;'
+        }
+        exists_stmt = f'''
+            SELECT sku FROM {self.table_name}
+            WHERE sku IN (SELECT value FROM json_each(:skus));
+        '''
+
+        # validate every operation before touching the database
+        results: list[dict] = [
+            {'index': index, 'status': 'ok'} for index in range(len(ops))
+        ]
+        valid: list[tuple[int, str, dict]] = []
+        for index, op in enumerate(ops):
+            params, reason = self._check_batch_op(op)
+            if params is None:
+                results[index].update({'status': 'invalid', 'error': reason})
+            else:
+                valid.append((index, op['op'], params))
+
+        def fail(index: int, error: Exception) -> None:
+            results[index].update({'status': 'failed', 'error': str(error)})
+
+        def report(committed: bool) -> dict:
+            statuses: list[str] = [result['status'] for result in results]
+            return {
+                'committed': committed,
+                'applied': statuses.count('ok'),
+                'not_found': statuses.count('not_found'),
+                'failed': statuses.count('invalid') + statuses.count('failed'),
+                'results': results
+            }
+
+        def apply(cur: sqlite3.Cursor) -> None:
+            # look up which products exist once, then follow the deletions of the batch
+            skus: str = json.dumps(sorted({params['sku'] for _, _, params in valid}))
+            existing: set[str] = {
+                row[0] for row in cur.execute(exists_stmt, {'skus': skus})
+            }
+
+            for kind, group in groupby(valid, key=lambda item: item[1]):
+                run: list[tuple[int, dict]] = []
+                for index, _, params in group:
+                    if params['sku'] not in existing:
+                        results[index]['status'] = 'not_found'
+                        continue
+                    run.append((index, params))
+                    if kind == 'delete':
+                        existing.discard(params['sku'])
+
+                # run the whole group at once; if that fails, run its operations one by
+                # one to find out which of them failed
+                cur.execute('SAVEPOINT batch_run;')
+                try:
+                    cur.executemany(stmts[kind], [params for _, params in run])
+                    cur.execute('RELEASE batch_run;')
+                    continue
+                except sqlite3.Error:
+                    cur.execute('ROLLBACK TO batch_run;')
+                    cur.execute('RELEASE batch_run;')
+
+                for index, params in run:
+                    cur.execute('SAVEPOINT batch_op;')
+                    try:
+                        cur.execute(stmts[kind], params)
+                        cur.execute('RELEASE batch_op;')
+                    except sqlite3.Error as error:
+                        cur.execute('ROLLBACK TO batch_op;')
+                        cur.execute('RELEASE batch_op;')
+                        fail(index, error)
+                        if kind == 'delete':
+                            existing.add(params['sku'])
+
+            if atomic and any(result['status'] == 'failed' for result in results):
+                raise _BatchRejected()
+
+        # queue the batch on the writer and wait for it to commit; an atomic batch with
+        # invalid operations is not run at all
+        committed: bool = not (atomic and len(valid) < len(ops))
+        try:
+            if committed and valid:
+                replayed, stored = self._write_once(
+                    apply,
+                    key=idempotency_key,
+                    request=['apply_batch', ops, atomic],
+                    result=lambda: report(committed=True)
+                )
+                if replayed:
+                    return stored
+        except _BatchRejected:
+            committed = False
+        except sqlite3.Error as error:
+            committed = False
+            for index, _, _ in valid:
+                fail(index, error)
+            print(self._sqlite_error_msg(
+                context='applying a batch of operations',
+                error=error,
+                table_name=self.table_name,
+                extra=f'Number of operations: {len(ops)}'
+            ))
+
+        if not committed:
+            for result in results:
+                if result['status'] in {'ok', 'not_found'}:
+                    result['status'] = 'rolled_back'
+
+        return report(committed)
+
+    @_timed
+    def recall(self, key: str, request: Any) -> Any:
+        """
+        Return the result stored by remember() under the idempotency `key`, or None if the
+        key is free or expired. `request` is a JSON-serializable description of the
+        request sent with the key.
+        Raise IdempotencyKeyReused if the key was taken by a different request.
+        """
+        # read the key from a pooled connection
+        with self._get_conn_cur() as (conn, cur):
+            stored: Optional[str] = self._recall(cur, key, self._fingerprint(request))
+        return None if stored is None else json.loads(stored)
+
+    @_timed
+    def remember(self, key: str, request: Any, result: Any, replace: bool = False) -> Any:
+        """
+        Store `result`, which must be JSON-serializable and not None, under the
+        idempotency `key` of a request that is not a single write, such as an import,
+        unless the key was taken in the meantime. Return the result stored under the key.
+        If `replace`, store `result` even if the key holds an earlier result of the same
+        request, for example the final state of a job in place of its first one.
+        Raise IdempotencyKeyReused if the key was taken by a different request.
+        """
+        fingerprint: str = self._fingerprint(request)
+
+        def take(cur: sqlite3.Cursor) -> str:
+            stored: Optional[str] = self._recall(cur, key, fingerprint)
+            if stored is None or replace:
+                stored = self._store_result(cur, key, fingerprint, result)
+            return stored
+
+        # queue the key on the writer and wait for it to commit
+        return json.loads(self._write(take))
+
+    @_timed
+    def forget(self, key: str, request: Any) -> None:
+        """
+        Free the idempotency `key` taken by remember() for `request`, for example when
+        the request could not be carried out after all, so that a retry is carried out
+        afresh. A key taken by a different request is left alone.
+        """
+        # SQL statement to delete a key along with its result
+        stmt = f'''
+            DELETE FROM {self.table_name}_idempotency
+            WHERE key = :key AND request = :request;
+        '''
+
+        # queue the SQL statement on the writer and wait for it to commit
+        self._write(lambda cur: cur.execute(
+            stmt, {'key': key, 'request': self._fingerprint(request)}
+        ))
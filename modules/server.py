@@ -0,0 +1,162 @@
+#!/usr/bin/env python3.9
+"""
+Production serving with several worker processes.
+Exposes serve(), a pre-forking server that runs a threaded WSGI server, or an ASGI
+server, in every worker process on one shared listening socket, and file_lock(), which
+serializes work such as database setup between processes.
+ASGI serving requires the optional uvicorn package (`pip install uvicorn`).
+"""
+
+import fcntl
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, NoReturn
+
+from werkzeug.serving import make_server
+
+try:
+    import uvicorn
+except ImportError:  # ASGI serving is optional
+    uvicorn = None
+
+# pending connections the kernel queues on the shared socket
+LISTEN_BACKLOG: int = 1024
+# seconds workers get to finish their requests before they are killed on shutdown
+SHUTDOWN_TIMEOUT: float = 10.0
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """
+    Hold an exclusive lock on the file at `path`, created if needed, for the duration of
+    a `with` block. Other processes taking the same lock wait until it is released; the
+    lock is also released if the process dies.
+    """
+    with open(path, 'a') as file:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def _run_worker(
+    create_app: Callable[[], Any],
+    sock: socket.socket,
+    asgi: bool = False
+) -> NoReturn:
+    """
+    Worker process main function: build the application, a WSGI one or an ASGI one if
+    `asgi` is set, and serve requests from the shared socket until told to stop, then
+    exit, running the exit handlers.
+    """
+    # the parent's handlers would shut down every worker instead of this one
+    def stop(signum: int, frame: object) -> None:
+        # a repeated signal must not interrupt the exit handlers
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, stop)
+
+    app: Any = create_app()
+    if asgi:
+        # uvicorn runs the event loop, and stops gracefully on SIGTERM
+        print(f' * Worker {os.getpid()} serving ASGI')
+        uvicorn.Server(
+            uvicorn.Config(app, log_level='warning', access_log=False)
+        ).run(sockets=[sock])
+        sys.exit(0)
+
+    # one access log line per request is a lot of overhead for a busy server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server(
+        sock.getsockname()[0], 0, app, threaded=True, fd=sock.fileno()
+    )
+    print(f' * Worker {os.getpid()} serving')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+    sys.exit(0)
+
+
+def serve(
+    create_app: Callable[[], Any],
+    host: str = '127.0.0.1',
+    port: int = 5000,
+    workers: int = 2,
+    asgi: bool = False
+) -> None:
+    """
+    Serve the application built by `create_app` on `host`:`port` with `workers` worker
+    processes, until interrupted. The application is a WSGI one, such as Flask's, or an
+    ASGI one if `asgi` is set, which requires uvicorn. The listening socket is opened
+    once and inherited by every worker, and the kernel hands each new connection to one
+    of them.
+    Every worker calls `create_app` itself after it starts, so that no threads or
+    database connections are shared between processes. Workers that die are replaced.
+    Requires fork(), so only runs on Unix.
+    """
+    assert workers >= 1
+    if asgi and uvicorn is None:
+        raise RuntimeError('Serving ASGI requires uvicorn; run `pip install uvicorn`.')
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(LISTEN_BACKLOG)
+    sock.set_inheritable(True)
+    print(f' * Serving on http://{host}:{port} with {workers} worker processes')
+
+    def start_worker() -> int:
+        pid: int = os.fork()
+        if pid == 0:
+            _run_worker(create_app, sock, asgi)
+        return pid
+
+    children: set[int] = {start_worker() for _ in range(workers)}
+    stopping: bool = False
+
+    def signal_children(signum: int) -> None:
+        for pid in list(children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass    # exited, and reaped below
+
+    def stop(signum: int, frame: object) -> None:
+        nonlocal stopping
+        stopping = True
+        signal_children(signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # replace workers that die until told to stop, then wait for the rest to exit
+    deadline: float = 0.0
+    while children:
+        if stopping and not deadline:
+            deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        if deadline and time.monotonic() > deadline:
+            signal_children(signal.SIGKILL)
+
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.1)
+            continue
+
+        children.discard(pid)
+        if not stopping:
+            print(f' * Worker {pid} exited with status {status}; starting a new one')
+            children.add(start_worker())
+
+    sock.close()
@@ -6,14 +6,47 @@ Also contains necessary private helper functions.
 
 from flask import Response, make_response
 from werkzeug.datastructures import FileStorage
-from werkzeug.utils import secure_filename
-from pathlib import Path
+from typing import IO, Iterator, Optional, Union
 import traceback
+import tempfile
+import hashlib
+import sqlite3
+import shutil
 import json
-import time
-
-from modules.products import Products
-from modules.csv_utils import csv_to_list, sqlite_rows_to_csv
+import os
+
+from modules.jobs import Job, JobManager, new_job_id
+from modules.metrics import METRICS, instrument
+from modules.products import MERGE_MODES, IdempotencyKeyReused, Products
+from modules.csv_utils import batched, iter_csv_text, gzip_chunks
+from modules.parallel_csv import iter_csv_chunks
+from modules import arrow_utils
+from modules.arrow_utils import iter_columnar_bytes, iter_columnar_chunks
+
+# number of CSV rows inserted per transaction during an import
+IMPORT_BATCH_SIZE: int = 5000
+# number of rejected rows described in detail in an import report
+MAX_REPORTED_REJECTIONS: int = 100
+# number of processes that parse and validate an imported CSV file; None for one per core
+IMPORT_WORKERS: Optional[int] = None
+# bytes copied at a time while saving an uploaded CSV file
+UPLOAD_COPY_BYTES: int = 1024 * 1024
+# largest number of operations accepted in one /batch request
+MAX_BATCH_OPS: int = 10000
+# answer to a request whose idempotency key was already used for a different request
+KEY_REUSED_MESSAGE: str = "Idempotency-Key was already used for a different request."
+
+# metrics of the service functions; streamed responses are timed until they are returned,
+# not until they are sent
+SERVICE_SECONDS = METRICS.histogram(
+    'inventory_service_seconds', 'Time spent in each service function.', ['service']
+)
+SERVICE_ERRORS = METRICS.counter(
+    'inventory_service_errors_total', 'Exceptions raised by each service function.',
+    ['service', 'error']
+)
+# records the duration and exceptions of a service function
+_timed = instrument(SERVICE_SECONDS, SERVICE_ERRORS)
 
 
 def _items_param_to_list(items_param: str) -> list:
@@ -26,10 +59,14 @@ def _items_param_to_list(items_param: str) -> list:
     return items
 
 
-def export_csv(inventory: Products, items_param: str, path: str) -> Response:
+@_timed
+def export_csv(inventory: Products, items_param: str, use_gzip: bool = False) -> Response:
     """
-    Export the products in `inventory` specified by `items` into a CSV file at `path`.
+    Export the products in `inventory` specified by `items` as a streamed CSV download.
     If `items` is empty, export all products.
+    Rows are read from a database cursor and written to the response in chunks, so
+    memory use stays constant, and concurrent exports do not share any files.
+    If `use_gzip` is set, the response body is gzip-compressed.
     """
 
     # try to read the list of items to export from the GET parameter `items`
@@ -42,24 +79,80 @@ def export_csv(inventory: Products, items_param: str, path: str) -> Response:
             400
         )
 
-    # get the products specified by items; empty list results in all products being dumped
-    dump: list
-    if items == []:
-        dump = inventory.get_all()
-    else:
-        dump = inventory.get_specific(skus=items)
+    # stream the products specified by items; empty list results in all products
+    # being dumped
+    rows: Iterator = inventory.iter_products(skus=(items or None))
+    body: Iterator = iter_csv_text(rows)
+    if use_gzip:
+        body = gzip_chunks(body)
+
+    resp: Response = Response(body, mimetype='text/csv')
+    resp.headers['Content-Disposition'] = 'attachment; filename=inventory_export.csv'
+    resp.headers['Vary'] = 'Accept-Encoding'
+    if use_gzip:
+        resp.headers['Content-Encoding'] = 'gzip'
+    return resp
+
+
+@_timed
+def export_columnar(inventory: Products, items_param: str, fmt: str = 'arrow') -> Response:
+    """
+    Export the products in `inventory` specified by `items` as a streamed Arrow IPC or
+    Parquet download, depending on `fmt`, one of arrow_utils.FORMATS.
+    If `items` is empty, export all products.
+    Rows are fetched from a database cursor a record batch at a time, and every batch is
+    written to the response as soon as it is encoded, so memory use stays constant.
+    """
+    # check that the format can be written
+    if fmt not in arrow_utils.FORMATS:
+        return make_response(
+            f"Invalid format (must be one of: {', '.join(arrow_utils.FORMATS)}).", 400
+        )
+    if not arrow_utils.available():
+        return make_response("Columnar formats require the pyarrow package.", 501)
 
-    # try to convert the list of SQLite Rows in the dump to a CSV file
+    # try to read the list of items to export from the GET parameter `items`
     try:
-        sqlite_rows_to_csv(dump, path=path)
+        items: list = _items_param_to_list(items_param)
     except Exception as err:
-        print(f"---\nEndpoint: /export-csv\n{err}\n---")
+        print(f"---\nEndpoint: /export-columnar\n{err}\n---")
         return make_response(
-            "Server could not export the CSV file. Please try again.",
-            500
+            "Parameter error! Must provide a JSON list of SKU strings for `items`.",
+            400
         )
 
-    return make_response("ok", 200)
+    # stream the products specified by items; empty list results in all products
+    # being dumped
+    rows: Iterator = inventory.iter_products(skus=(items or None))
+    extension: str = 'arrows' if fmt == 'arrow' else fmt
+    resp: Response = Response(
+        iter_columnar_bytes(rows, fmt), mimetype=arrow_utils.FORMATS[fmt]['mimetype']
+    )
+    resp.headers['Content-Disposition'] = (
+        f'attachment; filename=inventory_export.{extension}'
+    )
+    resp.headers['Vary'] = 'Accept'
+    return resp
+
+
+def _key_reused(endpoint: str, err: IdempotencyKeyReused) -> Response:
+    """
+    Respond to a request whose idempotency key was already sent along with a different
+    request.
+    """
+    print(f"---\nEndpoint: {endpoint}\n{err}\n---")
+    return make_response(KEY_REUSED_MESSAGE, 422)
+
+
+def _file_digest(path: str) -> str:
+    """
+    Return the SHA-256 digest of the file at `path`, as hexadecimal text.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(UPLOAD_COPY_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
 def _allowed_filetype(filename: str, allowed_exts: set) -> bool:
@@ -71,46 +164,405 @@ def _allowed_filetype(filename: str, allowed_exts: set) -> bool:
     return ('.' in filename) and (filename.rsplit('.', 1)[1].lower() in allowed_exts)
 
 
-def import_csv(inventory: Products, post_file: FileStorage) -> Response:
+@_timed
+def import_csv(
+    inventory: Products,
+    jobs: JobManager,
+    post_file: FileStorage,
+    mode: str = 'ignore',
+    idempotency_key: Optional[str] = None
+) -> Response:
+    """
+    Import the products from the uploaded CSV file `post_file` into the `inventory`, in
+    a background job run by `jobs`, merging existing products according to `mode`.
+    A retry sent with the same `idempotency_key` and file is answered with the job
+    started by the first attempt (see start_import_job()).
+    """
+    # check that a file is selected
+    if type(post_file.filename) != str or (post_file.filename == ''):
+        return make_response("No file selected.", 400)
+
+    # check that the file is non-empty
+    if not post_file:
+        return make_response("Invalid file.", 400)
+
+    return import_csv_stream(
+        inventory=inventory,
+        jobs=jobs,
+        stream=post_file.stream,
+        filename=post_file.filename,
+        mode=mode,
+        idempotency_key=idempotency_key
+    )
+
+
+@_timed
+def import_csv_file(
+    inventory: Products,
+    path: str,
+    job: Optional[Job] = None,
+    mode: str = 'ignore',
+    batch_size: int = IMPORT_BATCH_SIZE
+) -> dict:
+    """
+    Import the products from the CSV file at `path` into the `inventory`. The file is
+    parsed and validated in parallel, one byte range per worker process, while the valid
+    rows are inserted `batch_size` at a time by the inventory's single writer.
+    Rows whose SKU already exists are merged according to `mode`, one of MERGE_MODES.
+    Return the import report: the numbers of inserted, updated, unchanged and rejected
+    (invalid) rows, the progress after each batch, and details for the first
+    MAX_REPORTED_REJECTIONS rejected rows.
+    If the import runs as a background `job`, the job's progress, in bytes of the file,
+    and report are updated after every batch, and the import stops between batches once
+    the job is cancelled; the batches inserted until then stay in the inventory.
+    """
+    return _import_chunks(
+        inventory=inventory,
+        chunks=iter_csv_chunks(path, workers=IMPORT_WORKERS),
+        message="CSV data successfully imported!",
+        job=job, mode=mode, batch_size=batch_size
+    )
+
+
+@_timed
+def import_columnar_file(
+    inventory: Products,
+    path: str,
+    fmt: str,
+    job: Optional[Job] = None,
+    mode: str = 'ignore',
+    batch_size: int = IMPORT_BATCH_SIZE
+) -> dict:
+    """
+    Import the products from the Arrow IPC or Parquet file at `path`, depending on `fmt`
+    (one of arrow_utils.FORMATS), into the `inventory`. Every record batch of the file is
+    validated and inserted `batch_size` rows at a time, without any text parsing.
+    Return the import report, and update the background `job`, like import_csv_file().
+    """
+    return _import_chunks(
+        inventory=inventory,
+        chunks=iter_columnar_chunks(path, fmt),
+        message=f"{fmt.capitalize()} data successfully imported!",
+        job=job, mode=mode, batch_size=batch_size
+    )
+
+
+def _import_chunks(
+    inventory: Products,
+    chunks: Iterator[dict],
+    message: str,
+    job: Optional[Job] = None,
+    mode: str = 'ignore',
+    batch_size: int = IMPORT_BATCH_SIZE
+) -> dict:
+    """
+    Insert the valid rows of `chunks`, dictionaries shaped like the chunks of
+    parallel_csv.iter_csv_chunks(), into the `inventory`, and return the import report
+    described in import_csv_file(), with `message` as its message.
+    """
+    report: dict = {
+        'message': message, 'mode': mode,
+        'rows': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'rejected': 0,
+        'rejections': [], 'batches': []
+    }
+
+    for chunk in chunks:
+        report['rows'] += chunk['records']
+        report['rejected'] += len(chunk['rejections'])
+        room: int = MAX_REPORTED_REJECTIONS - len(report['rejections'])
+        report['rejections'].extend(chunk['rejections'][:max(room, 0)])
+
+        # insert the validated rows batch by batch, recording the progress after each one
+        inserted_rows: int = 0      # valid rows of the chunk passed to the inventory
+        batches: Iterator[list] = batched(chunk['rows'], batch_size)
+        for progress in inventory.import_batches(batches, mode=mode):
+            inserted_rows += progress['rows']
+            report['inserted'] += progress['inserted']
+            report['updated'] += progress['updated']
+            report['unchanged'] += progress['unchanged']
+            report['rejected'] += progress['failed']
+            report['batches'].append({
+                **progress,
+                'batch': len(report['batches']) + 1,
+                'rows_processed': report['rows'],
+                'rejected_so_far': report['rejected']
+            })
+            if job is not None:
+                # estimate the bytes behind the rows inserted so far within the chunk
+                job.update(
+                    chunk['start'] + (chunk['end'] - chunk['start']) * inserted_rows
+                    // max(len(chunk['rows']), 1),
+                    report
+                )
+                job.check_cancelled()
+
+        if job is not None:
+            job.update(chunk['end'], report)
+
+    return report
+
+
+@_timed
+def import_csv_stream(
+    inventory: Products,
+    jobs: JobManager,
+    stream: IO[bytes],
+    filename: str,
+    mode: str = 'ignore',
+    idempotency_key: Optional[str] = None
+) -> Response:
+    """
+    Import the products from a binary stream of CSV data named `filename`, such as the
+    request body, into the `inventory`. The stream is saved to a temporary file, which
+    is then imported by import_csv_file() in a background job run by `jobs`, so that the
+    file can be split between worker processes and the request returns right away.
+    Products that already exist are merged according to `mode`, one of MERGE_MODES.
+    Respond with the status of the job, which can be followed at /jobs/<id>, or with
+    that of the job started by the first request sent with the same `idempotency_key`.
+    """
+    # check that the file has a valid extension
+    if not _allowed_filetype(filename=filename, allowed_exts={'csv'}):
+        return make_response("Incorrect file extension (must be CSV).", 400)
+
+    # check that the merge mode is known
+    if mode not in MERGE_MODES:
+        return make_response(
+            f"Invalid mode (must be one of: {', '.join(MERGE_MODES)}).", 400
+        )
+
+    # save the upload; the file is deleted once the job has ended
+    upload = tempfile.NamedTemporaryFile(suffix='.csv', delete=False)
+    try:
+        with upload:
+            shutil.copyfileobj(stream, upload, UPLOAD_COPY_BYTES)
+    except Exception as err:
+        print(f"---\nEndpoint: /import-csv\n{err}")
+        traceback.print_exc()
+        print("\n---")
+        os.remove(upload.name)
+        return make_response("Server could not receive the CSV file. Please try again.", 500)
+
+    return start_import_job(
+        inventory=inventory, jobs=jobs, path=upload.name, mode=mode,
+        idempotency_key=idempotency_key
+    )
+
+
+@_timed
+def import_columnar(
+    inventory: Products,
+    jobs: JobManager,
+    post_file: FileStorage,
+    mode: str = 'ignore',
+    idempotency_key: Optional[str] = None
+) -> Response:
     """
-    Import the products from the uploaded CSV file `post_file` into the `inventory`.
+    Import the products from the uploaded Arrow IPC or Parquet file `post_file`, told
+    apart by its extension, into the `inventory`, in a background job run by `jobs`,
+    merging existing products according to `mode`, like import_csv().
     """
     # check that a file is selected
     if type(post_file.filename) != str or (post_file.filename == ''):
         return make_response("No file selected.", 400)
 
-    # check that the file is non-empty and has a valid extension; then save it temporarily
-    if post_file and _allowed_filetype(filename=post_file.filename, allowed_exts={'csv'}):
-        # temporary filename is `upload_<unix_timestamp>_original_filename.csv`
-        saved_filename = ''.join(
-            ('./upload_', str(int(time.time())), '_', secure_filename(post_file.filename))
+    # check that the file is non-empty
+    if not post_file:
+        return make_response("Invalid file.", 400)
+
+    return import_columnar_stream(
+        inventory=inventory,
+        jobs=jobs,
+        stream=post_file.stream,
+        filename=post_file.filename,
+        fmt=arrow_utils.format_of(post_file.filename),
+        mode=mode,
+        idempotency_key=idempotency_key
+    )
+
+
+@_timed
+def import_columnar_stream(
+    inventory: Products,
+    jobs: JobManager,
+    stream: IO[bytes],
+    filename: str,
+    fmt: str,
+    mode: str = 'ignore',
+    idempotency_key: Optional[str] = None
+) -> Response:
+    """
+    Import the products from a binary stream of Arrow IPC or Parquet data named
+    `filename`, depending on `fmt`, into the `inventory`. The stream is saved to a
+    temporary file, which is then imported by import_columnar_file() in a background job
+    run by `jobs`; Parquet is only readable once its footer has arrived.
+    Products that already exist are merged according to `mode`, one of MERGE_MODES.
+    Respond with the status of the job, which can be followed at /jobs/<id>, or with
+    that of the job started by the first request sent with the same `idempotency_key`.
+    """
+    # check that the format is known, and can be read
+    if fmt not in arrow_utils.FORMATS:
+        extensions: list = sorted(
+            extension for spec in arrow_utils.FORMATS.values()
+            for extension in spec['extensions']
         )
-        post_file.save(saved_filename)
-    else:
         return make_response(
-            "Incorrect file extension (must be CSV), or invalid file.", 400
+            f"Incorrect file format (must be one of: {', '.join(extensions)}).", 400
         )
+    if not arrow_utils.available():
+        return make_response("Columnar formats require the pyarrow package.", 501)
 
-    # read the temporary CSV file and import the data into the inventory database
+    # check that the merge mode is known
+    if mode not in MERGE_MODES:
+        return make_response(
+            f"Invalid mode (must be one of: {', '.join(MERGE_MODES)}).", 400
+        )
+
+    # save the upload; the file is deleted once the job has ended
+    upload = tempfile.NamedTemporaryFile(suffix=f'.{fmt}', delete=False)
     try:
-        data_to_import: list[dict] = csv_to_list(saved_filename)
-        inventory.import_data(data=data_to_import)
+        with upload:
+            shutil.copyfileobj(stream, upload, UPLOAD_COPY_BYTES)
     except Exception as err:
-        print(f"---\nEndpoint: /import-csv\n{err}\n---")
+        print(f"---\nEndpoint: /import-columnar\n{err}")
+        traceback.print_exc()
+        print("\n---")
+        os.remove(upload.name)
         return make_response(
-            "Server could not import the CSV file. Please try again.",
-            500
+            f"Server could not receive the {fmt} file. Please try again.", 500
         )
 
-    # delete the uploaded CSV file
-    Path(saved_filename).unlink()
+    return start_import_job(
+        inventory=inventory, jobs=jobs, path=upload.name, mode=mode, fmt=fmt,
+        idempotency_key=idempotency_key
+    )
 
-    return make_response("CSV data successfully imported!", 200)
 
+def _submit_import_job(
+    inventory: Products,
+    jobs: JobManager,
+    path: str,
+    mode: str,
+    fmt: str = 'csv',
+    idempotency_key: Optional[str] = None
+) -> tuple[Union[dict, str], int]:
+    """
+    Import the saved upload at `path`, a CSV file or a file in one of the columnar
+    formats named by `fmt`, into the `inventory` in a background job run by `jobs`, and
+    return the status of the job with the status code 202, or an error message with
+    its status code. The file is deleted once the job has ended, or right away if the
+    job cannot be queued.
+    If the same file was already uploaded with the same `fmt`, `mode` and
+    `idempotency_key`, no job is started, and the status returned is the current status
+    of the job started then, or its final status if it is no longer known. The key is
+    taken, along with the ID of the job, before the job is queued, so only one of
+    several concurrent attempts queues a job, and is freed if the job cannot be queued.
+    Blocks while the file is hashed, so async callers run it on an executor.
+    """
+    job_id: str = new_job_id()
+    endpoint: str = '/import-csv' if fmt == 'csv' else '/import-columnar'
 
-def add_product(inventory: Products, sku: str, name: str, quantity: int) -> Response:
+    def run(job: Job) -> None:
+        report: dict = (
+            import_csv_file(inventory, path, job=job, mode=mode) if fmt == 'csv'
+            else import_columnar_file(inventory, path, fmt, job=job, mode=mode)
+        )
+        job.update(job.total, report)
+
+    def finish() -> None:
+        # the job has ended: retries are answered with its final status from now on
+        final: Optional[dict] = jobs.status(job_id)
+        if idempotency_key is not None and final is not None:
+            try:
+                inventory.remember(idempotency_key, request, final, replace=True)
+            except (sqlite3.Error, IdempotencyKeyReused) as err:
+                print(f"---\nEndpoint: {endpoint}\n{err}\n---")
+        os.remove(path)
+
+    # take the key for a new job, unless a retried upload finds the job started by the
+    # first attempt
+    request: list = []
+    if idempotency_key is not None:
+        request = ['import', fmt, mode, _file_digest(path)]
+        try:
+            stored: dict = inventory.remember(
+                idempotency_key, request, {'id': job_id, 'status': 'queued'}
+            )
+        except IdempotencyKeyReused as err:
+            os.remove(path)
+            print(f"---\nEndpoint: {endpoint}\n{err}\n---")
+            return KEY_REUSED_MESSAGE, 422
+        if stored['id'] != job_id:
+            os.remove(path)
+            return jobs.status(stored['id']) or stored, 202
+
+    job: Optional[Job] = jobs.submit(
+        run, total=os.path.getsize(path), cleanup=finish, job_id=job_id
+    )
+    if job is None:
+        os.remove(path)
+        if idempotency_key is not None:
+            inventory.forget(idempotency_key, request)
+        return "Too many imports in progress. Please try again later.", 429
+
+    return job.snapshot(), 202
+
+
+@_timed
+def start_import_job(
+    inventory: Products,
+    jobs: JobManager,
+    path: str,
+    mode: str,
+    fmt: str = 'csv',
+    idempotency_key: Optional[str] = None
+) -> Response:
     """
-    Rename the product in the `inventory` identified by the `sku` into `new_name`.
+    Import the saved upload at `path` in a background job, as described in
+    _submit_import_job(), and respond with the status of the job, along with its URL.
+    """
+    body, status = _submit_import_job(
+        inventory=inventory, jobs=jobs, path=path, mode=mode, fmt=fmt,
+        idempotency_key=idempotency_key
+    )
+    resp: Response = make_response(body, status)
+    if isinstance(body, dict):
+        resp.headers['Location'] = f'/jobs/{body["id"]}'
+    return resp
+
+
+@_timed
+def job_status(jobs: JobManager, job_id: str) -> Response:
+    """
+    Respond with the status, progress and report of the background job `job_id`.
+    """
+    snapshot: Optional[dict] = jobs.status(job_id)
+    if snapshot is None:
+        return make_response("No such job.", 404)
+    return make_response(snapshot, 200)
+
+
+@_timed
+def cancel_job(jobs: JobManager, job_id: str) -> Response:
+    """
+    Ask the background job `job_id` to stop, and respond with its status.
+    """
+    snapshot: Optional[dict] = jobs.cancel(job_id)
+    if snapshot is None:
+        return make_response("No such job.", 404)
+    return make_response(snapshot, 202)
+
+
+@_timed
+def add_product(
+    inventory: Products,
+    sku: str,
+    name: str,
+    quantity: int,
+    idempotency_key: Optional[str] = None
+) -> Response:
+    """
+    Add a new product to the `inventory`.
+    A retry sent with the same `idempotency_key` is not applied again.
     """
     # reject less than 0 quantities
     if not (int(quantity) >= 0):
@@ -118,7 +570,11 @@ def add_product(inventory: Products, sku: str, name: str, quantity: int) -> Resp
 
     # try to change the name of the specified product in the inventory
     try:
-        inventory.add_product(sku=sku, name=name, quantity=int(quantity))
+        inventory.add_product(
+            sku=sku, name=name, quantity=int(quantity), idempotency_key=idempotency_key
+        )
+    except IdempotencyKeyReused as err:
+        return _key_reused('/add-product', err)
     except Exception as err:
         print(f"---\nEndpoint: /add-product\n{err}")
         traceback.print_exc()
@@ -131,9 +587,15 @@ def add_product(inventory: Products, sku: str, name: str, quantity: int) -> Resp
     return make_response("Successfully added the product!", 200)
 
 
-def delete_products(inventory: Products, items_param: str) -> Response:
+@_timed
+def delete_products(
+    inventory: Products,
+    items_param: str,
+    idempotency_key: Optional[str] = None
+) -> Response:
     """
     Delete products in `inventory` specified by `items`. `items` must be non-empty.
+    A retry sent with the same `idempotency_key` is not applied again.
     """
     # try to read the list of items to delete from the GET parameter `items`
     try:
@@ -150,7 +612,9 @@ def delete_products(inventory: Products, items_param: str) -> Response:
 
     # try to delete the specified items from the inventory
     try:
-        inventory.delete_products(items)
+        inventory.delete_products(items, idempotency_key=idempotency_key)
+    except IdempotencyKeyReused as err:
+        return _key_reused('/delete-products', err)
     except Exception as err:
         print(f"---\nEndpoint: /delete-products\n{err}")
         traceback.print_exc()
@@ -163,13 +627,22 @@ def delete_products(inventory: Products, items_param: str) -> Response:
     return make_response("Successfully deleted products!", 200)
 
 
-def change_name(inventory: Products, sku: str, new_name: str) -> Response:
+@_timed
+def change_name(
+    inventory: Products,
+    sku: str,
+    new_name: str,
+    idempotency_key: Optional[str] = None
+) -> Response:
     """
     Rename the product in the `inventory` identified by the `sku` into `new_name`.
+    A retry sent with the same `idempotency_key` is not applied again.
     """
     # try to change the name of the specified product in the inventory
     try:
-        inventory.change_name(sku=sku, new_name=new_name)
+        inventory.change_name(sku=sku, new_name=new_name, idempotency_key=idempotency_key)
+    except IdempotencyKeyReused as err:
+        return _key_reused('/change-name', err)
     except Exception as err:
         print(f"---\nEndpoint: /change-name\n{err}")
         traceback.print_exc()
@@ -182,10 +655,19 @@ def change_name(inventory: Products, sku: str, new_name: str) -> Response:
     return make_response("Successfully renamed the product!", 200)
 
 
-def update_quantity(inventory: Products, sku: str, operation: str, count: int) -> Response:
+@_timed
+def update_quantity(
+    inventory: Products,
+    sku: str,
+    operation: str,
+    count: int,
+    idempotency_key: Optional[str] = None
+) -> Response:
     """
     Updates the quantity of the product in `inventory` by either adding, subtracting, or
     setting the quantity to `count`.
+    A retry sent with the same `idempotency_key` is not applied again, so an addition is
+    only counted once.
     """
     if operation not in {'add', 'subtract', 'set'}:
         return make_response("`operation` must only be 'add', 'subtract', or 'set'", 400)
@@ -195,7 +677,11 @@ def update_quantity(inventory: Products, sku: str, operation: str, count: int) -
 
     # try to change the name of the specified product in the inventory
     try:
-        inventory.update_quantity(sku=sku, operation=operation, count=int(count))
+        inventory.update_quantity(
+            sku=sku, operation=operation, count=int(count), idempotency_key=idempotency_key
+        )
+    except IdempotencyKeyReused as err:
+        return _key_reused('/update-quantity', err)
     except Exception as err:
         print(f"---\nEndpoint: /update-quantity\n{err}")
         traceback.print_exc()
@@ -206,3 +692,43 @@ def update_quantity(inventory: Products, sku: str, operation: str, count: int) -
         )
 
     return make_response("Successfully updated product quantity!", 200)
+
+
+@_timed
+def apply_batch(
+    inventory: Products,
+    ops: list,
+    atomic: bool = False,
+    idempotency_key: Optional[str] = None
+) -> Response:
+    """
+    Apply a list of add, subtract, set, rename and delete operations to products in the
+    `inventory` in a single transaction, and respond with the outcome of each operation.
+    If `atomic` is set, nothing is applied unless every operation succeeds.
+    A retry of a committed batch sent with the same `idempotency_key` is answered with
+    the outcome of the first attempt, without applying the batch again.
+    """
+    if not isinstance(ops, list) or ops == []:
+        return make_response("`ops` must be a non-empty list of operations.", 400)
+
+    if len(ops) > MAX_BATCH_OPS:
+        return make_response(f"At most {MAX_BATCH_OPS} operations per batch.", 400)
+
+    # try to apply the operations to the inventory
+    try:
+        report: dict = inventory.apply_batch(
+            ops, atomic=bool(atomic), idempotency_key=idempotency_key
+        )
+    except IdempotencyKeyReused as err:
+        return _key_reused('/batch', err)
+    except Exception as err:
+        print(f"---\nEndpoint: /batch\n{err}")
+        traceback.print_exc()
+        print("\n---")
+        return make_response(
+            f"Server could not apply the batch of operations.\n{err}",
+            500
+        )
+
+    # an atomic batch that was rolled back conflicts with the current inventory
+    return make_response(report, 200 if report['committed'] else 409)
@@ -0,0 +1,794 @@
+#!/usr/bin/env python3.9
+"""
+Hash-partitioned products storage across several SQLite database files.
+Exposes the ShardedProducts class, which offers the Products API over a set of shards
+that each have their own database file and writer, shard_paths(), coordinator_path()
+and shard_of(), which locate the shard files, the file shared by all shards and the
+shard of a SKU, and rebalance(), which moves all products to a different number of
+shards.
+Run `python3.9 -m modules.sharding --db products.db --from 1 --to 4` to rebalance.
+"""
+
+import argparse
+import heapq
+import json
+import queue
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Optional, Sequence
+
+from modules.csv_utils import batched
+from modules.metrics import instrument
+from modules.products import MERGE_MODES, METHOD_ERRORS, METHOD_ROWS, METHOD_SECONDS, Products
+
+# change log positions remembered to answer get_changes(); older ones cause a reset
+MAX_REMEMBERED_POSITIONS: int = 10000
+
+_timed = instrument(METHOD_SECONDS, METHOD_ERRORS, rows=METHOD_ROWS)
+
+
+def shard_paths(db_path: str, count: int) -> list[str]:
+    """
+    Return the database file paths of `count` shards stored next to `db_path`. A single
+    shard is the file at `db_path` itself, so an unsharded database is a one-shard one.
+    """
+    assert count >= 1
+    if count == 1 or db_path == ':memory:':
+        return [db_path] * count
+    path = Path(db_path)
+    return [
+        str(path.with_name(f'{path.stem}.{i}-of-{count}{path.suffix}')) for i in range(count)
+    ]
+
+
+def coordinator_path(db_path: str) -> str:
+    """
+    Return the path of the database file stored next to `db_path` that holds what
+    belongs to no single shard, whatever the number of shards.
+    """
+    if db_path == ':memory:':
+        return db_path
+    path = Path(db_path)
+    return str(path.with_name(f'{path.stem}.shards{path.suffix}'))
+
+
+def shard_of(sku: str, count: int) -> int:
+    """
+    Return the index of the shard that stores the product identified by `sku`, among
+    `count` shards. The hash is stable across processes and Python versions.
+    """
+    return zlib.crc32(sku.encode('utf-8')) % count
+
+
+def _merge_stats(stats: list[dict]) -> dict:
+    """
+    Combine the statistics counters of several shards: counters are added up, maxima
+    are combined, and ratios are recomputed from the combined counters.
+    """
+    merged: dict = {}
+    for shard_stats in stats:
+        for key, value in shard_stats.items():
+            if key.startswith('max_'):
+                merged[key] = max(merged.get(key, value), value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+    if 'coalescing_ratio' in merged:
+        merged['coalescing_ratio'] = (
+            merged['flushed_updates'] / merged['flushed_rows']
+            if merged['flushed_rows'] else 0.0
+        )
+    return merged
+
+
+class ShardedProducts(Products):
+    """
+    Products partitioned by a hash of their SKU across several SQLite database files,
+    each with its own connection pool, cache and writer, so writes to different shards
+    are committed in parallel. Offers the same API as Products.
+
+    Operations on one product go to its shard only. Operations on many products, such
+    as get_all(), get_specific(), get_page(), search() and iter_products(), run on the
+    shards involved in parallel and merge the results. Transactions do not span shards:
+    a batch given to apply_batch() is applied by every shard on its own, and an atomic
+    batch must only touch products of one shard. Calls are timed in the metrics of
+    Products as a whole, and not again by every shard they involve.
+
+    The object itself is the Products of a database file shared by all shards (see
+    coordinator_path()), which stores no products, only what spans several shards.
+
+    Every shard keeps its own change log and ledger. change_seq() is the sum of the
+    shards' change log positions, which grows with every change, and the shards'
+    positions each sum stands for are stored in the shared database before it is handed
+    out, so get_changes() resolves the recent positions handed out by any process using
+    the same files, and asks for a reset otherwise. Ledger entry numbers (`seq` of
+    history(), product_at(), products_at() and rebuild()) are those of a product's shard,
+    so only points in time can be given across several shards.
+
+    The idempotency key of a write is first taken in the shared database, which holds
+    the one table of keys that tells requests apart, so a key cannot be reused for a
+    different write, even one that changes other shards; keys given to remember() are
+    stored there too. The key is then stored again by every shard the write changes, in
+    the same transaction as that shard's part of the write, so a retry only applies the
+    parts that were not committed.
+
+    Public methods:
+        - ShardedProducts(db_path: str = ":memory:", shards: int = 2, **options) -> None
+        - ShardedProducts.shard(sku: str) -> Products
+    and those of Products.
+    """
+
+    shards: list[Products]  # the shards, in the order of their indices
+
+    def __init__(self, db_path: str = ":memory:", shards: int = 2, **options: Any) -> None:
+        """
+        Open `shards` shards stored next to `db_path` (see shard_paths()), and the
+        database they share. The other options are those of Products, and apply to every
+        shard; calls are recorded by this object only, not again by every shard.
+        """
+        assert shards >= 1
+        # the shared database never buffers writes nor keeps a ledger
+        shared: dict[str, Any] = {**options, 'write_behind': 0.0, 'snapshot_interval': 0}
+        super().__init__(db_path=coordinator_path(db_path), **shared)
+        self.db_path = db_path
+        self.shards = [
+            Products(db_path=path, method_metrics=False, **options)
+            for path in shard_paths(db_path, shards)
+        ]
+        # calls that span several shards run on these threads, besides the caller's own
+        self._executor = ThreadPoolExecutor(
+            max_workers=4 * shards, thread_name_prefix='shard'
+        )
+        # change log positions this object stored, with the shards' positions of each
+        self._positions: OrderedDict[int, tuple] = OrderedDict()
+        self._positions_lock = threading.Lock()
+
+    def shard(self, sku: str) -> Products:
+        """
+        Return the shard that stores the product identified by `sku`.
+        """
+        return self.shards[shard_of(sku, len(self.shards))]
+
+    def _each(
+        self,
+        call: Callable[[int, Products], Any],
+        indices: Optional[Iterable[int]] = None
+    ) -> dict[int, Any]:
+        """
+        Call `call` with the index and the shard of every shard, or of the shards in
+        `indices`, in parallel, and return the results by shard index. The calling
+        thread runs one of the calls itself.
+        """
+        selected: list[int] = list(range(len(self.shards)) if indices is None else indices)
+        if not selected:
+            return {}
+        futures: dict = {
+            index: self._executor.submit(call, index, self.shards[index])
+            for index in selected[1:]
+        }
+        results: dict[int, Any] = {selected[0]: call(selected[0], self.shards[selected[0]])}
+        for index, future in futures.items():
+            results[index] = future.result()
+        return results
+
+    def _partition(self, items: Iterable[Any], key: Callable[[Any], str]) -> dict[int, list]:
+        """
+        Group `items` by the shard of the SKU `key` returns for each of them, keeping
+        their order within every group.
+        """
+        groups: dict[int, list] = {}
+        for item in items:
+            groups.setdefault(shard_of(key(item), len(self.shards)), []).append(item)
+        return groups
+
+    def _remember(self, positions: tuple) -> int:
+        """
+        Return the change log position standing for the shards' `positions`, after
+        storing which positions it stands for, unless this object already did. A
+        position reached through different shard positions is ambiguous, and resolved
+        by nothing.
+        """
+        seq: int = sum(positions)
+        with self._positions_lock:
+            if self._positions.get(seq) == positions:
+                self._positions.move_to_end(seq)
+                return seq
+
+        # SQL statement to store the shards' positions of a position, or mark it as
+        # ambiguous if it was stored with others
+        stmt = f'''
+            INSERT INTO {self.table_name}_positions(seq, positions)
+            VALUES (:seq, :positions)
+            ON CONFLICT(seq) DO UPDATE SET positions = NULL
+            WHERE positions IS NOT excluded.positions;
+        '''
+
+        # queue the SQL statement on the writer and wait for it to commit
+        try:
+            self._write(lambda cur: cur.execute(
+                stmt, {'seq': seq, 'positions': json.dumps(positions)}
+            ))
+        except sqlite3.Error as error:
+            print(self._sqlite_error_msg(
+                context='storing change log positions',
+                error=error,
+                table_name=self.table_name
+            ))
+            return seq
+
+        with self._positions_lock:
+            self._positions[seq] = positions
+            self._positions.move_to_end(seq)
+            while len(self._positions) > MAX_REMEMBERED_POSITIONS:
+                self._positions.popitem(last=False)
+        return seq
+
+    def _prune_changes(self) -> None:
+        """
+        Delete all but the newest MAX_REMEMBERED_POSITIONS change log positions from the
+        shared database, which has no change log of its own. Called every so often by
+        _write().
+        """
+        # SQL statement to delete the oldest positions
+        stmt = f'''
+            DELETE FROM {self.table_name}_positions
+            WHERE seq < (
+                SELECT seq FROM {self.table_name}_positions
+                ORDER BY seq DESC LIMIT 1 OFFSET :keep
+            );
+        '''
+
+        # queue the SQL statement on the writer and wait for it to commit
+        try:
+            self.writer.run(lambda cur: cur.execute(stmt, {'keep': MAX_REMEMBERED_POSITIONS}))
+        except sqlite3.Error as error:
+            print(self._sqlite_error_msg(
+                context='pruning change log positions',
+                error=error,
+                table_name=self.table_name
+            ))
+
+    def _claim(self, key: Optional[str], request: Any) -> None:
+        """
+        Take the idempotency `key` of the write described by `request` in the shared
+        database, before any shard applies its part of the write, or do nothing if the
+        key was already taken by the same request or is None.
+        Raise IdempotencyKeyReused if the key was taken by a different request.
+        """
+        if key is not None:
+            self._write_once(lambda cur: None, key=key, request=request)
+
+    def _resolve(self, seq: int) -> Optional[tuple]:
+        """
+        Return the shards' positions the change log position `seq` stands for, or None
+        if it was not handed out recently, is ambiguous, or stands for another number
+        of shards.
+        """
+        # SQL statement to fetch the shards' positions of a position
+        stmt = f'SELECT positions FROM {self.table_name}_positions WHERE seq = ?;'
+
+        # borrow a connection to the shared database and fetch them
+        positions: Optional[list] = None
+        with self._get_conn_cur() as (conn, cur):
+            try:
+                row: Optional[tuple] = cur.execute(stmt, (seq,)).fetchone()
+                if row is not None and row[0] is not None:
+                    positions = json.loads(row[0])
+            except sqlite3.Error as error:
+                print(self._sqlite_error_msg(
+                    context='getting change log positions',
+                    error=error,
+                    table_name=self.table_name
+                ))
+
+        if positions is None or len(positions) != len(self.shards):
+            return None
+        return tuple(positions)
+
+    @property
+    def version(self) -> int:
+        return sum(shard.version for shard in self.shards)
+
+    def instance_id(self) -> str:
+        ids: str = ','.join(shard.instance_id() for shard in self.shards)
+        return f'{zlib.crc32(ids.encode()):08x}'
+
+    def add_write_listener(self, listener: Callable[[], Any]) -> None:
+        for shard in self.shards:
+            shard.add_write_listener(listener)
+
+    def pool_stats(self) -> dict:
+        return _merge_stats([shard.pool_stats() for shard in self.shards])
+
+    def cache_stats(self) -> dict:
+        return _merge_stats([shard.cache_stats() for shard in self.shards])
+
+    def writer_stats(self) -> dict:
+        return _merge_stats([shard.writer_stats() for shard in self.shards])
+
+    def write_behind_stats(self) -> dict:
+        return _merge_stats([shard.write_behind_stats() for shard in self.shards])
+
+    @_timed
+    def flush(self) -> None:
+        self._each(lambda index, shard: shard.flush())
+
+    def close(self) -> None:
+        """
+        Close every shard and the shared database, then stop the threads used for calls
+        that span shards. The shards are closed one at a time, since this may run at
+        interpreter shutdown, when no new threads can be started.
+        """
+        for shard in self.shards:
+            shard.close()
+        super().close()
+        self._executor.shutdown()
+
+    @_timed
+    def create_table(self) -> None:
+        """
+        Like Products.create_table(), on every shard; the shared database gets a table of
+        the change log positions handed out, each with the shards' positions it stands
+        for, or NULL if it is ambiguous, and the table of idempotency keys.
+        """
+        self._each(lambda index, shard: shard.create_table())
+
+        # SQL statements to create the table of change log positions and that of keys
+        stmts: list[str] = [
+            f'''
+                CREATE TABLE IF NOT EXISTS {self.table_name}_positions (
+                    seq         INTEGER PRIMARY KEY NOT NULL,
+                    positions   TEXT
+                );
+            ''',
+            *self._idempotency_stmts()
+        ]
+
+        def create(cur: sqlite3.Cursor) -> None:
+            for stmt in stmts:
+                cur.execute(stmt)
+
+        # queue the SQL statements on the writer and wait for them to commit
+        try:
+            self.writer.run(create)
+        except sqlite3.Error as error:
+            print(self._sqlite_error_msg(
+                context='creating table',
+                error=error,
+                table_name=self.table_name
+            ))
+
+    @_timed
+    def import_data(self, data: list[dict]) -> None:
+        groups: dict[int, list] = self._partition(data, lambda row: row['sku'])
+        self._each(lambda index, shard: shard.import_data(groups[index]), groups)
+
+    @_timed
+    def import_batches(
+        self,
+        batches: Iterable[Sequence[tuple]],
+        mode: str = 'ignore'
+    ) -> Iterator[dict]:
+        """
+        Like Products.import_batches(); the rows of every batch are split between the
+        shards, which import their parts in parallel, and the progress dictionary of the
+        batch adds up theirs.
+        """
+        assert mode in MERGE_MODES
+
+        for number, batch in enumerate(batches, start=1):
+            groups: dict[int, list] = self._partition(batch, lambda row: row[0])
+            reports: dict[int, dict] = self._each(
+                lambda index, shard: list(
+                    shard.import_batches([groups[index]], mode=mode)
+                )[0],
+                groups
+            )
+            progress: dict = {'batch': number, 'rows': len(batch)}
+            for key in ('inserted', 'updated', 'unchanged', 'failed'):
+                progress[key] = sum(report[key] for report in reports.values())
+            yield progress
+
+    @_timed
+    def get_all(self) -> list[sqlite3.Row]:
+        results: dict[int, list] = self._each(lambda index, shard: shard.get_all())
+        return [row for index in sorted(results) for row in results[index]]
+
+    @_timed
+    def get_specific(self, skus: list) -> list[sqlite3.Row]:
+        groups: dict[int, list] = self._partition(skus, lambda sku: sku)
+        results: dict[int, list] = self._each(
+            lambda index, shard: shard.get_specific(groups[index]), groups
+        )
+        return [row for index in sorted(results) for row in results[index]]
+
+    @_timed
+    def get_page(
+        self,
+        after_sku: Optional[str] = None,
+        limit: int = 100,
+        sort: str = 'sku',
+        after_name: Optional[str] = None
+    ) -> list[sqlite3.Row]:
+        """
+        Like Products.get_page(); every shard returns its first `limit` products after
+        the cursor, and the pages are merged in order.
+        """
+        assert sort in {'sku', 'name'}
+
+        # the shards cannot look up the name of a product stored elsewhere
+        if sort == 'name' and after_sku is not None and after_name is None:
+            found: list = self.shard(after_sku).get_specific([after_sku])
+            if not found:
+                return []
+            after_name = found[0]['name']
+
+        pages: dict[int, list] = self._each(lambda index, shard: shard.get_page(
+            after_sku=after_sku, limit=limit, sort=sort, after_name=after_name
+        ))
+        key: Callable = (
+            (lambda row: row['sku']) if sort == 'sku'
+            else (lambda row: (row['name'], row['sku']))
+        )
+        return list(islice(heapq.merge(*pages.values(), key=key), limit))
+
+    @_timed
+    def count(self) -> int:
+        return sum(shard.count() for shard in self.shards)
+
+    @_timed
+    def low_stock(self, threshold: int, limit: int = 100) -> list[sqlite3.Row]:
+        results: dict[int, list] = self._each(
+            lambda index, shard: shard.low_stock(threshold, limit=limit)
+        )
+        return list(islice(
+            heapq.merge(*results.values(), key=lambda row: (row['quantity'], row['sku'])),
+            limit
+        ))
+
+    @_timed
+    def total_quantity(self) -> int:
+        return sum(shard.total_quantity() for shard in self.shards)
+
+    @_timed
+    def quantity_histogram(self) -> list[dict]:
+        histograms: list[list[dict]] = [shard.quantity_histogram() for shard in self.shards]
+        return [
+            {**buckets[0], 'products': sum(bucket['products'] for bucket in buckets)}
+            for buckets in zip(*histograms)
+        ]
+
+    @_timed
+    def search(self, query: str, limit: int = 50) -> list[sqlite3.Row]:
+        """
+        Like Products.search(); the shards' best matches are interleaved, best first,
+        since products are spread evenly between the shards.
+        """
+        results: dict[int, list] = self._each(
+            lambda index, shard: shard.search(query, limit=limit)
+        )
+        ranked: list[sqlite3.Row] = []
+        for rank in range(limit):
+            for index in sorted(results):
+                if rank < len(results[index]):
+                    ranked.append(results[index][rank])
+        return ranked[:limit]
+
+    @_timed
+    def change_seq(self, fresh: bool = False) -> int:
+        return self._remember(tuple(shard.change_seq(fresh=fresh) for shard in self.shards))
+
+    @_timed
+    def get_changes(self, since: int, limit: int = 500) -> dict:
+        """
+        Like Products.get_changes(). `since` must be a position handed out recently by
+        an object using the same files; the changes of every shard since its own
+        position are merged, and all of them carry the new position as their `seq`.
+        """
+        assert limit >= 1
+
+        start: Optional[tuple] = self._resolve(since)
+        if start is None:
+            current: int = self.change_seq()
+            return {'seq': current, 'reset': since != current, 'changes': []}
+        positions: tuple = start
+
+        feeds: dict[int, dict] = self._each(
+            lambda index, shard: shard.get_changes(since=positions[index], limit=limit)
+        )
+        seq: int = self._remember(tuple(feeds[index]['seq'] for index in sorted(feeds)))
+        changes: list[dict] = [
+            {**dict(row), 'seq': seq}
+            for index in sorted(feeds) for row in feeds[index]['changes']
+        ]
+        if any(feed['reset'] for feed in feeds.values()) or len(changes) > limit:
+            return {'seq': seq, 'reset': True, 'changes': []}
+        return {'seq': seq, 'reset': False, 'changes': changes}
+
+    @_timed
+    def history(
+        self,
+        sku: str,
+        limit: int = 100,
+        before: Optional[int] = None
+    ) -> list[sqlite3.Row]:
+        return self.shard(sku).history(sku, limit=limit, before=before)
+
+    @_timed
+    def product_at(
+        self,
+        sku: str,
+        at: Optional[float] = None,
+        seq: Optional[int] = None
+    ) -> Optional[sqlite3.Row]:
+        return self.shard(sku).product_at(sku, at=at, seq=seq)
+
+    @_timed
+    def products_at(
+        self,
+        at: Optional[float] = None,
+        seq: Optional[int] = None
+    ) -> list[sqlite3.Row]:
+        assert seq is None or len(self.shards) == 1, 'ledger entries are numbered per shard'
+        results: dict[int, list] = self._each(
+            lambda index, shard: shard.products_at(at=at, seq=seq)
+        )
+        return list(heapq.merge(*results.values(), key=lambda row: row['sku']))
+
+    @_timed
+    def take_snapshot(self) -> Optional[int]:
+        """
+        Like Products.take_snapshot(), on every shard; return the sum of the ledger
+        entries the snapshots include, or None if any of them failed.
+        """
+        results: dict[int, Optional[int]] = self._each(
+            lambda index, shard: shard.take_snapshot()
+        )
+        if any(result is None for result in results.values()):
+            return None
+        return sum(results.values())
+
+    @_timed
+    def rebuild(self, seq: Optional[int] = None) -> dict:
+        assert seq is None or len(self.shards) == 1, 'ledger entries are numbered per shard'
+        reports: dict[int, dict] = self._each(lambda index, shard: shard.rebuild(seq=seq))
+        merged: dict = {'committed': all(report['committed'] for report in reports.values())}
+        for key in ('seq', 'inserted', 'updated', 'deleted'):
+            merged[key] = sum(report[key] for report in reports.values())
+        return merged
+
+    @_timed
+    def iter_products(
+        self,
+        skus: Optional[list] = None,
+        chunk_size: int = 1000
+    ) -> Iterator[sqlite3.Row]:
+        """
+        Like Products.iter_products(); every shard involved is read by its own thread,
+        up to two chunks ahead, and rows are yielded in the order their chunks arrive.
+        The threads stop when the generator is exhausted or closed.
+        """
+        groups: dict[int, Optional[list]] = dict.fromkeys(range(len(self.shards)))
+        if skus is not None:
+            groups = dict(self._partition(skus, lambda sku: sku))
+        chunks: queue.Queue = queue.Queue(maxsize=2 * len(self.shards))
+        stop = threading.Event()
+
+        def put(item: Optional[list]) -> bool:
+            # wait for room in the queue, unless the consumer went away
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce(shard: Products, shard_skus: Optional[list]) -> None:
+            rows: Iterator[sqlite3.Row] = shard.iter_products(
+                skus=shard_skus, chunk_size=chunk_size
+            )
+            try:
+                while chunk := list(islice(rows, chunk_size)):
+                    if not put(chunk):
+                        return
+            finally:
+                rows.close()  # type: ignore
+                put(None)
+
+        producers: list[threading.Thread] = [
+            threading.Thread(
+                target=produce, args=(self.shards[index], shard_skus), daemon=True
+            )
+            for index, shard_skus in groups.items()
+        ]
+        for producer in producers:
+            producer.start()
+
+        finished: int = 0
+        try:
+            while finished < len(producers):
+                chunk: Optional[list] = chunks.get()
+                if chunk is None:
+                    finished += 1
+                else:
+                    yield from chunk
+        finally:
+            stop.set()
+
+    @_timed
+    def add_product(
+        self,
+        sku: str,
+        name: str,
+        quantity: int = 0,
+        idempotency_key: Optional[str] = None
+    ) -> None:
+        self._claim(idempotency_key, ['add_product', sku, name, quantity])
+        self.shard(sku).add_product(sku, name, quantity, idempotency_key=idempotency_key)
+
+    @_timed
+    def delete_products(self, skus: list[str], idempotency_key: Optional[str] = None) -> None:
+        assert skus != []
+        self._claim(idempotency_key, ['delete_products', skus])
+        groups: dict[int, list] = self._partition(skus, lambda sku: sku)
+        self._each(
+            lambda index, shard: shard.delete_products(
+                groups[index], idempotency_key=idempotency_key
+            ),
+            groups
+        )
+
+    @_timed
+    def change_name(
+        self,
+        sku: str,
+        new_name: str,
+        idempotency_key: Optional[str] = None
+    ) -> None:
+        self._claim(idempotency_key, ['change_name', sku, new_name])
+        self.shard(sku).change_name(sku, new_name, idempotency_key=idempotency_key)
+
+    @_timed
+    def update_quantity(
+        self,
+        sku: str,
+        operation: str,
+        count: int,
+        idempotency_key: Optional[str] = None
+    ) -> None:
+        self._claim(idempotency_key, ['update_quantity', sku, operation, count])
+        self.shard(sku).update_quantity(
+            sku, operation, count, idempotency_key=idempotency_key
+        )
+
+    @_timed
+    def apply_batch(
+        self,
+        ops: list[dict],
+        atomic: bool = False,
+        idempotency_key: Optional[str] = None
+    ) -> dict:
+        """
+        Like Products.apply_batch(); the operations of every shard are applied by that
+        shard, in parallel, in one transaction per shard. An atomic batch whose products
+        are stored by more than one shard is rejected as a whole.
+        """
+        # operations without a valid SKU are left to the first shard to report
+        groups: dict[int, list[int]] = {}
+        for index, op in enumerate(ops):
+            sku: Any = op.get('sku') if isinstance(op, dict) else None
+            shard: int = shard_of(sku, len(self.shards)) if isinstance(sku, str) else 0
+            groups.setdefault(shard, []).append(index)
+
+        if atomic and len(groups) > 1:
+            return {
+                'committed': False,
+                'applied': 0,
+                'not_found': 0,
+                'failed': len(ops),
+                'results': [
+                    {
+                        'index': index,
+                        'status': 'invalid',
+                        'error': 'an atomic batch must only change products of one shard'
+                    }
+                    for index in range(len(ops))
+                ]
+            }
+
+        self._claim(idempotency_key, ['apply_batch', ops, atomic])
+        reports: dict[int, dict] = self._each(
+            lambda index, shard: shard.apply_batch(
+                [ops[op_index] for op_index in groups[index]],
+                atomic=atomic,
+                idempotency_key=idempotency_key
+            ),
+            groups
+        )
+        results: list[dict] = [{} for _ in ops]
+        for shard_index, report in reports.items():
+            for result in report['results']:
+                op_index: int = groups[shard_index][result['index']]
+                results[op_index] = {**result, 'index': op_index}
+        merged: dict = {
+            'committed': all(report['committed'] for report in reports.values())
+        }
+        for key in ('applied', 'not_found', 'failed'):
+            merged[key] = sum(report[key] for report in reports.values())
+        merged['results'] = results
+        return merged
+
+
+def rebalance(
+    db_path: str,
+    old_count: int,
+    new_count: int,
+    table_name: str = 'products',
+    batch_size: int = 5000
+) -> dict:
+    """
+    Copy every product from the `old_count` shards stored next to `db_path` into
+    `new_count` new shards, and return the number of products copied per new shard.
+    The new shard files must not exist yet; the old ones are left untouched, to be
+    removed once the server runs with the new count. Must run while no server uses
+    the database. Ledgers start over in the new shards, from their first snapshot.
+    """
+    assert old_count != new_count
+    old_paths: list[str] = shard_paths(db_path, old_count)
+    new_paths: list[str] = shard_paths(db_path, new_count)
+    missing: list[str] = [path for path in old_paths if not Path(path).is_file()]
+    existing: list[str] = [path for path in new_paths if Path(path).exists()]
+    if missing or existing:
+        raise FileExistsError(
+            f'missing old shards: {missing}; new shards that already exist: {existing}'
+        )
+
+    target: Products = (
+        ShardedProducts(db_path, shards=new_count, table_name=table_name) if new_count > 1
+        else Products(db_path=db_path, table_name=table_name)
+    )
+    try:
+        target.create_table()
+        for path in old_paths:
+            source = Products(db_path=path, table_name=table_name)
+            try:
+                rows: Iterator[tuple] = (
+                    (row['sku'], row['name'], row['quantity'])
+                    for row in source.iter_products()
+                )
+                for progress in target.import_batches(batched(rows, batch_size)):
+                    if progress['failed']:
+                        raise sqlite3.DatabaseError(f'could not copy products from {path}')
+            finally:
+                source.close()
+        target.flush()
+        shards: list[Products] = (
+            target.shards if isinstance(target, ShardedProducts) else [target]
+        )
+        return {path: shard.count() for path, shard in zip(new_paths, shards)}
+    finally:
+        target.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Move all products of a database to a different number of shards'
+    )
+    parser.add_argument('--db', default='products.db', help='SQLite database file')
+    parser.add_argument('--from', dest='old_count', type=int, required=True)
+    parser.add_argument('--to', dest='new_count', type=int, required=True)
+    parser.add_argument('--table', default='products')
+    args = parser.parse_args()
+
+    copied: dict = rebalance(args.db, args.old_count, args.new_count, table_name=args.table)
+    for shard_path, products in copied.items():
+        print(f'{shard_path}: {products} products')
+    print(
+        'Start the server with --shards', args.new_count, 'and remove the old files:',
+        *shard_paths(args.db, args.old_count)
+    )
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3.9
+"""
+A single-writer queue for SQLite mutations.
+Exposes the WriteQueue class, which funnels every write through one dedicated thread and
+connection so concurrent requests never compete for SQLite's write lock.
+"""
+
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+# a unit of work: receives a cursor on the writer connection, must not commit itself
+WriteJob = Callable[[sqlite3.Cursor], Any]
+
+
+class WriteQueue:
+    """
+    Serializes database mutations on a dedicated writer thread.
+
+    Callers submit jobs with run() and block until the job's transaction has committed.
+    Jobs that are queued at the same time are committed together in one transaction
+    (group commit), each inside its own savepoint, so one failing job is rolled back
+    and reported to its caller without affecting the others.
+
+    Public methods:
+        - WriteQueue(connect: Callable[[], sqlite3.Connection], max_batch: int = 64)
+        - WriteQueue.run(job: WriteJob) -> Any
+        - WriteQueue.stats() -> dict
+        - WriteQueue.close() -> None
+    """
+
+    max_batch: int  # maximum number of jobs committed in a single transaction
+
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        max_batch: int = 64
+    ) -> None:
+        """
+        Start the writer thread. `connect` is called once, on the writer thread, to open
+        the writer connection.
+        """
+        assert max_batch >= 1
+
+        self.max_batch = max_batch
+        self._connect = connect
+        self._jobs: queue.SimpleQueue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._closed: bool = False
+        self._counters: dict[str, int] = {
+            'jobs': 0,          # jobs executed
+            'failed_jobs': 0,   # jobs rolled back because they raised
+            'transactions': 0,  # transactions committed
+            'max_batch_seen': 0  # largest number of jobs in one transaction
+        }
+
+        # open the connection on the writer thread and surface connection errors here
+        ready: Future = Future()
+        self._thread = threading.Thread(
+            target=self._work, args=(ready,), name='sqlite-writer', daemon=True
+        )
+        self._thread.start()
+        ready.result()
+
+    def run(self, job: WriteJob) -> Any:
+        """
+        Execute `job` on the writer connection, wait for its transaction to commit, and
+        return the job's return value. Exceptions raised by the job, or by the commit,
+        are re-raised in the calling thread.
+        """
+        if threading.current_thread() is self._thread:
+            # a job that submits another job would wait on itself; run it in place
+            return job(self._conn.cursor())
+
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError('Write queue has been closed.')
+            self._jobs.put((job, future))
+        return future.result()
+
+    def _work(self, ready: Future) -> None:
+        """
+        Writer thread main loop: take queued jobs in batches and commit each batch.
+        """
+        try:
+            self._conn: sqlite3.Connection = self._connect()
+            # transactions are managed explicitly below
+            self._conn.isolation_level = None
+        except BaseException as error:
+            ready.set_exception(error)
+            return
+        ready.set_result(None)
+
+        while True:
+            batch: list[tuple[Optional[WriteJob], Future]] = [self._jobs.get()]
+            # pick up whatever else is already waiting, up to the batch limit
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            jobs = [(job, future) for job, future in batch if job is not None]
+            if jobs:
+                self._commit_batch(jobs)
+            if len(jobs) != len(batch):
+                # a None job is the shutdown sentinel
+                self._conn.close()
+                return
+
+    def _commit_batch(self, jobs: list) -> None:
+        """
+        Run a batch of jobs in one transaction, isolating each job in a savepoint.
+        """
+        cur: sqlite3.Cursor = self._conn.cursor()
+        outcomes: list[tuple[bool, Any]] = []
+        try:
+            cur.execute('BEGIN IMMEDIATE;')
+            for job, _ in jobs:
+                cur.execute('SAVEPOINT job;')
+                try:
+                    outcomes.append((True, job(cur)))
+                    cur.execute('RELEASE job;')
+                except BaseException as error:
+                    cur.execute('ROLLBACK TO job;')
+                    cur.execute('RELEASE job;')
+                    outcomes.append((False, error))
+            cur.execute('COMMIT;')
+        except BaseException as error:
+            # the transaction itself failed; nothing in this batch was committed
+            if self._conn.in_transaction:
+                self._conn.rollback()
+            for _, future in jobs:
+                future.set_exception(error)
+            return
+        finally:
+            cur.close()
+
+        with self._lock:
+            self._counters['jobs'] += len(jobs)
+            self._counters['failed_jobs'] += sum(1 for ok, _ in outcomes if not ok)
+            self._counters['transactions'] += 1
+            self._counters['max_batch_seen'] = max(
+                self._counters['max_batch_seen'], len(jobs)
+            )
+
+        for (_, future), (ok, value) in zip(jobs, outcomes):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def stats(self) -> dict:
+        """
+        Return counters describing how many jobs ran and how well they were grouped.
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    def close(self) -> None:
+        """
+        Finish every queued job, then stop the writer thread and close its connection.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._jobs.put((None, Future()))
+        self._thread.join()
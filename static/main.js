@@ -4,6 +4,30 @@ const page_url_root = window.location.protocol + '//' + window.location.host;
 // list of product SKUs that are selected
 let selected_products = new Set();
 
+// how the inventory table is ordered: 'sku' or 'name'
+let inventory_sort = 'sku';
+
+// delays searching until the user pauses typing
+let search_timer = null;
+
+// change feed requests run one after another, so patches are applied in order
+let changes_pending = Promise.resolve();
+
+// gathers change notifications that arrive close together into one change feed request
+let changes_timer = null;
+
+// ID of the background job running the CSV import started from this page, if any
+let import_job = null;
+
+// loads the next page of products once the "Load more" row scrolls into view
+const load_more_observer = new IntersectionObserver((entries) => {
+    for (let entry of entries) {
+        if (entry.isIntersecting) {
+            loadMoreProducts();
+        }
+    }
+});
+
 
 /*
     Function that gets called upon every page load.
@@ -20,6 +44,40 @@ function onPageLoad() {
 
     // toggle buttons that only work when at least one product is selected
     setSelectOnlyButtons();
+
+    // load further pages of products as the user scrolls
+    observeLoadMore();
+
+    // show changes made by other users as they happen
+    listenForChanges();
+}
+
+
+/*
+    Subscribe to /events, and apply the changes other users make to the inventory as
+    soon as the server announces them. The browser reconnects on its own, and the server
+    resumes the stream after the last event received.
+*/
+function listenForChanges() {
+    const table = document.querySelector('#inventoryContainer table');
+    const params = new URLSearchParams({'since': table.dataset.seq});
+    const events = new EventSource(page_url_root + '/events?' + params);
+
+    events.addEventListener('change', (event) => {
+        // skip changes the table already shows, such as the user's own edits
+        const table = document.querySelector('#inventoryContainer table');
+        if (table !== null && Number(event.lastEventId) <= Number(table.dataset.seq)) {
+            return;
+        }
+        clearTimeout(changes_timer);
+        changes_timer = setTimeout(applyChanges, 100);
+    });
+
+    // too many changes were missed to patch the table row by row
+    events.addEventListener('reset', () => {
+        clearTimeout(changes_timer);
+        refreshInventory();
+    });
 }
 
 
@@ -39,25 +97,35 @@ function exportProducts(selected) {
 
 
 /*
-    Triggered by onchange() of #importCsvElem; sends the chosen CSV file to /import-csv.
-    Alerts on success and failures.
+    Triggered by onchange() of #importCsvElem; sends the chosen CSV file to /import-csv,
+    which imports it in a background job, merging existing products as chosen in
+    #importModeElem. The file is sent as the raw request body, and the progress of the
+    job is shown until it ends. Alerts on success and failures.
 */
 async function importCsv() {
     try {
         const file = document.getElementById('importCsvElem').files[0];
-        const formData = new FormData();
-        formData.append('file', file);
 
         const data = {
             method: 'POST',
-            body: formData
+            headers: {'Content-Type': 'text/csv'},
+            body: file
         };
-        const response = await fetch(page_url_root + '/import-csv', data);
-
-        // if request was successful, refresh the inventory
-        if (response.status === 200) {
-            await refreshInventory();
-            alert("CSV import complete!");
+        const params = new URLSearchParams({
+            'filename': file.name,
+            'mode': document.getElementById('importModeElem').value
+        });
+        const response = await fetch(page_url_root + '/import-csv?' + params, data);
+
+        // if the import job was started, follow its progress until it ends
+        if (response.status === 202) {
+            const job = await response.json();
+            import_job = job.id;
+            showImportProgress(job);
+            await followImportJob(job.id);
+        }
+        else if (response.status === 429) {
+            alert("Too many CSV imports are in progress. Please try again later.");
         }
         else {
             throw response.status;
@@ -67,6 +135,83 @@ async function importCsv() {
         alert("Importing CSV failed. See console for details.");
         console.log(e);
     }
+
+    // allow the same file to be selected again
+    import_job = null;
+    document.getElementById('importProgress').style.display = 'none';
+    document.getElementById('importCsvElem').value = '';
+}
+
+
+/*
+    Poll /jobs/<id> every half second and show the progress of the CSV import job
+    `job_id`. Once the job ends, refresh the inventory and report the row counts.
+*/
+async function followImportJob(job_id) {
+    let job;
+    do {
+        await new Promise((resolve) => setTimeout(resolve, 500));
+        const response = await fetch(page_url_root + '/jobs/' + job_id);
+        if (response.status !== 200) {
+            throw response.status;
+        }
+        job = await response.json();
+        showImportProgress(job);
+    } while (job.status === 'queued' || job.status === 'running');
+
+    const report = job.report;
+    if (job.status === 'failed') {
+        throw job.error;
+    }
+    await refreshInventory();
+    alert(
+        (job.status === 'cancelled' ? "CSV import cancelled.\n" : "CSV import complete!\n") +
+        `Inserted: ${report.inserted || 0}, updated: ${report.updated || 0}, ` +
+        `unchanged: ${report.unchanged || 0}, rejected: ${report.rejected || 0}`
+    );
+    if (report.rejected > 0) {
+        console.log(report.rejections);
+    }
+}
+
+
+/*
+    Show the progress bar of a CSV import job, given its status from /jobs/<id>.
+*/
+function showImportProgress(job) {
+    document.getElementById('importProgress').style.display = '';
+    document.getElementById('importProgressBar').value = job.progress || 0;
+
+    let text = (job.status === 'queued') ? 'Waiting to start' :
+        `${Math.floor(100 * (job.progress || 0))}% (${job.report.rows || 0} rows)`;
+    if (job.eta !== null) {
+        text += `, ${Math.ceil(job.eta)}s left`;
+    }
+    if (job.cancel_requested) {
+        text += ', cancelling';
+    }
+    document.getElementById('importProgressText').textContent = text;
+}
+
+
+/*
+    Triggered by the `Cancel import` button. Asks the server to stop the running CSV
+    import job; the rows imported so far are kept. Calls /jobs/<id>.
+*/
+async function cancelImport() {
+    if (import_job === null) {
+        return;
+    }
+    try {
+        const response = await fetch(page_url_root + '/jobs/' + import_job, {method: 'DELETE'});
+        if (response.status !== 202) {
+            throw response.status;
+        }
+    }
+    catch(e) {
+        alert("Cancelling the CSV import failed. See console for details.");
+        console.log(e);
+    }
 }
 
 
@@ -94,7 +239,8 @@ async function submitNewProduct() {
 
         // if successfully added a new product
         if (response.status === 200) {
-            await refreshInventory();   // refresh the inventory
+            document.getElementById('newProductActive').remove();
+            await applyChanges();       // show the new product
             selectAllProducts(false);   // deselect all products
             setAddProductButton(true);  // enable the add product button
         }
@@ -146,10 +292,10 @@ async function deleteProducts(selected) {
                 {method: 'DELETE'}
             );
 
-            // if request was successful, refresh the inventory and deselect all products
+            // if request was successful, remove the products and deselect all products
             if (response.status === 200) {
                 selectAllProducts(false);
-                await refreshInventory();
+                await applyChanges();
             }
             else {
                 throw response.status;
@@ -200,9 +346,9 @@ async function renameProduct(event) {
     try {
         const response = await fetch(page_url_root + '/change-name', payload);
 
-        // if request was successful, refresh the inventory
+        // if request was successful, update the product's row
         if (response.status === 200) {
-            await refreshInventory();
+            await applyChanges();
         }
         else {
             throw response.status;
@@ -291,9 +437,9 @@ async function updateQuantity(event) {
     try {
         const response = await fetch(page_url_root + '/update-quantity', payload);
 
-        // if request was successful, refresh the inventory
+        // if request was successful, update the product's row
         if (response.status === 200) {
-            await refreshInventory();
+            await applyChanges();
         }
         else {
             throw response.status;
@@ -329,12 +475,28 @@ function switchQuantityMode(event) {
 
 /*
     Calls /get-inventory and replaces the inventory table with the one returned from the
-    backend.
+    backend. As many products as are currently shown are fetched again, so the user does
+    not lose their place in a long list.
+    While there is text in the search box, calls /search for the matching products
+    instead.
 */
 async function refreshInventory() {
     try {
         // ask the server for the inventory table
-        const response = await fetch(page_url_root + '/get-inventory');
+        let response;
+        const query = document.getElementById('searchInput').value.trim();
+        if (query !== '') {
+            response = await fetch(
+                page_url_root + '/search?' + new URLSearchParams({'q': query})
+            );
+        }
+        else {
+            const params = new URLSearchParams({
+                'sort': inventory_sort,
+                'limit': inventoryRows().length
+            });
+            response = await fetch(page_url_root + '/get-inventory?' + params);
+        }
 
         // if request was successful, replace the inventory table
         if (response.status === 200) {
@@ -342,6 +504,7 @@ async function refreshInventory() {
             container.innerHTML = await response.text();
             // update product count
             document.getElementById('productCount').textContent = document.getElementById('productTotal').textContent;
+            observeLoadMore();
         }
         else {
             throw response.status;
@@ -353,6 +516,186 @@ async function refreshInventory() {
 }
 
 
+/*
+    Calls /changes for the products changed since the inventory table was rendered, and
+    patches only their rows. Falls back to refreshInventory() when the server cannot list
+    the changes, or while search results are shown.
+*/
+function applyChanges() {
+    changes_pending = changes_pending.then(async () => {
+        const table = document.querySelector('#inventoryContainer table');
+        const query = document.getElementById('searchInput').value.trim();
+        if (query !== '' || table === null) {
+            await refreshInventory();
+            return;
+        }
+
+        try {
+            const params = new URLSearchParams({'since': table.dataset.seq});
+            const response = await fetch(page_url_root + '/changes?' + params);
+            if (response.status !== 200) {
+                throw response.status;
+            }
+
+            const feed = await response.json();
+            if (feed.reset) {
+                await refreshInventory();
+                return;
+            }
+            for (let change of feed.changes) {
+                patchRow(change);
+            }
+            table.dataset.seq = feed.seq;
+            document.getElementById('productTotal').textContent = feed.count;
+            document.getElementById('productCount').textContent = feed.count;
+            observeLoadMore();
+        }
+        catch(e) {
+            console.log(e);
+        }
+    });
+    return changes_pending;
+}
+
+
+/*
+    Replace the row of a changed product, given as an entry of the /changes feed, with
+    its new HTML at its place in the current sort order, or remove it if the product was
+    deleted. Products that sort after the loaded pages are left for loadMoreProducts().
+*/
+function patchRow(change) {
+    const oldRow = document.getElementById('row-' + change.sku);
+    if (oldRow !== null) {
+        oldRow.remove();
+    }
+    if (change.deleted) {
+        selected_products.delete(change.sku);
+        setSelectOnlyButtons();
+        return;
+    }
+
+    // find the first row that sorts after the changed product
+    const key = rowSortKey(change.name, change.sku);
+    let nextRow = null;
+    for (let row of inventoryRows()) {
+        if (compareSortKeys(rowSortKey(row.dataset.name, rowIdToSKU(row.id)), key) > 0) {
+            nextRow = row;
+            break;
+        }
+    }
+    const loadMoreRow = document.getElementById('loadMoreRow');
+    if (nextRow === null && loadMoreRow !== null) {
+        return;
+    }
+
+    const holder = document.createElement('tbody');
+    holder.innerHTML = change.html;
+    const newRow = holder.querySelector('tr');
+    newRow.querySelector('input[name="select-item"]').checked = selected_products.has(change.sku);
+    document.querySelector('#inventoryContainer tbody').insertBefore(newRow, nextRow);
+}
+
+
+/* Return the values a row is ordered by in the inventory table. */
+function rowSortKey(name, sku) {
+    return (inventory_sort === 'name' ? [name, sku] : [sku]);
+}
+
+
+/* Compare two row sort keys; negative, zero or positive like a sort comparator. */
+function compareSortKeys(a, b) {
+    for (let i = 0; i < a.length; i++) {
+        if (a[i] !== b[i]) {
+            return (a[i] < b[i] ? -1 : 1);
+        }
+    }
+    return 0;
+}
+
+
+/*
+    Calls /get-inventory for the page of products after the last one shown, and appends
+    the returned rows to the inventory table.
+*/
+async function loadMoreProducts() {
+    const loadMoreRow = document.getElementById('loadMoreRow');
+    const rows = inventoryRows();
+    // only one page can be loading at a time
+    if (loadMoreRow === null || loadMoreRow.dataset.loading === 'true' || rows.length === 0) {
+        return;
+    }
+    loadMoreRow.dataset.loading = 'true';
+
+    const lastRow = rows[rows.length - 1];
+    const params = new URLSearchParams({
+        'after': rowIdToSKU(lastRow.id),
+        'after_name': lastRow.dataset.name,
+        'sort': inventory_sort
+    });
+
+    try {
+        const response = await fetch(page_url_root + '/get-inventory?' + params);
+
+        // if request was successful, replace the "Load more" row with the next page
+        if (response.status === 200) {
+            const html = await response.text();
+            loadMoreRow.remove();
+            lastRow.parentNode.insertAdjacentHTML('beforeend', html);
+            observeLoadMore();
+        }
+        else {
+            throw response.status;
+        }
+    }
+    catch(e) {
+        loadMoreRow.dataset.loading = 'false';
+        console.log(e);
+    }
+}
+
+
+/* Watch the "Load more" row, if there is one, to load the next page on scroll. */
+function observeLoadMore() {
+    load_more_observer.disconnect();
+    const loadMoreRow = document.getElementById('loadMoreRow');
+    if (loadMoreRow !== null) {
+        load_more_observer.observe(loadMoreRow);
+    }
+}
+
+
+/* Triggered by typing in the search box; shows the matching products. */
+function searchInventory() {
+    clearTimeout(search_timer);
+    search_timer = setTimeout(async () => {
+        // start from the first page again once the search box is cleared
+        for (let row of inventoryRows()) {
+            row.remove();
+        }
+        await refreshInventory();
+    }, 200);
+}
+
+
+/* Order the inventory table by `sort`, either 'sku' or 'name', starting from the top. */
+async function sortInventory(sort) {
+    inventory_sort = sort;
+    let container = document.getElementById('inventoryContainer');
+    // drop the loaded pages so that only the first page is fetched
+    for (let row of inventoryRows()) {
+        row.remove();
+    }
+    await refreshInventory();
+    container.scrollTop = 0;
+}
+
+
+/* Return the product rows currently shown in the inventory table. */
+function inventoryRows() {
+    return document.querySelectorAll('#inventoryContainer tbody tr[id^="row-"]');
+}
+
+
 /*
     Either select or de-select all products, depending on the boolean parameter `value`.
 */
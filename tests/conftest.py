@@ -0,0 +1,55 @@
+#!/usr/bin/env python3.9
+"""
+Fixtures shared by the tests: products databases and the Flask application, each in a
+temporary directory and closed after the test.
+"""
+
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import pytest
+from flask.testing import FlaskClient
+
+from modules.products import Products
+import main
+
+
+@pytest.fixture
+def make_products(tmp_path: Path) -> Iterator[Callable[..., Products]]:
+    """
+    Yield a function that opens a products database of the given class (Products by
+    default) in the temporary directory, creates its table, and returns it. Every
+    database opened is closed after the test.
+    """
+    opened: list[Products] = []
+
+    def make(cls: type = Products, name: str = 'products.db', **options: Any) -> Products:
+        products: Products = cls(db_path=str(tmp_path / name), **options)
+        products.create_table()
+        opened.append(products)
+        return products
+
+    yield make
+    for products in reversed(opened):
+        products.close()
+
+
+@pytest.fixture
+def inventory(make_products: Callable[..., Products]) -> Products:
+    """
+    Return an empty products database.
+    """
+    return make_products()
+
+
+
+@pytest.fixture
+def client(tmp_path: Path) -> Iterator[FlaskClient]:
+    """
+    Yield a test client of the Flask application, serving an empty database.
+    """
+    app = main.create_app(db_path=str(tmp_path / 'app.db'), seed_csv='')
+    yield app.test_client()
+    main.BROADCASTER.close()
+    main.JOBS.close()
+    main.INVENTORY.close()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3.9
+"""
+Tests of the Arrow IPC and Parquet readers in modules/arrow_utils.py.
+"""
+
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from modules import arrow_utils
+
+pyarrow = pytest.importorskip('pyarrow')
+
+
+def _read(tmp_path: Path, fmt: str, columns: dict) -> tuple[list[tuple], list[dict]]:
+    """
+    Write the products `columns` to a file in the format `fmt`, and return the valid and
+    rejected rows read back from it.
+    """
+    path: Path = tmp_path / f'products.{fmt}'
+    table: Any = pyarrow.table(columns)
+    if fmt == 'arrow':
+        with pyarrow.ipc.new_stream(str(path), table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pyarrow.parquet.write_table(table, str(path))
+
+    chunks: list[dict] = list(arrow_utils.iter_columnar_chunks(str(path), fmt))
+    return (
+        [row for chunk in chunks for row in chunk['rows']],
+        [rejection for chunk in chunks for rejection in chunk['rejections']]
+    )
+
+
+@pytest.mark.parametrize('fmt', ['arrow', 'parquet'])
+def test_skus_and_names_are_kept_as_they_are(tmp_path: Path, fmt: str) -> None:
+    # every row valid: validated column by column
+    rows, rejections = _read(tmp_path, fmt, {
+        'sku': [' sku-1 ', 'sku-2'], 'name': [' Padded name ', 'Plain'], 'quantity': [3, 0]
+    })
+    assert rows == [(' sku-1 ', ' Padded name ', 3), ('sku-2', 'Plain', 0)]
+    assert rejections == []
+
+
+@pytest.mark.parametrize('fmt', ['arrow', 'parquet'])
+def test_blank_fields_are_rejected(tmp_path: Path, fmt: str) -> None:
+    # some rows invalid: validated row by row
+    rows, rejections = _read(tmp_path, fmt, {
+        'sku': [' sku-1 ', '  ', 'sku-3'],
+        'name': [' Padded name ', 'Blank SKU', None],
+        'quantity': [3, 1, 2]
+    })
+    assert rows == [(' sku-1 ', ' Padded name ', 3)]
+    assert rejections == [
+        {'row': 2, 'reason': 'missing sku'}, {'row': 3, 'reason': 'missing name'}
+    ]
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3.9
+"""
+Tests of the batches of changes of modules/products.py and the /batch endpoint.
+"""
+
+import sqlite3
+
+from flask.testing import FlaskClient
+
+from modules.products import Products
+
+
+def _quantities(inventory: Products) -> dict[str, int]:
+    return {row['sku']: row['quantity'] for row in inventory.get_all()}
+
+
+def test_batch_applies_valid_operations(inventory: Products) -> None:
+    inventory.add_product('a', 'Apple', 5)
+    inventory.add_product('b', 'Banana', 5)
+    report: dict = inventory.apply_batch([
+        {'op': 'subtract', 'sku': 'a', 'count': 9},
+        {'op': 'rename', 'sku': 'b', 'name': 'Plantain'},
+        {'op': 'add', 'sku': 'b'},
+        {'op': 'delete', 'sku': 'a'},
+        {'op': 'set', 'sku': 'a', 'count': 1}
+    ])
+    assert report['committed']
+    assert [result['status'] for result in report['results']] == \
+        ['ok', 'ok', 'invalid', 'ok', 'not_found']
+    assert [tuple(row) for row in inventory.get_all()] == [('b', 'Plantain', 5)]
+
+
+def test_later_operations_see_earlier_ones(inventory: Products) -> None:
+    inventory.add_product('a', 'Apple', 5)
+    report: dict = inventory.apply_batch([
+        {'op': 'subtract', 'sku': 'a', 'count': 3},
+        {'op': 'subtract', 'sku': 'a', 'count': 3},
+        {'op': 'delete', 'sku': 'a'},
+        {'op': 'add', 'sku': 'a', 'count': 1}
+    ])
+    assert [result['status'] for result in report['results']] == \
+        ['ok', 'ok', 'ok', 'not_found']
+    assert inventory.get_all() == []
+
+
+def test_atomic_batch_with_an_invalid_operation_is_not_applied(inventory: Products) -> None:
+    inventory.add_product('a', 'Apple', 5)
+    report: dict = inventory.apply_batch([
+        {'op': 'add', 'sku': 'a', 'count': 1},
+        {'op': 'set', 'sku': 'a', 'count': -1}
+    ], atomic=True)
+    assert not report['committed']
+    assert [result['status'] for result in report['results']] == ['rolled_back', 'invalid']
+    assert _quantities(inventory) == {'a': 5}
+
+
+def test_atomic_batch_is_rolled_back_when_an_operation_fails(inventory: Products) -> None:
+    inventory.add_product('a', 'Apple', 5)
+    inventory.add_product('b', 'Banana', 5)
+    # make renaming a product to 'Forbidden' fail inside the database
+    with sqlite3.connect(inventory.db_path) as conn:
+        conn.execute('''
+            CREATE TRIGGER forbidden_name BEFORE UPDATE OF name ON products
+            WHEN NEW.name = 'Forbidden'
+            BEGIN SELECT RAISE(ABORT, 'forbidden name'); END;
+        ''')
+    conn.close()
+    ops: list[dict] = [
+        {'op': 'add', 'sku': 'a', 'count': 1},
+        {'op': 'rename', 'sku': 'b', 'name': 'Forbidden'},
+        {'op': 'delete', 'sku': 'b'}
+    ]
+
+    report: dict = inventory.apply_batch(ops, atomic=True, idempotency_key='atomic')
+    assert not report['committed']
+    assert [result['status'] for result in report['results']] == \
+        ['rolled_back', 'failed', 'rolled_back']
+    assert 'forbidden name' in report['results'][1]['error']
+    assert _quantities(inventory) == {'a': 5, 'b': 5}
+    # without `atomic`, the other operations are applied; the key is still free, since
+    # the atomic batch was not committed
+    report = inventory.apply_batch(ops, idempotency_key='atomic')
+    assert report['committed']
+    assert [result['status'] for result in report['results']] == ['ok', 'failed', 'ok']
+    assert _quantities(inventory) == {'a': 6}
+
+
+def test_batch_endpoint(client: FlaskClient) -> None:
+    client.post('/add-product', json={'sku': 'a', 'name': 'Apple', 'quantity': 1})
+    resp = client.post('/batch', json={'ops': [
+        {'op': 'add', 'sku': 'a', 'count': 2},
+        {'op': 'rename', 'sku': 'a', 'name': 'Green apple'}
+    ]})
+    assert resp.status_code == 200 and resp.get_json()['applied'] == 2
+
+    # a rolled back atomic batch is a conflict; malformed batches are rejected
+    resp = client.post('/batch', json={'atomic': True, 'ops': [
+        {'op': 'add', 'sku': 'a', 'count': 2},
+        {'op': 'set', 'sku': 'a', 'count': -1}
+    ]})
+    assert resp.status_code == 409 and not resp.get_json()['committed']
+    assert client.post('/batch', json={'ops': []}).status_code == 400
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3.9
+"""
+Tests of the read cache in modules/cache.py, and of its invalidation by the writes of
+modules/products.py.
+"""
+
+import sqlite3
+import time
+from typing import Callable
+
+from modules.cache import LRUCache
+from modules.products import Products
+
+
+def test_least_recently_used_entry_is_evicted() -> None:
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == (True, 1)
+    cache.put('c', 3)
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 1) and cache.get('c') == (True, 3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire_after_the_ttl() -> None:
+    cache = LRUCache(ttl=0.01)
+    cache.put('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') == (False, None)
+    assert cache.stats()['expirations'] == 1
+
+
+def test_reads_are_cached_until_a_write(inventory: Products) -> None:
+    inventory.add_product('a', 'Apple', 1)
+    assert inventory.count() == 1
+    hits: int = inventory.cache_stats()['hits']
+    assert inventory.count() == 1
+    assert inventory.cache_stats()['hits'] == hits + 1
+
+    # every kind of write drops the cached results
+    inventory.add_product('b', 'Banana', 2)
+    assert inventory.count() == 2
+    inventory.update_quantity('a', 'add', 4)
+    assert [row['quantity'] for row in inventory.get_specific(['a'])] == [5]
+    inventory.change_name('a', 'Green apple')
+    assert [row['name'] for row in inventory.get_specific(['a'])] == ['Green apple']
+    inventory.apply_batch([{'op': 'delete', 'sku': 'b'}])
+    assert inventory.count() == 1
+    inventory.delete_products(['a'])
+    assert inventory.count() == 0 and inventory.get_all() == []
+
+
+def test_writes_of_other_processes_are_seen_after_the_ttl(
+    make_products: Callable[..., Products]
+) -> None:
+    inventory: Products = make_products(cache_ttl=0.05)
+    inventory.add_product('a', 'Apple', 1)
+    assert inventory.count() == 1
+    with sqlite3.connect(inventory.db_path) as conn:
+        conn.execute("INSERT INTO products(sku, name, quantity) VALUES ('b', 'Banana', 1);")
+    conn.close()
+
+    assert inventory.count() == 1
+    time.sleep(0.1)
+    assert inventory.count() == 2
+    # a fresh look at the change log sees them right away
+    with sqlite3.connect(inventory.db_path) as conn:
+        conn.execute("DELETE FROM products WHERE sku = 'b';")
+    conn.close()
+    inventory.change_seq(fresh=True)
+    assert inventory.count() == 1
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3.9
+"""
+Tests of the write-behind buffering of quantity updates in modules/coalescer.py.
+"""
+
+import random
+
+import pytest
+
+from modules.coalescer import NO_CHANGE, QuantityChange, QuantityCoalescer, compose
+
+
+def _apply(quantity: int, operation: str, count: int) -> int:
+    """
+    Apply one update to `quantity`, as Products.update_quantity() does.
+    """
+    if operation == 'set':
+        return count
+    if operation == 'add':
+        return quantity + count
+    return max(0, quantity - count)
+
+
+def _apply_change(quantity: int, change: QuantityChange) -> int:
+    """
+    Apply a pending change to `quantity`, as Products._flush_quantities() does.
+    """
+    value, floor, delta = change
+    return value if value is not None else max(floor, quantity + delta)
+
+
+def test_no_change_leaves_quantities_as_they_are() -> None:
+    for quantity in (0, 1, 17):
+        assert _apply_change(quantity, NO_CHANGE) == quantity
+
+
+def test_set_discards_earlier_updates() -> None:
+    change: QuantityChange = compose(compose(NO_CHANGE, 'add', 5), 'set', 3)
+    assert change == (3, 0, 0)
+    assert _apply_change(100, compose(change, 'add', 2)) == 5
+
+
+def test_subtraction_stops_at_zero_between_updates() -> None:
+    # 2 - 5 is 0, not -3, so adding 4 afterwards makes 4, not 1
+    change: QuantityChange = compose(compose(NO_CHANGE, 'subtract', 5), 'add', 4)
+    assert _apply_change(2, change) == 4
+    assert _apply_change(10, change) == 9
+
+
+def test_composed_changes_match_updates_applied_one_by_one() -> None:
+    rng = random.Random(2022)
+    for _ in range(2000):
+        updates: list[tuple[str, int]] = [
+            (rng.choice(('add', 'subtract', 'set')), rng.randrange(10))
+            for _ in range(rng.randrange(1, 8))
+        ]
+        change: QuantityChange = NO_CHANGE
+        for operation, count in updates:
+            change = compose(change, operation, count)
+        for start in (0, 3, 12):
+            expected: int = start
+            for operation, count in updates:
+                expected = _apply(expected, operation, count)
+            assert _apply_change(start, change) == expected, (start, updates)
+
+
+def test_coalescer_merges_updates_per_sku() -> None:
+    flushed: list[dict] = []
+    coalescer = QuantityCoalescer(flushed.append, max_delay=60)
+    coalescer.update('a', 'add', 2)
+    coalescer.update('a', 'add', 3)
+    coalescer.update('b', 'set', 7)
+    coalescer.update('a', 'subtract', 1)
+    coalescer.flush()
+
+    assert flushed == [{'a': (None, 4, 4), 'b': (7, 0, 0)}]
+    stats: dict = coalescer.stats()
+    assert stats['flushed_updates'] == 4
+    assert stats['flushed_rows'] == 2
+    assert stats['coalescing_ratio'] == 2.0
+    coalescer.close()
+
+
+def test_coalescer_flushes_once_full_and_on_close() -> None:
+    flushed: list[dict] = []
+    coalescer = QuantityCoalescer(flushed.append, max_pending=2, max_delay=60)
+    coalescer.update('a', 'add', 1)
+    assert flushed == []
+    coalescer.update('b', 'add', 1)
+    assert flushed == [{'a': (None, 1, 1), 'b': (None, 1, 1)}]
+
+    coalescer.update('c', 'set', 0)
+    coalescer.close()
+    assert flushed[-1] == {'c': (0, 0, 0)}
+
+
+def test_failed_flush_drops_its_changes() -> None:
+    def fail(pending: dict) -> None:
+        raise RuntimeError('disk full')
+
+    coalescer = QuantityCoalescer(fail, max_delay=60)
+    coalescer.update('a', 'add', 1)
+    with pytest.raises(RuntimeError):
+        coalescer.flush()
+    stats: dict = coalescer.stats()
+    assert stats['failed_flushes'] == 1
+    assert stats['lost_updates'] == 1
+    assert stats['pending_rows'] == 0
+    coalescer.close()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3.9
+"""
+Tests of the in-memory column store and the columnar reads in modules/columnar.py.
+"""
+
+import random
+from typing import Callable
+
+import pytest
+
+from modules import columnar
+from modules.columnar import ColumnarProducts, ColumnRow, ColumnStore
+from modules.products import Products
+
+
+def _check(store: ColumnStore, expected: dict[str, tuple[str, int]]) -> None:
+    """
+    Check that `store` holds exactly the products in `expected`, a dictionary mapping
+    SKUs to (name, quantity), and finds each of them at its position.
+    """
+    assert len(store) == len(expected)
+    rows: list[tuple[str, str, int]] = list(store.rows())
+    assert {sku: (name, quantity) for sku, name, quantity in rows} == expected
+    assert store.total_quantity() == sum(quantity for _, quantity in expected.values())
+
+    skus: list[str] = [sku for sku, _, _ in rows]
+    assert store.find(skus) == list(range(len(rows)))
+    assert list(store.rows(store.find(reversed(skus)))) == rows[::-1]
+
+
+def test_put_adds_and_replaces_products() -> None:
+    store = ColumnStore()
+    store.put('a', 'Apple', 3)
+    store.put('b', 'Banana', 5)
+    store.put('a', 'Green apple', 1)
+    _check(store, {'a': ('Green apple', 1), 'b': ('Banana', 5)})
+
+
+def test_remove_moves_the_last_product_into_the_gap() -> None:
+    store = ColumnStore()
+    for sku in ('a', 'b', 'c', 'd'):
+        store.put(sku, sku.upper(), 1)
+    store.remove('b')
+    assert [sku for sku, _, _ in store.rows()] == ['a', 'd', 'c']
+    assert store.find(['d']) == [1]
+
+    store.remove('missing')
+    store.remove('c')
+    _check(store, {'a': ('A', 1), 'd': ('D', 1)})
+
+
+def test_find_skips_missing_and_repeated_skus() -> None:
+    store = ColumnStore()
+    store.put('a', 'A', 1)
+    store.put('b', 'B', 2)
+    assert store.find(['b', 'x', 'b', 'a']) == [1, 0]
+
+
+def test_random_operations_across_growth() -> None:
+    rng = random.Random(2022)
+    store = ColumnStore()
+    expected: dict[str, tuple[str, int]] = {}
+    # few enough SKUs that removals often hit, and enough to grow the table many times
+    skus: list[str] = [f'sku-{i}' for i in range(3000)]
+    for step in range(20000):
+        sku: str = rng.choice(skus)
+        if rng.random() < 0.35:
+            store.remove(sku)
+            expected.pop(sku, None)
+        else:
+            name: str = f'name {rng.randrange(100)} é' * rng.randrange(1, 3)
+            quantity: int = rng.randrange(1000)
+            store.put(sku, name, quantity)
+            expected[sku] = (name, quantity)
+        if step % 2500 == 0:
+            _check(store, expected)
+    _check(store, expected)
+
+    # removing everything leaves an empty store that can be filled again
+    for sku in list(expected):
+        store.remove(sku)
+    _check(store, {})
+    store.put('a', 'A', 1)
+    _check(store, {'a': ('A', 1)})
+
+
+def test_snapshot_is_not_affected_by_later_changes() -> None:
+    store = ColumnStore()
+    store.put('a', 'Apple', 1)
+    store.put('b', 'Banana', 2)
+    everything = store.snapshot()
+    selected = store.snapshot(store.find(['b']))
+    store.put('b', 'Plantain', 3)
+    store.remove('a')
+    assert list(everything) == [('a', 'Apple', 1), ('b', 'Banana', 2)]
+    assert list(selected) == [('b', 'Banana', 2)]
+
+
+@pytest.mark.parametrize('with_pyarrow', [True, False])
+def test_below_and_lowest_filter_quantities(
+    with_pyarrow: bool,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+    if with_pyarrow:
+        pytest.importorskip('pyarrow')
+    else:
+        monkeypatch.setattr(columnar, 'pyarrow', None)
+    store = ColumnStore()
+    for sku, quantity in (('a', 5), ('b', 0), ('c', 9), ('d', 0), ('e', 12)):
+        store.put(sku, sku.upper(), quantity)
+    assert store.below(6) == [0, 1, 3]
+    assert list(store.rows(store.lowest(store.below(10), 3))) == \
+        [('b', 'B', 0), ('d', 'D', 0), ('a', 'A', 5)]
+    assert store.below(0) == []
+    # the columns can still grow once filtered
+    store.put('f', 'F', 1)
+    assert store.lowest(store.below(2), 1) == [1]
+
+
+def test_column_rows_read_like_database_rows() -> None:
+    row = ColumnRow(('a', 'Apple', 3))
+    assert row['sku'] == row[0] == 'a' and row['quantity'] == 3
+    assert tuple(row) == ('a', 'Apple', 3) and row[1:] == ('Apple', 3)
+    assert dict(row) == {'sku': 'a', 'name': 'Apple', 'quantity': 3}
+
+
+def test_reads_match_the_database(make_products: Callable[..., Products]) -> None:
+    inventory: Products = make_products()
+    in_memory: Products = make_products(ColumnarProducts, refresh_interval=60.0)
+    for i in range(50):
+        inventory.add_product(f'sku-{i:02}', f'Product {i}', i % 7)
+    # writes through the columnar object are synced before its next read
+    in_memory.update_quantity('sku-03', 'set', 0)
+    in_memory.delete_products(['sku-04'])
+    inventory.cache.clear()
+
+    def rows(products: list) -> list[tuple]:
+        return sorted(tuple(row) for row in products)
+
+    assert rows(in_memory.get_all()) == rows(inventory.get_all())
+    assert rows(in_memory.get_specific(['sku-09', 'missing', 'sku-01'])) == \
+        rows(inventory.get_specific(['sku-09', 'missing', 'sku-01']))
+    assert [tuple(row) for row in in_memory.low_stock(3, limit=10)] == \
+        [tuple(row) for row in inventory.low_stock(3, limit=10)]
+    assert in_memory.count() == inventory.count() == 49
+    assert in_memory.total_quantity() == inventory.total_quantity()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3.9
+"""
+Tests of the ETags and cached fragments of the inventory table in main.py.
+"""
+
+from typing import Callable
+
+from flask.testing import FlaskClient
+
+from modules.products import Products
+import main
+
+
+def _etag(client: FlaskClient, path: str = '/get-inventory') -> str:
+    resp = client.get(path)
+    assert resp.status_code == 200
+    return resp.headers['ETag']
+
+
+def test_unchanged_inventory_is_not_modified(client: FlaskClient) -> None:
+    main.INVENTORY.add_product('a', 'Apple', 1)
+    etag: str = _etag(client)
+    resp = client.get('/get-inventory', headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    # other URLs have their own fragments, with the same version
+    assert _etag(client, '/get-inventory?sort=name') == etag
+
+
+def test_changes_from_another_process_change_the_etag(client: FlaskClient) -> None:
+    etag: str = _etag(client)
+    # another worker writes to the same database
+    other = Products(db_path=main.INVENTORY.db_path)
+    other.add_product('a', 'Apple', 1)
+    resp = client.get('/get-inventory', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+    assert 'Apple' in resp.get_data(as_text=True)
+
+    # the tag is derived from the database, so every worker and restart agrees on it
+    assert other.instance_id() == main.INVENTORY.instance_id()
+    assert resp.headers['ETag'] == f'"{other.instance_id()}-{other.change_seq(fresh=True)}"'
+    other.close()
+
+
+def test_each_database_has_its_own_id(make_products: Callable[..., Products]) -> None:
+    first: Products = make_products(name='first.db')
+    second: Products = make_products(name='second.db')
+    assert first.instance_id() != second.instance_id()
+    # creating the table again keeps the identifier
+    identifier: str = first.instance_id()
+    first.create_table()
+    assert make_products(name='first.db').instance_id() == identifier
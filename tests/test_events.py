@@ -0,0 +1,90 @@
+#!/usr/bin/env python3.9
+"""
+Tests of the change notifications in modules/events.py and their /events stream.
+"""
+
+from typing import Iterator, Optional
+
+import pytest
+from flask.testing import FlaskClient
+
+from modules.events import ChangeBroadcaster, Subscription
+from modules.products import Products
+
+
+@pytest.fixture
+def broadcaster(inventory: Products) -> Iterator[ChangeBroadcaster]:
+    """
+    Yield a broadcaster of the changes to an empty products database, buffering up to
+    four events per subscriber.
+    """
+    broadcaster = ChangeBroadcaster(inventory, buffer_size=4, poll_interval=0.05)
+    yield broadcaster
+    broadcaster.close()
+
+
+def _next(subscription: Subscription) -> list[dict]:
+    # wait for the next events delivered to the subscription
+    events: Optional[list[dict]] = subscription.get(timeout=5)
+    assert events
+    return events
+
+
+def test_changes_reach_every_subscriber(
+    inventory: Products,
+    broadcaster: ChangeBroadcaster
+) -> None:
+    first: Subscription = broadcaster.subscribe()
+    second: Subscription = broadcaster.subscribe()
+    inventory.add_product('a', 'Apple', 1)
+
+    for subscription in (first, second):
+        events: list[dict] = _next(subscription)
+        assert [(event['event'], event['data']) for event in events] == [
+            ('change', {'sku': 'a', 'op': 'insert', 'name': 'Apple', 'quantity': 1})
+        ]
+    inventory.delete_products(['a'])
+    assert _next(first)[0]['data']['op'] == 'delete'
+    assert broadcaster.stats()['subscribers'] == 2
+
+
+def test_subscriber_resumes_after_its_last_event(
+    inventory: Products,
+    broadcaster: ChangeBroadcaster
+) -> None:
+    inventory.add_product('a', 'Apple', 1)
+    seq: int = inventory.change_seq(fresh=True)
+    inventory.add_product('b', 'Banana', 2)
+    inventory.update_quantity('a', 'add', 1)
+
+    subscription: Subscription = broadcaster.subscribe(last_seq=seq)
+    events: list[dict] = _next(subscription)
+    assert [event['data']['sku'] for event in events] == ['b', 'a']
+    assert events[-1]['data']['quantity'] == 2
+
+
+def test_slow_subscriber_gets_a_reset(
+    inventory: Products,
+    broadcaster: ChangeBroadcaster
+) -> None:
+    subscription: Subscription = broadcaster.subscribe()
+    inventory.import_data([
+        {'sku': f'sku-{i}', 'name': 'Product', 'quantity': i} for i in range(10)
+    ])
+    events: list[dict] = _next(subscription)
+    assert [event['event'] for event in events] == ['reset']
+
+
+def test_events_endpoint_streams_changes(client: FlaskClient) -> None:
+    assert client.post(
+        '/add-product', json={'sku': 'a', 'name': 'Apple', 'quantity': 1}
+    ).status_code < 400
+    resp = client.get('/events?since=0', buffered=False)
+    assert resp.mimetype == 'text/event-stream'
+    chunks: Iterator[bytes] = iter(resp.response)
+    try:
+        assert next(chunks).startswith(b'retry:')
+        event: str = next(chunks).decode()
+    finally:
+        resp.close()
+    assert 'event: change' in event and '"sku": "a"' in event
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3.9
+"""
+Tests of the idempotency keys of writes and imports, in modules/products.py,
+modules/sharding.py and modules/services.py.
+"""
+
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+import pytest
+
+from modules import services
+from modules.jobs import JobManager
+from modules.products import IdempotencyKeyReused, Products
+from modules.sharding import ShardedProducts, shard_of
+
+SHARDS: int = 3
+
+
+def _quantities(inventory: Products) -> dict[str, int]:
+    return {row['sku']: row['quantity'] for row in inventory.get_all()}
+
+
+@pytest.fixture
+def jobs() -> Iterator[JobManager]:
+    """
+    Yield a job manager that runs one import at a time, with no queue.
+    """
+    manager = JobManager(max_running=1, max_queued=0)
+    yield manager
+    manager.close()
+
+
+def _upload(tmp_path: Path, name: str = 'upload.csv') -> str:
+    # a saved upload, deleted by the import
+    path: Path = tmp_path / name
+    path.write_text('sku,name,quantity\na,Apple,1\nb,Banana,2\n', encoding='utf-8')
+    return str(path)
+
+
+def _wait(jobs: JobManager, job_id: str, upload: Optional[str] = None) -> dict:
+    # wait for the job to end, and for its upload to be deleted, which comes last
+    for _ in range(500):
+        status: Optional[dict] = jobs.status(job_id)
+        if status is not None and status['status'] in {'done', 'failed', 'cancelled'}:
+            if upload is None or not Path(upload).exists():
+                return status
+        time.sleep(0.01)
+    raise TimeoutError(job_id)
+
+
+def test_write_with_a_used_key_is_not_applied_again(inventory: Products) -> None:
+    inventory.add_product('a', 'Apple', 1, idempotency_key='add-a')
+    inventory.add_product('a', 'Apple', 1, idempotency_key='add-a')
+    inventory.update_quantity('a', 'add', 5, idempotency_key='restock')
+    inventory.update_quantity('a', 'add', 5, idempotency_key='restock')
+    assert _quantities(inventory) == {'a': 6}
+
+    # the same update without a key, or with another one, is applied again
+    inventory.update_quantity('a', 'add', 5)
+    inventory.update_quantity('a', 'add', 5, idempotency_key='restock-2')
+    assert _quantities(inventory) == {'a': 16}
+
+
+def test_key_reused_for_a_different_request_raises(inventory: Products) -> None:
+    inventory.add_product('a', 'Apple', 1)
+    inventory.update_quantity('a', 'add', 5, idempotency_key='key')
+    with pytest.raises(IdempotencyKeyReused):
+        inventory.update_quantity('a', 'add', 6, idempotency_key='key')
+    with pytest.raises(IdempotencyKeyReused):
+        inventory.change_name('a', 'Pear', idempotency_key='key')
+    assert _quantities(inventory) == {'a': 6}
+
+
+def test_replayed_batch_returns_the_first_report(inventory: Products) -> None:
+    inventory.add_product('a', 'Apple', 1)
+    ops: list[dict] = [
+        {'op': 'add', 'sku': 'a', 'count': 2},
+        {'op': 'subtract', 'sku': 'missing', 'count': 1}
+    ]
+    first: dict = inventory.apply_batch(ops, idempotency_key='batch')
+    assert first['committed'] and first['applied'] == 1 and first['not_found'] == 1
+
+    assert inventory.apply_batch(ops, idempotency_key='batch') == first
+    assert _quantities(inventory) == {'a': 3}
+
+
+def test_recall_remember_and_forget(inventory: Products) -> None:
+    request: list = ['import', 'digest']
+    assert inventory.recall('import', request) is None
+    assert inventory.remember('import', request, {'id': 'job-1'}) == {'id': 'job-1'}
+    # the first result stored under a key is kept, unless it is replaced
+    assert inventory.remember('import', request, {'id': 'job-2'}) == {'id': 'job-1'}
+    assert inventory.recall('import', request) == {'id': 'job-1'}
+    assert inventory.remember('import', request, {'id': 'job-1', 'status': 'done'},
+                              replace=True) == {'id': 'job-1', 'status': 'done'}
+    with pytest.raises(IdempotencyKeyReused):
+        inventory.recall('import', ['import', 'other digest'])
+    with pytest.raises(IdempotencyKeyReused):
+        inventory.remember('import', ['import', 'other digest'], {'id': 'job-3'},
+                           replace=True)
+
+    # only the request that took a key frees it
+    inventory.forget('import', ['import', 'other digest'])
+    assert inventory.recall('import', request) == {'id': 'job-1', 'status': 'done'}
+    inventory.forget('import', request)
+    assert inventory.recall('import', ['import', 'other digest']) is None
+
+
+def test_key_bypasses_the_write_behind_buffer(
+    make_products: Callable[..., Products]
+) -> None:
+    inventory: Products = make_products(write_behind=60.0)
+    inventory.add_product('a', 'Apple', 0)
+    inventory.update_quantity('a', 'add', 1, idempotency_key='key')
+    inventory.update_quantity('a', 'add', 1, idempotency_key='key')
+    assert inventory.write_behind_stats()['pending_updates'] == 0
+    assert _quantities(inventory) == {'a': 1}
+
+
+def test_key_reused_across_shards_raises(make_products: Callable[..., Products]) -> None:
+    sharded: Products = make_products(ShardedProducts, shards=SHARDS)
+    first, other = 'sku-000', next(
+        f'sku-{i:03}' for i in range(1, 100)
+        if shard_of(f'sku-{i:03}', SHARDS) != shard_of('sku-000', SHARDS)
+    )
+    sharded.add_product(first, 'Product', 1, idempotency_key='key')
+    sharded.add_product(first, 'Product', 1, idempotency_key='key')
+    with pytest.raises(IdempotencyKeyReused):
+        sharded.add_product(other, 'Product', 1, idempotency_key='key')
+    with pytest.raises(IdempotencyKeyReused):
+        sharded.remember('key', ['import', 'digest'], {'id': 'job'})
+    assert _quantities(sharded) == {first: 1}
+
+
+def test_retried_import_reuses_the_first_job(
+    inventory: Products,
+    jobs: JobManager,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(services, 'IMPORT_WORKERS', 1)
+    upload: str = _upload(tmp_path)
+    first, status = services._submit_import_job(
+        inventory, jobs, upload, mode='ignore', idempotency_key='import'
+    )
+    assert status == 202 and isinstance(first, dict)
+    retried, status = services._submit_import_job(
+        inventory, jobs, _upload(tmp_path, 'retry.csv'), mode='ignore',
+        idempotency_key='import'
+    )
+    assert status == 202 and isinstance(retried, dict) and retried['id'] == first['id']
+    assert _wait(jobs, first['id'], upload)['status'] == 'done'
+    assert _quantities(inventory) == {'a': 1, 'b': 2}
+
+    # once the job is forgotten, retries get its final status
+    other = JobManager()
+    try:
+        stored, status = services._submit_import_job(
+            inventory, other, _upload(tmp_path, 'retry.csv'), mode='ignore',
+            idempotency_key='import'
+        )
+    finally:
+        other.close()
+    assert status == 202 and isinstance(stored, dict)
+    assert stored['id'] == first['id'] and stored['status'] == 'done'
+    assert stored['report']['inserted'] == 2
+
+
+def test_import_key_is_taken_before_the_job_is_queued(
+    inventory: Products,
+    jobs: JobManager,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(services, 'IMPORT_WORKERS', 1)
+    # concurrent attempts queue one job between them
+    results: list = []
+    barrier = threading.Barrier(4)
+
+    def attempt(index: int) -> None:
+        path: str = _upload(tmp_path, f'upload-{index}.csv')
+        barrier.wait()
+        results.append(services._submit_import_job(
+            inventory, jobs, path, mode='ignore', idempotency_key='import'
+        ))
+
+    threads: list[threading.Thread] = [
+        threading.Thread(target=attempt, args=(index,)) for index in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [status for _, status in results] == [202] * 4
+    assert len({body['id'] for body, _ in results}) == 1
+    _wait(jobs, results[0][0]['id'])
+
+
+def test_import_key_is_freed_when_the_job_is_not_queued(
+    inventory: Products,
+    jobs: JobManager,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(services, 'IMPORT_WORKERS', 1)
+    release = threading.Event()
+    busy = jobs.submit(lambda job: release.wait(5))
+    assert busy is not None
+    upload: str = _upload(tmp_path)
+    body, status = services._submit_import_job(
+        inventory, jobs, upload, mode='ignore', idempotency_key='import'
+    )
+    assert status == 429 and not Path(upload).exists()
+
+    release.set()
+    _wait(jobs, busy.id)
+    body, status = services._submit_import_job(
+        inventory, jobs, _upload(tmp_path), mode='ignore', idempotency_key='import'
+    )
+    assert status == 202 and isinstance(body, dict)
+    assert _wait(jobs, body['id'])['status'] == 'done'
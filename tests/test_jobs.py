@@ -0,0 +1,132 @@
+#!/usr/bin/env python3.9
+"""
+Tests of the background jobs in modules/jobs.py.
+"""
+
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+import pytest
+
+from modules.jobs import Job, JobManager
+
+
+@pytest.fixture
+def jobs() -> Iterator[JobManager]:
+    """
+    Yield a job manager that runs one job at a time, with room for one more.
+    """
+    manager = JobManager(max_running=1, max_queued=1, keep_finished=2)
+    yield manager
+    manager.close()
+
+
+def _wait(jobs: JobManager, job_id: str) -> dict:
+    # wait for the job to end
+    for _ in range(500):
+        status: Optional[dict] = jobs.status(job_id)
+        if status is not None and status['status'] in {'done', 'failed', 'cancelled'}:
+            return status
+        time.sleep(0.01)
+    raise TimeoutError(job_id)
+
+
+def test_job_reports_progress_and_result(jobs: JobManager) -> None:
+    def task(job: Job) -> None:
+        job.update(5, {'rows': 5})
+        job.update(10, {'rows': 10})
+
+    job: Optional[Job] = jobs.submit(task, total=10)
+    assert job is not None
+    status: dict = _wait(jobs, job.id)
+    assert status['status'] == 'done' and status['progress'] == 1.0
+    assert status['report'] == {'rows': 10}
+
+
+def test_failed_job_records_its_error(jobs: JobManager) -> None:
+    def task(job: Job) -> None:
+        raise ValueError('bad file')
+
+    cleaned: threading.Event = threading.Event()
+    job: Optional[Job] = jobs.submit(task, cleanup=cleaned.set)
+    assert job is not None
+    status: dict = _wait(jobs, job.id)
+    assert status['status'] == 'failed' and status['error'] == 'bad file'
+    assert cleaned.wait(5)
+
+
+def test_queue_is_bounded_and_jobs_can_be_cancelled(jobs: JobManager) -> None:
+    release: threading.Event = threading.Event()
+    running: Optional[Job] = jobs.submit(lambda job: release.wait(5))
+    queued: Optional[Job] = jobs.submit(lambda job: None)
+    assert running is not None and queued is not None
+    assert jobs.submit(lambda job: None) is None
+
+    # a queued job that is cancelled never runs
+    cancelled: Optional[dict] = jobs.cancel(queued.id)
+    assert cancelled is not None and cancelled['cancel_requested']
+    release.set()
+    assert _wait(jobs, running.id)['status'] == 'done'
+    assert _wait(jobs, queued.id)['status'] == 'cancelled'
+    assert jobs.status('unknown') is None and jobs.cancel('unknown') is None
+
+
+def test_running_job_stops_when_cancelled(jobs: JobManager) -> None:
+    started: threading.Event = threading.Event()
+
+    def task(job: Job) -> None:
+        started.set()
+        while True:
+            job.check_cancelled()
+            time.sleep(0.01)
+
+    job: Optional[Job] = jobs.submit(task)
+    assert job is not None and started.wait(5)
+    jobs.cancel(job.id)
+    assert _wait(jobs, job.id)['status'] == 'cancelled'
+
+
+def test_state_dir_shares_jobs_between_managers(tmp_path: Path) -> None:
+    # two managers sharing a directory stand for two worker processes
+    runner = JobManager(state_dir=str(tmp_path))
+    other = JobManager(state_dir=str(tmp_path))
+    try:
+        started: threading.Event = threading.Event()
+
+        def task(job: Job) -> None:
+            started.set()
+            while True:
+                job.check_cancelled()
+                time.sleep(0.01)
+
+        job: Optional[Job] = runner.submit(task, total=3)
+        assert job is not None and started.wait(5)
+        status: Optional[dict] = other.status(job.id)
+        assert status is not None and status['status'] == 'running'
+
+        # the other manager asks the job to stop through the directory
+        cancelled: Optional[dict] = other.cancel(job.id)
+        assert cancelled is not None and cancelled['cancel_requested']
+        assert _wait(runner, job.id)['status'] == 'cancelled'
+        assert _wait(other, job.id)['status'] == 'cancelled'
+        assert other.status('../../etc/passwd') is None
+    finally:
+        runner.close()
+        other.close()
+
+
+def test_only_the_latest_finished_jobs_are_kept(jobs: JobManager) -> None:
+    finished: list[str] = []
+    for _ in range(4):
+        job: Optional[Job] = jobs.submit(lambda job: None)
+        assert job is not None
+        _wait(jobs, job.id)
+        finished.append(job.id)
+    # jobs are forgotten when later ones are submitted
+    job = jobs.submit(lambda job: None)
+    assert job is not None
+    _wait(jobs, job.id)
+    assert jobs.get(finished[0]) is None
+    assert jobs.get(finished[-1]) is not None
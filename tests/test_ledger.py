@@ -0,0 +1,112 @@
+#!/usr/bin/env python3.9
+"""
+Tests of the ledger of modules/products.py: product histories, point-in-time reads,
+snapshots and rebuilds.
+"""
+
+import sqlite3
+import time
+
+from flask.testing import FlaskClient
+
+from modules.products import Products
+
+
+def _state(rows: list[sqlite3.Row]) -> dict[str, tuple]:
+    return {row['sku']: (row['name'], row['quantity']) for row in rows}
+
+
+def test_history_lists_changes_newest_first(inventory: Products) -> None:
+    inventory.add_product('a', 'Apple', 1)
+    inventory.update_quantity('a', 'add', 4)
+    inventory.change_name('a', 'Green apple')
+    inventory.delete_products(['a'])
+    inventory.add_product('b', 'Banana', 2)
+
+    entries: list[sqlite3.Row] = inventory.history('a')
+    assert [(entry['op'], entry['name'], entry['quantity'], entry['delta'])
+            for entry in entries] == [
+        ('delete', 'Green apple', None, -5),
+        ('update', 'Green apple', 5, 0),
+        ('update', 'Apple', 5, 4),
+        ('insert', 'Apple', 1, 1)
+    ]
+    # pages follow each other through `before`
+    page: list[sqlite3.Row] = inventory.history('a', limit=2)
+    page += inventory.history('a', limit=2, before=page[-1]['seq'])
+    assert [entry['seq'] for entry in page] == [entry['seq'] for entry in entries]
+    assert inventory.history('missing') == []
+
+
+def test_products_are_read_as_they_were(inventory: Products) -> None:
+    inventory.add_product('a', 'Apple', 1)
+    inventory.add_product('b', 'Banana', 2)
+    seq: int = inventory.history('b')[0]['seq']
+    time.sleep(0.05)
+    at: float = time.time()
+    time.sleep(0.05)
+    inventory.update_quantity('a', 'add', 4)
+    inventory.delete_products(['b'])
+    inventory.add_product('c', 'Cherry', 3)
+
+    before: dict = {'a': ('Apple', 1), 'b': ('Banana', 2)}
+    assert _state(inventory.products_at(seq=seq)) == before
+    assert _state(inventory.products_at(at=at)) == before
+    assert _state(inventory.products_at()) == {'a': ('Apple', 5), 'c': ('Cherry', 3)}
+    assert inventory.products_at(seq=0) == []
+
+    assert _state([inventory.product_at('b', seq=seq)]) == {'b': ('Banana', 2)}
+    assert inventory.product_at('b', at=at)['quantity'] == 2
+    assert inventory.product_at('b') is None
+    assert inventory.product_at('c', at=at) is None
+
+
+def test_reads_start_from_the_latest_snapshot(inventory: Products) -> None:
+    inventory.add_product('a', 'Apple', 1)
+    first: int = inventory.history('a')[0]['seq']
+    inventory.add_product('b', 'Banana', 2)
+    snapshot = inventory.take_snapshot()
+    assert snapshot is not None and snapshot > first
+    inventory.update_quantity('a', 'add', 4)
+
+    # the same state is found before, at and after the snapshot
+    assert _state(inventory.products_at(seq=first)) == {'a': ('Apple', 1)}
+    assert _state(inventory.products_at(seq=snapshot)) == {
+        'a': ('Apple', 1), 'b': ('Banana', 2)
+    }
+    assert _state(inventory.products_at()) == {'a': ('Apple', 5), 'b': ('Banana', 2)}
+    assert inventory.product_at('b')['quantity'] == 2
+
+
+def test_rebuild_restores_an_earlier_state(inventory: Products) -> None:
+    inventory.add_product('a', 'Apple', 1)
+    inventory.add_product('b', 'Banana', 2)
+    seq: int = inventory.history('b')[0]['seq']
+    inventory.update_quantity('a', 'add', 4)
+    inventory.delete_products(['b'])
+    inventory.add_product('c', 'Cherry', 3)
+
+    report: dict = inventory.rebuild(seq=seq)
+    assert report == {
+        'committed': True, 'seq': seq, 'inserted': 1, 'updated': 1, 'deleted': 1
+    }
+    assert _state(inventory.get_all()) == {'a': ('Apple', 1), 'b': ('Banana', 2)}
+    # the rebuild is itself in the ledger
+    assert inventory.history('b')[0]['op'] == 'insert'
+    assert inventory.rebuild()['inserted'] == 0
+
+
+def test_history_and_products_at_endpoints(client: FlaskClient) -> None:
+    assert client.post(
+        '/add-product', json={'sku': 'a', 'name': 'Apple', 'quantity': 1}
+    ).status_code < 400
+    entries: list = client.get('/history?sku=a').get_json()['entries']
+    assert [entry['op'] for entry in entries] == ['insert']
+
+    seq: int = entries[0]['seq']
+    assert client.get(f'/products-at?seq={seq}').get_json() == {
+        'products': [{'sku': 'a', 'name': 'Apple', 'quantity': 1}]
+    }
+    assert client.get(f'/products-at?seq={seq}&sku=b').get_json() == {'products': []}
+    assert client.get('/products-at').status_code == 400
+    assert client.get('/history').status_code == 400
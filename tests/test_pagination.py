@@ -0,0 +1,45 @@
+#!/usr/bin/env python3.9
+"""
+Tests of the paginated inventory listing of main.py.
+"""
+
+from flask.testing import FlaskClient
+
+import main
+
+
+def _fill(count: int) -> None:
+    main.INVENTORY.import_data([
+        {'sku': f'sku-{i:04}', 'name': f'Product {count - i:04}', 'quantity': i}
+        for i in range(count)
+    ])
+
+
+def test_page_size_is_clamped_to_the_allowed_range(client: FlaskClient) -> None:
+    _fill(main.MAX_PAGE_SIZE + 10)
+    assert len(main._inventory_page(limit=20)['rows']) == 20
+    assert len(main._inventory_page(limit=0)['rows']) == 1
+    assert len(main._inventory_page(limit=10 ** 6)['rows']) == main.MAX_PAGE_SIZE
+
+
+def test_pages_follow_each_other(client: FlaskClient) -> None:
+    _fill(25)
+    for sort, column in (('sku', 'sku'), ('name', 'name')):
+        seen: list[str] = []
+        page: dict = main._inventory_page(limit=10, sort=sort)
+        while True:
+            seen.extend(row[column] for row in page['rows'])
+            if not page['has_more']:
+                break
+            last = page['rows'][-1]
+            page = main._inventory_page(
+                after_sku=last['sku'], after_name=last['name'], limit=10, sort=sort
+            )
+        assert seen == sorted(seen) and len(seen) == 25
+
+
+def test_limit_parameter(client: FlaskClient) -> None:
+    _fill(30)
+    resp = client.get('/get-inventory?limit=20')
+    assert resp.status_code == 200
+    assert resp.get_data(as_text=True).count('<tr id="row-') == 20
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3.9
+"""
+Tests of the parallel CSV parsing in modules/parallel_csv.py.
+"""
+
+import csv
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from modules.parallel_csv import iter_csv_chunks
+
+
+def _write(path: Path, rows: list[list[str]]) -> None:
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        csv.writer(file).writerows([['sku', 'name', 'quantity'], *rows])
+
+
+def _parse(path: Path, workers: int) -> tuple[list[tuple[str, str, int]], list[dict]]:
+    rows: list[tuple[str, str, int]] = []
+    rejections: list[dict] = []
+    for chunk in iter_csv_chunks(str(path), workers=workers, chunk_bytes=64):
+        rows.extend(chunk['rows'])
+        rejections.extend(chunk['rejections'])
+    return rows, rejections
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_ranges_are_parsed_in_file_order(tmp_path: Path, workers: int) -> None:
+    path: Path = tmp_path / 'products.csv'
+    rows: list[list[str]] = [[f'sku-{i}', f'Product {i}', str(i)] for i in range(200)]
+    _write(path, rows + [['', 'x', '1']])
+
+    parsed, rejections = _parse(path, workers)
+    assert parsed == [(f'sku-{i}', f'Product {i}', i) for i in range(200)]
+    assert [rejection['row'] for rejection in rejections] == [201]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_quoted_line_breaks_across_ranges(tmp_path: Path, workers: int) -> None:
+    # names spanning several lines, some of which look like records of their own
+    name: str = 'Multi-line\nsku-fake,Fake,1\n' * 8
+    path: Path = tmp_path / 'products.csv'
+    _write(path, [[f'sku-{i}', f'{name}{i}', str(i)] for i in range(20)])
+
+    rows, rejections = _parse(path, workers)
+    assert rows == [(f'sku-{i}', f'{name}{i}', i) for i in range(20)]
+    assert rejections == []
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_stray_quote_before_quoted_line_breaks(tmp_path: Path, workers: int) -> None:
+    # the stray quote of the first name throws the quote parity off, so the ranges after
+    # it are cut inside the quoted names, and the rest of the file is read sequentially
+    path: Path = tmp_path / 'products.csv'
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        file.write('sku,name,quantity\nsku-screen,5" screen,1\n')
+    with open(path, 'a', newline='', encoding='utf-8') as file:
+        csv.writer(file).writerows(
+            [[f'sku-{i}', f'Line one\nline two {i}', str(i)] for i in range(20)]
+        )
+
+    rows, rejections = _parse(path, workers)
+    assert rows == [('sku-screen', '5" screen', 1)] + [
+        (f'sku-{i}', f'Line one\nline two {i}', i) for i in range(20)
+    ]
+    assert rejections == []
+
+
+def test_workers_do_not_run_the_main_module(tmp_path: Path) -> None:
+    path: Path = tmp_path / 'products.csv'
+    _write(path, [[f'sku-{i}', f'Product {i}', str(i)] for i in range(200)])
+    runs: Path = tmp_path / 'runs.txt'
+    script: Path = tmp_path / 'server.py'
+    # a main module that notes every process running it
+    script.write_text(f'''
+with open({str(runs)!r}, 'a') as file:
+    file.write(__name__ + '\\n')
+
+if __name__ == '__main__':
+    from modules.parallel_csv import iter_csv_chunks
+    chunks = list(iter_csv_chunks({str(path)!r}, workers=2, chunk_bytes=64))
+    print(sum(len(chunk['rows']) for chunk in chunks))
+''')
+    result = subprocess.run(
+        [sys.executable, str(script)], capture_output=True, text=True, check=True,
+        env={**os.environ, 'PYTHONPATH': str(Path(__file__).parent.parent)}
+    )
+    assert result.stdout.strip() == '200'
+    assert runs.read_text().split() == ['__main__']
+
+
+def test_skus_and_names_are_kept_as_they_are(tmp_path: Path) -> None:
+    path: Path = tmp_path / 'products.csv'
+    _write(path, [[' sku-1 ', ' Padded name ', ' 3 '], ['   ', 'Blank SKU', '1']])
+
+    rows, rejections = _parse(path, 1)
+    assert rows == [(' sku-1 ', ' Padded name ', 3)]
+    assert [(rejection['row'], rejection['reason']) for rejection in rejections] == \
+        [(2, 'missing sku')]
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3.9
+"""
+Tests of the hash-partitioned products storage in modules/sharding.py.
+"""
+
+from pathlib import Path
+from typing import Callable
+
+import pytest
+
+from modules.products import METHOD_SECONDS, Products
+from modules.sharding import (
+    ShardedProducts, coordinator_path, rebalance, shard_of, shard_paths
+)
+
+SHARDS: int = 3
+SKUS: list[str] = [f'sku-{i:03}' for i in range(60)]
+
+
+@pytest.fixture
+def sharded(make_products: Callable[..., Products]) -> Products:
+    """
+    Return SHARDS empty shards.
+    """
+    return make_products(ShardedProducts, shards=SHARDS)
+
+
+def _skus(products: Products) -> list[str]:
+    return sorted(row['sku'] for row in products.get_all())
+
+
+def test_shard_paths() -> None:
+    assert shard_paths('data/products.db', 1) == ['data/products.db']
+    assert shard_paths('data/products.db', 2) == [
+        'data/products.0-of-2.db', 'data/products.1-of-2.db'
+    ]
+
+
+def _calls(method: str) -> int:
+    # the number of calls of a Products method recorded in the metrics
+    prefix: str = f'{METHOD_SECONDS.name}_count{{method="{method}"}} '
+    lines: list[str] = [line for line in METHOD_SECONDS.render() if line.startswith(prefix)]
+    return int(lines[0][len(prefix):]) if lines else 0
+
+
+def test_coordinator_path() -> None:
+    assert coordinator_path('data/products.db') == 'data/products.shards.db'
+    assert coordinator_path(':memory:') == ':memory:'
+
+
+def test_calls_are_recorded_once(sharded: ShardedProducts) -> None:
+    before: int = _calls('count')
+    assert sharded.count() == 0
+    assert _calls('count') == before + 1
+
+
+def test_shard_of_is_stable() -> None:
+    # a CRC-32 of the SKU, unlike hash(), does not change between processes
+    assert shard_of('sku-000', 3) == 0
+    assert shard_of('sku-001', 3) == 2
+    assert all(shard_of(sku, 1) == 0 for sku in SKUS)
+
+
+def test_products_are_stored_by_their_shard_only(sharded: ShardedProducts) -> None:
+    for sku in SKUS:
+        sharded.add_product(sku, f'Product {sku}', 1)
+
+    for index, shard in enumerate(sharded.shards):
+        stored: list[str] = _skus(shard)
+        assert stored == [sku for sku in SKUS if shard_of(sku, SHARDS) == index]
+        assert all(sharded.shard(sku) is shard for sku in stored)
+    # every shard is used, and their products are merged
+    assert all(shard.count() for shard in sharded.shards)
+    assert _skus(sharded) == SKUS
+    assert sharded.count() == len(SKUS)
+
+
+def test_writes_reach_the_shard_of_the_product(sharded: ShardedProducts) -> None:
+    for sku in SKUS:
+        sharded.add_product(sku, f'Product {sku}', 1)
+    sharded.update_quantity('sku-007', 'add', 4)
+    sharded.change_name('sku-008', 'Renamed')
+    sharded.delete_products(['sku-001', 'sku-002', 'sku-003'])
+
+    shard: Products = sharded.shard('sku-007')
+    assert [row['quantity'] for row in shard.get_specific(['sku-007'])] == [5]
+    assert [row['name'] for row in sharded.get_specific(['sku-008'])] == ['Renamed']
+    assert sharded.get_specific(['sku-001', 'sku-002', 'sku-003']) == []
+    assert sharded.total_quantity() == len(SKUS) - 3 + 4
+
+
+def test_batch_is_split_across_shards(sharded: ShardedProducts) -> None:
+    for sku in SKUS:
+        sharded.add_product(sku, f'Product {sku}', 1)
+    ops: list[dict] = [{'op': 'add', 'sku': sku, 'count': 1} for sku in SKUS[:10]]
+    ops.append({'op': 'delete', 'sku': 'missing'})
+
+    report: dict = sharded.apply_batch(ops)
+    assert report['committed'] and report['applied'] == 10 and report['not_found'] == 1
+    assert [result['index'] for result in report['results']] == list(range(len(ops)))
+    assert sharded.total_quantity() == len(SKUS) + 10
+
+    # an atomic batch may only change the products of one shard
+    report = sharded.apply_batch(ops, atomic=True)
+    assert not report['committed'] and report['failed'] == len(ops)
+    assert sharded.total_quantity() == len(SKUS) + 10
+
+
+def test_change_positions_are_shared_between_processes(
+    make_products: Callable[..., Products]
+) -> None:
+    # two objects over the same files stand for two worker processes
+    first: Products = make_products(ShardedProducts, shards=SHARDS)
+    second: Products = make_products(ShardedProducts, shards=SHARDS)
+    first.add_product('sku-000', 'Product', 1)
+    seq: int = first.change_seq(fresh=True)
+
+    second.add_product('sku-001', 'Product', 2)
+    second.change_name('sku-000', 'Renamed')
+    feed: dict = second.get_changes(since=seq)
+    assert not feed['reset'] and feed['seq'] == seq + 2
+    assert sorted(change['sku'] for change in feed['changes']) == ['sku-000', 'sku-001']
+    assert first.get_changes(since=feed['seq'])['changes'] == []
+
+    # positions that were never handed out ask for a reset
+    assert second.get_changes(since=seq + 100)['reset']
+
+
+def test_rebalance_keeps_every_product(tmp_path: Path) -> None:
+    db_path: str = str(tmp_path / 'products.db')
+    source = ShardedProducts(db_path=db_path, shards=2)
+    source.create_table()
+    source.import_data([{'sku': sku, 'name': 'Product', 'quantity': 1} for sku in SKUS])
+    source.close()
+
+    copied: dict = rebalance(db_path, 2, SHARDS)
+    assert list(copied) == shard_paths(db_path, SHARDS)
+    assert sum(copied.values()) == len(SKUS)
+
+    target = ShardedProducts(db_path=db_path, shards=SHARDS)
+    assert _skus(target) == SKUS
+    target.close()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3.9
+"""
+Tests of the single-writer queue in modules/writer.py.
+"""
+
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+import pytest
+
+from modules.writer import WriteQueue
+
+
+def _queue(tmp_path: Path) -> WriteQueue:
+    """
+    Return a write queue on a new database with a one-column table of values.
+    """
+    path: str = str(tmp_path / 'writer.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE items (value TEXT PRIMARY KEY);')
+    conn.close()
+    return WriteQueue(lambda: sqlite3.connect(path, check_same_thread=False))
+
+
+def _values(queue: WriteQueue) -> list[str]:
+    return queue.run(
+        lambda cur: [row[0] for row in cur.execute('SELECT value FROM items ORDER BY value;')]
+    )
+
+
+def test_run_returns_the_job_result(tmp_path: Path) -> None:
+    queue = _queue(tmp_path)
+    assert queue.run(lambda cur: cur.execute("INSERT INTO items VALUES ('a');").rowcount) == 1
+    assert _values(queue) == ['a']
+    queue.close()
+
+
+def test_group_commit_rolls_back_failing_jobs_only(tmp_path: Path) -> None:
+    queue = _queue(tmp_path)
+    release = threading.Event()
+
+    def insert(value: str) -> Callable[[sqlite3.Cursor], str]:
+        def job(cur: sqlite3.Cursor) -> str:
+            cur.execute('INSERT INTO items VALUES (?);', (value,))
+            if value.startswith('bad'):
+                # the row above is written, then the job fails
+                raise ValueError(value)
+            return value
+        return job
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        # hold the writer, so that the next jobs are queued together
+        blocker: Future = executor.submit(queue.run, lambda cur: release.wait(5))
+        futures: dict[str, Future] = {}
+        for value in ('a', 'bad-1', 'b', 'bad-2', 'c'):
+            futures[value] = executor.submit(queue.run, insert(value))
+        deadline: float = time.monotonic() + 5
+        while queue._jobs.qsize() < len(futures) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        blocker.result()
+
+        for value, future in futures.items():
+            if value.startswith('bad'):
+                with pytest.raises(ValueError):
+                    future.result()
+            else:
+                assert future.result() == value
+
+    # the failing jobs were rolled back, the others committed in a single transaction
+    assert _values(queue) == ['a', 'b', 'c']
+    stats: dict = queue.stats()
+    assert stats['failed_jobs'] == 2
+    assert stats['max_batch_seen'] == 5
+    queue.close()
+
+
+def test_failed_transaction_fails_every_job_of_its_batch(tmp_path: Path) -> None:
+    queue = _queue(tmp_path)
+    queue.run(lambda cur: cur.execute("INSERT INTO items VALUES ('a');"))
+
+    def commit_early(cur: sqlite3.Cursor) -> None:
+        # ending the transaction from inside a job breaks the savepoints that follow
+        cur.execute('COMMIT;')
+
+    with pytest.raises(sqlite3.OperationalError):
+        queue.run(commit_early)
+    # the writer keeps working after the failed transaction
+    queue.run(lambda cur: cur.execute("INSERT INTO items VALUES ('b');"))
+    assert _values(queue) == ['a', 'b']
+    queue.close()
+
+
+def test_run_after_close_raises(tmp_path: Path) -> None:
+    queue = _queue(tmp_path)
+    queue.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        queue.run(lambda cur: None)